@@ -3,6 +3,7 @@ SEPA Direct Debit Batch Optimization System
 Automatically creates optimally-sized batches for efficient processing
 """
 
+import heapq
 from collections import defaultdict
 
 import frappe
@@ -65,7 +66,8 @@ def create_optimal_batches(target_date=None, config=None):
         invoice_analysis = analyze_invoices_for_optimization(eligible_invoices)
 
         # Step 3: Create optimal batch combinations
-        batch_groups = create_optimal_batch_groups(invoice_analysis, batch_config)
+        plan_stats = BatchPlanStats()
+        batch_groups = create_optimal_batch_groups(invoice_analysis, batch_config, plan_stats)
 
         # Step 4: Create actual DD batch documents
         created_batches = []
@@ -74,7 +76,9 @@ def create_optimal_batches(target_date=None, config=None):
             created_batches.append(batch_doc)
 
         # Step 5: Generate optimization report
-        optimization_report = generate_optimization_report(eligible_invoices, created_batches, batch_config)
+        optimization_report = generate_optimization_report(
+            eligible_invoices, created_batches, batch_config, plan_stats
+        )
 
         frappe.logger().info(f"Created {len(created_batches)} optimized batches")
 
@@ -359,7 +363,7 @@ def analyze_invoices_for_optimization(invoices):
     return analysis
 
 
-def create_optimal_batch_groups(analysis, config):
+def create_optimal_batch_groups(analysis, config, stats=None):
     """Create optimal groupings of invoices for batching"""
 
     all_invoices = []
@@ -371,7 +375,7 @@ def create_optimal_batch_groups(analysis, config):
 
     # Strategy 1: Prioritize high-priority invoices first
     if analysis["by_priority"].get("High"):
-        priority_batches = create_priority_batches(analysis["by_priority"]["High"], config)
+        priority_batches = create_priority_batches(analysis["by_priority"]["High"], config, stats)
         batch_groups.extend(priority_batches)
         # Remove processed invoices
         processed_invoices = set()
@@ -380,7 +384,7 @@ def create_optimal_batch_groups(analysis, config):
         remaining_invoices = [inv for inv in remaining_invoices if inv["invoice"] not in processed_invoices]
 
     # Strategy 2: Create customer-consolidated batches
-    customer_batches = create_customer_consolidated_batches(remaining_invoices, config)
+    customer_batches = create_customer_consolidated_batches(remaining_invoices, config, stats)
     batch_groups.extend(customer_batches)
 
     # Remove processed invoices
@@ -390,135 +394,202 @@ def create_optimal_batch_groups(analysis, config):
     remaining_invoices = [inv for inv in remaining_invoices if inv["invoice"] not in processed_invoices]
 
     # Strategy 3: Create amount-optimized batches for remaining invoices
-    amount_batches = create_amount_optimized_batches(remaining_invoices, config)
+    amount_batches = create_amount_optimized_batches(remaining_invoices, config, stats)
     batch_groups.extend(amount_batches)
 
     frappe.logger().info(f"Created {len(batch_groups)} optimal batch groups")
     return batch_groups
 
 
-def create_priority_batches(priority_invoices, config):
+def create_priority_batches(priority_invoices, config, stats=None):
     """Create batches for high-priority invoices"""
-    batches = []
-    current_batch = []
-    current_amount = 0
-
-    for invoice in sorted(priority_invoices, key=lambda x: flt(x["amount"]), reverse=True):
-        invoice_amount = flt(invoice["amount"])
-
-        # Check if adding this invoice would exceed limits
-        if (
-            len(current_batch) >= config["max_invoices_per_batch"]
-            or current_amount + invoice_amount > config["max_amount_per_batch"]
-        ):
-            if len(current_batch) >= config["min_invoices_per_batch"]:
-                batches.append(current_batch)
-            current_batch = []
-            current_amount = 0
-
-        current_batch.append(invoice)
-        current_amount += invoice_amount
-
-    # Add final batch if it meets minimum requirements
-    if len(current_batch) >= config["min_invoices_per_batch"]:
-        batches.append(current_batch)
-
+    batches, _unplaced = pack_invoice_groups(
+        [[invoice] for invoice in priority_invoices],
+        max_amount=config["max_amount_per_batch"],
+        max_count=config["max_invoices_per_batch"],
+        min_count=config["min_invoices_per_batch"],
+        stats=stats,
+    )
     return batches
 
 
-def create_customer_consolidated_batches(invoices, config):
+def create_customer_consolidated_batches(invoices, config, stats=None):
     """Create batches that consolidate invoices by customer when beneficial"""
-    batches = []
     customer_groups = defaultdict(list)
 
     # Group by customer
     for invoice in invoices:
         customer_groups[invoice["customer"]].append(invoice)
 
-    # Process customers with multiple invoices first
-    multi_invoice_customers = {k: v for k, v in customer_groups.items() if len(v) > 1}
-    # single_invoice_customers = {k: v for k, v in customer_groups.items() if len(v) == 1}  # Unused
-
-    current_batch = []
-    current_amount = 0
-    processed_customers = set()
-
-    # Process multi-invoice customers
-    for customer, customer_invoices in multi_invoice_customers.items():
+    # Keep the invoices of customers with multiple invoices together, as long as they fit one batch
+    consolidated_groups = []
+    remaining_invoices = []
+    for customer_invoices in customer_groups.values():
         customer_total = sum(flt(inv["amount"]) for inv in customer_invoices)
-
-        # If customer's invoices alone make a good batch
         if (
-            len(customer_invoices) >= config["min_invoices_per_batch"]
+            len(customer_invoices) > 1
+            and len(customer_invoices) <= config["max_invoices_per_batch"]
             and customer_total <= config["max_amount_per_batch"]
         ):
-            batches.append(customer_invoices)
-            processed_customers.add(customer)
+            consolidated_groups.append(customer_invoices)
         else:
-            # Try to fit customer invoices in current batch
-            if (
-                len(current_batch) + len(customer_invoices) <= config["max_invoices_per_batch"]
-                and current_amount + customer_total <= config["max_amount_per_batch"]
-            ):
-                current_batch.extend(customer_invoices)
-                current_amount += customer_total
-                processed_customers.add(customer)
-
-    # Add current batch if it's substantial
-    if len(current_batch) >= config["min_invoices_per_batch"]:
-        batches.append(current_batch)
-
-    # Process remaining invoices
-    remaining_invoices = []
-    for customer, customer_invoices in customer_groups.items():
-        if customer not in processed_customers:
             remaining_invoices.extend(customer_invoices)
 
+    batches, unplaced = pack_invoice_groups(
+        consolidated_groups,
+        max_amount=config["max_amount_per_batch"],
+        max_count=config["max_invoices_per_batch"],
+        min_count=config["min_invoices_per_batch"],
+        stats=stats,
+    )
+    remaining_invoices.extend(unplaced)
+
     # Create additional batches from remaining invoices
     if remaining_invoices:
-        additional_batches = create_amount_optimized_batches(remaining_invoices, config)
+        additional_batches = create_amount_optimized_batches(remaining_invoices, config, stats)
         batches.extend(additional_batches)
 
     return batches
 
 
-def create_amount_optimized_batches(invoices, config):
+def create_amount_optimized_batches(invoices, config, stats=None):
     """Create batches optimized for amount distribution and risk"""
-    batches = []
-
-    # Sort invoices by amount (mix high and low for balanced risk)
-    sorted_invoices = sorted(invoices, key=lambda x: flt(x["amount"]), reverse=True)
+    batches, _unplaced = pack_invoice_groups(
+        [[invoice] for invoice in invoices],
+        max_amount=config["max_amount_per_batch"],
+        max_count=min(config["preferred_batch_size"], config["max_invoices_per_batch"]),
+        min_count=config["min_invoices_per_batch"],
+        stats=stats,
+    )
+    return batches
 
-    current_batch = []
-    current_amount = 0
 
-    for invoice in sorted_invoices:
-        invoice_amount = flt(invoice["amount"])
+def pack_invoice_groups(groups, max_amount, max_count, min_count, stats=None):
+    """
+    Pack groups of invoices into batches, largest group amount first
 
-        # Check batch limits
-        if (
-            len(current_batch) >= config["max_invoices_per_batch"]
-            or current_amount + invoice_amount > config["max_amount_per_batch"]
-        ):
-            if len(current_batch) >= config["min_invoices_per_batch"]:
-                batches.append(current_batch)
-            current_batch = []
-            current_amount = 0
+    Open batches are kept in a heap ordered by their current amount, so every group is
+    offered to the open batches with the most room left first. Batches that cannot take
+    the group, for example because it would exceed max_count, are skipped until one fits;
+    a new batch is only opened when none does. Batches are closed once they hold
+    max_count invoices. The invoices of one group always end up in the same batch.
 
-        current_batch.append(invoice)
-        current_amount += invoice_amount
+    Returns the batches with at least min_count invoices and the invoices of the batches
+    that were left out.
+    """
+    batches = []
+    totals = []
+    stat_keys = []
+    open_batches = []  # (batch amount, batch index)
+
+    sized_groups = [(sum(flt(inv["amount"]) for inv in group), group) for group in groups if group]
+    sized_groups.sort(key=lambda sized_group: sized_group[0], reverse=True)
+
+    for group_amount, group in sized_groups:
+        index = None
+        skipped = []
+        while open_batches:
+            batch_amount, candidate = heapq.heappop(open_batches)
+            if batch_amount + group_amount > max_amount:
+                # The remaining batches hold at least this amount, none of them fits
+                skipped.append((batch_amount, candidate))
+                break
+            if len(batches[candidate]) + len(group) <= max_count:
+                index = candidate
+                break
+            skipped.append((batch_amount, candidate))
+
+        for entry in skipped:
+            heapq.heappush(open_batches, entry)
+
+        if index is None:
+            index = len(batches)
+            batches.append([])
+            totals.append(0)
+            stat_keys.append(stats.open_batch() if stats else None)
+
+        batches[index].extend(group)
+        totals[index] += group_amount
+        if stats:
+            for invoice in group:
+                stats.add_invoice(stat_keys[index], invoice["amount"])
+
+        if len(batches[index]) < max_count:
+            heapq.heappush(open_batches, (totals[index], index))
+
+    packed = []
+    unplaced = []
+    for index, batch in enumerate(batches):
+        if len(batch) >= min_count:
+            packed.append(batch)
+            continue
+
+        unplaced.extend(batch)
+        if stats:
+            stats.discard_batch(stat_keys[index])
+
+    return packed, unplaced
+
+
+class BatchPlanStats:
+    """Running totals of a batch plan, updated as invoices are placed in batches"""
+
+    def __init__(self):
+        self.invoice_count = 0
+        self.batches = {}
+        self.risk_counts = {"High": 0, "Medium": 0, "Low": 0}
+        self._next_key = 0
+
+    def open_batch(self):
+        """Register a new, empty batch and return its key"""
+        key = self._next_key
+        self._next_key += 1
+        self.batches[key] = (0, 0)
+        return key
+
+    def add_invoice(self, key, amount):
+        total_amount, invoice_count = self.batches[key]
+        if invoice_count:
+            self.risk_counts[get_batch_risk_level(total_amount, invoice_count)] -= 1
+
+        total_amount += flt(amount)
+        invoice_count += 1
+        self.batches[key] = (total_amount, invoice_count)
+        self.risk_counts[get_batch_risk_level(total_amount, invoice_count)] += 1
+        self.invoice_count += 1
+
+    def discard_batch(self, key):
+        """Remove a batch that will not be created"""
+        total_amount, invoice_count = self.batches.pop(key)
+        if invoice_count:
+            self.risk_counts[get_batch_risk_level(total_amount, invoice_count)] -= 1
+        self.invoice_count -= invoice_count
+
+    @property
+    def batch_count(self):
+        return len(self.batches)
+
+    def get_risk_distribution(self):
+        return {
+            "high_risk_batches": self.risk_counts["High"],
+            "medium_risk_batches": self.risk_counts["Medium"],
+            "low_risk_batches": self.risk_counts["Low"],
+        }
 
-        # Create batch if we hit the preferred size
-        if len(current_batch) >= config["preferred_batch_size"]:
-            batches.append(current_batch)
-            current_batch = []
-            current_amount = 0
+    def get_efficiency_score(self, target_size):
+        avg_batch_size = self.invoice_count / self.batch_count if self.batch_count else 0
+        return calculate_efficiency_score(
+            avg_batch_size, target_size, self.get_risk_distribution(), self.batch_count
+        )
 
-    # Add final batch if it meets requirements
-    if len(current_batch) >= config["min_invoices_per_batch"]:
-        batches.append(current_batch)
 
-    return batches
+def get_batch_risk_level(total_amount, invoice_count):
+    """Risk level of a batch with the given total amount and number of invoices"""
+    if flt(total_amount) > 4000 or invoice_count > 25:
+        return "High"
+    if flt(total_amount) > 2000:
+        return "Medium"
+    return "Low"
 
 
 def create_dd_batch_document(batch_invoices, target_date, batch_number, config):
@@ -653,8 +724,13 @@ def determine_batch_type(batch_invoices):
     return "RCUR"
 
 
-def generate_optimization_report(original_invoices, created_batches, config):
-    """Generate report on optimization results"""
+def generate_optimization_report(original_invoices, created_batches, config, plan_stats=None):
+    """
+    Generate report on optimization results
+
+    plan_stats holds the running totals collected while the batches were planned; without
+    it the risk distribution and efficiency score are computed from the created batches.
+    """
 
     total_original_amount = sum(flt(inv["amount"]) for inv in original_invoices)
     total_batched_amount = sum(flt(batch.total_amount) for batch in created_batches)
@@ -663,21 +739,20 @@ def generate_optimization_report(original_invoices, created_batches, config):
     avg_batch_size = len(original_invoices) / len(created_batches) if created_batches else 0
     avg_batch_amount = total_batched_amount / len(created_batches) if created_batches else 0
 
-    # Risk assessment
-    high_risk_batches = sum(
-        1 for batch in created_batches if flt(batch.total_amount) > 4000 or batch.entry_count > 25
-    )
-
-    risk_distribution = {
-        "high_risk_batches": high_risk_batches,
-        "medium_risk_batches": len([b for b in created_batches if 2000 < flt(b.total_amount) <= 4000]),
-        "low_risk_batches": len([b for b in created_batches if flt(b.total_amount) <= 2000]),
-    }
-
-    # Efficiency score (0-100)
-    efficiency_score = calculate_efficiency_score(
-        avg_batch_size, config["preferred_batch_size"], risk_distribution, len(created_batches)
-    )
+    # Risk assessment and efficiency score (0-100)
+    if plan_stats:
+        risk_distribution = plan_stats.get_risk_distribution()
+        efficiency_score = plan_stats.get_efficiency_score(config["preferred_batch_size"])
+    else:
+        risk_levels = [get_batch_risk_level(b.total_amount, b.entry_count) for b in created_batches]
+        risk_distribution = {
+            "high_risk_batches": risk_levels.count("High"),
+            "medium_risk_batches": risk_levels.count("Medium"),
+            "low_risk_batches": risk_levels.count("Low"),
+        }
+        efficiency_score = calculate_efficiency_score(
+            avg_batch_size, config["preferred_batch_size"], risk_distribution, len(created_batches)
+        )
 
     report = {
         "summary": {
@@ -695,11 +770,7 @@ def generate_optimization_report(original_invoices, created_batches, config):
                 "invoice_count": batch.entry_count,
                 "total_amount": flt(batch.total_amount),
                 "batch_type": batch.batch_type,
-                "risk_level": "High"
-                if flt(batch.total_amount) > 4000 or batch.entry_count > 25
-                else "Medium"
-                if flt(batch.total_amount) > 2000
-                else "Low",
+                "risk_level": get_batch_risk_level(batch.total_amount, batch.entry_count),
             }
             for batch in created_batches
         ],
@@ -742,7 +813,8 @@ def get_batching_preview(config=None):
 
     # Analyze and create preview
     invoice_analysis = analyze_invoices_for_optimization(eligible_invoices)
-    batch_groups = create_optimal_batch_groups(invoice_analysis, batch_config)
+    plan_stats = BatchPlanStats()
+    batch_groups = create_optimal_batch_groups(invoice_analysis, batch_config, plan_stats)
 
     preview = []
     for i, group in enumerate(batch_groups):
@@ -752,11 +824,7 @@ def get_batching_preview(config=None):
                 "batch_number": i + 1,
                 "invoice_count": len(group),
                 "total_amount": group_total,
-                "risk_level": "High"
-                if group_total > 4000 or len(group) > 25
-                else "Medium"
-                if group_total > 2000
-                else "Low",
+                "risk_level": get_batch_risk_level(group_total, len(group)),
                 "customers": list(set(inv["customer"] for inv in group)),
                 "sample_invoices": [inv["invoice"] for inv in group[:3]],  # Show first 3
             }
@@ -767,6 +835,7 @@ def get_batching_preview(config=None):
         "eligible_invoices": len(eligible_invoices),
         "total_amount": sum(flt(inv["amount"]) for inv in eligible_invoices),
         "preview": preview,
+        "efficiency_score": plan_stats.get_efficiency_score(batch_config["preferred_batch_size"]),
         "config_used": batch_config,
     }
 
@@ -95,29 +95,16 @@ def _emit_invoice_event(event_name, event_data):
     subscribers = _get_event_subscribers(event_name)
 
     for subscriber in subscribers:
-        # For payment history updates, we need special handling to prevent
-        # concurrent updates to the same member
+        # Payment history updates are coalesced per customer and deferred until after
+        # commit, so a burst of invoice events leads to a single rebuild per member
         if "payment_history_subscriber" in subscriber:
-            # Get the customer from event data
             customer = event_data.get("customer")
             if customer:
-                # Find all members for this customer
-                members = frappe.get_all("Member", filters={"customer": customer}, fields=["name"])
-
-                for member in members:
-                    # Use member-specific job name to serialize updates
-                    # The dedupe key ensures only one job per member runs at a time
-                    frappe.enqueue(
-                        method=subscriber,
-                        queue="short",
-                        job_name=f"payment_history_update_{member.name}",
-                        dedupe=True,  # This prevents multiple jobs for same member
-                        timeout=300,  # 5 minutes timeout
-                        **{  # Separate method arguments from enqueue parameters
-                            "event_name": event_name,
-                            "event_data": event_data,
-                        },
-                    )
+                from verenigingen.events.subscribers.payment_history_coalescer import (
+                    queue_member_history_update,
+                )
+
+                queue_member_history_update(customer)
             else:
                 # Fallback to original behavior if no customer
                 frappe.enqueue(
@@ -0,0 +1,130 @@
+"""
+Coalescing payment history updater
+
+Payment Entry and Sales Invoice events only mark the affected customer as dirty.
+Customers are collected per transaction and published to a Redis set after the
+transaction commits, so rolled back changes never trigger a rebuild. A short-interval
+scheduled job drains the set and rebuilds each affected member's payment history once
+with the bulk payment history builder, however many events arrived for that customer.
+"""
+
+import frappe
+
+# Redis set holding customers whose members need a payment history rebuild
+DIRTY_CUSTOMERS_KEY = "payment_history_dirty_customers"
+
+# Maximum number of customers rebuilt per drain, the rest waits for the next run
+MAX_CUSTOMERS_PER_RUN = 2000
+
+# Number of members whose history is built together in one set of queries
+REBUILD_CHUNK_SIZE = 200
+
+
+def queue_member_history_update(customer):
+    """
+    Mark a customer's members for a deferred payment history rebuild.
+
+    The customer is published to the dirty set once the current transaction commits;
+    repeated calls for the same customer in one transaction collapse into one entry.
+    """
+    if not customer:
+        return
+
+    pending = getattr(frappe.local, "payment_history_pending_customers", None)
+    if pending is None:
+        pending = frappe.local.payment_history_pending_customers = set()
+        frappe.db.after_commit.add(_publish_pending_customers)
+        frappe.db.after_rollback.add(_discard_pending_customers)
+
+    pending.add(customer)
+
+
+def _publish_pending_customers():
+    """After commit: move the customers collected in this transaction to the dirty set"""
+    pending = getattr(frappe.local, "payment_history_pending_customers", None) or set()
+    frappe.local.payment_history_pending_customers = None
+
+    if pending:
+        frappe.cache().sadd(DIRTY_CUSTOMERS_KEY, *pending)
+
+
+def _discard_pending_customers():
+    """After rollback: forget customers collected in the rolled back transaction"""
+    frappe.local.payment_history_pending_customers = None
+
+
+def get_pending_customer_count():
+    """Number of customers waiting for a payment history rebuild"""
+    return len(frappe.cache().smembers(DIRTY_CUSTOMERS_KEY) or [])
+
+
+def process_pending_member_history_updates():
+    """
+    Scheduled job: rebuild the payment history of all members whose customer was marked
+    dirty since the previous run, one rebuild per member.
+    """
+    cache = frappe.cache()
+    customers = [
+        customer.decode() if isinstance(customer, bytes) else customer
+        for customer in (cache.smembers(DIRTY_CUSTOMERS_KEY) or [])
+    ][:MAX_CUSTOMERS_PER_RUN]
+
+    if not customers:
+        return {"customers": 0, "updated": 0, "errors": 0}
+
+    # Remove before rebuilding: events arriving during the rebuild mark the customer again
+    cache.srem(DIRTY_CUSTOMERS_KEY, *customers)
+
+    try:
+        result = refresh_member_payment_history_for_customers(customers)
+    except Exception:
+        # Put the customers back so the next run retries them; rebuilding an already
+        # committed chunk again is harmless
+        cache.sadd(DIRTY_CUSTOMERS_KEY, *customers)
+        raise
+
+    result["customers"] = len(customers)
+
+    frappe.logger("payment_history").info(
+        f"Coalesced payment history update: {len(customers)} customers, "
+        f"{result['updated']} members updated, {result['errors']} errors"
+    )
+    return result
+
+
+def refresh_member_payment_history_for_customers(customers):
+    """Rebuild and save the payment history of every member linked to the given customers"""
+    from verenigingen.verenigingen.doctype.member.payment_history_builder import build_payment_history
+
+    members = frappe.get_all(
+        "Member",
+        filters={"customer": ["in", list(customers)], "docstatus": ["!=", 2]},
+        fields=["name", "customer"],
+    )
+
+    updated = 0
+    errors = 0
+    for i in range(0, len(members), REBUILD_CHUNK_SIZE):
+        chunk = members[i : i + REBUILD_CHUNK_SIZE]
+        payment_histories = build_payment_history(chunk)
+
+        for member_data in chunk:
+            try:
+                member = frappe.get_doc("Member", member_data.name)
+                member._load_payment_history_without_save(payment_histories.get(member_data.name, []))
+                member.flags.ignore_version = True
+                member.flags.ignore_links = True
+                member.save(ignore_permissions=True)
+                updated += 1
+            except Exception as e:
+                errors += 1
+                # Re-mark the customer so the next run retries this member
+                frappe.cache().sadd(DIRTY_CUSTOMERS_KEY, member_data.customer)
+                frappe.log_error(
+                    f"Failed to update payment history for Member {member_data.name}: {str(e)}",
+                    "Coalesced Payment History Update Error",
+                )
+
+        frappe.db.commit()
+
+    return {"updated": updated, "errors": errors}
@@ -195,6 +195,12 @@ scheduler_events = {
         # Security audit log cleanup
         "verenigingen.utils.security.audit_logging.get_audit_logger().cleanup_old_logs",
     ],
+    "cron": {
+        # Coalesced member payment history rebuilds for payment and invoice events
+        "* * * * *": [
+            "verenigingen.events.subscribers.payment_history_coalescer.process_pending_member_history_updates"
+        ],
+    },
     "hourly": [
         # Check analytics alert rules
         "verenigingen.verenigingen.doctype.analytics_alert_rule.analytics_alert_rule.check_all_active_alerts",
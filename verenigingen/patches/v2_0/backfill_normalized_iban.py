@@ -0,0 +1,25 @@
+"""
+Migration patch to fill the normalized IBAN fields used for reconciliation matching
+"""
+
+import frappe
+
+
+def execute():
+    """Fill iban_normalized on SEPA Mandate and Member from the existing IBANs"""
+
+    for doctype, module_path in (("SEPA Mandate", "sepa_mandate"), ("Member", "member")):
+        frappe.reload_doc("verenigingen", "doctype", module_path)
+
+        frappe.db.sql(
+            f"""
+            UPDATE `tab{doctype}`
+            SET iban_normalized = UPPER(REPLACE(iban, ' ', ''))
+            WHERE IFNULL(iban, '') != ''
+            AND IFNULL(iban_normalized, '') != UPPER(REPLACE(iban, ' ', ''))
+        """
+        )
+
+        frappe.logger().info(f"Backfilled normalized IBANs for {doctype}")
+
+    frappe.db.commit()
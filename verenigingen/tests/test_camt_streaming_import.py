@@ -0,0 +1,144 @@
+"""
+Tests for the streaming CAMT.053/CAMT.054 import
+"""
+
+import io
+import tracemalloc
+import unittest
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+import frappe
+
+from verenigingen.utils import manual_camt_import, mt940_import
+from verenigingen.utils.manual_camt_import import iter_camt_entries, process_manual_camt_document
+
+CAMT_053_ENTRY = """
+<Ntry>
+  <Amt Ccy="EUR">{amount}</Amt>
+  <CdtDbtInd>CRDT</CdtDbtInd>
+  <Sts>BOOK</Sts>
+  <BookgDt><Dt>2025-01-{day:02d}</Dt></BookgDt>
+  <AcctSvcrRef>REF-{number}</AcctSvcrRef>
+  <BkTxCd><Domn><Cd>PMNT</Cd><Fmly><Cd>RCDT</Cd><SubFmlyCd>ESCT</SubFmlyCd></Fmly></Domn></BkTxCd>
+  <NtryDtls><TxDtls>
+    <Refs><EndToEndId>NOTPROVIDED</EndToEndId></Refs>
+    <RltdPties>
+      <Dbtr><Nm>Jan de Vries</Nm></Dbtr>
+      <DbtrAcct><Id><IBAN>NL91ABNA0417164300</IBAN></Id></DbtrAcct>
+    </RltdPties>
+    <RmtInf><Ustrd>Contributie {number}</Ustrd></RmtInf>
+  </TxDtls></NtryDtls>
+</Ntry>"""
+
+CAMT_054_DOCUMENT = """<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.054.001.08">
+  <BkToCstmrDbtCdtNtfctn>
+    <Ntfctn>
+      <Acct><Id><IBAN>NL02TRIO0123456789</IBAN></Id></Acct>
+      <Ntry>
+        <Amt Ccy="EUR">12.50</Amt>
+        <CdtDbtInd>DBIT</CdtDbtInd>
+        <Sts><Cd>PDNG</Cd></Sts>
+        <ValDt><Dt>2025-02-03</Dt></ValDt>
+        <NtryDtls><TxDtls>
+          <Refs><EndToEndId>E2E-1</EndToEndId><MndtId>MANDATE-1</MndtId></Refs>
+          <RltdPties><Cdtr><Pty><Nm>Energie BV</Nm></Pty></Cdtr></RltdPties>
+        </TxDtls></NtryDtls>
+      </Ntry>
+    </Ntfctn>
+  </BkToCstmrDbtCdtNtfctn>
+</Document>
+"""
+
+
+def make_camt_053(entry_count):
+    entries = "".join(
+        CAMT_053_ENTRY.format(amount=f"{25 + i % 10}.00", day=i % 28 + 1, number=i)
+        for i in range(entry_count)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.02"><BkToCstmrStmt><Stmt>'
+        "<Acct><Id><IBAN>NL02TRIO0123456789</IBAN></Id></Acct>"
+        f"{entries}</Stmt></BkToCstmrStmt></Document>"
+    ).encode("utf-8")
+
+
+class TestCAMTStreamingImport(unittest.TestCase):
+    """Test streaming entry parsing and resumable chunked imports"""
+
+    def test_camt_053_and_054_entries_are_read(self):
+        """Entries of both document types are read without namespaces"""
+        (statement_entry,) = iter_camt_entries(io.BytesIO(make_camt_053(1)))
+        (notification_entry,) = iter_camt_entries(io.BytesIO(CAMT_054_DOCUMENT.encode("utf-8")))
+
+        self.assertEqual(statement_entry.document_type, "camt.053")
+        self.assertEqual(statement_entry.account_iban, "NL02TRIO0123456789")
+        self.assertEqual((statement_entry.status, statement_entry.date), ("BOOK", "2025-01-01"))
+        self.assertEqual(statement_entry.amount, Decimal("25.00"))
+        self.assertEqual(statement_entry.eref, "")
+        self.assertEqual(statement_entry.counterparty, "Jan de Vries")
+        self.assertEqual(statement_entry.transaction_type, "SEPA Credit Transfer")
+
+        self.assertEqual(notification_entry.document_type, "camt.054")
+        self.assertEqual((notification_entry.status, notification_entry.date), ("PDNG", "2025-02-03"))
+        self.assertEqual(notification_entry.amount, Decimal("-12.50"))
+        self.assertEqual((notification_entry.eref, notification_entry.mref), ("E2E-1", "MANDATE-1"))
+        self.assertEqual(notification_entry.counterparty, "Energie BV")
+
+    def test_memory_stays_bounded(self):
+        """Entries are released after they are read, so peak memory does not grow with the file"""
+
+        def peak_memory(entry_count):
+            content = make_camt_053(entry_count)
+            tracemalloc.start()
+            try:
+                self.assertEqual(sum(1 for _entry in iter_camt_entries(io.BytesIO(content))), entry_count)
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        small_file_peak = peak_memory(500)
+
+        self.assertLess(peak_memory(2000), small_file_peak * 1.5)
+
+    def test_import_resumes_after_checkpoint(self):
+        """Entries of committed chunks are skipped and every chunk updates the checkpoint"""
+        checkpoint = MagicMock(
+            status="Failed", entries_processed=2, transactions_created=2, transactions_skipped=0
+        )
+        checkpoint.file_format = "camt.053"
+        database = MagicMock()
+        database.get_value.return_value = None
+        inserted = []
+
+        with patch.object(frappe, "db", database, create=True), patch.object(
+            frappe, "get_all", lambda *args, **kwargs: [], create=True
+        ), patch.object(frappe, "publish_progress", MagicMock(), create=True), patch.object(
+            frappe, "new_doc", lambda doctype: frappe._dict(doctype=doctype), create=True
+        ), patch.object(
+            manual_camt_import, "get_import_checkpoint", return_value=checkpoint
+        ), patch.object(
+            manual_camt_import, "mt940_enhanced_fields_exist", return_value=None
+        ), patch.object(
+            mt940_import, "insert_bank_transactions", inserted.append
+        ):
+            result = process_manual_camt_document(make_camt_053(7), "NL Bank", "Test Company", chunk_size=2)
+
+        self.assertTrue(result["success"])
+        self.assertEqual((result["transactions_created"], result["resumed_after"]), (5, 2))
+        self.assertEqual([len(chunk) for chunk in inserted], [2, 2, 1])
+        self.assertEqual(
+            [c.args[0]["entries_processed"] for c in checkpoint.db_set.call_args_list], [4, 6, 7, 7]
+        )
+        self.assertEqual(checkpoint.db_set.call_args_list[-1].args[0]["status"], "Completed")
+        self.assertEqual(checkpoint.db_set.call_args_list[-1].args[0]["transactions_created"], 7)
+        # Entries keep the bank reference as transaction id, as in earlier CAMT imports
+        self.assertEqual(
+            [bt.transaction_id for chunk in inserted for bt in chunk], [f"REF-{i}" for i in range(2, 7)]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
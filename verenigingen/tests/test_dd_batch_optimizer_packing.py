@@ -0,0 +1,131 @@
+"""
+Tests for the DD batch optimizer packing strategies
+"""
+
+import random
+import unittest
+
+from verenigingen.api.dd_batch_optimizer import (
+    DEFAULT_CONFIG,
+    BatchPlanStats,
+    calculate_efficiency_score,
+    create_amount_optimized_batches,
+    create_customer_consolidated_batches,
+    get_batch_risk_level,
+    pack_invoice_groups,
+)
+
+
+def make_invoice(number, amount, customer=None):
+    return {"invoice": f"INV-{number:05d}", "amount": amount, "customer": customer or f"CUST-{number:05d}"}
+
+
+class TestDDBatchOptimizerPacking(unittest.TestCase):
+    """Test batch packing under the amount and count limits"""
+
+    def setUp(self):
+        self.config = DEFAULT_CONFIG.copy()
+
+    def assertWithinLimits(self, batches, max_count):
+        for batch in batches:
+            self.assertLessEqual(len(batch), max_count)
+            self.assertGreaterEqual(len(batch), self.config["min_invoices_per_batch"])
+            self.assertLessEqual(sum(inv["amount"] for inv in batch), self.config["max_amount_per_batch"])
+
+    def test_packs_all_invoices_within_limits(self):
+        """Every invoice is placed once and no batch exceeds the limits"""
+        rng = random.Random(42)
+        invoices = [make_invoice(i, rng.choice([12.5, 25, 50, 150, 900])) for i in range(2000)]
+
+        batches = create_amount_optimized_batches(invoices, self.config)
+
+        placed = [inv["invoice"] for batch in batches for inv in batch]
+        self.assertEqual(len(placed), len(set(placed)))
+        self.assertEqual(len(placed), len(invoices))
+        self.assertWithinLimits(batches, self.config["preferred_batch_size"])
+
+    def test_large_invoices_share_batches_with_small_ones(self):
+        """Small invoices fill up the room left next to large ones"""
+        invoices = [make_invoice(i, 1500) for i in range(6)] + [make_invoice(i, 10) for i in range(6, 30)]
+
+        batches, unplaced = pack_invoice_groups(
+            [[invoice] for invoice in invoices], max_amount=4000, max_count=20, min_count=3
+        )
+
+        self.assertEqual(unplaced, [])
+        self.assertEqual(len(batches), 3)
+        for batch in batches:
+            self.assertEqual(sum(1 for inv in batch if inv["amount"] == 1500), 2)
+
+    def test_customer_invoices_stay_together(self):
+        """Invoices of a customer with multiple invoices end up in the same batch"""
+        invoices = []
+        for customer in range(30):
+            for i in range(3):
+                invoices.append(make_invoice(customer * 3 + i, 40, customer=f"CUST-{customer}"))
+
+        batches = create_customer_consolidated_batches(invoices, self.config)
+
+        batch_by_customer = {}
+        for index, batch in enumerate(batches):
+            for invoice in batch:
+                self.assertEqual(batch_by_customer.setdefault(invoice["customer"], index), index)
+        self.assertEqual(sum(len(batch) for batch in batches), len(invoices))
+        self.assertWithinLimits(batches, self.config["max_invoices_per_batch"])
+
+    def test_group_skips_batch_without_room_for_its_invoices(self):
+        """A group that exceeds the count limit of the emptiest batch goes to another open batch"""
+        groups = [
+            [make_invoice(1, 70)],
+            [make_invoice(2, 36)],
+            [make_invoice(3, 10), make_invoice(4, 10), make_invoice(5, 10)],
+            [make_invoice(6, 12), make_invoice(7, 12)],
+        ]
+
+        batches, unplaced = pack_invoice_groups(groups, max_amount=100, max_count=5, min_count=1)
+
+        self.assertEqual(unplaced, [])
+        self.assertEqual(
+            [[inv["invoice"] for inv in batch] for batch in batches],
+            [["INV-00001", "INV-00006", "INV-00007"], ["INV-00002", "INV-00003", "INV-00004", "INV-00005"]],
+        )
+
+    def test_undersized_batches_are_left_out(self):
+        """Batches below the minimum size are returned as unplaced invoices"""
+        invoices = [make_invoice(i, 3000) for i in range(2)]
+
+        batches, unplaced = pack_invoice_groups(
+            [[invoice] for invoice in invoices], max_amount=4000, max_count=20, min_count=3
+        )
+
+        self.assertEqual(batches, [])
+        self.assertEqual(len(unplaced), 2)
+
+    def test_plan_stats_match_created_batches(self):
+        """The incrementally kept efficiency score equals the score of the final batches"""
+        rng = random.Random(7)
+        invoices = [make_invoice(i, rng.choice([5, 30, 250, 1800])) for i in range(500)]
+        stats = BatchPlanStats()
+
+        batches = create_amount_optimized_batches(invoices, self.config, stats)
+
+        risk_levels = [get_batch_risk_level(sum(inv["amount"] for inv in b), len(b)) for b in batches]
+        risk_distribution = {
+            "high_risk_batches": risk_levels.count("High"),
+            "medium_risk_batches": risk_levels.count("Medium"),
+            "low_risk_batches": risk_levels.count("Low"),
+        }
+        expected_score = calculate_efficiency_score(
+            sum(len(b) for b in batches) / len(batches),
+            self.config["preferred_batch_size"],
+            risk_distribution,
+            len(batches),
+        )
+
+        self.assertEqual(stats.batch_count, len(batches))
+        self.assertEqual(stats.get_risk_distribution(), risk_distribution)
+        self.assertEqual(stats.get_efficiency_score(self.config["preferred_batch_size"]), expected_score)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+"""
+Tests for the set-based dues invoice eligibility engine
+"""
+
+import frappe
+from frappe.utils import add_days, getdate, today
+
+from verenigingen.tests.utils.base import VereningingenTestCase
+from verenigingen.verenigingen.doctype.membership_dues_schedule.dues_invoice_eligibility import (
+    get_billing_period,
+    get_invoice_eligibility,
+)
+
+
+class TestDuesInvoiceEligibility(VereningingenTestCase):
+    """Test that bulk eligibility agrees with the per-schedule checks"""
+
+    def _create_member_with_schedule(self, member_status="Active", **schedule_kwargs):
+        member = self.create_test_member(status=member_status)
+        membership = self.create_test_membership(member=member.name)
+        schedule = self.create_test_dues_schedule(
+            member=member.name, membership_type=membership.membership_type, **schedule_kwargs
+        )
+        return member, schedule
+
+    def _result_for(self, eligibility, schedule_name):
+        if schedule_name in eligibility["eligible"]:
+            return True, None
+        for skipped in eligibility["skipped"]:
+            if skipped["schedule"] == schedule_name:
+                return False, skipped["reason"]
+        return None, None
+
+    def test_eligible_schedule_is_returned(self):
+        """A billable member with a due schedule is eligible"""
+        _member, schedule = self._create_member_with_schedule()
+
+        eligible, _reason = self._result_for(get_invoice_eligibility(), schedule.name)
+
+        self.assertTrue(eligible)
+        self.assertTrue(schedule.can_generate_invoice()[0])
+
+    def test_terminated_member_is_skipped(self):
+        """Non-billable member statuses are skipped with a reason"""
+        _member, schedule = self._create_member_with_schedule(member_status="Terminated")
+
+        eligible, reason = self._result_for(get_invoice_eligibility(), schedule.name)
+
+        self.assertFalse(eligible)
+        self.assertEqual(reason, "Member is not eligible for billing")
+
+    def test_too_early_schedule_is_skipped(self):
+        """Schedules are only invoiced once the generation date is reached"""
+        _member, schedule = self._create_member_with_schedule(
+            next_invoice_date=add_days(today(), 20), invoice_days_before=5
+        )
+
+        eligible, reason = self._result_for(get_invoice_eligibility(), schedule.name)
+
+        self.assertFalse(eligible)
+        self.assertTrue(reason.startswith("Too early"))
+
+    def test_existing_invoice_in_period_is_skipped(self):
+        """An invoice for the customer in the current billing period blocks a new one"""
+        member, schedule = self._create_member_with_schedule()
+        self.create_test_sales_invoice(member=member.name, posting_date=today())
+
+        eligible, reason = self._result_for(get_invoice_eligibility(), schedule.name)
+
+        self.assertFalse(eligible)
+        self.assertTrue(reason.startswith("Same-day duplicate prevented"))
+        self.assertFalse(schedule.can_generate_invoice()[0])
+
+    def test_test_mode_schedules_are_separated(self):
+        """Regular runs ignore test mode schedules and vice versa"""
+        _member, schedule = self._create_member_with_schedule()
+        frappe.db.set_value("Membership Dues Schedule", schedule.name, "test_mode", 1)
+
+        self.assertEqual(self._result_for(get_invoice_eligibility(), schedule.name), (None, None))
+        self.assertTrue(self._result_for(get_invoice_eligibility(test_mode=True), schedule.name)[0])
+
+    def test_billing_periods(self):
+        """Billing periods match the schedule's billing frequency"""
+        invoice_date = getdate("2025-05-14")
+
+        self.assertEqual(
+            get_billing_period("Monthly", invoice_date), (getdate("2025-05-01"), getdate("2025-05-31"))
+        )
+        self.assertEqual(
+            get_billing_period("Quarterly", invoice_date), (getdate("2025-04-01"), getdate("2025-06-30"))
+        )
+        self.assertEqual(
+            get_billing_period("Custom", invoice_date, 2, "Months"),
+            (getdate("2025-05-01"), getdate("2025-06-30")),
+        )
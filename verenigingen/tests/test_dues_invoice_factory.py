@@ -0,0 +1,55 @@
+"""
+Tests for the bulk membership dues invoice factory
+"""
+
+import frappe
+from frappe.utils import getdate, today
+
+from verenigingen.tests.utils.base import VereningingenTestCase
+from verenigingen.verenigingen.doctype.membership_dues_schedule.dues_invoice_factory import (
+    DuesInvoiceFactory,
+    get_dues_item_code,
+)
+
+
+class TestDuesInvoiceFactory(VereningingenTestCase):
+    """Test chunked invoice creation with shared context"""
+
+    def setUp(self):
+        super().setUp()
+        self.schedules = []
+        for _ in range(3):
+            member = self.create_test_member()
+            # An old invoice makes sure the member has a customer record
+            self.create_test_sales_invoice(member=member.name, posting_date="2020-01-15")
+            membership = self.create_test_membership(member=member.name)
+            self.schedules.append(
+                self.create_test_dues_schedule(member=member.name, membership_type=membership.membership_type)
+            )
+
+    def test_invoices_are_created_in_chunks(self):
+        """Every schedule gets an invoice and throughput is reported per chunk"""
+        results = DuesInvoiceFactory(chunk_size=2).create_invoices([s.name for s in self.schedules])
+
+        for invoice in results["invoices"]:
+            self.track_doc("Sales Invoice", invoice["invoice"])
+
+        self.assertEqual(results["errors"], [])
+        self.assertEqual(results["generated"], 3)
+        self.assertEqual([chunk["generated"] for chunk in results["chunks"]], [2, 1])
+
+    def test_schedule_is_advanced_after_invoicing(self):
+        """The schedule records the invoice and its coverage period"""
+        schedule = self.schedules[0]
+        results = DuesInvoiceFactory().create_invoices([schedule.name])
+        invoice_name = results["invoices"][0]["invoice"]
+        self.track_doc("Sales Invoice", invoice_name)
+
+        schedule.reload()
+        invoice = frappe.get_doc("Sales Invoice", invoice_name)
+
+        self.assertEqual(schedule.last_generated_invoice, invoice_name)
+        self.assertEqual(getdate(schedule.last_invoice_date), getdate(today()))
+        self.assertEqual(getdate(invoice.custom_coverage_start_date), getdate(schedule.last_invoice_coverage_start))
+        self.assertEqual(invoice.items[0].item_code, get_dues_item_code(schedule.billing_frequency))
+        self.assertEqual(invoice.items[0].rate, schedule.dues_rate)
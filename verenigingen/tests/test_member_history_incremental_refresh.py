@@ -0,0 +1,38 @@
+"""
+Tests for the incremental (watermark driven) member financial history refresh
+"""
+
+import frappe
+from frappe.utils import add_to_date, now_datetime
+
+from verenigingen.tests.utils.base import VereningingenTestCase
+from verenigingen.verenigingen.doctype.member.scheduler import get_members_with_financial_changes
+
+
+class TestMemberHistoryIncrementalRefresh(VereningingenTestCase):
+    """Test change detection used by the incremental member history refresh"""
+
+    def setUp(self):
+        super().setUp()
+        self.member = self.create_test_member()
+
+    def test_member_with_new_invoice_is_detected(self):
+        """A member whose customer received an invoice after the watermark is returned"""
+        watermark = add_to_date(now_datetime(), seconds=-1)
+        self.create_test_sales_invoice(member=self.member.name)
+
+        changed = {m.name for m in get_members_with_financial_changes(watermark)}
+        self.assertIn(self.member.name, changed)
+
+    def test_unchanged_member_is_skipped(self):
+        """Members without changes since the watermark are not returned"""
+        self.create_test_sales_invoice(member=self.member.name)
+        watermark = add_to_date(now_datetime(), seconds=1)
+
+        changed = {m.name for m in get_members_with_financial_changes(watermark)}
+        self.assertNotIn(self.member.name, changed)
+
+    def test_no_changes_returns_empty_list(self):
+        """A watermark in the future yields no members"""
+        watermark = add_to_date(now_datetime(), days=1)
+        self.assertEqual(get_members_with_financial_changes(watermark), [])
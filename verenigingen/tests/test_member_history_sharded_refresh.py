@@ -0,0 +1,113 @@
+"""
+Tests for the sharded, checkpointed member history refresh
+"""
+
+from unittest.mock import patch
+
+import frappe
+
+from verenigingen.tests.utils.base import VereningingenTestCase
+from verenigingen.verenigingen.doctype.member import scheduler
+
+
+class TestMemberHistoryShardedRefresh(VereningingenTestCase):
+    """Test shard creation, checkpointing and resume of the member history refresh"""
+
+    def setUp(self):
+        super().setUp()
+        self.members = [self.create_test_member() for _ in range(3)]
+        for member in self.members:
+            self.create_test_sales_invoice(member=member.name)
+        self.run_ids = []
+
+    def tearDown(self):
+        for run_id in self.run_ids:
+            frappe.db.delete("Member History Refresh Shard", {"run_id": run_id})
+        super().tearDown()
+
+    def _enqueue(self):
+        with patch.object(scheduler, "enqueue") as mock_enqueue:
+            result = scheduler.enqueue_member_history_refresh(
+                [{"name": member.name} for member in self.members], shard_size=2
+            )
+        self.run_ids.append(result["run_id"])
+        return result, mock_enqueue
+
+    def test_members_are_split_into_shards(self):
+        """Each shard is recorded and enqueued, spread over the configured queues"""
+        result, mock_enqueue = self._enqueue()
+
+        self.assertTrue(result["success"])
+        self.assertEqual(result["shards"], 2)
+        self.assertEqual(mock_enqueue.call_count, 2)
+
+        queues = {call.kwargs["queue"] for call in mock_enqueue.call_args_list}
+        self.assertEqual(queues, set(scheduler.REFRESH_QUEUES))
+
+        shards = frappe.get_all(
+            "Member History Refresh Shard",
+            filters={"run_id": result["run_id"]},
+            fields=["status", "total_members"],
+        )
+        self.assertEqual(sorted(shard.total_members for shard in shards), [1, 2])
+        self.assertTrue(all(shard.status == "Queued" for shard in shards))
+
+    def test_completed_shards_are_checkpointed(self):
+        """Processing a shard marks it completed and updates the run progress"""
+        result, _ = self._enqueue()
+        shard_names = frappe.get_all(
+            "Member History Refresh Shard",
+            filters={"run_id": result["run_id"]},
+            pluck="name",
+            order_by="shard_index asc",
+        )
+
+        scheduler.process_member_history_shard(shard_names[0])
+
+        progress = scheduler.get_member_history_refresh_progress(result["run_id"])
+        self.assertEqual(progress["shards_by_status"].get("Completed"), 1)
+        self.assertEqual(progress["progress_percentage"], 50)
+        self.assertFalse(progress["is_complete"])
+
+    def test_resume_only_requeues_unfinished_shards(self):
+        """Resuming a run skips shards that already completed"""
+        result, _ = self._enqueue()
+        shard_names = frappe.get_all(
+            "Member History Refresh Shard",
+            filters={"run_id": result["run_id"]},
+            pluck="name",
+            order_by="shard_index asc",
+        )
+        scheduler.process_member_history_shard(shard_names[0])
+        frappe.db.set_value("Member History Refresh Shard", shard_names[1], "status", "Failed")
+
+        with patch.object(scheduler, "enqueue") as mock_enqueue:
+            resumed = scheduler.resume_member_history_refresh(result["run_id"])
+
+        self.assertEqual(resumed["shards"], 1)
+        self.assertEqual(mock_enqueue.call_args.kwargs["shard_name"], shard_names[1])
+
+    def test_exhausted_run_is_abandoned(self):
+        """A shard that keeps failing abandons its run instead of being re-queued forever"""
+        result, _ = self._enqueue()
+        shard_names = frappe.get_all(
+            "Member History Refresh Shard",
+            filters={"run_id": result["run_id"]},
+            pluck="name",
+            order_by="shard_index asc",
+        )
+        frappe.db.set_value(
+            "Member History Refresh Shard",
+            shard_names[1],
+            {"status": "Failed", "attempts": scheduler.REFRESH_SHARD_MAX_ATTEMPTS},
+        )
+
+        self.assertTrue(scheduler._abandon_exhausted_member_history_refresh_run(result["run_id"]))
+
+        statuses = frappe.get_all(
+            "Member History Refresh Shard",
+            filters={"run_id": result["run_id"]},
+            pluck="status",
+        )
+        self.assertEqual(set(statuses), {"Abandoned"})
+        self.assertNotEqual(scheduler.get_incomplete_member_history_refresh_run(), result["run_id"])
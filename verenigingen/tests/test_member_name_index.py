@@ -0,0 +1,64 @@
+"""
+Tests for the fuzzy member name index
+"""
+
+import unittest
+from unittest.mock import patch
+
+from verenigingen.utils import member_name_index
+from verenigingen.utils.member_name_index import MemberNameIndex, normalize_name
+
+
+class TestMemberNameIndex(unittest.TestCase):
+    """Test name normalization and blocked lookups"""
+
+    def test_normalize_name(self):
+        """Diacritics, punctuation and tussenvoegsels are removed"""
+        self.assertEqual(normalize_name("Jan van der Bërg"), "JAN BERG")
+        self.assertEqual(normalize_name("J.v.d. Berg"), "J BERG")
+        self.assertEqual(normalize_name("Sanne 't Hart"), "SANNE HART")
+        self.assertEqual(normalize_name(None), "")
+
+    def test_finds_name_in_description(self):
+        """A name written differently in a transaction description is found with a high score"""
+        index = MemberNameIndex(
+            [
+                {"full_name": "Jürgen van der Höfen", "invoice": "ACC-SINV-0001"},
+                {"full_name": "Anna de Vries", "invoice": "ACC-SINV-0002"},
+                {"full_name": "Jan Jansen", "invoice": "ACC-SINV-0003"},
+            ]
+        )
+
+        results = index.search("CONTRIBUTIE 2025 JURGEN V.D. HOFEN")
+
+        self.assertEqual(results[0][1]["invoice"], "ACC-SINV-0001")
+        self.assertEqual(results[0][0], 1.0)
+        self.assertEqual(index.search("12345"), [])
+
+    def test_returns_top_k_best_first(self):
+        """At most limit results are returned, ordered by score"""
+        index = MemberNameIndex([{"full_name": f"Member Name {i}"} for i in range(20)])
+
+        results = index.search("Member Name 7", limit=3)
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0][1]["full_name"], "Member Name 7")
+        self.assertEqual([score for score, _entry in results], sorted((s for s, _e in results), reverse=True))
+
+    def test_lookup_cost_is_bounded(self):
+        """Only a bounded number of candidates is scored, however many names share an amount"""
+        entries = [{"full_name": f"Emma de Boer {i:05d}"} for i in range(5000)]
+        entries.append({"full_name": "Quirijn Zwartkruis"})
+        index = MemberNameIndex(entries)
+
+        with patch.object(
+            MemberNameIndex, "_score", autospec=True, side_effect=MemberNameIndex._score
+        ) as score:
+            results = index.search("Betaling Q. Zwartkruis")
+
+        self.assertEqual(results[0][1]["full_name"], "Quirijn Zwartkruis")
+        self.assertLessEqual(score.call_count, member_name_index.MAX_CANDIDATES_PER_LOOKUP)
+
+
+if __name__ == "__main__":
+    unittest.main()
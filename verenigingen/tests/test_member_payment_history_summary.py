@@ -0,0 +1,56 @@
+"""
+Tests for the persisted member payment history and its denormalized summary
+"""
+
+import frappe
+
+from verenigingen.tests.utils.base import VereningingenTestCase
+
+
+class TestMemberPaymentHistorySummary(VereningingenTestCase):
+    """Test that payment history is persisted and only rebuilt on request"""
+
+    def setUp(self):
+        super().setUp()
+        self.member = self.create_test_member()
+        self.invoice = self.create_test_sales_invoice(member=self.member.name)
+        self.member.reload()
+
+    def tearDown(self):
+        frappe.flags.live_payment_history = False
+        super().tearDown()
+
+    def test_summary_is_persisted_with_history(self):
+        """Rebuilding the history stores the summary fields on the member"""
+        self.member.load_payment_history()
+
+        stored = frappe.db.get_value(
+            "Member",
+            self.member.name,
+            ["payment_history_updated_on", "outstanding_invoice_count"],
+            as_dict=True,
+        )
+        self.assertIsNotNone(stored.payment_history_updated_on)
+        # The test invoice is a draft, so nothing is outstanding yet
+        self.assertEqual(stored.outstanding_invoice_count, 0)
+
+    def test_on_load_does_not_rebuild_by_default(self):
+        """Loading a member keeps the persisted rows instead of scanning invoices"""
+        member = frappe.get_doc("Member", self.member.name)
+        member.payment_history = []
+
+        member.on_load()
+        self.assertEqual(len(member.payment_history), 0)
+
+    def test_live_rebuild_is_opt_in(self):
+        """Live rebuilds happen only when explicitly requested"""
+        member = frappe.get_doc("Member", self.member.name)
+        member.payment_history = []
+
+        frappe.flags.live_payment_history = True
+        member.on_load()
+        self.assertIn(self.invoice.name, [row.invoice for row in member.payment_history])
+
+        member.payment_history = []
+        rows = member.get_payment_history(live=True)
+        self.assertIn(self.invoice.name, [row.get("invoice") for row in rows])
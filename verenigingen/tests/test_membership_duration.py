@@ -0,0 +1,65 @@
+"""
+Tests for the membership duration engine
+"""
+
+import unittest
+
+import frappe
+from frappe.utils import getdate
+
+from verenigingen.verenigingen.doctype.member.membership_duration import (
+    calculate_total_membership_days,
+    format_membership_duration,
+    merge_periods,
+)
+
+
+class TestMembershipDuration(unittest.TestCase):
+    """Test interval merging and duration formatting"""
+
+    today_date = getdate("2025-06-30")
+
+    def _membership(self, start_date, renewal_date=None, status="Active", cancellation_date=None):
+        return frappe._dict(
+            start_date=start_date,
+            renewal_date=renewal_date,
+            status=status,
+            cancellation_date=cancellation_date,
+        )
+
+    def test_single_active_membership_counts_until_today(self):
+        memberships = [self._membership("2025-06-01", "2026-06-01")]
+        self.assertEqual(calculate_total_membership_days(memberships, self.today_date), 30)
+
+    def test_overlapping_memberships_are_not_double_counted(self):
+        memberships = [
+            self._membership("2024-01-01", "2024-12-31", status="Expired"),
+            self._membership("2024-12-01", "2025-01-31", status="Expired"),
+        ]
+        self.assertEqual(calculate_total_membership_days(memberships, self.today_date), 397)
+
+    def test_gaps_between_memberships_are_excluded(self):
+        memberships = [
+            self._membership("2024-01-01", "2024-01-10", status="Expired"),
+            self._membership("2024-02-01", "2024-02-10", status="Cancelled", cancellation_date="2024-02-05"),
+        ]
+        self.assertEqual(calculate_total_membership_days(memberships, self.today_date), 15)
+
+    def test_merge_periods(self):
+        periods = [
+            (getdate("2024-03-01"), getdate("2024-03-31")),
+            (getdate("2024-01-01"), getdate("2024-01-31")),
+            (getdate("2024-02-01"), getdate("2024-02-15")),
+        ]
+        self.assertEqual(
+            merge_periods(periods),
+            [
+                (getdate("2024-01-01"), getdate("2024-02-15")),
+                (getdate("2024-03-01"), getdate("2024-03-31")),
+            ],
+        )
+
+    def test_format_membership_duration(self):
+        self.assertEqual(format_membership_duration(0), "Less than 1 day")
+        self.assertEqual(format_membership_duration(45), "1 month, 15 days")
+        self.assertEqual(format_membership_duration(800), "2 years, 2 months")
@@ -0,0 +1,78 @@
+"""
+Tests for the chunked MT940 Bank Transaction import
+"""
+
+import unittest
+from unittest.mock import MagicMock, patch
+
+import frappe
+from frappe.utils import getdate
+
+from verenigingen.utils import mt940_import
+from verenigingen.utils.mt940_import import BankTransactionChunkImporter, iter_mt940_statements
+
+MT940_CONTENT = """{1:F01INGBNL2AXXXX0000000000}{2:I940INGBNL2AXXXXN}{4:
+:20:STATEMENT-1
+:25:NL91INGB0001234567
+:28C:1
+:60F:C250101EUR100,00
+:61:2501020102C25,00NTRFNONREF
+:86:Contributie januari
+:62F:C250102EUR125,00
+:20:STATEMENT-2
+:25:NL91INGB0001234567
+:28C:2
+:60F:C250102EUR125,00
+:61:2501030103D10,00NTRFNONREF
+:86:Bankkosten
+:62F:C250103EUR115,00
+-}
+"""
+
+
+class TestMT940ChunkedImport(unittest.TestCase):
+    """Test statement splitting and chunked duplicate detection"""
+
+    def test_statements_are_split_on_transaction_reference(self):
+        """Each :20: starts a statement and the SWIFT header before the first one is skipped"""
+        statements = list(iter_mt940_statements(MT940_CONTENT))
+
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(statements[0].startswith(":20:STATEMENT-1\n"))
+        self.assertIn(":86:Contributie januari\n", statements[0])
+        self.assertTrue(statements[1].startswith(":20:STATEMENT-2\n"))
+        self.assertTrue(statements[1].endswith("-}\n"))
+
+    def test_chunks_skip_existing_and_repeated_transactions(self):
+        """Duplicates come from one preload per chunk and every chunk is committed and reported"""
+        transactions = [frappe._dict(transaction_id=f"TX-{i}", date=f"2025-01-{i + 1:02d}") for i in range(5)]
+        transactions.append(frappe._dict(transaction_id="TX-4", date="2025-01-05"))
+        inserted = []
+        database = MagicMock()
+        get_all = MagicMock(side_effect=[["TX-1"], []])
+        publish_progress = MagicMock()
+
+        with patch.object(frappe, "db", database, create=True), patch.object(
+            frappe, "get_all", get_all, create=True
+        ), patch.object(frappe, "publish_progress", publish_progress, create=True), patch.object(
+            mt940_import, "insert_bank_transactions", inserted.append
+        ):
+            importer = BankTransactionChunkImporter("NL Bank", chunk_size=3)
+            for transaction in transactions:
+                importer.add(transaction, progress=0.5)
+            importer.flush(progress=1)
+
+        self.assertEqual(
+            [[bt.transaction_id for bt in chunk] for chunk in inserted], [["TX-0", "TX-2"], ["TX-3", "TX-4"]]
+        )
+        self.assertEqual((importer.created, importer.skipped, importer.chunks), (4, 1, 2))
+        self.assertEqual(
+            get_all.call_args_list[0].kwargs["filters"]["date"][1],
+            [getdate("2025-01-01"), getdate("2025-01-03")],
+        )
+        self.assertEqual(database.commit.call_count, 2)
+        self.assertEqual([c.args[0] for c in publish_progress.call_args_list], [50, 100])
+
+
+if __name__ == "__main__":
+    unittest.main()
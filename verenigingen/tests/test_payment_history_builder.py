@@ -0,0 +1,78 @@
+"""
+Tests for the set-based member payment history builder
+"""
+
+import frappe
+from frappe.utils import getdate
+
+from verenigingen.tests.utils.base import VereningingenTestCase
+from verenigingen.verenigingen.doctype.member.payment_history_builder import (
+    build_payment_history,
+    calculate_coverage_from_invoice_date,
+    get_payment_status,
+)
+
+
+class TestPaymentHistoryBuilder(VereningingenTestCase):
+    """Test bulk assembly of member payment history rows"""
+
+    def test_builds_rows_for_multiple_members(self):
+        """Each member gets rows for their own customer's invoices"""
+        member_a = self.create_test_member()
+        member_b = self.create_test_member()
+        invoice_a = self.create_test_sales_invoice(member=member_a.name)
+        invoice_b = self.create_test_sales_invoice(member=member_b.name)
+        member_a.reload()
+        member_b.reload()
+
+        history = build_payment_history([member_a, member_b])
+
+        self.assertEqual([row["invoice"] for row in history[member_a.name]], [invoice_a.name])
+        self.assertEqual([row["invoice"] for row in history[member_b.name]], [invoice_b.name])
+        self.assertEqual(history[member_a.name][0]["payment_status"], "Draft")
+
+    def test_members_without_customer_are_ignored(self):
+        """Members without a customer record produce no history entry"""
+        member = self.create_test_member()
+        self.assertEqual(build_payment_history([member]), {})
+
+    def test_matches_single_member_load(self):
+        """The per-member load produces the same rows as the bulk builder"""
+        member = self.create_test_member()
+        self.create_test_sales_invoice(member=member.name)
+        member.reload()
+
+        bulk_rows = build_payment_history([member])[member.name]
+        member._load_payment_history_without_save()
+
+        self.assertEqual(len(member.payment_history), len(bulk_rows))
+        for row, expected in zip(member.payment_history, bulk_rows):
+            self.assertEqual(row.invoice, expected["invoice"])
+            self.assertEqual(row.payment_status, expected["payment_status"])
+
+    def test_payment_status(self):
+        """Payment status is derived from docstatus, status and paid amount"""
+        invoice = frappe._dict(docstatus=1, status="Unpaid", grand_total=100)
+        self.assertEqual(get_payment_status(invoice, 0), "Unpaid")
+        self.assertEqual(get_payment_status(invoice, 40), "Partially Paid")
+        self.assertEqual(get_payment_status(frappe._dict(invoice, docstatus=0), 0), "Draft")
+        self.assertEqual(get_payment_status(frappe._dict(invoice, status="Paid"), 100), "Paid")
+
+    def test_coverage_calculation(self):
+        """Coverage end dates follow the billing frequency"""
+        start = getdate("2025-01-15")
+        self.assertEqual(
+            calculate_coverage_from_invoice_date(start, {"billing_frequency": "Monthly"}),
+            (start, getdate("2025-02-14")),
+        )
+        self.assertEqual(
+            calculate_coverage_from_invoice_date(start, {"billing_frequency": "Annual"}),
+            (start, getdate("2026-01-14")),
+        )
+        self.assertEqual(
+            calculate_coverage_from_invoice_date(
+                start,
+                {"billing_frequency": "Custom", "custom_frequency_number": 2, "custom_frequency_unit": "Weeks"},
+            ),
+            (start, getdate("2025-01-28")),
+        )
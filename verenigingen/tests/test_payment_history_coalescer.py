@@ -0,0 +1,83 @@
+"""
+Tests for the coalescing payment history update queue
+"""
+
+from unittest.mock import patch
+
+import frappe
+
+from verenigingen.events.subscribers import payment_history_coalescer as coalescer
+from verenigingen.tests.utils.base import VereningingenTestCase
+
+
+class TestPaymentHistoryCoalescer(VereningingenTestCase):
+    """Test that payment history events are coalesced per customer and deferred"""
+
+    def setUp(self):
+        super().setUp()
+        frappe.cache().delete_key(coalescer.DIRTY_CUSTOMERS_KEY)
+        frappe.local.payment_history_pending_customers = None
+
+        self.member = self.create_test_member()
+        self.invoice = self.create_test_sales_invoice(member=self.member.name)
+        self.member.reload()
+
+    def tearDown(self):
+        frappe.cache().delete_key(coalescer.DIRTY_CUSTOMERS_KEY)
+        frappe.local.payment_history_pending_customers = None
+        super().tearDown()
+
+    def test_updates_are_deferred_until_commit(self):
+        """Queued customers are not published before the transaction commits"""
+        coalescer.queue_member_history_update(self.member.customer)
+        self.assertEqual(coalescer.get_pending_customer_count(), 0)
+
+        coalescer._publish_pending_customers()
+        self.assertEqual(coalescer.get_pending_customer_count(), 1)
+
+    def test_burst_of_events_collapses_per_customer(self):
+        """Many events for one customer produce a single pending entry"""
+        for _ in range(50):
+            coalescer.queue_member_history_update(self.member.customer)
+        coalescer._publish_pending_customers()
+
+        self.assertEqual(coalescer.get_pending_customer_count(), 1)
+
+    def test_rollback_discards_pending_customers(self):
+        """Customers queued in a rolled back transaction are never published"""
+        coalescer.queue_member_history_update(self.member.customer)
+        coalescer._discard_pending_customers()
+        coalescer._publish_pending_customers()
+
+        self.assertEqual(coalescer.get_pending_customer_count(), 0)
+
+    def test_processing_rebuilds_member_history(self):
+        """Draining the queue rebuilds the member's payment history once"""
+        frappe.db.delete("Member Payment History", {"parent": self.member.name})
+        coalescer.queue_member_history_update(self.member.customer)
+        coalescer._publish_pending_customers()
+
+        result = coalescer.process_pending_member_history_updates()
+
+        self.assertEqual(result["customers"], 1)
+        self.assertEqual(result["updated"], 1)
+        self.assertEqual(coalescer.get_pending_customer_count(), 0)
+
+        invoices = frappe.get_all(
+            "Member Payment History", filters={"parent": self.member.name}, pluck="invoice"
+        )
+        self.assertIn(self.invoice.name, invoices)
+
+    def test_failed_rebuild_keeps_customers_queued(self):
+        """Customers stay in the dirty set when the rebuild fails, so the next run retries"""
+        coalescer.queue_member_history_update(self.member.customer)
+        coalescer._publish_pending_customers()
+
+        with patch(
+            "verenigingen.verenigingen.doctype.member.payment_history_builder.build_payment_history",
+            side_effect=Exception("Database unavailable"),
+        ):
+            with self.assertRaises(Exception):
+                coalescer.process_pending_member_history_updates()
+
+        self.assertEqual(coalescer.get_pending_customer_count(), 1)
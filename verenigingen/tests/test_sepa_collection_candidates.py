@@ -0,0 +1,67 @@
+"""
+Tests for the single-query SEPA collection candidate lookup
+"""
+
+import frappe
+from frappe.utils import add_days, today
+
+from verenigingen.tests.utils.base import VereningingenTestCase
+from verenigingen.verenigingen.doctype.direct_debit_batch.sepa_processor import SEPAProcessor
+
+
+class TestSEPACollectionCandidates(VereningingenTestCase):
+    """Test that collection candidates carry their existing invoice and mandate"""
+
+    def setUp(self):
+        super().setUp()
+        self.member = self.create_test_member(payment_method="SEPA Direct Debit")
+        self.mandate = self.create_test_sepa_mandate(member=self.member.name)
+        self.member.reload()
+        membership = self.create_test_membership(member=self.member.name)
+        self.schedule = self.create_test_dues_schedule(
+            member=self.member.name, membership_type=membership.membership_type
+        )
+        self.processor = SEPAProcessor()
+
+    def _candidate(self):
+        candidates = self.processor.get_collection_candidates(today())
+        return next((c for c in candidates if c.name == self.schedule.name), None)
+
+    def test_candidate_includes_active_mandate(self):
+        """The active mandate is returned with the schedule and reused for lookups"""
+        candidate = self._candidate()
+
+        self.assertIsNotNone(candidate)
+        self.assertEqual(candidate.mandate, self.mandate.name)
+        self.assertTrue(candidate.needs_invoice)
+        self.assertEqual(self.processor.get_active_mandate(self.schedule).name, self.mandate.name)
+
+    def test_schedule_with_unpaid_invoice_needs_no_new_invoice(self):
+        """An unpaid invoice covering the collection date is matched to the schedule"""
+        invoice = self.create_test_sales_invoice(
+            customer=self.member.customer,
+            custom_membership_dues_schedule=self.schedule.name,
+            custom_coverage_start_date=add_days(today(), -5),
+            custom_coverage_end_date=add_days(today(), 25),
+        )
+        # Only submitted Unpaid/Overdue invoices count as an existing invoice
+        invoice.submit()
+        self.assertIn(invoice.status, ("Unpaid", "Overdue"))
+
+        candidate = self._candidate()
+        self.assertEqual(candidate.existing_invoice, invoice.name)
+        self.assertFalse(candidate.needs_invoice)
+
+        eligible = self.processor.get_eligible_dues_schedules(today())
+        self.assertNotIn(self.schedule.name, [schedule.name for schedule in eligible])
+        self.assertEqual(self.processor.find_existing_invoice_for_schedule(self.schedule).name, invoice.name)
+
+    def test_future_schedules_are_not_candidates(self):
+        """Schedules whose generation date lies in the future are excluded in SQL"""
+        frappe.db.set_value(
+            "Membership Dues Schedule",
+            self.schedule.name,
+            {"next_invoice_date": add_days(today(), 20), "invoice_days_before": 5},
+        )
+
+        self.assertIsNone(self._candidate())
@@ -0,0 +1,135 @@
+"""
+Tests for single-pass SEPA conflict detection
+"""
+
+import unittest
+from unittest.mock import patch
+
+import frappe
+from frappe.utils import add_days, getdate, today
+
+from verenigingen.utils import sepa_conflict_detector
+from verenigingen.utils.sepa_conflict_detector import ConflictSeverity, SEPAConflictDetector
+
+
+class FakeDatabase:
+    """Answers the detector's lookups from in-memory rows and records the IN lists it receives"""
+
+    def __init__(self, assignments=(), invoices=(), mandates=()):
+        self.tables = {
+            "tabDirect Debit Batch Invoice": ("invoice", list(assignments)),
+            "tabSales Invoice": ("invoice", list(invoices)),
+            "tabSEPA Mandate": ("mandate_id", list(mandates)),
+        }
+        self.lookups = []
+
+    def sql(self, query, values=None, as_dict=False):
+        table = next((name for name in self.tables if f"FROM `{name}`" in query), None)
+        if not table:
+            return []
+
+        key, rows = self.tables[table]
+        self.lookups.append((table, len(values["values"])))
+        return [frappe._dict(row) for row in rows if row[key] in values["values"]]
+
+
+class TestSEPAConflictDetectorSinglePass(unittest.TestCase):
+    """Test conflict detection against preloaded lookups"""
+
+    def setUp(self):
+        # A working day, so the batch date itself raises no conflicts
+        self.batch_date = add_days(today(), 7)
+        while getdate(self.batch_date).weekday() >= 5:
+            self.batch_date = add_days(self.batch_date, 1)
+
+    def _detect(self, invoice_list, database):
+        with patch.object(frappe, "db", database, create=True):
+            return SEPAConflictDetector().detect_batch_creation_conflicts(
+                {"batch_date": self.batch_date, "batch_type": "CORE", "invoice_list": invoice_list}
+            )
+
+    def _invoice_row(self, name, outstanding_amount=25.0, status="Unpaid", **schedule):
+        return dict(
+            invoice=name,
+            docstatus=1,
+            outstanding_amount=outstanding_amount,
+            status=status,
+            schedule_id=schedule.get("schedule_id"),
+            member=schedule.get("member"),
+            next_due_date=schedule.get("next_due_date"),
+            billing_frequency="Monthly",
+            member_name="Test Member",
+        )
+
+    def test_all_conflict_classes_are_detected(self):
+        """Cross-batch, schedule, mandate and amount conflicts come from the shared lookups"""
+        database = FakeDatabase(
+            assignments=[
+                dict(
+                    invoice="SINV-001",
+                    batch_name="BATCH-OLD",
+                    batch_status="Draft",
+                    batch_date=today(),
+                    batch_type="RCUR",
+                    creation=today(),
+                    total_amount=25.0,
+                )
+            ],
+            invoices=[
+                self._invoice_row("SINV-001"),
+                self._invoice_row("SINV-002", outstanding_amount=10.0),
+                self._invoice_row(
+                    "SINV-003", schedule_id="SCHED-003", member="MEM-003", next_due_date=add_days(today(), 90)
+                ),
+            ],
+            mandates=[dict(mandate_id="MANDATE-001", status="Cancelled", is_active=0, expiry_date=None)],
+        )
+        invoice_list = [
+            {"invoice": "SINV-001", "amount": 25.0, "mandate_reference": "MANDATE-001"},
+            {"invoice": "SINV-002", "amount": 25.0, "mandate_reference": "MANDATE-002"},
+            {"invoice": "SINV-003", "amount": 25.0},
+            {"invoice": "SINV-004", "amount": 25.0},
+        ]
+
+        conflicts = self._detect(invoice_list, database)
+        conflict_types = {conflict.conflict_type: conflict for conflict in conflicts}
+
+        self.assertEqual(conflict_types["cross_batch_conflict"].severity, ConflictSeverity.CRITICAL)
+        self.assertEqual(conflict_types["inactive_mandate"].details["mandate_reference"], "MANDATE-001")
+        self.assertEqual(conflict_types["mandate_not_found"].details["mandate_reference"], "MANDATE-002")
+        self.assertEqual(conflict_types["amount_mismatch"].details["invoice_id"], "SINV-002")
+        self.assertEqual(conflict_types["invoice_not_found"].details["invoice_id"], "SINV-004")
+        self.assertEqual(conflict_types["early_collection"].details["invoice"], "SINV-003")
+
+    def test_lookups_are_loaded_once_in_chunks(self):
+        """Each table is queried once per chunk, however many invoices share a lookup"""
+        invoice_count = 2500
+        database = FakeDatabase(
+            invoices=[self._invoice_row(f"SINV-{i:05d}") for i in range(invoice_count)],
+            mandates=[dict(mandate_id="MANDATE-001", status="Active", is_active=1, expiry_date=None)],
+        )
+        invoice_list = [
+            {"invoice": f"SINV-{i:05d}", "amount": 25.0, "mandate_reference": "MANDATE-001"}
+            for i in range(invoice_count)
+        ]
+
+        with patch.object(sepa_conflict_detector, "LOOKUP_CHUNK_SIZE", 1000):
+            conflicts = self._detect(invoice_list, database)
+
+        self.assertEqual(
+            database.lookups,
+            [
+                ("tabDirect Debit Batch Invoice", 1000),
+                ("tabDirect Debit Batch Invoice", 1000),
+                ("tabDirect Debit Batch Invoice", 500),
+                ("tabSales Invoice", 1000),
+                ("tabSales Invoice", 1000),
+                ("tabSales Invoice", 500),
+                ("tabSEPA Mandate", 1),
+            ],
+        )
+        self.assertEqual([c.conflict_type for c in conflicts], ["high_mandate_usage"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+Tests for SEPA distributed locks and fencing tokens
+"""
+
+import time
+import unittest
+
+from verenigingen.utils.error_handling import SEPAError
+from verenigingen.utils.sepa_race_condition_manager import InProcessLockBackend, SEPADistributedLock
+
+
+class TestSEPADistributedLock(unittest.TestCase):
+    """Test lock semantics with the in-process backend"""
+
+    def setUp(self):
+        self.backend = InProcessLockBackend()
+
+    def _lock_manager(self):
+        lock_manager = SEPADistributedLock(backend=self.backend)
+        lock_manager.ACQUISITION_TIMEOUT = 0.2
+        return lock_manager
+
+    def test_fencing_tokens_increase(self):
+        """Every acquisition of a resource gets a higher fencing token"""
+        lock_manager = self._lock_manager()
+
+        with lock_manager.acquire_lock("test_resource", timeout=10) as first:
+            self.assertTrue(lock_manager.is_current_holder(first))
+
+        with lock_manager.acquire_lock("test_resource", timeout=10) as second:
+            self.assertGreater(second.fencing_token, first.fencing_token)
+            self.assertNotEqual(second.lock_id, first.lock_id)
+
+        self.assertEqual(lock_manager._get_current_lock_info("test_resource"), {})
+
+    def test_concurrent_acquisition_is_rejected(self):
+        """A held lock cannot be acquired by another lock manager"""
+        with self._lock_manager().acquire_lock("test_resource", timeout=10):
+            with self.assertRaises(SEPAError):
+                with self._lock_manager().acquire_lock("test_resource", timeout=10):
+                    pass
+
+    def test_expired_holder_is_fenced_off(self):
+        """After a lock expires, the stale holder can neither release nor pass the fencing check"""
+        stale_manager = self._lock_manager()
+        new_manager = self._lock_manager()
+
+        stale = stale_manager._acquire_lock_internal("test_resource", "batch_creation", 0.05, {})
+        time.sleep(0.1)
+
+        with new_manager.acquire_lock("test_resource", timeout=10) as current:
+            self.assertFalse(stale_manager.is_current_holder(stale))
+            self.assertFalse(self.backend.release("test_resource", stale.lock_id))
+            self.assertTrue(new_manager.is_current_holder(current))
+            self.assertGreater(current.fencing_token, stale.fencing_token)
+
+    def test_force_release(self):
+        """Administrators can release a lock held by someone else"""
+        lock_manager = self._lock_manager()
+
+        with lock_manager.acquire_lock("test_resource", timeout=10):
+            self.assertTrue(lock_manager.force_release_lock("test_resource", admin_override=True))
+            self.assertEqual(lock_manager._get_current_lock_info("test_resource"), {})
@@ -0,0 +1,62 @@
+"""
+Tests for the shared SEPA mandate cache
+"""
+
+import frappe
+
+from verenigingen.tests.utils.base import VereningingenTestCase
+from verenigingen.utils.sepa_mandate_service import get_sepa_mandate_service
+
+
+class TestSEPAMandateCache(VereningingenTestCase):
+    """Test the Redis-backed active mandate cache and its invalidation"""
+
+    def setUp(self):
+        super().setUp()
+        self.service = get_sepa_mandate_service()
+        self.service.clear_cache()
+        self.member = self.create_test_member()
+        self.mandate = self.create_test_sepa_mandate(member=self.member.name)
+
+    def tearDown(self):
+        self.service.clear_cache()
+        super().tearDown()
+
+    def test_lookups_are_served_from_cache(self):
+        """A repeated lookup is a cache hit and returns the same mandate"""
+        first = self.service.get_active_mandate(self.member.name)
+        stats_before = self.service.get_cache_stats()
+
+        second = self.service.get_active_mandate(self.member.name)
+        stats_after = self.service.get_cache_stats()
+
+        self.assertEqual(first.name, self.mandate.name)
+        self.assertEqual(second.name, self.mandate.name)
+        self.assertEqual(stats_after["mandate_cache_hits"], stats_before["mandate_cache_hits"] + 1)
+        self.assertEqual(stats_after["mandate_cache_misses"], stats_before["mandate_cache_misses"])
+
+    def test_members_without_mandate_are_cached(self):
+        """Members without an active mandate return None, also on a cache hit"""
+        other_member = self.create_test_member()
+
+        self.assertIsNone(self.service.get_active_mandate(other_member.name))
+        self.assertIsNone(self.service.get_active_mandate(other_member.name))
+
+    def test_mandate_update_invalidates_cache(self):
+        """Cancelling a mandate drops the member's cached lookup"""
+        self.assertEqual(self.service.get_active_mandate(self.member.name).name, self.mandate.name)
+
+        mandate = frappe.get_doc("SEPA Mandate", self.mandate.name)
+        mandate.status = "Cancelled"
+        mandate.save()
+
+        self.assertIsNone(self.service.get_active_mandate(self.member.name))
+
+    def test_batch_lookup_groups_by_member(self):
+        """Batch lookups return one entry per requested member"""
+        other_member = self.create_test_member()
+        results = self.service.get_active_mandate_batch([self.member.name, other_member.name, self.member.name])
+
+        self.assertEqual(set(results), {self.member.name, other_member.name})
+        self.assertEqual(results[self.member.name].name, self.mandate.name)
+        self.assertIsNone(results[other_member.name])
@@ -0,0 +1,195 @@
+"""
+Tests for matching bank transactions against preloaded reconciliation lookups
+"""
+
+import unittest
+from unittest.mock import patch
+
+import frappe
+from frappe.utils import add_days, today
+
+from verenigingen.utils.sepa_reconciliation import SEPAReconciliationManager
+
+
+class FakeDatabase:
+    """Answers the reconciliation preload queries from in-memory rows and counts them"""
+
+    def __init__(self, batches=(), mandates=(), batch_rows=(), invoices=()):
+        self.batches = list(batches)
+        self.mandates = list(mandates)
+        self.batch_rows = list(batch_rows)
+        self.invoices = list(invoices)
+        self.query_count = 0
+
+    def sql(self, query, values=None, as_dict=False):
+        self.query_count += 1
+        values = values or {}
+
+        if "FROM `tabDirect Debit Batch`" in query:
+            rows = [b for b in self.batches if b["total_amount"] in values["amounts"]]
+        elif "FROM `tabSEPA Mandate`" in query:
+            rows = [(m["iban_normalized"], m["member"]) for m in self.mandates]
+            rows = [row for row in rows if row[0] in values["ibans"]]
+        elif "FROM `tabDirect Debit Batch Invoice`" in query:
+            rows = [r for r in self.batch_rows if r["member"] in values["members"]]
+        elif "WHERE name IN" in query:
+            rows = [(i["name"],) for i in self.invoices if i["name"] in values["references"]]
+        elif "WHERE membership IN" in query:
+            rows = [
+                (i["membership"], i["name"]) for i in self.invoices if i["membership"] in values["references"]
+            ]
+        elif "ms.member IN" in query:
+            rows = [
+                dict(member=i["member"], name=i["name"], outstanding_amount=i["outstanding_amount"])
+                for i in self.invoices
+                if i["member"] in values["references"]
+            ]
+        else:
+            rows = [
+                dict(
+                    member_id=i["member"],
+                    full_name=i["full_name"],
+                    invoice=i["name"],
+                    outstanding_amount=i["outstanding_amount"],
+                )
+                for i in self.invoices
+                if i["outstanding_amount"] in values["amounts"]
+            ]
+
+        return [frappe._dict(row) for row in rows] if as_dict else rows
+
+    def sql_list(self, query, values=None):
+        return [row[0] for row in self.sql(query, values)]
+
+
+class TestSEPAReconciliationBatchMatching(unittest.TestCase):
+    """Test reconciliation of a set of transactions with lookups loaded once"""
+
+    def setUp(self):
+        self.database = FakeDatabase(
+            batches=[dict(name="DD-BATCH-2025-0042", total_amount=1250.0)],
+            mandates=[dict(iban_normalized="NL91ABNA0417164300", member="MEM-0001")],
+            batch_rows=[
+                dict(
+                    batch="DD-BATCH-2025-0040",
+                    invoice="ACC-SINV-0001",
+                    amount=25.0,
+                    iban="NL91 ABNA 0417 1643 00",
+                    member_name="Jan de Vries",
+                    member="MEM-0001",
+                    batch_date=today(),
+                )
+            ],
+            invoices=[
+                dict(
+                    name="ACC-SINV-0002",
+                    membership="MEMB-0002",
+                    member="MEM-0002",
+                    full_name="Anna Jansen",
+                    outstanding_amount=30.0,
+                ),
+                dict(
+                    name="ACC-SINV-0003",
+                    membership="MEMB-0003",
+                    member="MEM-0003",
+                    full_name="Pieter Bakker",
+                    outstanding_amount=15.0,
+                ),
+            ],
+        )
+
+    def _transaction(self, name, credit, description, reference_number=None, party_iban=None):
+        return frappe._dict(
+            name=name,
+            date=today(),
+            credit=credit,
+            debit=0,
+            description=description,
+            reference_number=reference_number,
+            party_iban=party_iban,
+        )
+
+    def _reconcile(self, transactions):
+        reconciled = []
+
+        def create_reconciliation(transaction, match):
+            reconciled.append((transaction.name, match["type"], match["reference"], match["confidence"]))
+            return True
+
+        with patch.object(frappe, "db", self.database, create=True), patch.object(
+            frappe, "get_single", lambda doctype: frappe._dict(), create=True
+        ), patch.object(frappe, "get_all", lambda *args, **kwargs: transactions, create=True):
+            manager = SEPAReconciliationManager()
+            manager.create_reconciliation = create_reconciliation
+            result = manager.reconcile_bank_transactions()
+
+        return result, reconciled
+
+    def test_transactions_are_matched_from_preloaded_lookups(self):
+        """Every strategy resolves from the lookups, loaded with a fixed number of queries"""
+        transactions = [
+            self._transaction("BT-1", 1250.0, "SEPA DD BATCH-2025-0042", reference_number="DD-REF"),
+            self._transaction("BT-2", 25.0, "Contributie", party_iban="nl91 abna 0417 1643 00"),
+            self._transaction("BT-3", 30.0, "Payment invoice acc-sinv-0002"),
+            self._transaction("BT-4", 15.0, "Pieter Bakker"),
+            self._transaction("BT-5", 99.0, "Unknown payment"),
+        ]
+
+        result, reconciled = self._reconcile(transactions)
+
+        self.assertEqual(result, {"total_transactions": 5, "matched": 4, "unmatched": 1})
+        self.assertEqual(
+            [(name, match_type, reference) for name, match_type, reference, _confidence in reconciled],
+            [
+                ("BT-1", "batch", "DD-BATCH-2025-0042"),
+                ("BT-2", "invoice", "ACC-SINV-0001"),
+                ("BT-3", "invoice", "ACC-SINV-0002"),
+                ("BT-4", "invoice", "ACC-SINV-0003"),
+            ],
+        )
+        self.assertEqual([confidence for *_match, confidence in reconciled][:3], [1.0, 0.95, 0.9])
+        self.assertLessEqual(self.database.query_count, 7)
+
+    def test_invoice_is_reconciled_once(self):
+        """A second transaction for an invoice reconciled in the same run is not matched to it"""
+        transactions = [
+            self._transaction("BT-1", 30.0, "Invoice ACC-SINV-0002"),
+            self._transaction("BT-2", 30.0, "Invoice ACC-SINV-0002"),
+        ]
+
+        result, reconciled = self._reconcile(transactions)
+
+        self.assertEqual(result["matched"], 1)
+        self.assertEqual([entry[0] for entry in reconciled], ["BT-1"])
+
+    def test_batch_rows_outside_date_window_are_ignored(self):
+        """Collections booked long after the batch date do not match on amount and IBAN"""
+        self.database.batch_rows[0]["batch_date"] = add_days(today(), -30)
+
+        result, reconciled = self._reconcile(
+            [self._transaction("BT-1", 25.0, "Contributie", party_iban="NL91ABNA0417164300")]
+        )
+
+        self.assertEqual(result["matched"], 0)
+        self.assertEqual(reconciled, [])
+
+    def test_members_sharing_a_name_are_not_auto_matched(self):
+        """A name that matches several members equally well is left for manual review"""
+        self.database.invoices.append(
+            dict(
+                name="ACC-SINV-0004",
+                membership="MEMB-0004",
+                member="MEM-0004",
+                full_name="Pieter Bakker",
+                outstanding_amount=15.0,
+            )
+        )
+
+        result, reconciled = self._reconcile([self._transaction("BT-1", 15.0, "Pieter Bakker")])
+
+        self.assertEqual(result["matched"], 0)
+        self.assertEqual(reconciled, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+"""
+Tests for the single-pass SEPA rulebook validator
+"""
+
+import io
+import unittest
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from verenigingen.utils.sepa_rulebook_validator import SEPARulebookValidator
+from verenigingen.utils.sepa_xml_enhanced_generator import (
+    SEPACreditor,
+    SEPADebtor,
+    SEPALocalInstrument,
+    SEPAMandate,
+    SEPAPaymentInfo,
+    SEPASequenceType,
+    SEPATransaction,
+    StreamingSEPAXMLWriter,
+)
+
+
+class TestSEPARulebookStreaming(unittest.TestCase):
+    """Test rulebook evaluation in a single streaming pass"""
+
+    def setUp(self):
+        self.creditor = SEPACreditor(
+            name="Test Company", iban="NL91ABNA0417164300", bic="ABNANL2A", creditor_id="NL13ZZZ12345678000"
+        )
+
+    def _xml(self, count, duplicate_ids=False, payment_infos=1):
+        stream = io.BytesIO()
+        writer = StreamingSEPAXMLWriter(stream)
+        writer.start_document("MSG-TEST-001", datetime.now() - timedelta(hours=1), "Test Company")
+
+        for block in range(payment_infos):
+            writer.start_payment_info(
+                SEPAPaymentInfo(
+                    payment_info_id=f"PMT-TEST-{block:03d}",
+                    payment_method="DD",
+                    batch_booking=True,
+                    requested_collection_date=date.today() + timedelta(days=7),
+                    creditor=self.creditor,
+                    local_instrument=SEPALocalInstrument.CORE,
+                    sequence_type=SEPASequenceType.RCUR,
+                    transactions=[],
+                )
+            )
+            for i in range(count):
+                writer.add_transaction(
+                    SEPATransaction(
+                        end_to_end_id="E2E-TEST-DUP" if duplicate_ids else f"E2E-TEST-{block}-{i:03d}",
+                        amount=Decimal("10.00"),
+                        currency="EUR",
+                        debtor=SEPADebtor(name="Test Customer", iban="NL69INGB0123456789", bic="INGBNL2A"),
+                        mandate=SEPAMandate(
+                            mandate_id=f"TEST-MANDATE-{i:03d}", date_of_signature=date.today()
+                        ),
+                        remittance_info="Test payment",
+                        sequence_type=SEPASequenceType.RCUR,
+                    )
+                )
+
+        writer.end_document()
+        return stream.getvalue()
+
+    def _rule_ids(self, result):
+        return [issue["rule_id"] for issue in result["issues"]]
+
+    def test_aggregate_rules_are_evaluated(self):
+        """Counts, control sums and end-to-end IDs are checked from the streamed totals"""
+        xml_content = self._xml(3, duplicate_ids=True).decode("utf-8")
+        xml_content = xml_content.replace("<NbOfTxs>3</NbOfTxs>", "<NbOfTxs>4</NbOfTxs>", 1)
+        xml_content = xml_content.replace("<CtrlSum>30.00</CtrlSum>", "<CtrlSum>31.00</CtrlSum>", 1)
+
+        result = SEPARulebookValidator().validate_sepa_xml(xml_content)
+        rule_ids = self._rule_ids(result)
+
+        self.assertFalse(result["is_compliant"])
+        self.assertFalse(result["truncated"])
+        self.assertIn("MSG003", rule_ids)
+        self.assertIn("MSG004", rule_ids)
+        self.assertEqual(rule_ids.count("TXN002"), 1)
+
+    def test_repeated_creditor_is_checked_once(self):
+        """Creditor details repeated in every payment info are reported once"""
+        self.creditor.creditor_id = "DE98ZZZ09999999999X"
+
+        result = SEPARulebookValidator().validate_sepa_xml(self._xml(1, payment_infos=3))
+
+        self.assertEqual(self._rule_ids(result).count("CDT001"), 1)
+        self.assertNotIn("PMT001", self._rule_ids(result))
+
+    def test_stops_at_error_cap(self):
+        """Validation stops once the configured number of errors has been found"""
+        xml_content = self._xml(20).decode("utf-8").replace('Ccy="EUR">10.00<', 'Ccy="EUR">0.00<')
+
+        capped = SEPARulebookValidator(max_errors=5).validate_sepa_xml(xml_content)
+        uncapped = SEPARulebookValidator(max_errors=None).validate_sepa_xml(xml_content)
+
+        self.assertTrue(capped["truncated"])
+        self.assertEqual(self._rule_ids(capped).count("TXN001"), 5)
+        self.assertFalse(uncapped["truncated"])
+        self.assertEqual(self._rule_ids(uncapped).count("TXN001"), 20)
+
+    def test_parse_error(self):
+        """Malformed XML is reported as a single critical issue"""
+        result = SEPARulebookValidator().validate_sepa_xml("<Document><GrpHdr></Document>")
+
+        self.assertFalse(result["is_compliant"])
+        self.assertEqual(self._rule_ids(result), ["XML001"])
@@ -0,0 +1,106 @@
+"""
+Tests for deriving SEPA sequence types from aggregated mandate usage
+"""
+
+import unittest
+
+import frappe
+from frappe.utils import add_days, add_months, today
+
+from verenigingen.verenigingen.doctype.sepa_mandate_usage.sepa_mandate_usage import (
+    get_sequence_type_from_usage,
+    is_final_collection,
+)
+from verenigingen.utils.sepa_mandate_lifecycle_manager import (
+    MandateUsageType,
+    SEPAMandateLifecycleManager,
+)
+
+
+class TestSEPASequenceTypeResolution(unittest.TestCase):
+    """Test FRST/RCUR/FNAL derivation from a mandate usage summary"""
+
+    def _summary(self, **kwargs):
+        summary = frappe._dict(
+            mandate="SEPA-MANDATE-TEST",
+            mandate_id="TEST-MANDATE-001",
+            sign_date=add_months(today(), -12),
+            mandate_type="RCUR",
+            collected_count=0,
+            first_collected_date=None,
+            last_collected_date=None,
+            has_final_collection=0,
+            failed_count=0,
+            last_failed_date=None,
+        )
+        summary.update(kwargs)
+        return summary
+
+    def _collected(self, **kwargs):
+        values = {
+            "collected_count": 3,
+            "first_collected_date": add_months(today(), -3),
+            "last_collected_date": add_months(today(), -1),
+        }
+        values.update(kwargs)
+        return self._summary(**values)
+
+    def test_unused_mandate_is_first(self):
+        """Mandates without collections start with FRST"""
+        self.assertEqual(get_sequence_type_from_usage(self._summary())["sequence_type"], "FRST")
+
+    def test_failed_first_collection_is_first_again(self):
+        """A failed first collection does not count as usage"""
+        result = get_sequence_type_from_usage(self._summary(failed_count=1, last_failed_date=today()))
+
+        self.assertEqual(result["sequence_type"], "FRST")
+        self.assertIn("failed", result["reason"])
+
+    def test_collected_mandate_is_recurring(self):
+        """Mandates with collections continue with RCUR"""
+        self.assertEqual(get_sequence_type_from_usage(self._collected())["sequence_type"], "RCUR")
+
+    def test_renewed_mandate_is_first(self):
+        """A mandate signed after its last collection starts a new sequence"""
+        result = get_sequence_type_from_usage(self._collected(sign_date=add_days(today(), -7)))
+        self.assertEqual(result["sequence_type"], "FRST")
+
+    def test_lapsed_mandate_is_first(self):
+        """A mandate unused for more than 36 months starts a new sequence"""
+        result = get_sequence_type_from_usage(
+            self._collected(sign_date=add_months(today(), -60), last_collected_date=add_months(today(), -40))
+        )
+        self.assertEqual(result["sequence_type"], "FRST")
+
+    def test_final_collection(self):
+        """FNAL is used for the last collection and closes the mandate"""
+        self.assertEqual(get_sequence_type_from_usage(self._collected(), is_final=True)["sequence_type"], "FNAL")
+        self.assertIsNone(
+            get_sequence_type_from_usage(self._collected(has_final_collection=1))["sequence_type"]
+        )
+
+    def test_final_collection_follows_mandate_state(self):
+        """A mandate that expires before the next collection or is cancelled gets FNAL"""
+        self.assertFalse(is_final_collection(self._collected(expiry_date=add_months(today(), 6))))
+        self.assertTrue(is_final_collection(self._collected(expiry_date=add_days(today(), 10))))
+        self.assertTrue(is_final_collection(self._collected(cancelled_date=add_days(today(), 20))))
+
+        expiring = self._collected(status="Active", expiry_date=add_days(today(), 10))
+        self.assertEqual(get_sequence_type_from_usage(expiring)["sequence_type"], "FNAL")
+
+    def test_lifecycle_manager_agrees_with_batch_rules(self):
+        """The lifecycle manager derives the same sequence types as the batch checks"""
+        manager = SEPAMandateLifecycleManager()
+        mandate = {"mandate_type": "RCUR", "status": "Active", "expiry_date": add_days(today(), 10)}
+
+        usage_type, sequence_type = manager._analyze_mandate_usage(mandate, self._collected())
+        self.assertEqual((usage_type, sequence_type.value), (MandateUsageType.FINAL_USE, "FNAL"))
+
+        usage_type, sequence_type = manager._analyze_mandate_usage(
+            dict(mandate, expiry_date=None), self._collected(has_final_collection=1)
+        )
+        self.assertEqual((usage_type, sequence_type), (MandateUsageType.EXPIRED_USE, None))
+
+    def test_missing_mandate_defaults_to_first(self):
+        """Unknown mandates default to FRST"""
+        self.assertEqual(get_sequence_type_from_usage(None)["sequence_type"], "FRST")
@@ -0,0 +1,124 @@
+"""
+Tests for the streaming pain.008 writer
+"""
+
+import io
+import unittest
+import xml.etree.ElementTree as ET
+from datetime import date, datetime
+from decimal import Decimal
+
+from verenigingen.utils.sepa_xml_enhanced_generator import (
+    EnhancedSEPAXMLGenerator,
+    SEPACreditor,
+    SEPADebtor,
+    SEPALocalInstrument,
+    SEPAMandate,
+    SEPAPaymentInfo,
+    SEPASequenceType,
+    SEPATransaction,
+    StreamingSEPAXMLWriter,
+    validate_sepa_xml_compliance,
+)
+
+NS = {"ns": "urn:iso:std:iso:20022:tech:xsd:pain.008.001.02"}
+
+
+class NonSeekableStream(io.RawIOBase):
+    """Write-only stream that cannot seek, like a socket or HTTP response"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def getvalue(self):
+        return b"".join(self.chunks)
+
+
+class TestSEPAStreamingWriter(unittest.TestCase):
+    """Test incremental XML output with back-patched totals"""
+
+    def setUp(self):
+        self.creditor = SEPACreditor(
+            name="Test Company", iban="NL91ABNA0417164300", bic="ABNANL2A", creditor_id="NL13ZZZ123456780000"
+        )
+
+    def _transaction(self, index, amount="10.25"):
+        return SEPATransaction(
+            end_to_end_id=f"E2E-TEST-{index:03d}",
+            amount=Decimal(amount),
+            currency="EUR",
+            debtor=SEPADebtor(name="Test Customer", iban="NL69INGB0123456789", bic="INGBNL2A"),
+            mandate=SEPAMandate(mandate_id=f"TEST-MANDATE-{index:03d}", date_of_signature=date.today()),
+            remittance_info="Test payment",
+            sequence_type=SEPASequenceType.RCUR,
+        )
+
+    def _payment_info(self, transactions=None):
+        return SEPAPaymentInfo(
+            payment_info_id="PMT-TEST-001",
+            payment_method="DD",
+            batch_booking=True,
+            requested_collection_date=date.today(),
+            creditor=self.creditor,
+            local_instrument=SEPALocalInstrument.CORE,
+            sequence_type=SEPASequenceType.RCUR,
+            transactions=transactions or [],
+        )
+
+    def _write(self, stream, count):
+        writer = StreamingSEPAXMLWriter(stream)
+        writer.start_document("MSG-TEST-001", datetime.now(), "Test Company")
+        writer.start_payment_info(self._payment_info())
+        for i in range(count):
+            writer.add_transaction(self._transaction(i, amount="12.50" if i % 2 else "7.25"))
+        return writer.end_document()
+
+    def test_totals_are_back_patched(self):
+        """Group and payment info totals are filled in once all transactions are written"""
+        stream = io.BytesIO()
+        stats = self._write(stream, 5)
+        root = ET.fromstring(stream.getvalue())
+
+        self.assertEqual(stats["transactions"], 5)
+        self.assertEqual(root.find(".//ns:GrpHdr/ns:NbOfTxs", NS).text, "5")
+        self.assertEqual(root.find(".//ns:GrpHdr/ns:CtrlSum", NS).text, "46.75")
+        self.assertEqual(root.find(".//ns:PmtInf/ns:NbOfTxs", NS).text, "5")
+        self.assertEqual(root.find(".//ns:PmtInf/ns:CtrlSum", NS).text, "46.75")
+        self.assertEqual(len(root.findall(".//ns:DrctDbtTxInf", NS)), 5)
+
+    def test_non_seekable_stream(self):
+        """Output to a non-seekable stream is spooled and written out complete"""
+        seekable = io.BytesIO()
+        non_seekable = NonSeekableStream()
+        self._write(seekable, 3)
+        self._write(non_seekable, 3)
+
+        root = ET.fromstring(non_seekable.getvalue())
+        self.assertEqual(root.find(".//ns:GrpHdr/ns:NbOfTxs", NS).text, "3")
+        self.assertEqual(len(non_seekable.getvalue()), len(seekable.getvalue()))
+
+    def test_generator_output_is_compliant(self):
+        """The generator produces compliant XML through the streaming writer"""
+        xml_content = EnhancedSEPAXMLGenerator().generate_sepa_xml(
+            "MSG-TEST-002",
+            datetime.now(),
+            [self._payment_info([self._transaction(1), self._transaction(2)])],
+            "Test Company",
+        )
+
+        self.assertTrue(validate_sepa_xml_compliance(xml_content)["is_valid"])
+
+    def test_transaction_outside_payment_info_is_rejected(self):
+        """Transactions can only be added inside an open payment info block"""
+        writer = StreamingSEPAXMLWriter(io.BytesIO())
+        writer.start_document("MSG-TEST-003", datetime.now(), "Test Company")
+
+        with self.assertRaises(Exception):
+            writer.add_transaction(self._transaction(1))
@@ -96,9 +96,6 @@ class TestSEPAWeek3Features(unittest.TestCase):
     def cleanup_test_data(self):
         """Clean up test data from database"""
         try:
-            # Clean up test locks
-            frappe.db.sql("DELETE FROM `tabSEPA_Distributed_Lock` WHERE lock_owner LIKE 'test_%'")
-            
             # Clean up test rollback operations
             frappe.db.sql("DELETE FROM `tabSEPA_Rollback_Operation` WHERE operation_id LIKE 'TEST_%'")
             
@@ -450,10 +447,11 @@ class TestSEPAWeek3Features(unittest.TestCase):
         manager = SEPAMandateLifecycleManager()
         
         # Mock mandate data
-        with patch.object(manager, '_get_mandate_info') as mock_mandate, \
-             patch.object(manager, '_get_mandate_usage_history') as mock_history:
+        with patch.object(manager, '_get_mandate_infos') as mock_mandates, \
+             patch.object(manager, '_get_mandate_usage_summaries') as mock_usage:
             
-            mock_mandate.return_value = {
+            mock_mandates.return_value = {"TEST-MANDATE-001": {
+                "name": "TEST-SEPA-MANDATE-001",
                 "mandate_id": "TEST-MANDATE-001",
                 "status": "Active",
                 "sign_date": add_days(today(), -30),
@@ -464,9 +462,9 @@ class TestSEPAWeek3Features(unittest.TestCase):
                 "mandate_type": "RCUR",
                 "creation": add_days(today(), -30),
                 "modified": today()
-            }
+            }}
             
-            mock_history.return_value = []  # No previous usage
+            mock_usage.return_value = {}  # No previous usage
             
             result = manager.determine_sequence_type("TEST-MANDATE-001")
             
@@ -1,18 +1,49 @@
+import hashlib
+import io
 import traceback
+import xml.etree.ElementTree as ET
+from decimal import Decimal
 
 import frappe
-from frappe.utils import getdate, today
+from frappe.utils import cint, getdate, now_datetime, today
+
+from verenigingen.utils.mt940_import import (
+    SEPA_TRANSACTION_TYPES,
+    BankTransactionChunkImporter,
+    extract_sepa_purpose_code,
+    mt940_enhanced_fields_exist,
+)
+
+# Elements holding the entries of a camt.053 statement and a camt.054 notification
+CAMT_ENTRY_CONTAINERS = {"Stmt": "camt.053", "Ntfctn": "camt.054"}
+
+# Paths to the IBAN of the account a statement or notification is for
+ACCOUNT_IBAN_PATHS = [[container, "Acct", "Id"] for container in CAMT_ENTRY_CONTAINERS]
+
+# ISO 20022 bank transaction (sub)family codes
+CAMT_BANK_TRANSACTION_CODES = {
+    "RCDT": "SEPA Credit Transfer",
+    "ICDT": "SEPA Credit Transfer",
+    "RDDT": "SEPA Direct Debit",
+    "IDDT": "SEPA Direct Debit",
+    "CCRD": "POS Payment",
+    "CHRG": "Bank Charges",
+}
+
+# References banks fill in when none was given
+CAMT_EMPTY_REFERENCES = {"NOTPROVIDED", "NONREF"}
 
 
 @frappe.whitelist()
-def import_camt_file(bank_account, file_content, company=None):
+def import_camt_file(bank_account, file_content, company=None, chunk_size=None):
     """
-    Manual CAMT.053 file import for when EBICS isn't available or too expensive.
+    Manual CAMT.053/CAMT.054 file import for when EBICS isn't available or too expensive.
 
     Args:
         bank_account: ERPNext Bank Account name
         file_content: Base64 encoded CAMT XML file content
         company: Company name (optional, will be fetched from bank account)
+        chunk_size: Bank Transactions committed together (optional)
 
     Returns:
         dict: Import results with success/error information
@@ -29,7 +60,7 @@ def import_camt_file(bank_account, file_content, company=None):
         import base64
 
         try:
-            xml_content = base64.b64decode(file_content).decode("utf-8")
+            xml_content = base64.b64decode(file_content)
         except Exception as e:
             return {"success": False, "message": f"Failed to decode file content: {str(e)}"}
 
@@ -46,10 +77,7 @@ def import_camt_file(bank_account, file_content, company=None):
         if not frappe.db.exists("Bank Account", bank_account):
             return {"success": False, "message": f"Bank Account {bank_account} does not exist"}
 
-        # Process the CAMT file using the banking app's logic
-        result = process_manual_camt_document(xml_content, bank_account, company)
-
-        return result
+        return process_manual_camt_document(xml_content, bank_account, company, chunk_size=chunk_size)
 
     except Exception as e:
         frappe.logger().error(f"Error in manual CAMT import: {str(e)}")
@@ -57,155 +85,337 @@ def import_camt_file(bank_account, file_content, company=None):
         return {"success": False, "message": f"Import failed with error: {str(e)}"}
 
 
-def process_manual_camt_document(xml_content, bank_account, company):
+def process_manual_camt_document(xml_content, bank_account, company, chunk_size=None):
     """
     Process CAMT document content manually without EBICS.
 
-    Uses the same logic as the banking app but for manual file uploads.
+    The document is read with iterparse and every entry is released once it has been
+    handled, so memory use does not grow with the number of entries. New Bank
+    Transactions are inserted and committed in chunks with the duplicate detection of
+    the MT940 import. The entries handled by committed chunks are recorded in a Bank
+    Statement Import Checkpoint for the file, and importing the file again resumes
+    after them.
     """
-    try:
-        # Try to import the fintech library (might not be available without license)
-        try:
-            from fintech.sepa import CAMTDocument
-        except ImportError:
-            return {
-                "success": False,
-                "message": "Fintech library not available. For bank file imports, please use MT940 format instead via verenigingen.utils.mt940_import",
-            }
+    if isinstance(xml_content, str):
+        xml_content = xml_content.encode("utf-8")
 
-        # Parse the CAMT document
-        try:
-            camt_document = CAMTDocument(xml=xml_content)
-        except Exception as e:
-            return {"success": False, "message": f"Failed to parse CAMT document: {str(e)}"}
+    # Get bank account IBAN for validation
+    bank_account_iban = frappe.db.get_value("Bank Account", bank_account, "bank_account_no")
 
-        # Get bank account IBAN for validation
-        bank_account_iban = frappe.db.get_value("Bank Account", bank_account, "bank_account_no")
+    checkpoint = get_import_checkpoint(bank_account, hashlib.sha256(xml_content).hexdigest())
+    if checkpoint.status == "Completed":
+        return {
+            "success": True,
+            "message": "This file has already been imported",
+            "transactions_created": 0,
+            "transactions_skipped": checkpoint.entries_processed,
+            "errors": [],
+            "statement_date": str(getdate(today())),
+        }
 
-        # Validate IBAN matches (if available)
-        if bank_account_iban and camt_document.iban and bank_account_iban != camt_document.iban:
-            return {
-                "success": False,
-                "message": f"IBAN mismatch: Bank Account IBAN {bank_account_iban} does not match CAMT IBAN {camt_document.iban}",
+    resume_from = cint(checkpoint.entries_processed)
+    created_before = cint(checkpoint.transactions_created)
+    skipped_before = cint(checkpoint.transactions_skipped)
+    state = frappe._dict(entries=0, file_format=checkpoint.file_format, iban=None, last_date=None)
+
+    def save_checkpoint(importer, status="Running"):
+        checkpoint.db_set(
+            {
+                "status": status,
+                "file_format": state.file_format,
+                "entries_processed": state.entries,
+                "transactions_created": created_before + importer.created,
+                "transactions_skipped": skipped_before + importer.skipped,
+                "last_entry_date": state.last_date,
+                "completed_at": now_datetime() if status == "Completed" else None,
             }
+        )
 
-        # Process transactions
-        transactions_created = 0
-        transactions_skipped = 0
-        errors = []
+    importer = BankTransactionChunkImporter(
+        bank_account,
+        chunk_size=cint(chunk_size) or None,
+        progress_title="Importing CAMT",
+        on_flush=save_checkpoint,
+    )
+    enhanced_fields_exist = mt940_enhanced_fields_exist()
+    source = io.BytesIO(xml_content)
 
-        for transaction in camt_document:
-            try:
-                # Skip non-booked transactions
-                if transaction.status and transaction.status != "BOOK":
-                    transactions_skipped += 1
-                    continue
+    try:
+        for entry in iter_camt_entries(source):
+            state.entries += 1
+            state.file_format = entry.document_type
+
+            # Validate IBAN matches (if available)
+            if bank_account_iban and entry.account_iban and bank_account_iban != entry.account_iban:
+                checkpoint.db_set({"status": "Failed", "error_message": "IBAN mismatch"})
+                return {
+                    "success": False,
+                    "message": f"IBAN mismatch: Bank Account IBAN {bank_account_iban} does not match CAMT IBAN {entry.account_iban}",
+                }
+            state.iban = entry.account_iban
 
-                # Create bank transaction using the same logic as EBICS
-                if create_bank_transaction_from_sepa(transaction, bank_account, company):
-                    transactions_created += 1
-                else:
-                    transactions_skipped += 1
+            # Entries of committed chunks were handled by an earlier run
+            if state.entries <= resume_from:
+                continue
 
+            # Skip non-booked transactions
+            if entry.status and entry.status != "BOOK":
+                importer.skipped += 1
+                continue
+
+            try:
+                bt = build_bank_transaction_from_camt(
+                    entry, bank_account, company, enhanced_fields_exist=enhanced_fields_exist
+                )
             except Exception as e:
-                errors.append(f"Transaction error: {str(e)}")
+                importer.errors.append(f"Transaction error: {str(e)}")
                 frappe.logger().error(f"Error processing transaction: {str(e)}")
+                continue
 
-        return {
-            "success": True,
-            "message": f"Import completed: {transactions_created} transactions created, {transactions_skipped} skipped",
-            "transactions_created": transactions_created,
-            "transactions_skipped": transactions_skipped,
-            "errors": errors[:10],  # Limit errors shown
-            "iban": camt_document.iban,
-            "statement_date": str(getdate(today())),
-        }
+            state.last_date = bt.date
+            importer.add(bt, progress=source.tell() / len(xml_content))
+
+        importer.flush(progress=1)
+        save_checkpoint(importer, status="Completed")
+        frappe.db.commit()
 
     except Exception as e:
+        frappe.db.rollback()
+        checkpoint.db_set({"status": "Failed", "error_message": str(e)})
+        frappe.db.commit()
         return {"success": False, "message": f"Failed to process CAMT document: {str(e)}"}
 
+    if not state.entries:
+        return {"success": False, "message": "No entries found in CAMT document"}
+
+    return {
+        "success": True,
+        "message": f"Import completed: {importer.created} transactions created, {importer.skipped} skipped",
+        "transactions_created": importer.created,
+        "transactions_skipped": importer.skipped,
+        "errors": importer.errors[:10],  # Limit errors shown
+        "iban": state.iban,
+        "file_format": state.file_format,
+        "resumed_after": resume_from,
+        "statement_date": str(getdate(today())),
+    }
+
+
+def get_import_checkpoint(bank_account, file_hash):
+    """The import checkpoint of a file for a bank account, created when the file is new"""
+    name = frappe.db.get_value(
+        "Bank Statement Import Checkpoint", {"bank_account": bank_account, "file_hash": file_hash}
+    )
+    if name:
+        checkpoint = frappe.get_doc("Bank Statement Import Checkpoint", name)
+        if checkpoint.status != "Completed":
+            checkpoint.db_set({"status": "Running", "error_message": None})
+        return checkpoint
+
+    checkpoint = frappe.get_doc(
+        {
+            "doctype": "Bank Statement Import Checkpoint",
+            "bank_account": bank_account,
+            "file_hash": file_hash,
+            "status": "Running",
+            "started_at": now_datetime(),
+        }
+    )
+    checkpoint.insert(ignore_permissions=True)
+    frappe.db.commit()
+    return checkpoint
+
 
-def create_bank_transaction_from_sepa(sepa_transaction, bank_account, company):
+def iter_camt_entries(source):
     """
-    Create ERPNext Bank Transaction from SEPA transaction.
-    Adapted from banking app's _create_bank_transaction function.
+    Yield the entries (Ntry) of a camt.053 or camt.054 document one at a time
+
+    Namespaces are dropped from the tags. An entry is released as soon as it has been
+    read, and so is every element outside an entry once it ends, so only the entry
+    being read is kept in memory.
     """
-    try:
-        import contextlib
+    path = []
+    elements = []
+    entry_depth = 0
+    account_iban = None
+
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            elem.tag = elem.tag.rsplit("}", 1)[-1]
+            path.append(elem.tag)
+            elements.append(elem)
+            if elem.tag == "Ntry" and not entry_depth:
+                entry_depth = len(path)
+            continue
+
+        if len(path) == entry_depth:
+            entry_depth = 0
+            if path[-2] in CAMT_ENTRY_CONTAINERS:
+                yield read_camt_entry(elem, CAMT_ENTRY_CONTAINERS[path[-2]], account_iban)
+        elif elem.tag == "IBAN" and path[-4:-1] in ACCOUNT_IBAN_PATHS:
+            account_iban = (elem.text or "").strip() or None
+
+        path.pop()
+        elements.pop()
+
+        # The ending element is always the last child of its parent
+        if elements and not entry_depth:
+            del elements[-1][-1]
+
+
+def read_camt_entry(ntry, document_type, account_iban=None):
+    """Transaction data of a CAMT entry; related parties and references come from its first TxDtls"""
+
+    def text(elem, path):
+        return (elem.findtext(path) or "").strip() if elem is not None else ""
+
+    transaction_details = ntry.find("NtryDtls/TxDtls")
+    is_credit = text(ntry, "CdtDbtInd") == "CRDT"
+
+    amount = Decimal(text(ntry, "Amt") or "0")
+    if not is_credit:
+        amount = -amount
+
+    amount_element = ntry.find("Amt")
+    currency = amount_element.get("Ccy") if amount_element is not None else None
+
+    # Booking date, falling back to the value date
+    entry_date = (
+        text(ntry, "BookgDt/Dt")
+        or text(ntry, "BookgDt/DtTm")[:10]
+        or text(ntry, "ValDt/Dt")
+        or text(ntry, "ValDt/DtTm")[:10]
+    )
+
+    # The counterparty is the debtor of a credit and the creditor of a debit
+    party = "Dbtr" if is_credit else "Cdtr"
+    counterparty = text(transaction_details, f"RltdPties/{party}/Nm") or text(
+        transaction_details, f"RltdPties/{party}/Pty/Nm"
+    )
+
+    eref = text(transaction_details, "Refs/EndToEndId")
+    purpose_lines = []
+    if transaction_details is not None:
+        purpose_lines = [
+            line.text.strip() for line in transaction_details.findall("RmtInf/Ustrd") if line.text
+        ]
+
+    entry = frappe._dict(
+        document_type=document_type,
+        account_iban=account_iban,
+        # camt.053.001.02 has the status as text, later versions in a Cd element
+        status=text(ntry, "Sts/Cd") or text(ntry, "Sts"),
+        date=entry_date,
+        amount=amount,
+        currency=currency or "EUR",
+        eref="" if eref.upper() in CAMT_EMPTY_REFERENCES else eref,
+        end_to_end_id=eref,
+        mref=text(transaction_details, "Refs/MndtId"),
+        creditor_ref=text(transaction_details, "RmtInf/Strd/CdtrRefInf/Ref"),
+        bank_reference=text(ntry, "AcctSvcrRef") or text(transaction_details, "Refs/AcctSvcrRef"),
+        counterparty=counterparty,
+        counterparty_iban=text(transaction_details, f"RltdPties/{party}Acct/Id/IBAN"),
+        purpose_lines=purpose_lines,
+        purpose="\n".join(purpose_lines),
+        info=text(ntry, "AddtlNtryInf") or text(transaction_details, "AddtlTxInf"),
+        family_code=text(ntry, "BkTxCd/Domn/Fmly/Cd"),
+        sub_family_code=text(ntry, "BkTxCd/Domn/Fmly/SubFmlyCd"),
+        booking_code=text(ntry, "BkTxCd/Prtry/Cd"),
+    )
+    entry.transaction_type = get_camt_transaction_type(entry)
+    return entry
+
+
+def get_camt_transaction_type(entry):
+    """
+    Transaction type of a CAMT entry, classified like MT940 transactions.
 
-        # Generate transaction ID
-        transaction_id = (
-            getattr(sepa_transaction, "bank_reference", None)
-            or getattr(sepa_transaction, "eref", None)
-            or generate_transaction_hash(sepa_transaction)
-        )
+    Priority order:
+    1. ISO 20022 bank transaction family or sub family code
+    2. SEPA transaction type classification
+    3. Amount-based fallback
+    """
+    for code in (entry.sub_family_code, entry.family_code):
+        if code in CAMT_BANK_TRANSACTION_CODES:
+            return CAMT_BANK_TRANSACTION_CODES[code]
 
-        # Check if transaction already exists
-        if transaction_id and frappe.db.exists(
-            "Bank Transaction", {"transaction_id": transaction_id, "bank_account": bank_account}
-        ):
-            return False  # Already exists
-
-        # Create new Bank Transaction
-        bt = frappe.new_doc("Bank Transaction")
-        bt.date = sepa_transaction.date
-        bt.bank_account = bank_account
-        bt.company = company
-
-        amount = float(sepa_transaction.amount.value)
-        bt.deposit = max(amount, 0)
-        bt.withdrawal = abs(min(amount, 0))
-        bt.currency = sepa_transaction.amount.currency
-
-        # Set description from purpose lines or info
-        purposes = getattr(sepa_transaction, "purpose", [])
-        if purposes:
-            bt.description = "\n".join(purposes)
-        else:
-            bt.description = getattr(sepa_transaction, "info", "")
-
-        bt.reference_number = getattr(sepa_transaction, "ere", "")
-        bt.transaction_id = transaction_id
-        bt.bank_party_iban = getattr(sepa_transaction, "iban", "")
-        bt.bank_party_name = getattr(sepa_transaction, "name", "")
-
-        # Insert and submit
-        with contextlib.suppress(frappe.exceptions.UniqueValidationError):
-            bt.insert()
-            bt.submit()
-            return True
+    purpose = entry.purpose.upper()
+    for sepa_code, sepa_type in SEPA_TRANSACTION_TYPES.items():
+        if sepa_code in purpose:
+            return sepa_type
 
-    except Exception as e:
-        frappe.logger().error(f"Error creating bank transaction: {str(e)}")
-        raise
+    return "Incoming Transfer" if entry.amount > 0 else "Outgoing Transfer"
 
-    return False
 
+def get_camt_transaction_id(entry):
+    """
+    Transaction id of a CAMT entry, the same as earlier CAMT imports gave it
+
+    The bank reference or end-to-end reference when there is one, otherwise a hash of
+    the entry, so entries imported before are recognised as duplicates.
+    """
+    return entry.bank_reference or entry.end_to_end_id or generate_transaction_hash(entry)
 
-def generate_transaction_hash(transaction):
-    """Generate a hash for transaction identification"""
-    import hashlib
 
+def generate_transaction_hash(entry):
+    """Generate a hash for transaction identification"""
     sha = hashlib.sha256()
     hash_components = [
-        str(transaction.date),
-        str(getattr(transaction, "iban", "")),
-        str(getattr(transaction, "name", "")),
-        str(getattr(transaction, "ere", "")),
-        str(transaction.amount.value),
-        str(transaction.amount.currency),
-        str(getattr(transaction, "info", "")),
+        str(entry.date),
+        str(entry.counterparty_iban),
+        str(entry.counterparty),
+        "",  # Earlier imports hashed an attribute that was always empty here
+        str(entry.amount),
+        str(entry.currency),
+        str(entry.info),
     ]
 
     # Add purpose lines if available
-    purposes = getattr(transaction, "purpose", [])
-    if purposes:
-        hash_components.extend(str(p) for p in purposes)
+    hash_components.extend(str(line) for line in entry.purpose_lines)
 
     sha.update("".join(hash_components).encode())
     return sha.hexdigest()[:16]  # Use first 16 characters
 
 
+def build_bank_transaction_from_camt(entry, bank_account, company, enhanced_fields_exist=False):
+    """Unsaved Bank Transaction for a CAMT entry"""
+    bt = frappe.new_doc("Bank Transaction")
+    bt.date = getdate(entry.date) if entry.date else getdate(today())
+    bt.bank_account = bank_account
+    bt.company = company
+
+    amount = float(entry.amount)
+    bt.deposit = max(amount, 0)
+    bt.withdrawal = abs(min(amount, 0))
+    bt.currency = entry.currency
+
+    # Set description from purpose lines or info
+    bt.description = entry.purpose or entry.info or "CAMT Transaction"
+    bt.transaction_type = entry.transaction_type
+    bt.reference_number = entry.eref
+    bt.transaction_id = get_camt_transaction_id(entry)
+    bt.bank_party_iban = entry.counterparty_iban
+    bt.bank_party_name = entry.counterparty
+
+    # Store additional SEPA data in the enhanced MT940 custom fields (if available)
+    if enhanced_fields_exist:
+        from verenigingen.utils.mt940_enhanced_fields import populate_enhanced_mt940_fields
+
+        populate_enhanced_mt940_fields(
+            bt,
+            {
+                "mandate_reference": entry.mref,
+                "creditor_reference": entry.creditor_ref,
+                "booking_key": entry.booking_code,
+                "bank_reference": entry.bank_reference,
+                "enhanced_transaction_type": bt.transaction_type,
+                "sepa_purpose_code": extract_sepa_purpose_code(entry.purpose),
+            },
+        )
+
+    return bt
+
+
 @frappe.whitelist()
 def get_import_status():
     """Get status of manual CAMT imports"""
@@ -236,28 +446,23 @@ def validate_camt_file(file_content):
         # Decode file content
         import base64
 
-        xml_content = base64.b64decode(file_content).decode("utf-8")
-
-        # Try to import fintech
-        try:
-            from fintech.sepa import CAMTDocument
-        except ImportError:
-            return {
-                "success": False,
-                "message": "Fintech library not available for CAMT validation. For Dutch banks, please use MT940 format instead via verenigingen.utils.mt940_import",
-            }
-
-        # Parse document
-        camt_document = CAMTDocument(xml=xml_content)
+        xml_content = base64.b64decode(file_content)
 
-        # Count transactions
-        transaction_count = sum(1 for _ in camt_document)
+        # Count entries in a streaming pass
+        transaction_count = 0
+        file_format = None
+        iban = None
+        for entry in iter_camt_entries(io.BytesIO(xml_content)):
+            transaction_count += 1
+            file_format = entry.document_type
+            iban = iban or entry.account_iban
 
         return {
             "success": True,
             "message": f"Valid CAMT file with {transaction_count} transactions",
             "transaction_count": transaction_count,
-            "iban": getattr(camt_document, "iban", "Unknown"),
+            "file_format": file_format,
+            "iban": iban or "Unknown",
             "file_size": len(xml_content),
         }
 
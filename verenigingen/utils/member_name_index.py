@@ -0,0 +1,130 @@
+"""
+In-memory index for fuzzy matching of member names in free text
+
+Names are normalized before they are indexed or compared: diacritics are removed,
+punctuation is ignored and Dutch name particles (tussenvoegsels such as "van der")
+are dropped, so "Jan van der Berg", "J.v.d. Berg" and "JAN BERG" share their
+significant tokens.
+
+Lookups are blocked on character trigrams of the name tokens. Only entries sharing
+the rarest trigrams of the searched text are scored, and the number of postings read
+and entries scored per lookup are bounded, so a lookup does not get slower as more
+members share an amount.
+"""
+
+import heapq
+import re
+import unicodedata
+from collections import Counter
+from difflib import SequenceMatcher
+
+# Dutch name particles, ignored when comparing names
+TUSSENVOEGSELS = frozenset(
+    "AAN BIJ D DA DE DEN DER DES DI DU HET IN LA LE OP S T TE TEN TER UIT V VAN VD VON VOOR".split()
+)
+
+# Postings read per lookup, rarest trigrams first
+MAX_POSTINGS_PER_LOOKUP = 5000
+
+# Entries scored per lookup, by number of shared trigrams
+MAX_CANDIDATES_PER_LOOKUP = 25
+
+_NON_ALPHANUMERIC = re.compile(r"[^A-Z0-9]+")
+
+
+def normalize_name_tokens(text):
+    """Upper case tokens of a name or text without diacritics, punctuation and name particles"""
+    if not text:
+        return []
+
+    decomposed = unicodedata.normalize("NFKD", text)
+    ascii_text = "".join(char for char in decomposed if not unicodedata.combining(char))
+    tokens = _NON_ALPHANUMERIC.sub(" ", ascii_text.upper()).split()
+
+    return [token for token in tokens if token not in TUSSENVOEGSELS]
+
+
+def normalize_name(text):
+    return " ".join(normalize_name_tokens(text))
+
+
+def get_trigrams(tokens):
+    """Character trigrams of the tokens, padded so short tokens and token edges count"""
+    trigrams = set()
+    for token in tokens:
+        padded = f" {token} "
+        trigrams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+class MemberNameIndex:
+    """
+    Trigram index over the names of a list of entries
+
+    Entries are dicts; the name is read from name_field. search() returns the best
+    matching entries with a similarity score between 0 and 1.
+    """
+
+    def __init__(self, entries, name_field="full_name"):
+        self.entries = []
+        self.postings = {}
+
+        for entry in entries:
+            tokens = normalize_name_tokens(entry.get(name_field))
+            if not tokens:
+                continue
+
+            entry_id = len(self.entries)
+            self.entries.append((" ".join(tokens), len(tokens), entry))
+            for trigram in get_trigrams(tokens):
+                self.postings.setdefault(trigram, []).append(entry_id)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, text, limit=5):
+        """
+        Best matching entries for a name or a text containing a name
+
+        Returns up to limit (score, entry) tuples, best first. The score is the
+        SequenceMatcher ratio between the normalized name and the part of the text
+        with the same number of tokens that resembles it most, or the whole text.
+        """
+        tokens = normalize_name_tokens(text)
+        if not tokens or not self.entries:
+            return []
+
+        # Read the postings of the rarest, most selective trigrams first
+        posting_lists = sorted(
+            (self.postings[trigram] for trigram in get_trigrams(tokens) if trigram in self.postings), key=len
+        )
+        shared_trigrams = Counter()
+        postings_read = 0
+        for posting_list in posting_lists:
+            if postings_read + len(posting_list) > MAX_POSTINGS_PER_LOOKUP and shared_trigrams:
+                break
+            shared_trigrams.update(posting_list)
+            postings_read += len(posting_list)
+
+        candidates = [entry_id for entry_id, _count in shared_trigrams.most_common(MAX_CANDIDATES_PER_LOOKUP)]
+
+        scored = []
+        for entry_id in candidates:
+            name, token_count, entry = self.entries[entry_id]
+            scored.append((self._score(name, token_count, tokens), entry_id))
+
+        return [(score, self.entries[entry_id][2]) for score, entry_id in heapq.nlargest(limit, scored)]
+
+    def _score(self, name, token_count, text_tokens):
+        matcher = SequenceMatcher(None, b=name)
+        best_score = 0
+
+        windows = [" ".join(text_tokens)]
+        windows.extend(
+            " ".join(text_tokens[i : i + token_count]) for i in range(len(text_tokens) - token_count + 1)
+        )
+        for window in windows:
+            matcher.set_seq1(window)
+            best_score = max(best_score, matcher.ratio())
+
+        return best_score
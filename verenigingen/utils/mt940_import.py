@@ -1,11 +1,12 @@
 import base64
 import hashlib
+import io
 import os
 import tempfile
 import traceback
 
 import frappe
-from frappe.utils import getdate, today
+from frappe.utils import flt, getdate, today
 
 # Dutch Banking Transaction Type Mapping (ING, Triodos, ABN AMRO, Rabobank)
 DUTCH_BOOKING_CODES = {
@@ -43,6 +44,9 @@ SEPA_TRANSACTION_TYPES = {
     "SECU": "Securities Purchase/Sale",
 }
 
+# Bank Transactions inserted and committed together by the chunked import
+IMPORT_CHUNK_SIZE = 500
+
 
 @frappe.whitelist()
 def import_mt940_file(bank_account, file_content, company=None):
@@ -264,7 +268,9 @@ def process_mt940_document(mt940_content, bank_account, company):
     """
     Process MT940 document content using the WoLpH/mt940 library.
 
-    Uses the free mt940 library instead of expensive fintech license.
+    Uses the free mt940 library instead of expensive fintech license. Statements are
+    parsed one at a time and new Bank Transactions are inserted in chunks, so the
+    time and memory needed do not grow with the history already imported.
     """
     try:
         # Try to import the mt940 library
@@ -276,113 +282,312 @@ def process_mt940_document(mt940_content, bank_account, company):
                 "message": "MT940 library not available. Please install with: pip install mt-940",
             }
 
-        # Write content to temporary file (mt940 library expects file path)
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".sta", delete=False) as temp_file:
-            temp_file.write(mt940_content)
-            temp_file_path = temp_file.name
+        # Get bank account IBAN for validation
+        bank_account_iban = frappe.db.get_value("Bank Account", bank_account, "bank_account_no")
 
-        try:
-            # Parse the MT940 file
-            transactions = mt940.parse(temp_file_path)
+        importer = BankTransactionChunkImporter(bank_account, progress_title="Importing MT940")
+        enhanced_fields_exist = mt940_enhanced_fields_exist()
+        statement_iban = None
+        from_date = to_date = None
+        transaction_dates = set()
+        characters_read = 0
 
-            # Convert to list to check if any transactions found
-            transaction_list = list(transactions)
+        for statement_block in iter_mt940_statements(mt940_content):
+            characters_read += len(statement_block)
 
-            if not transaction_list:
-                return {"success": False, "message": "No transactions found in MT940 file"}
+            statement = mt940.models.Transactions()
+            statement.parse(statement_block)
 
-            # Get bank account IBAN for validation
-            bank_account_iban = frappe.db.get_value("Bank Account", bank_account, "bank_account_no")
+            # Extract IBAN from statement
+            statement_iban = statement.data.get("account_identification") or statement_iban
 
-            # Process transactions
-            transactions_created = 0
-            transactions_skipped = 0
-            errors = []
-            statement_iban = None
+            # Validate IBAN matches (if available)
+            if bank_account_iban and statement_iban and bank_account_iban != statement_iban:
+                return {
+                    "success": False,
+                    "message": f"IBAN mismatch: Bank Account IBAN {bank_account_iban} does not match MT940 IBAN {statement_iban}",
+                }
 
-            # Process transactions - avoid double counting by processing all transactions directly
-            processed_transaction_ids = set()  # Track processed transactions to avoid duplicates
+            for transaction in statement:
+                try:
+                    bt = build_bank_transaction_from_mt940(
+                        transaction, bank_account, company, enhanced_fields_exist=enhanced_fields_exist
+                    )
+                except Exception as e:
+                    importer.errors.append(f"Transaction error: {str(e)}")
+                    frappe.logger().error(f"Error processing MT940 transaction: {str(e)}")
+                    continue
 
-            for statement in transaction_list:
-                # Extract IBAN from statement
-                if hasattr(statement, "data") and "account_identification" in statement.data:
-                    statement_iban = statement.data["account_identification"]
+                transaction_date = getdate(bt.date)
+                transaction_dates.add(transaction_date)
+                from_date = min(from_date or transaction_date, transaction_date)
+                to_date = max(to_date or transaction_date, transaction_date)
 
-                # Validate IBAN matches (if available)
-                if bank_account_iban and statement_iban and bank_account_iban != statement_iban:
-                    return {
-                        "success": False,
-                        "message": f"IBAN mismatch: Bank Account IBAN {bank_account_iban} does not match MT940 IBAN {statement_iban}",
-                    }
+                importer.add(bt, progress=characters_read / len(mt940_content))
 
-                # In MT940 library, each statement object IS a transaction, not a container
-                # The library structure treats each parsed item as a single transaction
-                try:
-                    # Generate transaction ID to check for duplicates within this import
-                    from verenigingen.utils.mt940_import import (
-                        extract_sepa_data_enhanced,
-                        get_enhanced_duplicate_hash,
-                    )
+        importer.flush(progress=1)
 
-                    sepa_data = extract_sepa_data_enhanced(statement)
-                    transaction_id = get_enhanced_duplicate_hash(statement, sepa_data)[:16]
+        if not transaction_dates:
+            return {"success": False, "message": "No transactions found in MT940 file"}
 
-                    # Skip if we've already processed this exact transaction in this import
-                    if transaction_id in processed_transaction_ids:
-                        continue
+        return {
+            "success": True,
+            "message": f"Import completed: {importer.created} transactions created, {importer.skipped} skipped",
+            "transactions_created": importer.created,
+            "transactions_skipped": importer.skipped,
+            "errors": importer.errors[:10],  # Limit errors shown
+            "iban": statement_iban,
+            "statement_date": str(getdate(today())),
+            "statement_from_date": str(from_date),
+            "statement_to_date": str(to_date),
+            "transaction_count": len(transaction_dates),
+        }
 
-                    processed_transaction_ids.add(transaction_id)
+    except Exception as e:
+        return {"success": False, "message": f"Failed to process MT940 document: {str(e)}"}
 
-                    # Create bank transaction using enhanced method
-                    if create_enhanced_bank_transaction_from_mt940(statement, bank_account, company):
-                        transactions_created += 1
-                    else:
-                        transactions_skipped += 1
 
-                except Exception as e:
-                    errors.append(f"Transaction error: {str(e)}")
-                    frappe.logger().error(f"Error processing MT940 transaction: {str(e)}")
+def iter_mt940_statements(mt940_content):
+    """
+    Yield the statements of MT940 content one at a time
 
-            # Calculate date range from processed transactions - each statement IS a transaction
-            transaction_dates = []
-            processed_dates = set()  # Track unique dates to avoid duplicates
+    Each statement starts at its :20: transaction reference line; anything before the
+    first statement, such as a SWIFT header block, is skipped.
+    """
+    statement_lines = []
+    for line in io.StringIO(mt940_content.lstrip("\ufeff")):
+        if line.startswith(":20:") and statement_lines:
+            yield "".join(statement_lines)
+            statement_lines = []
+        if statement_lines or line.startswith(":20:"):
+            statement_lines.append(line)
 
-            for statement in transaction_list:
-                # Extract date from statement data
-                transaction_data = getattr(statement, "data", {})
-                if transaction_data and "date" in transaction_data:
-                    date_obj = transaction_data["date"]
-                    date_str = str(date_obj)
+    if statement_lines:
+        yield "".join(statement_lines)
 
-                    # Only add unique dates to avoid counting the same date multiple times
-                    if date_str not in processed_dates:
-                        transaction_dates.append(date_obj)
-                        processed_dates.add(date_str)
 
-            # Determine date range
-            from_date = min(transaction_dates) if transaction_dates else getdate(today())
-            to_date = max(transaction_dates) if transaction_dates else getdate(today())
+class BankTransactionChunkImporter:
+    """
+    Insert new Bank Transactions of a bank account in chunks
+
+    Transactions are collected with add() and written when a chunk is full. Before a
+    chunk is written, the transaction ids already imported for the bank account within
+    the chunk's date range are loaded in one query, so duplicates are skipped without a
+    lookup per transaction. Each written chunk is committed and reported as progress, so
+    an interrupted import can simply be run again. on_flush is called with the importer
+    after a chunk is inserted and before it is committed.
+    """
 
-            return {
-                "success": True,
-                "message": f"Import completed: {transactions_created} transactions created, {transactions_skipped} skipped",
-                "transactions_created": transactions_created,
-                "transactions_skipped": transactions_skipped,
-                "errors": errors[:10],  # Limit errors shown
-                "iban": statement_iban,
-                "statement_date": str(getdate(today())),
-                "statement_from_date": str(from_date),
-                "statement_to_date": str(to_date),
-                "transaction_count": len(transaction_dates),
-            }
+    def __init__(self, bank_account, chunk_size=None, progress_title=None, on_flush=None):
+        self.bank_account = bank_account
+        self.chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+        self.progress_title = progress_title or "Importing Bank Transactions"
+        self.on_flush = on_flush
+        self.pending = {}
+        self.created = 0
+        self.skipped = 0
+        self.chunks = 0
+        self.errors = []
+
+    def add(self, bank_transaction, progress=None):
+        """Queue a Bank Transaction, writing the chunk when it is full"""
+        # The same transaction repeated within a file is only imported once
+        self.pending.setdefault(bank_transaction.transaction_id, bank_transaction)
+
+        if len(self.pending) >= self.chunk_size:
+            self.flush(progress)
+
+    def flush(self, progress=None):
+        """Insert the new transactions of the pending chunk and commit them"""
+        if not self.pending:
+            return
+
+        chunk = list(self.pending.values())
+        self.pending = {}
+
+        existing_ids = self.get_existing_transaction_ids(chunk)
+        new_transactions = [bt for bt in chunk if bt.transaction_id not in existing_ids]
+
+        insert_bank_transactions(new_transactions)
+
+        self.created += len(new_transactions)
+        self.skipped += len(chunk) - len(new_transactions)
+        self.chunks += 1
+
+        if self.on_flush:
+            self.on_flush(self)
+        frappe.db.commit()
+
+        if progress is not None:
+            frappe.publish_progress(
+                min(progress * 100, 100),
+                title=self.progress_title,
+                description=f"Chunk {self.chunks}: {self.created} transactions created, {self.skipped} skipped",
+            )
 
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
+    def get_existing_transaction_ids(self, chunk):
+        dates = [getdate(bt.date) for bt in chunk]
+        return set(
+            frappe.get_all(
+                "Bank Transaction",
+                filters={
+                    "bank_account": self.bank_account,
+                    "date": ["between", [min(dates), max(dates)]],
+                    "transaction_id": ["is", "set"],
+                },
+                pluck="transaction_id",
+            )
+        )
 
-    except Exception as e:
-        return {"success": False, "message": f"Failed to process MT940 document: {str(e)}"}
+
+def insert_bank_transactions(bank_transactions):
+    """
+    Insert submitted Bank Transactions with one statement per chunk
+
+    The documents are named and given the amounts and status a submit would set, without
+    running their controllers one by one. When party matching is enabled in Accounts
+    Settings, the party is matched before the rows are inserted, as a submit would.
+    Duplicates must have been filtered out by the caller.
+    """
+    if not bank_transactions:
+        return
+
+    party_matching = frappe.db.get_single_value("Accounts Settings", "enable_party_matching")
+
+    rows = []
+    for bt in bank_transactions:
+        bt.docstatus = 1
+        bt.allocated_amount = 0
+        bt.unallocated_amount = abs(flt(bt.withdrawal) - flt(bt.deposit))
+        bt.status = "Unreconciled" if bt.unallocated_amount > 0 else "Reconciled"
+        if party_matching and not (bt.party_type and bt.party):
+            set_matched_party(bt)
+
+        bt.set_new_name()
+        bt.set_user_and_timestamp()
+        rows.append(bt.get_valid_dict(convert_dates_to_str=True))
+
+    fields = list(rows[0])
+    frappe.db.bulk_insert(
+        "Bank Transaction", fields, [tuple(row.get(field) for field in fields) for row in rows]
+    )
+
+
+def set_matched_party(bank_transaction):
+    """
+    Set the party ERPNext's automatic party matching finds for a Bank Transaction
+
+    BankTransaction.auto_set_party writes the party to the saved row, so it cannot be
+    used before the row is inserted; the same matcher is called directly instead.
+    """
+    from erpnext.accounts.doctype.bank_transaction.auto_match_party import AutoMatchParty
+
+    result = AutoMatchParty(
+        bank_party_account_number=bank_transaction.get("bank_party_account_number"),
+        bank_party_iban=bank_transaction.bank_party_iban,
+        bank_party_name=bank_transaction.bank_party_name,
+        description=bank_transaction.description,
+        deposit=bank_transaction.deposit,
+    ).match()
+    if result:
+        bank_transaction.party_type, bank_transaction.party = result
+
+
+def mt940_enhanced_fields_exist():
+    """Whether the enhanced MT940 custom fields exist on Bank Transaction"""
+    try:
+        from verenigingen.utils.mt940_enhanced_fields import validate_enhanced_fields_exist
+    except ImportError:
+        # Enhanced fields module not available
+        return None
+
+    return validate_enhanced_fields_exist()
+
+
+def build_bank_transaction_from_mt940(mt940_transaction, bank_account, company, enhanced_fields_exist=False):
+    """
+    Unsaved Bank Transaction for an MT940 transaction
+
+    The transaction_id is the enhanced duplicate hash. Enhanced SEPA data is stored in
+    the custom fields when enhanced_fields_exist, otherwise kept on the document for
+    debugging; it is skipped when enhanced_fields_exist is None.
+    """
+    # Extract enhanced SEPA data
+    sepa_data = extract_sepa_data_enhanced(mt940_transaction)
+
+    # Create new Bank Transaction with enhanced data
+    bt = frappe.new_doc("Bank Transaction")
+
+    # Extract date from transaction data
+    transaction_data = mt940_transaction.data
+    bt.date = transaction_data.get("date") or getdate(today())
+    bt.bank_account = bank_account
+    bt.company = company
+
+    # Handle amount and direction - amount is in the data structure
+    amount_obj = transaction_data.get("amount")
+    if amount_obj:
+        amount = float(amount_obj.amount) if hasattr(amount_obj, "amount") else float(amount_obj)
+        bt.currency = getattr(amount_obj, "currency", "EUR") if hasattr(amount_obj, "currency") else "EUR"
+    else:
+        amount = 0.0
+        bt.currency = "EUR"
+
+    bt.deposit = max(amount, 0)
+    bt.withdrawal = abs(min(amount, 0))
+
+    # Enhanced description using SEPA SVWZ field (Banking app approach)
+    description = sepa_data["svwz"]
+    if not description:
+        # Fallback to other description sources
+        description_parts = []
+        if transaction_data.get("purpose"):
+            description_parts.append(str(transaction_data["purpose"]))
+        if transaction_data.get("extra_details"):
+            description_parts.append(str(transaction_data["extra_details"]))
+        description = " | ".join(filter(None, description_parts))
+
+    bt.description = description or "MT940 Transaction"
+
+    # Enhanced transaction type using Banking app approach
+    bt.transaction_type = get_enhanced_transaction_type(mt940_transaction)
+
+    # Enhanced reference using SEPA EREF (Banking app approach)
+    reference = sepa_data["eref"]
+    bt.reference_number = reference if reference != "NONREF" else ""
+
+    # Generate enhanced transaction ID using Banking app strategy
+    bt.transaction_id = get_enhanced_duplicate_hash(mt940_transaction, sepa_data)[:16]
+
+    # Enhanced party information using SEPA ABWA field
+    bt.bank_party_name = sepa_data["counterparty"]
+    bt.bank_party_iban = sepa_data["counterparty_iban"]
+
+    # Store additional SEPA data in custom fields (if available)
+    if enhanced_fields_exist:
+        from verenigingen.utils.mt940_enhanced_fields import populate_enhanced_mt940_fields
+
+        enhanced_data = {
+            "mandate_reference": sepa_data["mref"],
+            "creditor_reference": sepa_data["creditor_ref"],
+            "booking_key": transaction_data.get("booking_key", ""),
+            "bank_reference": transaction_data.get("bank_reference", ""),
+            "enhanced_transaction_type": bt.transaction_type,
+            "sepa_purpose_code": extract_sepa_purpose_code(sepa_data["svwz"]),
+        }
+
+        populate_enhanced_mt940_fields(bt, enhanced_data)
+    elif enhanced_fields_exist is not None:
+        # Store in temporary attribute for debugging if fields don't exist
+        bt._enhanced_data = {
+            "mandate_reference": sepa_data["mref"],
+            "creditor_reference": sepa_data["creditor_ref"],
+            "booking_key": transaction_data.get("booking_key", ""),
+            "bank_reference": transaction_data.get("bank_reference", ""),
+            "raw_sepa": sepa_data["raw_sepa"],
+        }
+
+    return bt
 
 
 def create_enhanced_bank_transaction_from_mt940(mt940_transaction, bank_account, company):
@@ -398,96 +603,16 @@ def create_enhanced_bank_transaction_from_mt940(mt940_transaction, bank_account,
     try:
         import contextlib
 
-        # Extract enhanced SEPA data
-        sepa_data = extract_sepa_data_enhanced(mt940_transaction)
-
-        # Generate enhanced transaction ID using Banking app strategy
-        transaction_id = get_enhanced_duplicate_hash(mt940_transaction, sepa_data)[:16]
+        bt = build_bank_transaction_from_mt940(
+            mt940_transaction, bank_account, company, enhanced_fields_exist=mt940_enhanced_fields_exist()
+        )
 
         # Check if transaction already exists
-        if transaction_id and frappe.db.exists(
-            "Bank Transaction", {"transaction_id": transaction_id, "bank_account": bank_account}
+        if bt.transaction_id and frappe.db.exists(
+            "Bank Transaction", {"transaction_id": bt.transaction_id, "bank_account": bank_account}
         ):
             return False  # Already exists
 
-        # Create new Bank Transaction with enhanced data
-        bt = frappe.new_doc("Bank Transaction")
-
-        # Extract date from transaction data
-        transaction_data = mt940_transaction.data
-        bt.date = transaction_data.get("date") or getdate(today())
-        bt.bank_account = bank_account
-        bt.company = company
-
-        # Handle amount and direction - amount is in the data structure
-        amount_obj = transaction_data.get("amount")
-        if amount_obj:
-            amount = float(amount_obj.amount) if hasattr(amount_obj, "amount") else float(amount_obj)
-            bt.currency = getattr(amount_obj, "currency", "EUR") if hasattr(amount_obj, "currency") else "EUR"
-        else:
-            amount = 0.0
-            bt.currency = "EUR"
-
-        bt.deposit = max(amount, 0)
-        bt.withdrawal = abs(min(amount, 0))
-
-        # Enhanced description using SEPA SVWZ field (Banking app approach)
-        description = sepa_data["svwz"]
-        if not description:
-            # Fallback to other description sources
-            transaction_data = mt940_transaction.data
-            description_parts = []
-            if transaction_data.get("purpose"):
-                description_parts.append(str(transaction_data["purpose"]))
-            if transaction_data.get("extra_details"):
-                description_parts.append(str(transaction_data["extra_details"]))
-            description = " | ".join(filter(None, description_parts))
-
-        bt.description = description or "MT940 Transaction"
-
-        # Enhanced transaction type using Banking app approach
-        bt.transaction_type = get_enhanced_transaction_type(mt940_transaction)
-
-        # Enhanced reference using SEPA EREF (Banking app approach)
-        reference = sepa_data["eref"]
-        bt.reference_number = reference if reference != "NONREF" else ""
-        bt.transaction_id = transaction_id
-
-        # Enhanced party information using SEPA ABWA field
-        bt.bank_party_name = sepa_data["counterparty"]
-        bt.bank_party_iban = sepa_data["counterparty_iban"]
-
-        # Store additional SEPA data in custom fields (if available)
-        try:
-            from verenigingen.utils.mt940_enhanced_fields import (
-                populate_enhanced_mt940_fields,
-                validate_enhanced_fields_exist,
-            )
-
-            if validate_enhanced_fields_exist():
-                enhanced_data = {
-                    "mandate_reference": sepa_data["mref"],
-                    "creditor_reference": sepa_data["creditor_ref"],
-                    "booking_key": mt940_transaction.data.get("booking_key", ""),
-                    "bank_reference": mt940_transaction.data.get("bank_reference", ""),
-                    "enhanced_transaction_type": bt.transaction_type,
-                    "sepa_purpose_code": extract_sepa_purpose_code(sepa_data["svwz"]),
-                }
-
-                populate_enhanced_mt940_fields(bt, enhanced_data)
-            else:
-                # Store in temporary attribute for debugging if fields don't exist
-                bt._enhanced_data = {
-                    "mandate_reference": sepa_data["mref"],
-                    "creditor_reference": sepa_data["creditor_ref"],
-                    "booking_key": mt940_transaction.data.get("booking_key", ""),
-                    "bank_reference": mt940_transaction.data.get("bank_reference", ""),
-                    "raw_sepa": sepa_data["raw_sepa"],
-                }
-        except ImportError:
-            # Enhanced fields module not available
-            pass
-
         # Insert and submit with enhanced error handling
         with contextlib.suppress(frappe.exceptions.UniqueValidationError):
             bt.insert()
@@ -495,8 +620,8 @@ def create_enhanced_bank_transaction_from_mt940(mt940_transaction, bank_account,
 
             # Log enhanced transaction creation for debugging
             frappe.logger().info(
-                f"Enhanced MT940 transaction created: {transaction_id} - "
-                f"{bt.transaction_type} - {amount} {bt.currency} - {sepa_data['counterparty']}"
+                f"Enhanced MT940 transaction created: {bt.transaction_id} - "
+                f"{bt.transaction_type} - {bt.deposit or -bt.withdrawal} {bt.currency} - {bt.bank_party_name}"
             )
             return True
 
@@ -19,6 +19,9 @@ from frappe.utils import add_days, getdate, now, today
 from verenigingen.utils.error_handling import SEPAError, ValidationError, handle_api_error
 from verenigingen.utils.performance_utils import performance_monitor
 
+# Maximum number of values passed in a single IN (...) list
+LOOKUP_CHUNK_SIZE = 1000
+
 
 class ConflictSeverity(Enum):
     """Severity levels for detected conflicts"""
@@ -89,11 +92,14 @@ class SEPAConflictDetector:
         # 1. Invoice duplicate detection
         conflicts.extend(self._detect_invoice_duplicates(invoice_list))
 
+        # Cross-batch, schedule, mandate and amount conflicts are evaluated in one pass
+        invoice_conflicts = self._detect_invoice_conflicts(invoice_list, batch_date)
+
         # 2. Cross-batch invoice conflicts
-        conflicts.extend(self._detect_cross_batch_conflicts(invoice_list))
+        conflicts.extend(invoice_conflicts["cross_batch"])
 
         # 3. Schedule overlap detection
-        conflicts.extend(self._detect_schedule_overlaps(invoice_list, batch_date))
+        conflicts.extend(invoice_conflicts["schedule"])
 
         # 4. Date-based conflicts
         conflicts.extend(self._detect_date_conflicts(batch_date, batch_type))
@@ -102,10 +108,10 @@ class SEPAConflictDetector:
         conflicts.extend(self._detect_business_rule_conflicts(batch_data))
 
         # 6. SEPA mandate conflicts
-        conflicts.extend(self._detect_mandate_conflicts(invoice_list))
+        conflicts.extend(invoice_conflicts["mandate"])
 
         # 7. Amount reconciliation conflicts
-        conflicts.extend(self._detect_amount_conflicts(invoice_list))
+        conflicts.extend(invoice_conflicts["amount"])
 
         # Sort conflicts by severity
         conflicts.sort(key=lambda x: self._get_severity_priority(x.severity), reverse=True)
@@ -138,186 +144,279 @@ class SEPAConflictDetector:
 
         return conflicts
 
-    def _detect_cross_batch_conflicts(self, invoice_list: List[Dict[str, Any]]) -> List[ConflictResult]:
-        """Detect invoices already in other active batches"""
-        conflicts = []
-        invoice_names = [inv.get("invoice") for inv in invoice_list if inv.get("invoice")]
+    def _detect_invoice_conflicts(
+        self, invoice_list: List[Dict[str, Any]], batch_date: str
+    ) -> Dict[str, List[ConflictResult]]:
+        """
+        Detect cross-batch, schedule, mandate and amount conflicts
 
-        if not invoice_names:
-            return conflicts
+        The existing batch assignments, invoices, dues schedules and mandates of the batch
+        are loaded once, in chunks, and every invoice is then checked against the indexed
+        lookups in a single pass. Conflicts are returned per conflict class.
+        """
+        conflicts = {"cross_batch": [], "schedule": [], "mandate": [], "amount": []}
 
-        try:
-            # Query for existing batch assignments
-            existing_assignments = frappe.db.sql(
-                """
-                SELECT
-                    ddi.invoice,
-                    ddb.name as batch_name,
-                    ddb.status as batch_status,
-                    ddb.batch_date,
-                    ddb.batch_type,
-                    ddb.creation,
-                    ddb.total_amount
-                FROM `tabDirect Debit Batch Invoice` ddi
-                JOIN `tabDirect Debit Batch` ddb ON ddi.parent = ddb.name
-                WHERE ddi.invoice IN %(invoices)s
-                AND ddb.docstatus != 2  -- Not cancelled
-                AND ddb.status NOT IN ('Failed', 'Cancelled', 'Rejected')
-                ORDER BY ddb.creation DESC
-            """,
-                {"invoices": invoice_names},
-                as_dict=True,
-            )
+        invoice_names = []
+        mandate_groups = {}
+        for invoice in invoice_list:
+            if invoice.get("invoice"):
+                invoice_names.append(invoice.get("invoice"))
+            mandate_ref = invoice.get("mandate_reference")
+            if mandate_ref:
+                mandate_groups.setdefault(mandate_ref, []).append(invoice)
+        invoice_names = list(dict.fromkeys(invoice_names))
 
-            # Group by invoice for detailed analysis
-            invoice_conflicts = {}
-            for assignment in existing_assignments:
-                invoice_id = assignment.invoice
-                if invoice_id not in invoice_conflicts:
-                    invoice_conflicts[invoice_id] = []
-                invoice_conflicts[invoice_id].append(assignment)
-
-            # Analyze each conflict
-            for invoice_id, assignments in invoice_conflicts.items():
-                # Most recent assignment
-                recent_assignment = assignments[0]
-
-                # Determine conflict severity based on batch status
-                if recent_assignment.batch_status in ["Draft", "Generated"]:
-                    severity = ConflictSeverity.CRITICAL
-                    action = f"Remove invoice from batch {recent_assignment.batch_name} or cancel that batch"
-                elif recent_assignment.batch_status in ["Submitted", "Processing"]:
-                    severity = ConflictSeverity.CRITICAL
-                    action = "Cannot include invoice - already being processed"
-                else:
-                    severity = ConflictSeverity.WARNING
-                    action = "Review invoice history before proceeding"
+        assignments = sales_invoices = mandates = batch_date_obj = None
 
-                conflicts.append(
+        if invoice_names:
+            try:
+                assignments = self._load_batch_assignments(invoice_names)
+            except Exception as e:
+                conflicts["cross_batch"].append(
                     ConflictResult(
-                        severity=severity,
-                        conflict_type="cross_batch_conflict",
-                        message=f"Invoice {invoice_id} already in batch {recent_assignment.batch_name} (status: {recent_assignment.batch_status})",
-                        affected_resources=[invoice_id, recent_assignment.batch_name],
-                        suggested_action=action,
-                        details={
-                            "invoice_id": invoice_id,
-                            "conflicting_batch": recent_assignment.batch_name,
-                            "batch_status": recent_assignment.batch_status,
-                            "batch_date": str(recent_assignment.batch_date),
-                            "assignment_count": len(assignments),
-                        },
+                        severity=ConflictSeverity.WARNING,
+                        conflict_type="detection_error",
+                        message=f"Error detecting cross-batch conflicts: {str(e)}",
+                        affected_resources=invoice_names[:5],  # First 5 for context
+                        suggested_action="Review batch manually for conflicts",
+                        details={"error": str(e)},
                     )
                 )
 
-        except Exception as e:
-            conflicts.append(
-                ConflictResult(
-                    severity=ConflictSeverity.WARNING,
-                    conflict_type="detection_error",
-                    message=f"Error detecting cross-batch conflicts: {str(e)}",
-                    affected_resources=invoice_names[:5],  # First 5 for context
-                    suggested_action="Review batch manually for conflicts",
-                    details={"error": str(e)},
+            try:
+                sales_invoices = self._load_sales_invoices(invoice_names)
+                batch_date_obj = getdate(batch_date) if batch_date else None
+            except Exception as e:
+                if batch_date:
+                    conflicts["schedule"].append(
+                        ConflictResult(
+                            severity=ConflictSeverity.INFO,
+                            conflict_type="schedule_check_error",
+                            message=f"Could not verify schedule overlaps: {str(e)}",
+                            affected_resources=[],
+                            suggested_action="Manually verify schedule conflicts",
+                            details={"error": str(e)},
+                        )
+                    )
+                if sales_invoices is None:
+                    conflicts["amount"].append(
+                        ConflictResult(
+                            severity=ConflictSeverity.WARNING,
+                            conflict_type="amount_check_error",
+                            message=f"Error checking amount conflicts: {str(e)}",
+                            affected_resources=invoice_names[:5],
+                            suggested_action="Manually verify invoice amounts",
+                            details={"error": str(e)},
+                        )
+                    )
+
+        if mandate_groups:
+            try:
+                mandates = self._load_mandates(list(mandate_groups))
+            except Exception as e:
+                conflicts["mandate"].append(
+                    ConflictResult(
+                        severity=ConflictSeverity.WARNING,
+                        conflict_type="mandate_check_error",
+                        message=f"Error checking mandate conflicts: {str(e)}",
+                        affected_resources=list(mandate_groups.keys()),
+                        suggested_action="Manually verify mandate statuses",
+                        details={"error": str(e)},
+                    )
                 )
-            )
 
-        return conflicts
+        checked_invoices = set()
+        for invoice in invoice_list:
+            invoice_id = invoice.get("invoice")
+            if not invoice_id:
+                continue
 
-    def _detect_schedule_overlaps(
-        self, invoice_list: List[Dict[str, Any]], batch_date: str
-    ) -> List[ConflictResult]:
-        """Detect conflicts with membership dues schedules"""
-        conflicts = []
+            first_occurrence = invoice_id not in checked_invoices
+            checked_invoices.add(invoice_id)
 
-        if not batch_date:
-            return conflicts
+            if first_occurrence and assignments and invoice_id in assignments:
+                conflicts["cross_batch"].append(
+                    self._get_cross_batch_conflict(invoice_id, assignments[invoice_id])
+                )
 
-        try:
-            # Get membership dues schedules for invoices
-            invoice_names = [inv.get("invoice") for inv in invoice_list if inv.get("invoice")]
-            if not invoice_names:
-                return conflicts
+            if sales_invoices is None:
+                continue
 
-            schedule_conflicts = frappe.db.sql(
-                """
-                SELECT
-                    si.name as invoice,
-                    si.custom_membership_dues_schedule as schedule_id,
-                    mds.member,
-                    mds.next_invoice_date,
-                    mds.billing_frequency,
-                    mds.status as schedule_status,
-                    mem.full_name as member_name
-                FROM `tabSales Invoice` si
-                LEFT JOIN `tabMembership Dues Schedule` mds ON si.custom_membership_dues_schedule = mds.name
-                LEFT JOIN `tabMember` mem ON mds.member = mem.name
-                WHERE si.name IN %(invoices)s
-                AND mds.name IS NOT NULL
-                AND mds.status = 'Active'
-            """,
-                {"invoices": invoice_names},
-                as_dict=True,
-            )
+            db_invoice = sales_invoices.get(invoice_id)
+            if first_occurrence and batch_date_obj and db_invoice and db_invoice.schedule_id:
+                schedule_conflict = self._get_schedule_conflict(db_invoice, batch_date_obj, batch_date)
+                if schedule_conflict:
+                    conflicts["schedule"].append(schedule_conflict)
 
-            batch_date_obj = getdate(batch_date)
+            if db_invoice and db_invoice.docstatus != 1:
+                db_invoice = None
+            conflicts["amount"].extend(self._get_amount_conflicts(invoice, db_invoice))
 
-            for schedule in schedule_conflicts:
-                if not schedule.next_due_date:
-                    continue
+        if mandates is not None:
+            for mandate_ref, invoices in mandate_groups.items():
+                conflicts["mandate"].extend(
+                    self._get_mandate_conflicts(mandate_ref, invoices, mandates.get(mandate_ref))
+                )
 
-                next_due = getdate(schedule.next_due_date)
-                days_diff = (batch_date_obj - next_due).days
+        return conflicts
 
-                # Check for schedule timing conflicts
-                if days_diff < -30:  # Batch more than 30 days early
-                    conflicts.append(
-                        ConflictResult(
-                            severity=ConflictSeverity.WARNING,
-                            conflict_type="early_collection",
-                            message=f"Invoice {schedule.invoice} scheduled for collection too early (next due: {schedule.next_due_date})",
-                            affected_resources=[schedule.invoice, schedule.member],
-                            suggested_action="Consider adjusting batch date or removing invoice",
-                            details={
-                                "invoice": schedule.invoice,
-                                "member": schedule.member_name,
-                                "next_due_date": str(schedule.next_due_date),
-                                "batch_date": batch_date,
-                                "days_early": abs(days_diff),
-                            },
-                        )
-                    )
-                elif days_diff > 90:  # Batch more than 90 days late
-                    conflicts.append(
-                        ConflictResult(
-                            severity=ConflictSeverity.WARNING,
-                            conflict_type="late_collection",
-                            message=f"Invoice {schedule.invoice} overdue by {days_diff} days",
-                            affected_resources=[schedule.invoice, schedule.member],
-                            suggested_action="Review member status and collection policy",
-                            details={
-                                "invoice": schedule.invoice,
-                                "member": schedule.member_name,
-                                "next_due_date": str(schedule.next_due_date),
-                                "batch_date": batch_date,
-                                "days_overdue": days_diff,
-                            },
-                        )
-                    )
+    def _sql_in_chunks(self, query: str, values: List[str]) -> List[Dict[str, Any]]:
+        """Run a query filtering on IN %(values)s for chunks of at most LOOKUP_CHUNK_SIZE values"""
+        rows = []
+        for start in range(0, len(values), LOOKUP_CHUNK_SIZE):
+            rows.extend(
+                frappe.db.sql(query, {"values": values[start : start + LOOKUP_CHUNK_SIZE]}, as_dict=True)
+            )
+        return rows
+
+    def _load_batch_assignments(self, invoice_names: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """Active batch assignments per invoice, most recent batch first"""
+        existing_assignments = self._sql_in_chunks(
+            """
+            SELECT
+                ddi.invoice,
+                ddb.name as batch_name,
+                ddb.status as batch_status,
+                ddb.batch_date,
+                ddb.batch_type,
+                ddb.creation,
+                ddb.total_amount
+            FROM `tabDirect Debit Batch Invoice` ddi
+            JOIN `tabDirect Debit Batch` ddb ON ddi.parent = ddb.name
+            WHERE ddi.invoice IN %(values)s
+            AND ddb.docstatus != 2  -- Not cancelled
+            AND ddb.status NOT IN ('Failed', 'Cancelled', 'Rejected')
+            ORDER BY ddb.creation DESC
+        """,
+            invoice_names,
+        )
+
+        assignments = {}
+        for assignment in existing_assignments:
+            assignments.setdefault(assignment.invoice, []).append(assignment)
+
+        return assignments
+
+    def _load_sales_invoices(self, invoice_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Invoices with their outstanding amount and active membership dues schedule"""
+        invoices = self._sql_in_chunks(
+            """
+            SELECT
+                si.name as invoice,
+                si.docstatus,
+                si.outstanding_amount,
+                si.status,
+                mds.name as schedule_id,
+                mds.member,
+                mds.next_invoice_date as next_due_date,
+                mds.billing_frequency,
+                mem.full_name as member_name
+            FROM `tabSales Invoice` si
+            LEFT JOIN `tabMembership Dues Schedule` mds
+                ON si.custom_membership_dues_schedule = mds.name AND mds.status = 'Active'
+            LEFT JOIN `tabMember` mem ON mds.member = mem.name
+            WHERE si.name IN %(values)s
+        """,
+            invoice_names,
+        )
+
+        return {inv.invoice: inv for inv in invoices}
+
+    def _load_mandates(self, mandate_refs: List[str]) -> Dict[str, Dict[str, Any]]:
+        """SEPA mandates by mandate reference"""
+        mandate_data = self._sql_in_chunks(
+            """
+            SELECT
+                mandate_id,
+                status,
+                is_active,
+                member,
+                iban,
+                sign_date,
+                expiry_date
+            FROM `tabSEPA Mandate`
+            WHERE mandate_id IN %(values)s
+        """,
+            mandate_refs,
+        )
+
+        return {m.mandate_id: m for m in mandate_data}
+
+    def _get_cross_batch_conflict(self, invoice_id: str, assignments: List[Dict[str, Any]]) -> ConflictResult:
+        """Conflict for an invoice that is already in other active batches"""
+        # Most recent assignment
+        recent_assignment = assignments[0]
+
+        # Determine conflict severity based on batch status
+        if recent_assignment.batch_status in ["Draft", "Generated"]:
+            severity = ConflictSeverity.CRITICAL
+            action = f"Remove invoice from batch {recent_assignment.batch_name} or cancel that batch"
+        elif recent_assignment.batch_status in ["Submitted", "Processing"]:
+            severity = ConflictSeverity.CRITICAL
+            action = "Cannot include invoice - already being processed"
+        else:
+            severity = ConflictSeverity.WARNING
+            action = "Review invoice history before proceeding"
+
+        return ConflictResult(
+            severity=severity,
+            conflict_type="cross_batch_conflict",
+            message=f"Invoice {invoice_id} already in batch {recent_assignment.batch_name} (status: {recent_assignment.batch_status})",
+            affected_resources=[invoice_id, recent_assignment.batch_name],
+            suggested_action=action,
+            details={
+                "invoice_id": invoice_id,
+                "conflicting_batch": recent_assignment.batch_name,
+                "batch_status": recent_assignment.batch_status,
+                "batch_date": str(recent_assignment.batch_date),
+                "assignment_count": len(assignments),
+            },
+        )
+
+    def _get_schedule_conflict(
+        self, schedule: Dict[str, Any], batch_date_obj, batch_date: str
+    ) -> Optional[ConflictResult]:
+        """Conflict between the batch date and the membership dues schedule of an invoice"""
+        if not schedule.next_due_date:
+            return None
+
+        next_due = getdate(schedule.next_due_date)
+        days_diff = (batch_date_obj - next_due).days
+
+        # Check for schedule timing conflicts
+        if days_diff < -30:  # Batch more than 30 days early
+            return ConflictResult(
+                severity=ConflictSeverity.WARNING,
+                conflict_type="early_collection",
+                message=f"Invoice {schedule.invoice} scheduled for collection too early (next due: {schedule.next_due_date})",
+                affected_resources=[schedule.invoice, schedule.member],
+                suggested_action="Consider adjusting batch date or removing invoice",
+                details={
+                    "invoice": schedule.invoice,
+                    "member": schedule.member_name,
+                    "next_due_date": str(schedule.next_due_date),
+                    "batch_date": batch_date,
+                    "days_early": abs(days_diff),
+                },
+            )
 
-        except Exception as e:
-            conflicts.append(
-                ConflictResult(
-                    severity=ConflictSeverity.INFO,
-                    conflict_type="schedule_check_error",
-                    message=f"Could not verify schedule overlaps: {str(e)}",
-                    affected_resources=[],
-                    suggested_action="Manually verify schedule conflicts",
-                    details={"error": str(e)},
-                )
+        if days_diff > 90:  # Batch more than 90 days late
+            return ConflictResult(
+                severity=ConflictSeverity.WARNING,
+                conflict_type="late_collection",
+                message=f"Invoice {schedule.invoice} overdue by {days_diff} days",
+                affected_resources=[schedule.invoice, schedule.member],
+                suggested_action="Review member status and collection policy",
+                details={
+                    "invoice": schedule.invoice,
+                    "member": schedule.member_name,
+                    "next_due_date": str(schedule.next_due_date),
+                    "batch_date": batch_date,
+                    "days_overdue": days_diff,
+                },
             )
 
-        return conflicts
+        return None
 
     def _detect_date_conflicts(self, batch_date: str, batch_type: str) -> List[ConflictResult]:
         """Detect date-related conflicts"""
@@ -487,201 +586,119 @@ class SEPAConflictDetector:
 
         return conflicts
 
-    def _detect_mandate_conflicts(self, invoice_list: List[Dict[str, Any]]) -> List[ConflictResult]:
-        """Detect SEPA mandate conflicts"""
+    def _get_mandate_conflicts(
+        self, mandate_ref: str, invoices: List[Dict[str, Any]], mandate: Optional[Dict[str, Any]]
+    ) -> List[ConflictResult]:
+        """Conflicts for the invoices in the batch that are collected with one SEPA mandate"""
         conflicts = []
 
-        # Group invoices by mandate reference
-        mandate_groups = {}
-        for invoice in invoice_list:
-            mandate_ref = invoice.get("mandate_reference")
-            if mandate_ref:
-                if mandate_ref not in mandate_groups:
-                    mandate_groups[mandate_ref] = []
-                mandate_groups[mandate_ref].append(invoice)
-
-        if not mandate_groups:
-            return conflicts
+        if not mandate:
+            return [
+                ConflictResult(
+                    severity=ConflictSeverity.CRITICAL,
+                    conflict_type="mandate_not_found",
+                    message=f"SEPA mandate not found: {mandate_ref}",
+                    affected_resources=[inv.get("invoice") for inv in invoices],
+                    suggested_action="Verify mandate reference or create mandate",
+                    details={"mandate_reference": mandate_ref, "affected_invoices": len(invoices)},
+                )
+            ]
 
-        try:
-            # Validate mandate statuses
-            mandate_refs = list(mandate_groups.keys())
-            mandate_data = frappe.db.sql(
-                """
-                SELECT
-                    mandate_id,
-                    status,
-                    valid_from,
-                    valid_until,
-                    member,
-                    iban,
-                    sign_date,
-                    usage_count
-                FROM `tabSEPA Mandate`
-                WHERE mandate_id IN %(mandates)s
-            """,
-                {"mandates": mandate_refs},
-                as_dict=True,
+        # Check mandate status
+        if mandate.status != "Active" or not mandate.is_active:
+            conflicts.append(
+                ConflictResult(
+                    severity=ConflictSeverity.CRITICAL,
+                    conflict_type="inactive_mandate",
+                    message=f"Mandate {mandate_ref} is not active (status: {mandate.status})",
+                    affected_resources=[inv.get("invoice") for inv in invoices],
+                    suggested_action="Activate mandate before processing",
+                    details={"mandate_reference": mandate_ref, "status": mandate.status},
+                )
             )
 
-            mandate_lookup = {m.mandate_id: m for m in mandate_data}
-
-            for mandate_ref, invoices in mandate_groups.items():
-                mandate = mandate_lookup.get(mandate_ref)
-
-                if not mandate:
-                    conflicts.append(
-                        ConflictResult(
-                            severity=ConflictSeverity.CRITICAL,
-                            conflict_type="mandate_not_found",
-                            message=f"SEPA mandate not found: {mandate_ref}",
-                            affected_resources=[inv.get("invoice") for inv in invoices],
-                            suggested_action="Verify mandate reference or create mandate",
-                            details={"mandate_reference": mandate_ref, "affected_invoices": len(invoices)},
-                        )
-                    )
-                    continue
-
-                # Check mandate status
-                if mandate.status != "Active":
-                    conflicts.append(
-                        ConflictResult(
-                            severity=ConflictSeverity.CRITICAL,
-                            conflict_type="inactive_mandate",
-                            message=f"Mandate {mandate_ref} is not active (status: {mandate.status})",
-                            affected_resources=[inv.get("invoice") for inv in invoices],
-                            suggested_action="Activate mandate before processing",
-                            details={"mandate_reference": mandate_ref, "status": mandate.status},
-                        )
-                    )
-
-                # Check mandate expiry
-                if mandate.valid_until and getdate(mandate.valid_until) < getdate(today()):
-                    conflicts.append(
-                        ConflictResult(
-                            severity=ConflictSeverity.CRITICAL,
-                            conflict_type="expired_mandate",
-                            message=f"Mandate {mandate_ref} has expired (valid until: {mandate.valid_until})",
-                            affected_resources=[inv.get("invoice") for inv in invoices],
-                            suggested_action="Renew mandate before processing",
-                            details={
-                                "mandate_reference": mandate_ref,
-                                "valid_until": str(mandate.valid_until),
-                            },
-                        )
-                    )
-
-                # Check for excessive usage on same mandate
-                if len(invoices) > 50:  # Arbitrary business rule
-                    conflicts.append(
-                        ConflictResult(
-                            severity=ConflictSeverity.WARNING,
-                            conflict_type="high_mandate_usage",
-                            message=f"High usage for mandate {mandate_ref}: {len(invoices)} invoices in batch",
-                            affected_resources=[mandate_ref],
-                            suggested_action="Review mandate usage pattern",
-                            details={"mandate_reference": mandate_ref, "usage_count": len(invoices)},
-                        )
-                    )
+        # Check mandate expiry
+        if mandate.expiry_date and getdate(mandate.expiry_date) < getdate(today()):
+            conflicts.append(
+                ConflictResult(
+                    severity=ConflictSeverity.CRITICAL,
+                    conflict_type="expired_mandate",
+                    message=f"Mandate {mandate_ref} has expired (expiry date: {mandate.expiry_date})",
+                    affected_resources=[inv.get("invoice") for inv in invoices],
+                    suggested_action="Renew mandate before processing",
+                    details={
+                        "mandate_reference": mandate_ref,
+                        "expiry_date": str(mandate.expiry_date),
+                    },
+                )
+            )
 
-        except Exception as e:
+        # Check for excessive usage on same mandate
+        if len(invoices) > 50:  # Arbitrary business rule
             conflicts.append(
                 ConflictResult(
                     severity=ConflictSeverity.WARNING,
-                    conflict_type="mandate_check_error",
-                    message=f"Error checking mandate conflicts: {str(e)}",
-                    affected_resources=list(mandate_groups.keys()),
-                    suggested_action="Manually verify mandate statuses",
-                    details={"error": str(e)},
+                    conflict_type="high_mandate_usage",
+                    message=f"High usage for mandate {mandate_ref}: {len(invoices)} invoices in batch",
+                    affected_resources=[mandate_ref],
+                    suggested_action="Review mandate usage pattern",
+                    details={"mandate_reference": mandate_ref, "usage_count": len(invoices)},
                 )
             )
 
         return conflicts
 
-    def _detect_amount_conflicts(self, invoice_list: List[Dict[str, Any]]) -> List[ConflictResult]:
-        """Detect amount reconciliation conflicts"""
-        conflicts = []
-
-        invoice_names = [inv.get("invoice") for inv in invoice_list if inv.get("invoice")]
-        if not invoice_names:
-            return conflicts
-
-        try:
-            # Get current outstanding amounts from database
-            db_amounts = frappe.db.sql(
-                """
-                SELECT name, outstanding_amount, status
-                FROM `tabSales Invoice`
-                WHERE name IN %(invoices)s
-                AND docstatus = 1
-            """,
-                {"invoices": invoice_names},
-                as_dict=True,
-            )
-
-            db_amount_lookup = {inv.name: inv for inv in db_amounts}
-
-            for invoice in invoice_list:
-                invoice_id = invoice.get("invoice")
-                requested_amount = float(invoice.get("amount", 0))
-
-                db_invoice = db_amount_lookup.get(invoice_id)
-                if not db_invoice:
-                    conflicts.append(
-                        ConflictResult(
-                            severity=ConflictSeverity.CRITICAL,
-                            conflict_type="invoice_not_found",
-                            message=f"Invoice missing from database: {invoice_id}",
-                            affected_resources=[invoice_id],
-                            suggested_action="Verify invoice exists and is submitted",
-                            details={"invoice_id": invoice_id},
-                        )
-                    )
-                    continue
+    def _get_amount_conflicts(
+        self, invoice: Dict[str, Any], db_invoice: Optional[Dict[str, Any]]
+    ) -> List[ConflictResult]:
+        """Conflicts between a batch invoice and the submitted Sales Invoice in the database"""
+        invoice_id = invoice.get("invoice")
+        requested_amount = float(invoice.get("amount", 0))
 
-                db_amount = float(db_invoice.outstanding_amount or 0)
-                amount_diff = abs(requested_amount - db_amount)
+        if not db_invoice:
+            return [
+                ConflictResult(
+                    severity=ConflictSeverity.CRITICAL,
+                    conflict_type="invoice_not_found",
+                    message=f"Invoice missing from database: {invoice_id}",
+                    affected_resources=[invoice_id],
+                    suggested_action="Verify invoice exists and is submitted",
+                    details={"invoice_id": invoice_id},
+                )
+            ]
 
-                # Check for significant amount differences
-                if amount_diff > 0.01:  # More than 1 cent difference
-                    conflicts.append(
-                        ConflictResult(
-                            severity=ConflictSeverity.CRITICAL,
-                            conflict_type="amount_mismatch",
-                            message=f"Amount mismatch for invoice {invoice_id}: requested €{requested_amount}, outstanding €{db_amount}",
-                            affected_resources=[invoice_id],
-                            suggested_action="Use current outstanding amount",
-                            details={
-                                "invoice_id": invoice_id,
-                                "requested_amount": requested_amount,
-                                "outstanding_amount": db_amount,
-                                "difference": amount_diff,
-                            },
-                        )
-                    )
+        conflicts = []
+        db_amount = float(db_invoice.outstanding_amount or 0)
+        amount_diff = abs(requested_amount - db_amount)
 
-                # Check invoice status
-                if db_invoice.status not in ["Unpaid", "Overdue"]:
-                    conflicts.append(
-                        ConflictResult(
-                            severity=ConflictSeverity.CRITICAL,
-                            conflict_type="invalid_status",
-                            message=f"Invoice {invoice_id} is not unpaid (status: {db_invoice.status})",
-                            affected_resources=[invoice_id],
-                            suggested_action="Remove invoice from batch",
-                            details={"invoice_id": invoice_id, "status": db_invoice.status},
-                        )
-                    )
+        # Check for significant amount differences
+        if amount_diff > 0.01:  # More than 1 cent difference
+            conflicts.append(
+                ConflictResult(
+                    severity=ConflictSeverity.CRITICAL,
+                    conflict_type="amount_mismatch",
+                    message=f"Amount mismatch for invoice {invoice_id}: requested €{requested_amount}, outstanding €{db_amount}",
+                    affected_resources=[invoice_id],
+                    suggested_action="Use current outstanding amount",
+                    details={
+                        "invoice_id": invoice_id,
+                        "requested_amount": requested_amount,
+                        "outstanding_amount": db_amount,
+                        "difference": amount_diff,
+                    },
+                )
+            )
 
-        except Exception as e:
+        # Check invoice status
+        if db_invoice.status not in ["Unpaid", "Overdue"]:
             conflicts.append(
                 ConflictResult(
-                    severity=ConflictSeverity.WARNING,
-                    conflict_type="amount_check_error",
-                    message=f"Error checking amount conflicts: {str(e)}",
-                    affected_resources=invoice_names[:5],
-                    suggested_action="Manually verify invoice amounts",
-                    details={"error": str(e)},
+                    severity=ConflictSeverity.CRITICAL,
+                    conflict_type="invalid_status",
+                    message=f"Invoice {invoice_id} is not unpaid (status: {db_invoice.status})",
+                    affected_resources=[invoice_id],
+                    suggested_action="Remove invoice from batch",
+                    details={"invoice_id": invoice_id, "status": db_invoice.status},
                 )
             )
 
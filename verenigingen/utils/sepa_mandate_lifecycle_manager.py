@@ -19,6 +19,7 @@ from frappe.utils import add_days, getdate, now, today
 
 from verenigingen.utils.error_handling import SEPAError, ValidationError, handle_api_error
 from verenigingen.utils.performance_utils import performance_monitor
+from verenigingen.utils.sepa_mandate_service import invalidate_mandate_cache_for_mandates
 from verenigingen.utils.sepa_xml_enhanced_generator import SEPASequenceType
 
 
@@ -99,61 +100,96 @@ class SEPAMandateLifecycleManager:
         Returns:
             MandateValidationResult with sequence type recommendation
         """
+        return self.determine_sequence_types([mandate_id], transaction_context)[mandate_id]
+
+    @performance_monitor(threshold_ms=1000)
+    def determine_sequence_types(
+        self, mandate_ids: List[str], transaction_context: Dict[str, Any] = None
+    ) -> Dict[str, MandateValidationResult]:
+        """
+        Determine appropriate SEPA sequence types for several mandates
+
+        Mandate details and usage history are each read with a single query for all
+        mandates; the sequence types are derived from them in memory.
+
+        Args:
+            mandate_ids: SEPA mandate IDs
+            transaction_context: Additional context (member, amount, etc.), applied to all mandates
+
+        Returns:
+            Dict of mandate ID to MandateValidationResult with sequence type recommendation
+        """
         try:
-            # Get mandate information
-            mandate = self._get_mandate_info(mandate_id)
+            mandates = self._get_mandate_infos(mandate_ids)
+            usage_summaries = self._get_mandate_usage_summaries(
+                [mandate["name"] for mandate in mandates.values()]
+            )
+        except Exception as e:
+            frappe.logger().error(f"Error determining sequence types for {len(mandate_ids)} mandates: {e}")
+            error = f"System error: {str(e)}"
+            return {mandate_id: self._failed_validation_result(error) for mandate_id in mandate_ids}
+
+        results = {}
+        for mandate_id in mandate_ids:
+            mandate = mandates.get(mandate_id)
             if not mandate:
-                return MandateValidationResult(
-                    is_valid=False,
-                    recommended_sequence_type=None,
-                    usage_type=MandateUsageType.NEVER_USED,
-                    last_usage_date=None,
-                    usage_count=0,
-                    warnings=[],
-                    errors=[f"Mandate not found: {mandate_id}"],
-                    next_allowed_sequence_types=[],
+                results[mandate_id] = self._failed_validation_result(f"Mandate not found: {mandate_id}")
+                continue
+
+            try:
+                results[mandate_id] = self._build_validation_result(
+                    mandate, usage_summaries.get(mandate["name"]), transaction_context
                 )
+            except Exception as e:
+                frappe.logger().error(f"Error determining sequence type for mandate {mandate_id}: {str(e)}")
+                results[mandate_id] = self._failed_validation_result(f"System error: {str(e)}")
 
-            # Get usage history
-            usage_history = self._get_mandate_usage_history(mandate_id)
+        return results
 
-            # Validate mandate status and age
-            validation_issues = self._validate_mandate_basic_requirements(mandate)
+    def _build_validation_result(
+        self,
+        mandate: Dict[str, Any],
+        usage: Optional[Dict[str, Any]],
+        transaction_context: Dict[str, Any] = None,
+    ) -> MandateValidationResult:
+        """Build the sequence type recommendation for a mandate from its usage summary"""
+        # Validate mandate status and age
+        validation_issues = self._validate_mandate_basic_requirements(mandate)
 
-            # Determine usage type and sequence
-            usage_type, recommended_sequence = self._analyze_mandate_usage(
-                mandate, usage_history, transaction_context
-            )
+        # Determine usage type and sequence
+        usage_type, recommended_sequence = self._analyze_mandate_usage(mandate, usage, transaction_context)
 
-            # Get next allowed sequence types
-            next_allowed = self._get_next_allowed_sequence_types(usage_type, recommended_sequence)
-
-            # Check for warnings
-            warnings = self._generate_mandate_warnings(mandate, usage_history, usage_type)
-
-            return MandateValidationResult(
-                is_valid=len(validation_issues) == 0,
-                recommended_sequence_type=recommended_sequence,
-                usage_type=usage_type,
-                last_usage_date=usage_history[-1].usage_date if usage_history else None,
-                usage_count=len(usage_history),
-                warnings=warnings,
-                errors=validation_issues,
-                next_allowed_sequence_types=next_allowed,
-            )
+        # Get next allowed sequence types
+        next_allowed = self._get_next_allowed_sequence_types(usage_type, recommended_sequence)
 
-        except Exception as e:
-            frappe.logger().error(f"Error determining sequence type for mandate {mandate_id}: {str(e)}")
-            return MandateValidationResult(
-                is_valid=False,
-                recommended_sequence_type=None,
-                usage_type=MandateUsageType.NEVER_USED,
-                last_usage_date=None,
-                usage_count=0,
-                warnings=[],
-                errors=[f"System error: {str(e)}"],
-                next_allowed_sequence_types=[],
-            )
+        # Check for warnings
+        warnings = self._generate_mandate_warnings(mandate, usage, usage_type)
+
+        return MandateValidationResult(
+            is_valid=len(validation_issues) == 0,
+            recommended_sequence_type=recommended_sequence,
+            usage_type=usage_type,
+            last_usage_date=getdate(usage["last_collected_date"])
+            if usage and usage.get("last_collected_date")
+            else None,
+            usage_count=usage.get("collected_count") or 0 if usage else 0,
+            warnings=warnings,
+            errors=validation_issues,
+            next_allowed_sequence_types=next_allowed,
+        )
+
+    def _failed_validation_result(self, error: str) -> MandateValidationResult:
+        """Validation result for a mandate whose sequence type could not be determined"""
+        return MandateValidationResult(
+            is_valid=False,
+            recommended_sequence_type=None,
+            usage_type=MandateUsageType.NEVER_USED,
+            last_usage_date=None,
+            usage_count=0,
+            warnings=[],
+            errors=[error],
+            next_allowed_sequence_types=[],
+        )
 
     def _get_mandate_info(self, mandate_id: str) -> Optional[Dict[str, Any]]:
         """Get mandate information from database"""
@@ -168,6 +204,7 @@ class SEPAMandateLifecycleManager:
                     "sign_date",
                     "first_collection_date",
                     "expiry_date",
+                    "cancelled_date",
                     "member",
                     "iban",
                     "bic",
@@ -182,6 +219,42 @@ class SEPAMandateLifecycleManager:
             frappe.logger().error(f"Error fetching mandate {mandate_id}: {str(e)}")
             return None
 
+    def _get_mandate_infos(self, mandate_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Get information for several mandates from database, keyed by mandate ID"""
+        if not mandate_ids:
+            return {}
+
+        mandates = {}
+        for mandate in frappe.get_all(
+            "SEPA Mandate",
+            filters={"mandate_id": ["in", list(set(mandate_ids))]},
+            fields=[
+                "name",
+                "mandate_id",
+                "status",
+                "sign_date",
+                "first_collection_date",
+                "expiry_date",
+                "cancelled_date",
+                "member",
+                "iban",
+                "bic",
+                "mandate_type",
+                "creation",
+                "modified",
+            ],
+        ):
+            mandates.setdefault(mandate.mandate_id, mandate)
+        return mandates
+
+    def _get_mandate_usage_summaries(self, mandate_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Get aggregated usage history for several mandates, keyed by mandate name"""
+        from verenigingen.verenigingen.doctype.sepa_mandate_usage.sepa_mandate_usage import (
+            get_mandate_usage_summaries,
+        )
+
+        return get_mandate_usage_summaries(mandate_names)
+
     def _get_mandate_usage_history(self, mandate_id: str) -> List[MandateUsageRecord]:
         """Get complete usage history for a mandate"""
         try:
@@ -259,55 +332,49 @@ class SEPAMandateLifecycleManager:
     def _analyze_mandate_usage(
         self,
         mandate: Dict[str, Any],
-        usage_history: List[MandateUsageRecord],
+        usage: Optional[Dict[str, Any]],
         transaction_context: Dict[str, Any] = None,
     ) -> Tuple[MandateUsageType, SEPASequenceType]:
-        """Analyze mandate usage to determine sequence type"""
+        """Analyze mandate usage summary to determine sequence type"""
+        usage_count = usage.get("collected_count") or 0 if usage else 0
 
         # Check for explicit mandate type (OOFF mandates)
-        mandate_type = mandate.get("mandate_type", "").upper()
+        mandate_type = (mandate.get("mandate_type") or "").upper()
         if mandate_type == "OOFF":
-            if usage_history:
+            if usage_count:
                 return MandateUsageType.EXPIRED_USE, SEPASequenceType.OOFF
             else:
                 return MandateUsageType.FIRST_USE, SEPASequenceType.OOFF
 
         # Check transaction context for one-off indication
         if transaction_context and transaction_context.get("is_one_off"):
-            if usage_history:
+            if usage_count:
                 return MandateUsageType.EXPIRED_USE, SEPASequenceType.OOFF
             else:
                 return MandateUsageType.FIRST_USE, SEPASequenceType.OOFF
 
-        # Check for final usage indication
-        if transaction_context and transaction_context.get("is_final"):
-            if usage_history:
-                return MandateUsageType.FINAL_USE, SEPASequenceType.FNAL
-            else:
-                return MandateUsageType.FIRST_USE, SEPASequenceType.FRST
-
-        # Standard recurring mandate logic
-        if not usage_history:
-            # Never used - first transaction
-            return MandateUsageType.FIRST_USE, SEPASequenceType.FRST
+        from verenigingen.verenigingen.doctype.sepa_mandate_usage.sepa_mandate_usage import (
+            get_sequence_type_from_usage,
+            is_final_collection,
+        )
 
-        # Check last usage date for recurring validation
-        last_usage = usage_history[-1]
-        last_usage_date = last_usage.usage_date
-        today_date = getdate(today())
+        # Recurring mandates follow the same sequence rules as the batch checks, with the
+        # final collection derived from the mandate's expiry and cancellation
+        is_final = bool(transaction_context and transaction_context.get("is_final"))
+        sequence_type = get_sequence_type_from_usage(
+            usage, is_final=is_final or is_final_collection(mandate)
+        )["sequence_type"]
 
-        # If last usage was FNAL, mandate should not be used again
-        if last_usage.sequence_type == SEPASequenceType.FNAL:
-            return MandateUsageType.EXPIRED_USE, SEPASequenceType.RCUR
+        if not sequence_type:
+            # A FNAL collection was made, the mandate must not be used again
+            return MandateUsageType.EXPIRED_USE, None
 
-        # Check if mandate has been used recently (within 36 months)
-        months_since_last_use = (today_date.year - last_usage_date.year) * 12 + (
-            today_date.month - last_usage_date.month
-        )
+        if sequence_type == "FRST":
+            # Never used, renewed or lapsed - a new sequence starts
+            return MandateUsageType.FIRST_USE, SEPASequenceType.FRST
 
-        if months_since_last_use > self.mandate_validity_months:
-            # Mandate expired due to non-use
-            return MandateUsageType.EXPIRED_USE, SEPASequenceType.FRST
+        if sequence_type == "FNAL":
+            return MandateUsageType.FINAL_USE, SEPASequenceType.FNAL
 
         # Regular recurring usage
         return MandateUsageType.RECURRING_USE, SEPASequenceType.RCUR
@@ -338,7 +405,7 @@ class SEPAMandateLifecycleManager:
         return []
 
     def _generate_mandate_warnings(
-        self, mandate: Dict[str, Any], usage_history: List[MandateUsageRecord], usage_type: MandateUsageType
+        self, mandate: Dict[str, Any], usage: Optional[Dict[str, Any]], usage_type: MandateUsageType
     ) -> List[str]:
         """Generate warnings for mandate usage"""
         warnings = []
@@ -354,17 +421,24 @@ class SEPAMandateLifecycleManager:
                 warnings.append(f"Mandate is {months_old} months old - consider renewal")
 
         # Usage pattern warnings
-        if usage_history:
-            last_usage = usage_history[-1]
-            days_since_last = (getdate(today()) - last_usage.usage_date).days
+        if usage and usage.get("last_collected_date"):
+            last_usage_date = getdate(usage["last_collected_date"])
+            days_since_last = (getdate(today()) - last_usage_date).days
 
             if days_since_last > 365:  # More than a year
                 warnings.append(f"Mandate not used for {days_since_last} days - validate with debtor")
 
             # Check for unusual usage patterns
-            if len(usage_history) > 50:  # Very frequent usage
+            if (usage.get("collected_count") or 0) > 50:  # Very frequent usage
                 warnings.append("High frequency mandate usage - monitor for potential issues")
 
+        # Failed collection warnings
+        if usage and usage.get("last_failed_date"):
+            last_failed_date = getdate(usage["last_failed_date"])
+            last_collected_date = usage.get("last_collected_date")
+            if not last_collected_date or last_failed_date > getdate(last_collected_date):
+                warnings.append(f"Last collection on {last_failed_date} failed - check debtor account")
+
         # Expiry warnings
         if mandate.get("expiry_date"):
             expiry_date = getdate(mandate["expiry_date"])
@@ -405,6 +479,7 @@ class SEPAMandateLifecycleManager:
                 # Mark FNAL mandate as completed
                 frappe.db.set_value("SEPA Mandate", {"mandate_id": mandate_id}, "status", "Completed")
 
+            invalidate_mandate_cache_for_mandates(mandate_id, fieldname="mandate_id")
             frappe.db.commit()
             return True
 
@@ -779,8 +854,7 @@ def bulk_validate_mandates(mandate_ids: str) -> Dict[str, Any]:
             "warnings_count": 0,
         }
 
-        for mandate_id in mandate_list:
-            result = manager.determine_sequence_type(mandate_id)
+        for mandate_id, result in manager.determine_sequence_types(mandate_list).items():
 
             results[mandate_id] = {
                 "is_valid": result.is_valid,
@@ -9,33 +9,53 @@ import frappe
 from frappe.utils import getdate, today
 
 
+# Redis key prefix for cached active mandates, one key per member
+MANDATE_CACHE_PREFIX = "sepa_mandate_service:active_mandate:"
+
+# Seconds a cached mandate lookup stays valid; updates and deletes invalidate earlier
+MANDATE_CACHE_TTL = 900
+
+# Redis counters for mandate cache hits and misses, shared by all processes
+MANDATE_CACHE_HITS_KEY = "sepa_mandate_service:cache_hits"
+MANDATE_CACHE_MISSES_KEY = "sepa_mandate_service:cache_misses"
+
+# Cached marker for members without an active mandate, so misses are cached too
+NO_ACTIVE_MANDATE = "__no_active_mandate__"
+
+
 class SEPAMandateService:
     """Centralized service for SEPA mandate operations with caching and batch processing"""
 
     def __init__(self):
-        self._mandate_cache = {}
         self._sequence_cache = {}
 
     def get_active_mandate_batch(self, member_names: List[str]) -> Dict[str, Optional[Dict]]:
         """
         Get active SEPA mandates for multiple members in a single query
         Returns dict with member_name as key and mandate info as value
+
+        Results are cached in Redis for all processes (batch creation, reconciliation,
+        batch UI, monitoring) until they expire or the member's mandate changes.
         """
         if not member_names:
             return {}
 
         # Check cache first
-        cached_results = {}
+        cache = frappe.cache()
+        results = {}
         uncached_members = []
 
-        for member in member_names:
-            if member in self._mandate_cache:
-                cached_results[member] = self._mandate_cache[member]
-            else:
+        for member in dict.fromkeys(member_names):
+            cached = cache.get_value(_get_mandate_cache_key(member))
+            if cached is None:
                 uncached_members.append(member)
+            else:
+                results[member] = None if cached == NO_ACTIVE_MANDATE else cached
+
+        _record_cache_lookups(hits=len(results), misses=len(uncached_members))
 
         if not uncached_members:
-            return cached_results
+            return results
 
         # Batch query for uncached members
         mandates = frappe.db.sql(
@@ -55,22 +75,23 @@ class SEPAMandateService:
                 AND sm.status = 'Active'
             ORDER BY sm.member, sm.creation DESC
         """,
-            {"members": uncached_members, "today": today()},
+            {"members": uncached_members},
             as_dict=True,
         )
 
-        # Process results and cache
-        results = cached_results.copy()
+        # Group by member in one pass; rows are ordered newest first per member
+        mandates_by_member = {}
+        for mandate in mandates:
+            mandates_by_member.setdefault(mandate.member, mandate)
 
+        # Cache the results (even if None)
         for member in uncached_members:
-            member_mandate = None
-            for mandate in mandates:
-                if mandate.member == member:
-                    member_mandate = mandate
-                    break
-
-            # Cache the result (even if None)
-            self._mandate_cache[member] = member_mandate
+            member_mandate = mandates_by_member.get(member)
+            cache.set_value(
+                _get_mandate_cache_key(member),
+                member_mandate or NO_ACTIVE_MANDATE,
+                expires_in_sec=MANDATE_CACHE_TTL,
+            )
             results[member] = member_mandate
 
         return results
@@ -89,46 +110,59 @@ class SEPAMandateService:
             return {}
 
         # Check cache first
-        cached_results = {}
+        results = {}
         uncached_pairs = []
 
         for mandate_name, invoice_name in mandate_invoice_pairs:
             cache_key = f"{mandate_name}:{invoice_name}"
             if cache_key in self._sequence_cache:
-                cached_results[cache_key] = self._sequence_cache[cache_key]
+                results[cache_key] = self._sequence_cache[cache_key]
             else:
                 uncached_pairs.append((mandate_name, invoice_name))
 
-        if not uncached_pairs:
-            return cached_results
+        for cache_key, sequence_info in self.get_sequence_info_batch(uncached_pairs).items():
+            results[cache_key] = sequence_info["sequence_type"]
+
+        return results
+
+    def get_sequence_info_batch(self, mandate_invoice_pairs: List[Tuple[str, str]]) -> Dict[str, Dict]:
+        """
+        Determine sequence types with their reasoning for multiple mandate-invoice pairs
+
+        The usage history of all mandates is aggregated in a single query and the
+        sequence types are derived from it in memory. Results always reflect the
+        current usage history and refresh the sequence type cache.
+
+        Returns dict with 'mandate_name:invoice_name' as key and a dict with
+        sequence_type and reason as value
+        """
+        if not mandate_invoice_pairs:
+            return {}
 
         # Import here to avoid circular imports
         from verenigingen.verenigingen.doctype.sepa_mandate_usage.sepa_mandate_usage import (
-            get_mandate_sequence_type,
+            get_mandate_sequence_types,
         )
 
-        # Batch process uncached pairs
-        results = cached_results.copy()
-
-        for mandate_name, invoice_name in uncached_pairs:
-            try:
-                sequence_info = get_mandate_sequence_type(mandate_name, invoice_name)
-                sequence_type = sequence_info["sequence_type"]
-
-                cache_key = f"{mandate_name}:{invoice_name}"
-                self._sequence_cache[cache_key] = sequence_type
-                results[cache_key] = sequence_type
+        try:
+            sequence_types = get_mandate_sequence_types(mandate_invoice_pairs)
+        except Exception as e:
+            # Log error and fall back for the whole batch
+            frappe.log_error(
+                f"Error determining sequence types for {len(mandate_invoice_pairs)} invoices: {str(e)}",
+                "SEPA Mandate Service - Sequence Type Error",
+            )
+            # Default to RCUR for safety
+            sequence_types = {
+                pair: {"sequence_type": "RCUR", "reason": f"Error occurred, defaulting to RCUR: {str(e)}"}
+                for pair in mandate_invoice_pairs
+            }
 
-            except Exception as e:
-                # Log error but continue processing
-                frappe.log_error(
-                    f"Error determining sequence type for mandate {mandate_name}, invoice {invoice_name}: {str(e)}",
-                    "SEPA Mandate Service - Sequence Type Error",
-                )
-                # Default to RCUR for safety
-                cache_key = f"{mandate_name}:{invoice_name}"
-                self._sequence_cache[cache_key] = "RCUR"
-                results[cache_key] = "RCUR"
+        results = {}
+        for (mandate_name, invoice_name), sequence_info in sequence_types.items():
+            cache_key = f"{mandate_name}:{invoice_name}"
+            self._sequence_cache[cache_key] = sequence_info["sequence_type"]
+            results[cache_key] = sequence_info
 
         return results
 
@@ -258,19 +292,82 @@ class SEPAMandateService:
 
     def clear_cache(self):
         """Clear the mandate and sequence type caches"""
-        self._mandate_cache.clear()
+        frappe.cache().delete_keys(MANDATE_CACHE_PREFIX)
         self._sequence_cache.clear()
         frappe.logger().info("SEPA Mandate Service cache cleared")
 
     def get_cache_stats(self) -> Dict:
         """Get cache statistics for monitoring"""
+        cache = frappe.cache()
+        mandate_cache_size = len(cache.get_keys(MANDATE_CACHE_PREFIX))
+        hits = _get_cache_counter(MANDATE_CACHE_HITS_KEY)
+        misses = _get_cache_counter(MANDATE_CACHE_MISSES_KEY)
+
         return {
-            "mandate_cache_size": len(self._mandate_cache),
+            "mandate_cache_size": mandate_cache_size,
             "sequence_cache_size": len(self._sequence_cache),
-            "total_cached_items": len(self._mandate_cache) + len(self._sequence_cache),
+            "total_cached_items": mandate_cache_size + len(self._sequence_cache),
+            "mandate_cache_hits": hits,
+            "mandate_cache_misses": misses,
+            "mandate_cache_hit_rate": round(hits / (hits + misses) * 100, 2) if hits + misses else 0,
+            "mandate_cache_ttl": MANDATE_CACHE_TTL,
         }
 
 
+def _get_mandate_cache_key(member_name: str) -> str:
+    return f"{MANDATE_CACHE_PREFIX}{member_name}"
+
+
+def _record_cache_lookups(hits: int, misses: int):
+    """Add mandate cache hits and misses to the shared counters"""
+    cache = frappe.cache()
+    try:
+        if hits:
+            cache.incrby(cache.make_key(MANDATE_CACHE_HITS_KEY), hits)
+        if misses:
+            cache.incrby(cache.make_key(MANDATE_CACHE_MISSES_KEY), misses)
+    except Exception:
+        # Statistics must never break mandate lookups
+        pass
+
+
+def _get_cache_counter(key: str) -> int:
+    cache = frappe.cache()
+    try:
+        return int(cache.get(cache.make_key(key)) or 0)
+    except Exception:
+        return 0
+
+
+def invalidate_mandate_cache(member_names):
+    """Drop cached active mandate lookups for the given member(s)"""
+    if isinstance(member_names, str):
+        member_names = [member_names]
+
+    cache = frappe.cache()
+    for member in member_names:
+        if member:
+            cache.delete_value(_get_mandate_cache_key(member))
+
+
+def invalidate_mandate_cache_for_mandates(mandates, fieldname="name"):
+    """
+    Drop cached active mandate lookups for the members of the given mandate(s), for writes
+    that bypass the SEPA Mandate document hooks
+
+    Args:
+        mandates: SEPA Mandate names, or values of `fieldname` such as mandate_id
+        fieldname: SEPA Mandate field the given values refer to
+    """
+    if isinstance(mandates, str):
+        mandates = [mandates]
+    if not mandates:
+        return
+
+    members = frappe.get_all("SEPA Mandate", filters={fieldname: ["in", list(mandates)]}, pluck="member")
+    invalidate_mandate_cache(members)
+
+
 # Global service instance
 _sepa_service = None
 
@@ -8,7 +8,9 @@ Implements Week 3 Day 1-2 requirements from the SEPA billing improvements projec
 """
 
 import hashlib
+import json
 import random
+import threading
 import time
 from contextlib import contextmanager
 from dataclasses import dataclass
@@ -17,7 +19,7 @@ from typing import Any, Dict, List, Optional, Set, Tuple
 
 import frappe
 from frappe import _
-from frappe.utils import add_seconds, get_datetime, now
+from frappe.utils import get_datetime, now
 
 from verenigingen.utils.error_handling import SEPAError, handle_api_error, log_error
 from verenigingen.utils.performance_utils import performance_monitor
@@ -34,14 +36,241 @@ class LockInfo:
     expires_at: datetime
     lock_type: str
     metadata: Dict[str, Any]
+    fencing_token: int = 0
+
+
+class SEPALockBackend:
+    """
+    Lock store used by SEPADistributedLock
+
+    Backends keep one lock record per resource and hand out a fencing token from a
+    per-resource counter each time a lock is acquired. Tokens only ever increase, so a
+    holder whose lock expired can be recognised by a newer token.
+    """
+
+    # Whether the store expires locks itself; others hold a lock until it is released
+    supports_expiry = True
+
+    def try_acquire(
+        self, resource: str, record: Dict[str, Any], ttl_ms: int, wait_ms: int = 0
+    ) -> Optional[int]:
+        """Store the lock record if the resource is free; returns the fencing token or None"""
+        raise NotImplementedError
+
+    def release(self, resource: str, lock_id: str) -> bool:
+        """Remove the lock if it is still held with this lock ID"""
+        raise NotImplementedError
+
+    def get_lock(self, resource: str) -> Optional[Dict[str, Any]]:
+        """Current lock record of a resource, or None when it is free"""
+        raise NotImplementedError
+
+    def force_release(self, resource: str) -> bool:
+        """Remove the lock regardless of its holder"""
+        raise NotImplementedError
+
+
+class RedisLockBackend(SEPALockBackend):
+    """Locks in Frappe's Redis cache using SET NX PX, released with a compare-and-delete script"""
+
+    RELEASE_SCRIPT = """
+        local value = redis.call("get", KEYS[1])
+        if value and cjson.decode(value)["lock_id"] == ARGV[1] then
+            return redis.call("del", KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache or frappe.cache()
+
+    def _lock_key(self, resource: str):
+        return self.cache.make_key(f"sepa_lock:{resource}")
+
+    def _fence_key(self, resource: str):
+        return self.cache.make_key(f"sepa_lock_fence:{resource}")
+
+    def try_acquire(
+        self, resource: str, record: Dict[str, Any], ttl_ms: int, wait_ms: int = 0
+    ) -> Optional[int]:
+        if not self.cache.set(self._lock_key(resource), json.dumps(record, default=str), nx=True, px=ttl_ms):
+            return None
+
+        # Only the holder increments the counter, so tokens follow the order of acquisition
+        return int(self.cache.incr(self._fence_key(resource)))
+
+    def release(self, resource: str, lock_id: str) -> bool:
+        return bool(self.cache.eval(self.RELEASE_SCRIPT, 1, self._lock_key(resource), lock_id))
+
+    def get_lock(self, resource: str) -> Optional[Dict[str, Any]]:
+        value = self.cache.get(self._lock_key(resource))
+        if not value:
+            return None
+
+        record = json.loads(value)
+        record["fencing_token"] = int(self.cache.get(self._fence_key(resource)) or 0)
+        return record
+
+    def force_release(self, resource: str) -> bool:
+        return bool(self.cache.delete(self._lock_key(resource)))
+
+
+class MariaDBLockBackend(SEPALockBackend):
+    """
+    Locks with MariaDB GET_LOCK, for sites without Redis
+
+    GET_LOCK waits on the server instead of polling and the lock is held by the
+    database connection until it is released or the connection closes, so lock
+    timeouts do not apply. Fencing tokens come from the naming series table.
+    """
+
+    supports_expiry = False
+
+    def __init__(self):
+        self._records = {}
+
+    def _lock_name(self, resource: str) -> str:
+        # Lock names are limited to 64 characters
+        return f"sepa_lock_{hashlib.sha1(resource.encode()).hexdigest()}"
+
+    def try_acquire(
+        self, resource: str, record: Dict[str, Any], ttl_ms: int, wait_ms: int = 0
+    ) -> Optional[int]:
+        # GET_LOCK is re-entrant within a connection
+        if resource in self._records:
+            return None
+
+        acquired = frappe.db.sql("SELECT GET_LOCK(%s, %s)", (self._lock_name(resource), wait_ms / 1000.0))
+        if not acquired or acquired[0][0] != 1:
+            return None
+
+        fencing_token = self._next_fencing_token(resource)
+        self._records[resource] = dict(record, fencing_token=fencing_token)
+        return fencing_token
+
+    def _next_fencing_token(self, resource: str) -> int:
+        series = f"SEPA-LOCK-{hashlib.sha1(resource.encode()).hexdigest()[:20]}"
+        frappe.db.sql(
+            """
+            INSERT INTO `tabSeries` (`name`, `current`) VALUES (%s, LAST_INSERT_ID(1))
+            ON DUPLICATE KEY UPDATE `current` = LAST_INSERT_ID(`current` + 1)
+        """,
+            series,
+        )
+        return int(frappe.db.sql("SELECT LAST_INSERT_ID()")[0][0])
+
+    def release(self, resource: str, lock_id: str) -> bool:
+        record = self._records.get(resource)
+        if not record or record["lock_id"] != lock_id:
+            return False
+
+        self._records.pop(resource, None)
+        released = frappe.db.sql("SELECT RELEASE_LOCK(%s)", self._lock_name(resource))
+        return bool(released and released[0][0] == 1)
+
+    def get_lock(self, resource: str) -> Optional[Dict[str, Any]]:
+        if resource in self._records:
+            return self._records[resource]
+
+        holder = frappe.db.sql("SELECT IS_USED_LOCK(%s)", self._lock_name(resource))
+        if not holder or holder[0][0] is None:
+            return None
+
+        # Held by another connection; only the connection is known
+        return {"owner": f"connection {holder[0][0]}"}
+
+    def force_release(self, resource: str) -> bool:
+        # RELEASE_LOCK only works for the connection holding the lock; a lock held by
+        # another connection is released when that connection ends or finishes its work
+        if resource in self._records:
+            self._records.pop(resource, None)
+            released = frappe.db.sql("SELECT RELEASE_LOCK(%s)", self._lock_name(resource))
+            return bool(released and released[0][0] == 1)
+
+        holder = frappe.db.sql("SELECT IS_USED_LOCK(%s)", self._lock_name(resource))
+        if holder and holder[0][0] is not None:
+            frappe.logger().warning(
+                f"SEPA lock for {resource} is held by database connection {holder[0][0]} "
+                "and is released when that connection closes"
+            )
+        return False
+
+
+class InProcessLockBackend(SEPALockBackend):
+    """Locks in process memory, for tests and single-process tools"""
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks = {}
+        self._fences = {}
+
+    def try_acquire(
+        self, resource: str, record: Dict[str, Any], ttl_ms: int, wait_ms: int = 0
+    ) -> Optional[int]:
+        with self._guard:
+            current = self._locks.get(resource)
+            if current and current[0] > time.monotonic():
+                return None
+
+            fencing_token = self._fences.get(resource, 0) + 1
+            self._fences[resource] = fencing_token
+            expires = time.monotonic() + ttl_ms / 1000.0
+            self._locks[resource] = (expires, dict(record, fencing_token=fencing_token))
+            return fencing_token
+
+    def release(self, resource: str, lock_id: str) -> bool:
+        with self._guard:
+            current = self._locks.get(resource)
+            if not current or current[1]["lock_id"] != lock_id:
+                return False
+
+            del self._locks[resource]
+            return True
+
+    def get_lock(self, resource: str) -> Optional[Dict[str, Any]]:
+        with self._guard:
+            current = self._locks.get(resource)
+            if not current or current[0] <= time.monotonic():
+                return None
+            return current[1]
+
+    def force_release(self, resource: str) -> bool:
+        with self._guard:
+            return self._locks.pop(resource, None) is not None
+
+
+_lock_backend = None
+
+
+def get_lock_backend() -> SEPALockBackend:
+    """Lock backend for this process: Redis when reachable, MariaDB GET_LOCK otherwise"""
+    global _lock_backend
+
+    if _lock_backend is None:
+        try:
+            cache = frappe.cache()
+            cache.ping()
+            _lock_backend = RedisLockBackend(cache)
+        except Exception as e:
+            frappe.logger().warning(f"Redis unavailable for SEPA locks, using MariaDB GET_LOCK: {str(e)}")
+            _lock_backend = MariaDBLockBackend()
+
+    return _lock_backend
+
+
+def set_lock_backend(backend: Optional[SEPALockBackend]):
+    """Replace the lock backend, e.g. with an InProcessLockBackend in tests; None restores the default"""
+    global _lock_backend
+    _lock_backend = backend
 
 
 class SEPADistributedLock:
     """
-    Distributed locking system for SEPA operations using database-backed locks
+    Distributed locking system for SEPA operations
 
-    This system prevents race conditions in batch processing by implementing
-    Redis-style distributed locks using Frappe's database infrastructure.
+    Locks live in a pluggable backend (Redis, MariaDB GET_LOCK or in-process) and
+    every acquisition hands out a monotonically increasing fencing token, which
+    writers can use to reject work from a holder whose lock has since expired.
     """
 
     # Lock types
@@ -55,9 +284,9 @@ class SEPADistributedLock:
     ACQUISITION_TIMEOUT = 30  # 30 seconds to acquire lock
     HEARTBEAT_INTERVAL = 60  # 1 minute heartbeat
 
-    def __init__(self):
+    def __init__(self, backend: SEPALockBackend = None):
         self.session_id = self._generate_session_id()
-        self._ensure_lock_table()
+        self.backend = backend or get_lock_backend()
 
     def _generate_session_id(self) -> str:
         """Generate unique session ID for this lock instance"""
@@ -69,51 +298,6 @@ class SEPADistributedLock:
         session_data = f"{user}:{site}:{timestamp}:{random_part}"
         return hashlib.md5(session_data.encode()).hexdigest()[:16]
 
-    def _ensure_lock_table(self):
-        """Ensure distributed lock table exists"""
-        try:
-            # Check if table exists
-            exists = frappe.db.sql(
-                """
-                SELECT COUNT(*) as count
-                FROM information_schema.tables
-                WHERE table_schema = DATABASE()
-                AND table_name = 'tabSEPA_Distributed_Lock'
-            """,
-                as_dict=True,
-            )
-
-            if not exists or exists[0].count == 0:
-                # Create lock table
-                frappe.db.sql(
-                    """
-                    CREATE TABLE IF NOT EXISTS `tabSEPA_Distributed_Lock` (
-                        `name` varchar(255) NOT NULL PRIMARY KEY,
-                        `creation` datetime(6) DEFAULT NULL,
-                        `modified` datetime(6) DEFAULT NULL,
-                        `modified_by` varchar(255) DEFAULT NULL,
-                        `owner` varchar(255) DEFAULT NULL,
-                        `docstatus` int(1) NOT NULL DEFAULT 0,
-                        `lock_id` varchar(255) NOT NULL,
-                        `resource` varchar(255) NOT NULL,
-                        `lock_owner` varchar(255) NOT NULL,
-                        `acquired_at` datetime(6) NOT NULL,
-                        `expires_at` datetime(6) NOT NULL,
-                        `lock_type` varchar(100) NOT NULL,
-                        `metadata` longtext DEFAULT NULL,
-                        `is_active` tinyint(1) DEFAULT 1,
-                        INDEX `idx_resource_active` (`resource`, `is_active`),
-                        INDEX `idx_expires_at` (`expires_at`),
-                        INDEX `idx_lock_owner` (`lock_owner`)
-                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-                """
-                )
-                frappe.db.commit()
-
-        except Exception as e:
-            # Table might already exist or creation failed - continue
-            frappe.logger().warning(f"Lock table creation issue: {str(e)}")
-
     @contextmanager
     def acquire_lock(
         self, resource: str, lock_type: str = None, timeout: int = None, metadata: Dict[str, Any] = None
@@ -133,25 +317,16 @@ class SEPADistributedLock:
         Raises:
             SEPAError: If lock cannot be acquired
         """
-        lock_info = None
+        lock_info = self._acquire_lock_internal(
+            resource=resource,
+            lock_type=lock_type or self.BATCH_CREATION_LOCK,
+            timeout=timeout or self.DEFAULT_TIMEOUT,
+            metadata=metadata or {},
+        )
         try:
-            lock_info = self._acquire_lock_internal(
-                resource=resource,
-                lock_type=lock_type or self.BATCH_CREATION_LOCK,
-                timeout=timeout or self.DEFAULT_TIMEOUT,
-                metadata=metadata or {},
-            )
             yield lock_info
-
-        except Exception:
-            if lock_info:
-                # Ensure cleanup on error
-                self._release_lock_internal(lock_info.lock_id)
-            raise
-
         finally:
-            if lock_info:
-                self._release_lock_internal(lock_info.lock_id)
+            self._release_lock_internal(lock_info)
 
     def _acquire_lock_internal(
         self, resource: str, lock_type: str, timeout: int, metadata: Dict[str, Any]
@@ -175,183 +350,110 @@ class SEPADistributedLock:
         start_time = time.time()
         attempt = 0
 
-        while time.time() - start_time < self.ACQUISITION_TIMEOUT:
+        while True:
             attempt += 1
+            remaining = self.ACQUISITION_TIMEOUT - (time.time() - start_time)
+
+            acquired_at = get_datetime(now())
+            expires_at = acquired_at + timedelta(seconds=timeout)
+            record = {
+                "lock_id": lock_id,
+                "resource": resource,
+                "owner": self.session_id,
+                "acquired_at": acquired_at,
+                "expires_at": expires_at,
+                "lock_type": lock_type,
+                "metadata": metadata,
+            }
 
             try:
-                # Clean up expired locks first
-                self._cleanup_expired_locks()
-
-                # Try to acquire lock atomically
-                acquired_at = get_datetime(now())
-                expires_at = acquired_at + timedelta(seconds=timeout)
-
-                # Use INSERT ... ON DUPLICATE KEY UPDATE for atomicity
-                frappe.db.sql(
-                    """
-                    INSERT INTO `tabSEPA_Distributed_Lock`
-                    (name, creation, modified, modified_by, owner,
-                     lock_id, resource, lock_owner, acquired_at, expires_at,
-                     lock_type, metadata, is_active)
-                    VALUES (%(name)s, %(now)s, %(now)s, %(user)s, %(user)s,
-                            %(lock_id)s, %(resource)s, %(owner)s, %(acquired_at)s, %(expires_at)s,
-                            %(lock_type)s, %(metadata)s, 1)
-                    ON DUPLICATE KEY UPDATE
-                    lock_id = IF(expires_at < %(now)s OR is_active = 0,
-                                VALUES(lock_id), lock_id),
-                    lock_owner = IF(expires_at < %(now)s OR is_active = 0,
-                                   VALUES(lock_owner), lock_owner),
-                    acquired_at = IF(expires_at < %(now)s OR is_active = 0,
-                                    VALUES(acquired_at), acquired_at),
-                    expires_at = IF(expires_at < %(now)s OR is_active = 0,
-                                   VALUES(expires_at), expires_at),
-                    modified = %(now)s,
-                    is_active = IF(expires_at < %(now)s OR is_active = 0, 1, is_active)
-                """,
-                    {
-                        "name": f"SEPA_LOCK_{resource}",
-                        "now": acquired_at,
-                        "user": frappe.session.user if frappe.session else "system",
-                        "lock_id": lock_id,
-                        "resource": resource,
-                        "owner": self.session_id,
-                        "acquired_at": acquired_at,
-                        "expires_at": expires_at,
-                        "lock_type": lock_type,
-                        "metadata": frappe.as_json(metadata),
-                    },
-                )
-
-                # Check if we got the lock
-                current_lock = frappe.db.get_value(
-                    "SEPA_Distributed_Lock",
-                    f"SEPA_LOCK_{resource}",
-                    ["lock_id", "lock_owner", "acquired_at", "expires_at", "is_active"],
-                    as_dict=True,
-                )
-
-                if (
-                    current_lock
-                    and current_lock.lock_id == lock_id
-                    and current_lock.lock_owner == self.session_id
-                    and current_lock.is_active
-                ):
-                    # Successfully acquired lock
-                    frappe.db.commit()
-
-                    return LockInfo(
-                        lock_id=lock_id,
-                        resource=resource,
-                        owner=self.session_id,
-                        acquired_at=current_lock.acquired_at,
-                        expires_at=current_lock.expires_at,
-                        lock_type=lock_type,
-                        metadata=metadata,
-                    )
-
-                # Lock is held by someone else
-                if current_lock and current_lock.is_active:
-                    owner_info = current_lock.lock_owner
-                    expires_info = current_lock.expires_at
-
-                    frappe.logger().debug(
-                        f"Lock acquisition attempt {attempt} failed: "
-                        f"resource={resource}, current_owner={owner_info}, "
-                        f"expires_at={expires_info}"
-                    )
-
-                # Wait with exponential backoff
-                wait_time = min(2**attempt * 0.1, 2.0)  # Max 2 seconds
-                time.sleep(wait_time)
-
+                # Backends without expiry wait on the server for the remaining time
+                wait_ms = 0 if self.backend.supports_expiry else max(int(remaining * 1000), 0)
+                fencing_token = self.backend.try_acquire(resource, record, timeout * 1000, wait_ms=wait_ms)
             except Exception as e:
-                frappe.db.rollback()
                 frappe.logger().error(f"Lock acquisition error on attempt {attempt}: {str(e)}")
-
+                fencing_token = None
                 if attempt >= 3:  # Give up after 3 attempts on errors
                     break
 
-                time.sleep(0.5)
+            if fencing_token is not None:
+                return LockInfo(
+                    lock_id=lock_id,
+                    resource=resource,
+                    owner=self.session_id,
+                    acquired_at=acquired_at,
+                    expires_at=expires_at,
+                    lock_type=lock_type,
+                    metadata=metadata,
+                    fencing_token=fencing_token,
+                )
+
+            remaining = self.ACQUISITION_TIMEOUT - (time.time() - start_time)
+            if remaining <= 0 or not self.backend.supports_expiry:
+                break
+
+            frappe.logger().debug(f"Lock acquisition attempt {attempt} failed: resource={resource}")
+
+            # Wait with exponential backoff and jitter
+            wait_time = min(2**attempt * 0.05, 2.0, remaining) * random.uniform(0.5, 1.0)
+            time.sleep(wait_time)
 
         # Failed to acquire lock
         current_lock_info = self._get_current_lock_info(resource)
         error_msg = (
             f"Failed to acquire lock for resource '{resource}' after {attempt} attempts. "
-            f"Lock held by: {current_lock_info.get('owner', 'unknown')} "
+            f"Lock held by: {current_lock_info.get('lock_owner', 'unknown')} "
             f"since {current_lock_info.get('acquired_at', 'unknown')}"
         )
 
         raise SEPAError(_(error_msg))
 
-    def _release_lock_internal(self, lock_id: str):
+    def _release_lock_internal(self, lock_info: LockInfo):
         """
         Release distributed lock
 
         Args:
-            lock_id: Lock ID to release
+            lock_info: Lock to release
         """
         try:
-            frappe.db.sql(
-                """
-                UPDATE `tabSEPA_Distributed_Lock`
-                SET is_active = 0, modified = %s
-                WHERE lock_id = %s AND lock_owner = %s
-            """,
-                (now(), lock_id, self.session_id),
-            )
-
-            frappe.db.commit()
+            if not self.backend.release(lock_info.resource, lock_info.lock_id):
+                frappe.logger().warning(
+                    f"Lock {lock_info.lock_id} on {lock_info.resource} expired before it was released"
+                )
 
         except Exception as e:
-            frappe.logger().error(f"Error releasing lock {lock_id}: {str(e)}")
+            frappe.logger().error(f"Error releasing lock {lock_info.lock_id}: {str(e)}")
 
     def _generate_lock_id(self, resource: str, lock_type: str) -> str:
         """Generate unique lock ID"""
         timestamp = str(int(time.time() * 1000))
-        lock_data = f"{resource}:{lock_type}:{self.session_id}:{timestamp}"
+        lock_data = f"{resource}:{lock_type}:{self.session_id}:{timestamp}:{random.random()}"
         return hashlib.md5(lock_data.encode()).hexdigest()
 
-    def _cleanup_expired_locks(self):
-        """Clean up expired locks"""
-        try:
-            current_time = now()
-
-            # Mark expired locks as inactive
-            frappe.db.sql(
-                """
-                UPDATE `tabSEPA_Distributed_Lock`
-                SET is_active = 0, modified = %s
-                WHERE expires_at < %s AND is_active = 1
-            """,
-                (current_time, current_time),
-            )
-
-            # Delete very old inactive locks (older than 24 hours)
-            cleanup_time = add_seconds(current_time, -86400)  # 24 hours ago
-            frappe.db.sql(
-                """
-                DELETE FROM `tabSEPA_Distributed_Lock`
-                WHERE modified < %s AND is_active = 0
-            """,
-                (cleanup_time,),
-            )
-
-        except Exception as e:
-            frappe.logger().warning(f"Lock cleanup error: {str(e)}")
-
     def _get_current_lock_info(self, resource: str) -> Dict[str, Any]:
         """Get information about current lock on resource"""
         try:
-            lock_info = frappe.db.get_value(
-                "SEPA_Distributed_Lock",
-                f"SEPA_LOCK_{resource}",
-                ["lock_owner", "acquired_at", "expires_at", "lock_type", "is_active"],
-                as_dict=True,
-            )
-            return lock_info or {}
+            record = self.backend.get_lock(resource)
         except Exception:
             return {}
 
+        if not record:
+            return {}
+
+        return {
+            "lock_owner": record.get("owner"),
+            "acquired_at": record.get("acquired_at"),
+            "expires_at": record.get("expires_at"),
+            "lock_type": record.get("lock_type"),
+            "fencing_token": record.get("fencing_token"),
+            "is_active": 1,
+        }
+
+    def is_current_holder(self, lock_info: LockInfo) -> bool:
+        """Whether the lock is still held with this fencing token, check before writing results"""
+        current = self._get_current_lock_info(lock_info.resource)
+        return current.get("fencing_token") == lock_info.fencing_token
+
     def force_release_lock(self, resource: str, admin_override: bool = False) -> bool:
         """
         Force release a lock (admin function)
@@ -367,17 +469,7 @@ class SEPADistributedLock:
             raise SEPAError(_("Only system managers can force release locks"))
 
         try:
-            frappe.db.sql(
-                """
-                UPDATE `tabSEPA_Distributed_Lock`
-                SET is_active = 0, modified = %s
-                WHERE resource = %s AND is_active = 1
-            """,
-                (now(), resource),
-            )
-
-            frappe.db.commit()
-            return True
+            return self.backend.force_release(resource)
 
         except Exception as e:
             frappe.logger().error(f"Error force releasing lock for {resource}: {str(e)}")
@@ -436,7 +528,9 @@ class SEPABatchRaceConditionManager:
             timeout=600,  # 10 minutes for batch creation
             metadata=lock_metadata,
         ) as lock_info:
-            frappe.logger().info(f"Acquired batch creation lock: {lock_info.lock_id}")
+            frappe.logger().info(
+                f"Acquired batch creation lock: {lock_info.lock_id} (fencing token {lock_info.fencing_token})"
+            )
 
             # Execute batch creation with transaction isolation
             return self._execute_batch_creation_with_isolation(batch_data, invoice_names)
@@ -1,9 +1,249 @@
 import re
-from difflib import SequenceMatcher
 
 import frappe
 from frappe import _
-from frappe.utils import flt
+from frappe.utils import date_diff, flt, getdate
+
+from verenigingen.utils.member_name_index import MemberNameIndex
+
+# Batch reference in a transaction description
+BATCH_REFERENCE_PATTERN = r"BATCH-([A-Z0-9-]+)"
+
+# Common patterns in SEPA descriptions, in the order they are tried
+DESCRIPTION_PATTERNS = [
+    (r"INVOICE\s+([A-Z0-9-]+)", "invoice"),
+    (r"MEMBERSHIP\s+([A-Z0-9-]+)", "membership"),
+    (r"MEMBER\s+ID\s*:?\s*([A-Z0-9-]+)", "member"),
+    (r"MANDATE\s*:?\s*([A-Z0-9-]+)", "mandate"),
+]
+
+# Days a collection may be booked before or after the batch date
+BATCH_DATE_TOLERANCE_DAYS = 7
+
+# Name match candidates considered per transaction
+NAME_MATCH_CANDIDATES = 5
+
+# Name scores this close to the best one make a fuzzy match ambiguous
+NAME_MATCH_AMBIGUITY_MARGIN = 0.05
+
+
+def get_amount_key(amount):
+    """Amounts are compared in cents"""
+    return flt(amount, 2)
+
+
+class ReconciliationLookups:
+    """
+    Database state needed to match a set of bank transactions
+
+    Everything the matching strategies consult is loaded once for all transactions and
+    kept in maps keyed the way the strategies look it up, so matching a transaction does
+    not query the database.
+    """
+
+    def __init__(self, transactions):
+        from verenigingen.utils.validation.iban_validator import normalize_iban
+
+        amounts = set()
+        ibans = set()
+        references = {match_type: set() for _pattern, match_type in DESCRIPTION_PATTERNS}
+        dates = []
+
+        for transaction in transactions:
+            if flt(transaction.get("credit")):
+                amounts.add(get_amount_key(transaction.get("credit")))
+            if transaction.get("party_iban"):
+                ibans.add(normalize_iban(transaction.get("party_iban")))
+            if transaction.get("date"):
+                dates.append(getdate(transaction.get("date")))
+
+            description = (transaction.get("description") or "").upper()
+            for pattern, match_type in DESCRIPTION_PATTERNS:
+                match = re.search(pattern, description)
+                if match:
+                    references[match_type].add(match.group(1))
+
+        # Invoices reconciled while these transactions are processed
+        self.settled_invoices = set()
+
+        self.batches_by_amount = self._load_batches(amounts)
+        self.members_by_iban = self._load_members_by_iban(ibans)
+        self.batch_rows_by_member_amount = self._load_batch_rows(
+            {member for members in self.members_by_iban.values() for member in members}, amounts, dates
+        )
+        self.invoices = self._load_invoices(references["invoice"])
+        self.invoice_by_membership = self._load_membership_invoices(references["membership"])
+        self.invoices_by_member_amount = self._load_member_invoices(references["member"])
+        self.name_index_by_amount = self._build_name_indexes(amounts)
+
+    def _load_batches(self, amounts):
+        """Direct Debit Batches by total amount"""
+        batches_by_amount = {}
+        if not amounts:
+            return batches_by_amount
+
+        for batch in frappe.db.sql(
+            """
+            SELECT name, total_amount
+            FROM `tabDirect Debit Batch`
+            WHERE total_amount IN %(amounts)s
+            AND docstatus != 2
+            ORDER BY creation
+        """,
+            {"amounts": list(amounts)},
+            as_dict=True,
+        ):
+            batches_by_amount.setdefault(get_amount_key(batch.total_amount), []).append(batch.name)
+
+        return batches_by_amount
+
+    def _load_members_by_iban(self, ibans):
+        """Members by the normalized IBAN on their record or on one of their SEPA mandates"""
+        members_by_iban = {}
+        if not ibans:
+            return members_by_iban
+
+        for row in frappe.db.sql(
+            """
+            SELECT iban_normalized, member
+            FROM `tabSEPA Mandate`
+            WHERE iban_normalized IN %(ibans)s
+            AND IFNULL(member, '') != ''
+            UNION
+            SELECT iban_normalized, name
+            FROM `tabMember`
+            WHERE iban_normalized IN %(ibans)s
+        """,
+            {"ibans": list(ibans)},
+        ):
+            members_by_iban.setdefault(row[0], set()).add(row[1])
+
+        return members_by_iban
+
+    def _load_batch_rows(self, members, amounts, dates):
+        """Collected batch rows by member and amount"""
+        rows_by_member_amount = {}
+        if not members or not amounts or not dates:
+            return rows_by_member_amount
+
+        for row in frappe.db.sql(
+            """
+            SELECT
+                ddi.parent as batch,
+                ddi.invoice,
+                ddi.amount,
+                ddi.iban,
+                ddi.member_name,
+                ddi.member,
+                ddb.batch_date
+            FROM `tabDirect Debit Batch Invoice` ddi
+            JOIN `tabDirect Debit Batch` ddb ON ddi.parent = ddb.name
+            WHERE
+                ddi.member IN %(members)s
+                AND ddi.parenttype = 'Direct Debit Batch'
+                AND ddi.amount IN %(amounts)s
+                AND ddb.status IN ('Submitted', 'Processed')
+                AND ddb.batch_date BETWEEN DATE_SUB(%(from_date)s, INTERVAL %(days)s DAY)
+                    AND DATE_ADD(%(to_date)s, INTERVAL %(days)s DAY)
+        """,
+            {
+                "members": list(members),
+                "amounts": list(amounts),
+                "from_date": min(dates),
+                "to_date": max(dates),
+                "days": BATCH_DATE_TOLERANCE_DAYS,
+            },
+            as_dict=True,
+        ):
+            rows_by_member_amount.setdefault((row.member, get_amount_key(row.amount)), []).append(row)
+
+        return rows_by_member_amount
+
+    def _load_invoices(self, references):
+        """Sales Invoice names by their upper case name"""
+        if not references:
+            return {}
+
+        return {
+            name.upper(): name
+            for name in frappe.db.sql_list(
+                "SELECT name FROM `tabSales Invoice` WHERE name IN %(references)s",
+                {"references": list(references)},
+            )
+        }
+
+    def _load_membership_invoices(self, references):
+        """Unpaid invoice of each membership, by upper case membership name"""
+        invoice_by_membership = {}
+        if not references:
+            return invoice_by_membership
+
+        for membership, invoice in frappe.db.sql(
+            """
+            SELECT membership, name
+            FROM `tabSales Invoice`
+            WHERE membership IN %(references)s
+            AND status IN ('Unpaid', 'Overdue')
+        """,
+            {"references": list(references)},
+        ):
+            invoice_by_membership.setdefault(membership.upper(), invoice)
+
+        return invoice_by_membership
+
+    def _load_member_invoices(self, references):
+        """Unpaid invoices by upper case member name and amount, latest due date first"""
+        invoices_by_member_amount = {}
+        if not references:
+            return invoices_by_member_amount
+
+        for row in frappe.db.sql(
+            """
+            SELECT ms.member, si.name, si.outstanding_amount
+            FROM `tabSales Invoice` si
+            JOIN `tabMembership` ms ON si.membership = ms.name
+            WHERE
+                ms.member IN %(references)s
+                AND si.status IN ('Unpaid', 'Overdue')
+            ORDER BY si.due_date DESC
+        """,
+            {"references": list(references)},
+            as_dict=True,
+        ):
+            key = (row.member.upper(), get_amount_key(row.outstanding_amount))
+            invoices_by_member_amount.setdefault(key, []).append(row.name)
+
+        return invoices_by_member_amount
+
+    def _build_name_indexes(self, amounts):
+        """Name index over the members with an unpaid invoice, per outstanding amount"""
+        candidates_by_amount = {}
+        if not amounts:
+            return {}
+
+        for row in frappe.db.sql(
+            """
+            SELECT DISTINCT
+                m.name as member_id,
+                m.full_name,
+                si.name as invoice,
+                si.outstanding_amount
+            FROM `tabMember` m
+            JOIN `tabMembership` ms ON ms.member = m.name
+            JOIN `tabSales Invoice` si ON si.membership = ms.name
+            WHERE
+                si.outstanding_amount IN %(amounts)s
+                AND si.status IN ('Unpaid', 'Overdue')
+        """,
+            {"amounts": list(amounts)},
+            as_dict=True,
+        ):
+            candidates_by_amount.setdefault(get_amount_key(row.outstanding_amount), []).append(row)
+
+        return {amount: MemberNameIndex(rows) for amount, rows in candidates_by_amount.items()}
+
+    def is_open(self, invoice):
+        return invoice not in self.settled_invoices
 
 
 class SEPAReconciliationManager:
@@ -23,10 +263,11 @@ class SEPAReconciliationManager:
         if bank_account:
             filters["bank_account"] = bank_account
 
-        if from_date:
+        if from_date and to_date:
+            filters["date"] = ["between", [from_date, to_date]]
+        elif from_date:
             filters["date"] = [">=", from_date]
-
-        if to_date:
+        elif to_date:
             filters["date"] = ["<=", to_date]
 
         transactions = frappe.get_all(
@@ -44,9 +285,12 @@ class SEPAReconciliationManager:
             ],
         )
 
+        # Load everything needed to match these transactions at once
+        lookups = ReconciliationLookups(transactions)
+
         matched_count = 0
         for transaction in transactions:
-            if self.match_transaction(transaction):
+            if self.match_transaction(transaction, lookups):
                 matched_count += 1
 
         return {
@@ -55,26 +299,33 @@ class SEPAReconciliationManager:
             "unmatched": len(transactions) - matched_count,
         }
 
-    def match_transaction(self, transaction):
-        """Try to match a bank transaction with SEPA payments"""
+    def match_transaction(self, transaction, lookups=None):
+        """
+        Try to match a bank transaction with SEPA payments
+
+        lookups holds the preloaded data for a set of transactions; without it the data
+        for this transaction alone is loaded.
+        """
+        if lookups is None:
+            lookups = ReconciliationLookups([transaction])
 
         # Try different matching strategies
         matches = []
 
         # Strategy 1: Match by SEPA batch reference
         if transaction.get("reference_number"):
-            batch_match = self.match_by_batch_reference(transaction)
+            batch_match = self.match_by_batch_reference(transaction, lookups)
             if batch_match:
                 matches.append(batch_match)
 
         # Strategy 2: Match by amount and IBAN
         if transaction.get("party_iban"):
-            amount_match = self.match_by_amount_and_iban(transaction)
+            amount_match = self.match_by_amount_and_iban(transaction, lookups)
             if amount_match:
                 matches.append(amount_match)
 
         # Strategy 3: Match by description patterns
-        desc_match = self.match_by_description(transaction)
+        desc_match = self.match_by_description(transaction, lookups)
         if desc_match:
             matches.append(desc_match)
 
@@ -82,28 +333,25 @@ class SEPAReconciliationManager:
         if matches:
             best_match = max(matches, key=lambda x: x["confidence"])
             if best_match["confidence"] >= self.match_threshold:
-                return self.create_reconciliation(transaction, best_match)
+                reconciled = self.create_reconciliation(transaction, best_match)
+                if reconciled and best_match["type"] != "batch":
+                    lookups.settled_invoices.add(best_match["reference"])
+                return reconciled
 
         return False
 
-    def match_by_batch_reference(self, transaction):
+    def match_by_batch_reference(self, transaction, lookups):
         """Match transaction by SEPA batch reference"""
 
         # Look for batch reference in transaction description
-        batch_pattern = r"BATCH-([A-Z0-9-]+)"
-        match = re.search(batch_pattern, transaction.get("description", ""))
+        match = re.search(BATCH_REFERENCE_PATTERN, transaction.get("description") or "")
 
         if match:
             batch_ref = match.group(1)
 
-            # Find matching batch
-            batch = frappe.db.exists("Direct Debit Batch", {"name": ["like", f"%{batch_ref}%"]})
-
-            if batch:
-                batch_doc = frappe.get_doc("Direct Debit Batch", batch)
-
-                # Verify amount matches
-                if flt(transaction["credit"]) == flt(batch_doc.total_amount):
+            # Find a batch with this reference and the transaction amount
+            for batch in lookups.batches_by_amount.get(get_amount_key(transaction["credit"]), []):
+                if batch_ref in batch:
                     return {
                         "type": "batch",
                         "reference": batch,
@@ -113,35 +361,25 @@ class SEPAReconciliationManager:
 
         return None
 
-    def match_by_amount_and_iban(self, transaction):
+    def match_by_amount_and_iban(self, transaction, lookups):
         """Match transaction by amount and IBAN"""
+        from verenigingen.utils.validation.iban_validator import normalize_iban
 
         amount = flt(transaction.get("credit", 0))
-        iban = transaction.get("party_iban", "").replace(" ", "").upper()
+        iban = normalize_iban(transaction.get("party_iban"))
 
         if not amount or not iban:
             return None
 
-        # Find invoices with matching amount and IBAN
-        matching_invoices = frappe.db.sql(
-            """
-            SELECT
-                ddi.parent as batch,
-                ddi.invoice,
-                ddi.amount,
-                ddi.iban,
-                ddi.member_name
-            FROM `tabDirect Debit Invoice` ddi
-            JOIN `tabDirect Debit Batch` ddb ON ddi.parent = ddb.name
-            WHERE
-                ddi.amount = %s
-                AND REPLACE(UPPER(ddi.iban), ' ', '') = %s
-                AND ddb.status IN ('Submitted', 'Processed')
-                AND ddb.batch_date BETWEEN DATE_SUB(%s, INTERVAL 7 DAY) AND DATE_ADD(%s, INTERVAL 7 DAY)
-        """,
-            (amount, iban, transaction["date"], transaction["date"]),
-            as_dict=True,
-        )
+        # Find invoices with matching amount collected from the members using this IBAN
+        matching_invoices = []
+        for member in sorted(lookups.members_by_iban.get(iban, ())):
+            for row in lookups.batch_rows_by_member_amount.get((member, get_amount_key(amount)), []):
+                if (
+                    abs(date_diff(row.batch_date, transaction["date"])) <= BATCH_DATE_TOLERANCE_DAYS
+                    and lookups.is_open(row.invoice)
+                ):
+                    matching_invoices.append(row)
 
         if matching_invoices:
             # If single match, high confidence
@@ -164,52 +402,45 @@ class SEPAReconciliationManager:
 
         return None
 
-    def match_by_description(self, transaction):
+    def match_by_description(self, transaction, lookups):
         """Match transaction by description patterns"""
 
-        description = transaction.get("description", "").upper()
+        description = (transaction.get("description") or "").upper()
+        amount = get_amount_key(transaction["credit"])
 
-        # Common patterns in SEPA descriptions
-        patterns = [
-            (r"INVOICE\s+([A-Z0-9-]+)", "invoice"),
-            (r"MEMBERSHIP\s+([A-Z0-9-]+)", "membership"),
-            (r"MEMBER\s+ID\s*:?\s*([A-Z0-9-]+)", "member"),
-            (r"MANDATE\s*:?\s*([A-Z0-9-]+)", "mandate"),
-        ]
-
-        for pattern, match_type in patterns:
+        for pattern, match_type in DESCRIPTION_PATTERNS:
             match = re.search(pattern, description)
             if match:
                 reference = match.group(1)
 
                 if match_type == "invoice":
-                    if frappe.db.exists("Sales Invoice", reference):
+                    invoice = lookups.invoices.get(reference)
+                    if invoice and lookups.is_open(invoice):
                         return {
                             "type": "invoice",
-                            "reference": reference,
+                            "reference": invoice,
                             "confidence": 0.9,
                             "match_reason": "Invoice number found in description",
                         }
 
                 elif match_type == "membership":
-                    if frappe.db.exists("Membership", reference):
-                        # Get related invoice
-                        invoice = frappe.db.get_value(
-                            "Sales Invoice",
-                            {"membership": reference, "status": ["in", ["Unpaid", "Overdue"]]},
-                            "name",
-                        )
-                        if invoice:
-                            return {
-                                "type": "invoice",
-                                "reference": invoice,
-                                "confidence": 0.85,
-                                "match_reason": f"Membership {reference} found in description",
-                            }
+                    # Get related invoice
+                    invoice = lookups.invoice_by_membership.get(reference)
+                    if invoice and lookups.is_open(invoice):
+                        return {
+                            "type": "invoice",
+                            "reference": invoice,
+                            "confidence": 0.85,
+                            "match_reason": f"Membership {reference} found in description",
+                        }
 
                 elif match_type == "member":
                     # Find unpaid invoices for member
-                    member_invoices = self.get_member_unpaid_invoices(reference, transaction["credit"])
+                    member_invoices = [
+                        invoice
+                        for invoice in lookups.invoices_by_member_amount.get((reference, amount), [])
+                        if lookups.is_open(invoice)
+                    ]
                     if member_invoices:
                         return {
                             "type": "member",
@@ -219,66 +450,44 @@ class SEPAReconciliationManager:
                         }
 
         # Fuzzy matching on member names
-        return self.fuzzy_match_member_name(description, transaction["credit"])
+        return self.fuzzy_match_member_name(description, transaction["credit"], lookups)
 
-    def fuzzy_match_member_name(self, description, amount):
+    def fuzzy_match_member_name(self, description, amount, lookups):
         """Try to match based on member name in description"""
 
-        # Get members with unpaid invoices of matching amount
-        members_with_invoices = frappe.db.sql(
-            """
-            SELECT DISTINCT
-                m.name as member_id,
-                m.full_name,
-                si.name as invoice
-            FROM `tabMember` m
-            JOIN `tabMembership` ms ON ms.member = m.name
-            JOIN `tabSales Invoice` si ON si.membership = ms.name
-            WHERE
-                si.outstanding_amount = %s
-                AND si.status IN ('Unpaid', 'Overdue')
-        """,
-            (amount,),
-            as_dict=True,
-        )
-
-        best_match = None
-        best_score = 0
-
-        for member in members_with_invoices:
-            # Calculate similarity between member name and description
-            score = SequenceMatcher(None, member["full_name"].upper(), description).ratio()
+        # Members with unpaid invoices of matching amount
+        name_index = lookups.name_index_by_amount.get(get_amount_key(amount))
+        if not name_index:
+            return None
 
-            if score > best_score and score > 0.6:  # At least 60% match
-                best_score = score
-                best_match = member
+        # Candidates come best first; names are compared without diacritics and tussenvoegsels
+        candidates = [
+            (score, member)
+            for score, member in name_index.search(description, limit=NAME_MATCH_CANDIDATES)
+            if score > 0.6 and lookups.is_open(member["invoice"])  # At least 60% match
+        ]
+        if not candidates:
+            return None
 
-        if best_match:
+        best_score, best_match = candidates[0]
+        close_matches = [
+            member for score, member in candidates if score >= best_score - NAME_MATCH_AMBIGUITY_MARGIN
+        ]
+        if len(close_matches) > 1:
+            # Members sharing a name cannot be told apart, leave them for manual review
             return {
-                "type": "invoice",
-                "reference": best_match["invoice"],
-                "confidence": best_score * 0.9,  # Reduce confidence for fuzzy matches
-                "match_reason": f'Name match: {best_match["full_name"]} (score: {best_score:.2f})',
+                "type": "multiple",
+                "matches": close_matches,
+                "confidence": 0.7,
+                "match_reason": f'Multiple members match name {best_match["full_name"]}',
             }
 
-        return None
-
-    def get_member_unpaid_invoices(self, member_id, amount):
-        """Get unpaid invoices for a member with matching amount"""
-
-        return frappe.db.sql_list(
-            """
-            SELECT si.name
-            FROM `tabSales Invoice` si
-            JOIN `tabMembership` ms ON si.membership = ms.name
-            WHERE
-                ms.member = %s
-                AND si.outstanding_amount = %s
-                AND si.status IN ('Unpaid', 'Overdue')
-            ORDER BY si.due_date DESC
-        """,
-            (member_id, amount),
-        )
+        return {
+            "type": "invoice",
+            "reference": best_match["invoice"],
+            "confidence": best_score * 0.9,  # Reduce confidence for fuzzy matches
+            "match_reason": f'Name match: {best_match["full_name"]} (score: {best_score:.2f})',
+        }
 
     def create_reconciliation(self, transaction, match):
         """Create reconciliation entry for matched transaction"""
@@ -20,6 +20,7 @@ from frappe.utils import add_days, getdate, now, today
 
 from verenigingen.utils.error_handling import SEPAError, handle_api_error, log_error
 from verenigingen.utils.performance_utils import performance_monitor
+from verenigingen.utils.sepa_mandate_service import invalidate_mandate_cache_for_mandates
 
 
 class RollbackReason(Enum):
@@ -593,6 +594,7 @@ class SEPARollbackManager:
                 except Exception as e:
                     errors.append(f"Failed to rollback mandate usage for {mandate_ref}: {str(e)}")
 
+            invalidate_mandate_cache_for_mandates(updated_mandates, fieldname="mandate_id")
             frappe.db.commit()
 
             return {"success": len(errors) == 0, "updated_mandates": updated_mandates, "errors": errors}
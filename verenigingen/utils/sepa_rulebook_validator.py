@@ -13,9 +13,9 @@ Implements Week 3 Day 3-4 requirements from the SEPA billing improvements projec
 import io
 import re
 import xml.etree.ElementTree as ET
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import date, datetime, timedelta
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 from enum import Enum
 from typing import Any, Dict, List, Optional, Tuple
 
@@ -27,6 +27,14 @@ from frappe.utils import add_days, getdate, today
 from verenigingen.utils.error_handling import SEPAError, ValidationError, handle_api_error
 from verenigingen.utils.sepa_xml_enhanced_generator import SEPALocalInstrument, SEPASequenceType
 
+SEPA_NAMESPACE = "urn:iso:std:iso:20022:tech:xsd:pain.008.001.02"
+
+# Element path for rules evaluated once the whole document has been read
+DOCUMENT_SCOPE = "/"
+
+# Stop validating once this many critical/error issues have been found
+DEFAULT_MAX_ERRORS = 1000
+
 
 class SEPARuleType(Enum):
     """Types of SEPA rules"""
@@ -57,6 +65,7 @@ class SEPARule:
     xpath: Optional[str] = None
     validator_function: Optional[str] = None
     countries: Optional[List[str]] = None
+    element_paths: Optional[List[str]] = None  # Dispatch paths for the streaming pass, defaults to xpath
 
 
 @dataclass
@@ -71,6 +80,73 @@ class ValidationIssue:
     suggested_fix: Optional[str] = None
 
 
+@dataclass
+class SEPAValidationContext:
+    """State collected during a single streaming pass over a SEPA document"""
+
+    path: Tuple[str, ...] = ()
+    creation_datetime: Optional[str] = None
+    declared_transaction_count: Optional[str] = None
+    declared_control_sum: Optional[str] = None
+    transaction_count: int = 0
+    control_sum: Decimal = Decimal("0")
+    has_invalid_amounts: bool = False
+    end_to_end_ids: set = field(default_factory=set)
+    duplicate_end_to_end_ids: Dict[str, None] = field(default_factory=dict)
+    payment_info: Dict[str, Any] = field(default_factory=dict)
+    checked_values: Dict[str, set] = field(default_factory=dict)
+
+    @property
+    def xpath(self) -> str:
+        """XPath of the element path currently being dispatched"""
+        return ".//" + "/".join(f"sepa:{tag}" for tag in self.path)
+
+    def start_element(self, tag: str):
+        """Reset per payment information state when a new block opens"""
+        if tag == "PmtInf":
+            self.payment_info = {"transactions": 0}
+
+    def collect(self, path: List[str], elem: ET.Element):
+        """Record the values aggregate rules need once the element is complete"""
+        tag = path[-1]
+        parent = path[-2] if len(path) > 1 else None
+
+        if tag == "DrctDbtTxInf":
+            self.transaction_count += 1
+            self.payment_info["transactions"] = self.payment_info.get("transactions", 0) + 1
+        elif tag == "InstdAmt" and parent == "DrctDbtTxInf":
+            try:
+                self.control_sum += Decimal(elem.text)
+            except (InvalidOperation, TypeError):
+                self.has_invalid_amounts = True
+        elif tag == "EndToEndId" and parent == "PmtId" and elem.text:
+            if elem.text in self.end_to_end_ids:
+                self.duplicate_end_to_end_ids[elem.text] = None
+            else:
+                self.end_to_end_ids.add(elem.text)
+        elif parent == "GrpHdr":
+            if tag == "CreDtTm":
+                self.creation_datetime = elem.text
+            elif tag == "NbOfTxs":
+                self.declared_transaction_count = elem.text
+            elif tag == "CtrlSum":
+                self.declared_control_sum = elem.text
+        elif tag == "ReqdColltnDt" and parent == "PmtInf":
+            self.payment_info["collection_date"] = elem.text
+        elif tag == "Cd" and parent == "LclInstrm":
+            self.payment_info["local_instrument"] = elem.text
+        elif tag == "SeqTp" and parent == "PmtTpInf":
+            self.payment_info["sequence_type"] = elem.text
+
+    def is_new_value(self, rule: SEPARule, value: Optional[str]) -> bool:
+        """Whether the rule has not yet checked this value in the current document"""
+        checked = self.checked_values.setdefault(rule.rule_id, set())
+        if value in checked:
+            return False
+        checked.add(value)
+        return True
+
+
 class SEPARulebookValidator:
     """
     Comprehensive SEPA rulebook validator
@@ -82,10 +158,12 @@ class SEPARulebookValidator:
     - Country-specific requirements (focus on Netherlands)
     """
 
-    def __init__(self):
-        self.namespace = {"sepa": "urn:iso:std:iso:20022:tech:xsd:pain.008.001.02"}
+    def __init__(self, max_errors: Optional[int] = DEFAULT_MAX_ERRORS):
+        self.namespace = {"sepa": SEPA_NAMESPACE}
         self.rules = self._initialize_sepa_rules()
+        self.max_errors = max_errors
         self.validation_cache = {}
+        self._compiled_rules = {}
 
     def _initialize_sepa_rules(self) -> List[SEPARule]:
         """Initialize SEPA rulebook rules"""
@@ -114,6 +192,7 @@ class SEPARulebookValidator:
                 description="Number of transactions must match actual count",
                 xpath="//sepa:GrpHdr/sepa:NbOfTxs",
                 validator_function="validate_transaction_count",
+                element_paths=[DOCUMENT_SCOPE],
             ),
             SEPARule(
                 rule_id="MSG004",
@@ -122,6 +201,7 @@ class SEPARulebookValidator:
                 description="Control sum must match sum of all transaction amounts",
                 xpath="//sepa:GrpHdr/sepa:CtrlSum",
                 validator_function="validate_control_sum",
+                element_paths=[DOCUMENT_SCOPE],
             ),
             # Payment Information Rules
             SEPARule(
@@ -131,6 +211,7 @@ class SEPARulebookValidator:
                 description="Collection date must be at least 5 business days from creation (CORE)",
                 xpath="//sepa:PmtInf/sepa:ReqdColltnDt",
                 validator_function="validate_collection_date_timing",
+                element_paths=["PmtInf"],
             ),
             SEPARule(
                 rule_id="PMT002",
@@ -138,6 +219,7 @@ class SEPARulebookValidator:
                 severity=ValidationSeverity.CRITICAL,
                 description="All transactions in payment info must have same sequence type",
                 validator_function="validate_sequence_type_consistency",
+                element_paths=["PmtInf"],
             ),
             SEPARule(
                 rule_id="PMT003",
@@ -145,6 +227,7 @@ class SEPARulebookValidator:
                 severity=ValidationSeverity.CRITICAL,
                 description="Maximum 10,000 transactions per payment information",
                 validator_function="validate_transaction_limit",
+                element_paths=["PmtInf"],
             ),
             # Creditor Rules
             SEPARule(
@@ -170,6 +253,7 @@ class SEPARulebookValidator:
                 severity=ValidationSeverity.CRITICAL,
                 description="FRST transactions require new mandates or first usage",
                 validator_function="validate_frst_mandate_usage",
+                element_paths=["PmtTpInf/SeqTp"],
             ),
             SEPARule(
                 rule_id="MND002",
@@ -177,6 +261,7 @@ class SEPARulebookValidator:
                 severity=ValidationSeverity.CRITICAL,
                 description="RCUR transactions require previously used mandates",
                 validator_function="validate_rcur_mandate_usage",
+                element_paths=["PmtTpInf/SeqTp"],
             ),
             SEPARule(
                 rule_id="MND003",
@@ -184,6 +269,7 @@ class SEPARulebookValidator:
                 severity=ValidationSeverity.CRITICAL,
                 description="OOFF transactions invalidate mandate after use",
                 validator_function="validate_ooff_mandate_usage",
+                element_paths=["PmtTpInf/SeqTp"],
             ),
             SEPARule(
                 rule_id="MND004",
@@ -191,6 +277,7 @@ class SEPARulebookValidator:
                 severity=ValidationSeverity.CRITICAL,
                 description="FNAL transactions are final usage of mandate",
                 validator_function="validate_fnal_mandate_usage",
+                element_paths=["PmtTpInf/SeqTp"],
             ),
             SEPARule(
                 rule_id="MND005",
@@ -198,6 +285,7 @@ class SEPARulebookValidator:
                 severity=ValidationSeverity.ERROR,
                 description="Mandate signature date must not be more than 36 months old",
                 validator_function="validate_mandate_age",
+                element_paths=["MndtRltdInf/DtOfSgntr"],
             ),
             # Transaction Rules
             SEPARule(
@@ -214,6 +302,7 @@ class SEPARulebookValidator:
                 severity=ValidationSeverity.CRITICAL,
                 description="End-to-end ID must be unique within message",
                 validator_function="validate_end_to_end_id_uniqueness",
+                element_paths=[DOCUMENT_SCOPE],
             ),
             SEPARule(
                 rule_id="TXN003",
@@ -230,6 +319,7 @@ class SEPARulebookValidator:
                 severity=ValidationSeverity.ERROR,
                 description="All text fields must use SEPA character set",
                 validator_function="validate_character_set",
+                element_paths=["InitgPty/Nm", "Cdtr/Nm", "Dbtr/Nm", "RmtInf/Ustrd"],
             ),
             # Netherlands-specific Rules
             SEPARule(
@@ -239,6 +329,7 @@ class SEPARulebookValidator:
                 description="Dutch IBANs should use proper bank codes",
                 countries=["NL"],
                 validator_function="validate_dutch_iban_format",
+                element_paths=["IBAN"],
             ),
             SEPARule(
                 rule_id="NL002",
@@ -247,39 +338,28 @@ class SEPARulebookValidator:
                 description="Consider Dutch holidays for collection dates",
                 countries=["NL"],
                 validator_function="validate_dutch_business_days",
+                element_paths=["ReqdColltnDt"],
             ),
         ]
 
-    def validate_sepa_xml(self, xml_content: str, country: str = "NL") -> Dict[str, Any]:
+    def validate_sepa_xml(self, xml_content, country: str = "NL") -> Dict[str, Any]:
         """
         Comprehensive SEPA XML validation against rulebook
 
+        The rulebook is compiled into a dispatch table keyed by element path and
+        evaluated in a single streaming pass, so large files are validated without
+        building the full tree. Validation stops once max_errors critical/error
+        issues have been found.
+
         Args:
-            xml_content: SEPA XML content to validate
+            xml_content: SEPA XML content to validate (string, bytes or file object)
             country: Country code for country-specific rules
 
         Returns:
             Validation result with issues and compliance score
         """
         try:
-            # Parse XML
-            root = ET.fromstring(xml_content)
-
-            # Run all applicable rules
-            issues = []
-
-            for rule in self.rules:
-                # Skip country-specific rules if not applicable
-                if (
-                    rule.rule_type == SEPARuleType.COUNTRY_SPECIFIC
-                    and rule.countries
-                    and country not in rule.countries
-                ):
-                    continue
-
-                # Run rule validation
-                rule_issues = self._validate_rule(rule, root, xml_content)
-                issues.extend(rule_issues)
+            issues, truncated = self._stream_validate(xml_content, country)
 
             # Calculate compliance metrics
             compliance_metrics = self._calculate_compliance_metrics(issues)
@@ -310,6 +390,7 @@ class SEPARulebookValidator:
                     }
                     for issue in issues
                 ],
+                "truncated": truncated,
                 "recommendations": recommendations,
                 "validation_summary": self._generate_validation_summary(issues),
             }
@@ -332,130 +413,196 @@ class SEPARulebookValidator:
                 "error": str(e),
             }
 
-    def _validate_rule(self, rule: SEPARule, root: ET.Element, xml_content: str) -> List[ValidationIssue]:
-        """Validate a specific SEPA rule"""
+    def _compile_rules(self, country: str) -> Dict[str, List[Tuple[Tuple[str, ...], SEPARule, Any]]]:
+        """
+        Compile the applicable rules into a dispatch table
+
+        The table is keyed by the local name of the last element in each rule path,
+        so elements no rule cares about cost a single dict lookup.
+        """
+        if country in self._compiled_rules:
+            return self._compiled_rules[country]
+
+        dispatch = {}
+
+        for rule in self.rules:
+            # Skip country-specific rules if not applicable
+            if (
+                rule.rule_type == SEPARuleType.COUNTRY_SPECIFIC
+                and rule.countries
+                and country not in rule.countries
+            ):
+                continue
+
+            handler = getattr(self, rule.validator_function, None) if rule.validator_function else None
+            if not handler:
+                continue
+
+            if rule.element_paths:
+                paths = rule.element_paths
+            elif rule.xpath:
+                paths = ["/".join(step.split(":")[-1] for step in rule.xpath.lstrip("/").split("/"))]
+            else:
+                continue
+
+            for path in paths:
+                steps = () if path == DOCUMENT_SCOPE else tuple(path.split("/"))
+                dispatch.setdefault(steps[-1] if steps else DOCUMENT_SCOPE, []).append((steps, rule, handler))
+
+        self._compiled_rules[country] = dispatch
+        return dispatch
+
+    def _stream_validate(self, xml_content, country: str) -> Tuple[List[ValidationIssue], bool]:
+        """Evaluate the compiled rulebook in one iterparse pass with element clearing"""
+        dispatch = self._compile_rules(country)
+        ctx = SEPAValidationContext()
         issues = []
+        error_count = 0
+        failed_rules = set()
+        namespace_prefix = "{" + SEPA_NAMESPACE + "}"
+        path = []
+        elements = []
+
+        if isinstance(xml_content, str):
+            source = io.BytesIO(xml_content.encode("utf-8"))
+        elif isinstance(xml_content, bytes):
+            source = io.BytesIO(xml_content)
+        else:
+            source = xml_content
+
+        def run(entries, elem):
+            nonlocal error_count
+            for steps, rule, handler in entries:
+                if len(steps) > 1 and tuple(path[-len(steps) :]) != steps:
+                    continue
 
-        try:
-            if rule.validator_function:
-                # Call specific validator function
-                validator = getattr(self, rule.validator_function, None)
-                if validator:
-                    rule_issues = validator(rule, root, xml_content)
-                    if isinstance(rule_issues, list):
-                        issues.extend(rule_issues)
-                    elif rule_issues:
-                        issues.append(rule_issues)
+                ctx.path = steps
+                try:
+                    rule_issues = handler(rule, elem, ctx) or []
+                except Exception as e:
+                    # Log validation error once per rule but continue
+                    if rule.rule_id not in failed_rules:
+                        failed_rules.add(rule.rule_id)
+                        frappe.logger().warning(f"Error validating rule {rule.rule_id}: {str(e)}")
+                    continue
 
-            elif rule.xpath:
-                # Generic XPath-based validation
-                elements = root.findall(rule.xpath, self.namespace)
-                if not elements:
-                    issues.append(
-                        ValidationIssue(
-                            rule_id=rule.rule_id,
-                            severity=rule.severity,
-                            message=f"Required element not found: {rule.xpath}",
-                            xpath=rule.xpath,
-                            suggested_fix="Add the required element",
-                        )
-                    )
+                for issue in rule_issues:
+                    issues.append(issue)
+                    if issue.severity in (ValidationSeverity.CRITICAL, ValidationSeverity.ERROR):
+                        error_count += 1
 
-        except Exception as e:
-            # Log validation error but continue
-            frappe.logger().warning(f"Error validating rule {rule.rule_id}: {str(e)}")
+            return self.max_errors is not None and error_count >= self.max_errors
 
-        return issues
+        for event, elem in ET.iterparse(source, events=("start", "end")):
+            if event == "start":
+                tag = elem.tag
+                if tag.startswith(namespace_prefix):
+                    tag = tag[len(namespace_prefix) :]
+                path.append(tag)
+                elements.append(elem)
+                ctx.start_element(tag)
+                continue
+
+            ctx.collect(path, elem)
+
+            entries = dispatch.get(path[-1])
+            if entries and run(entries, elem):
+                return issues, True
+
+            # The ending element is always the last child of its parent
+            path.pop()
+            elements.pop()
+            if elements:
+                del elements[-1][-1]
+
+        entries = dispatch.get(DOCUMENT_SCOPE)
+        if entries and run(entries, None):
+            return issues, True
+
+        return issues, False
 
     # Specific validator functions
 
     def validate_message_id(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: ET.Element, ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
         """Validate message ID format and uniqueness"""
         issues = []
 
-        msg_id_elem = root.find(".//sepa:GrpHdr/sepa:MsgId", self.namespace)
-        if msg_id_elem is not None:
-            msg_id = msg_id_elem.text
+        msg_id = elem.text
 
-            # Check length
-            if not msg_id or len(msg_id) > 35:
-                issues.append(
-                    ValidationIssue(
-                        rule_id=rule.rule_id,
-                        severity=rule.severity,
-                        message="Message ID must be 1-35 characters",
-                        xpath=rule.xpath,
-                        element_value=msg_id,
-                        suggested_fix="Use a shorter, unique message ID",
-                    )
+        # Check length
+        if not msg_id or len(msg_id) > 35:
+            issues.append(
+                ValidationIssue(
+                    rule_id=rule.rule_id,
+                    severity=rule.severity,
+                    message="Message ID must be 1-35 characters",
+                    xpath=rule.xpath,
+                    element_value=msg_id,
+                    suggested_fix="Use a shorter, unique message ID",
                 )
+            )
 
-            # Check character set
-            if msg_id and not re.match(r"^[a-zA-Z0-9\+\?\-\:\(\)\.\,\'\s/]+$", msg_id):
-                issues.append(
-                    ValidationIssue(
-                        rule_id=rule.rule_id,
-                        severity=rule.severity,
-                        message="Message ID contains invalid characters",
-                        xpath=rule.xpath,
-                        element_value=msg_id,
-                        suggested_fix="Use only SEPA allowed characters",
-                    )
+        # Check character set
+        if msg_id and not re.match(r"^[a-zA-Z0-9\+\?\-\:\(\)\.\,\'\s/]+$", msg_id):
+            issues.append(
+                ValidationIssue(
+                    rule_id=rule.rule_id,
+                    severity=rule.severity,
+                    message="Message ID contains invalid characters",
+                    xpath=rule.xpath,
+                    element_value=msg_id,
+                    suggested_fix="Use only SEPA allowed characters",
                 )
+            )
 
         return issues
 
     def validate_creation_datetime(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: ET.Element, ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
         """Validate creation datetime is not in future"""
         issues = []
 
-        datetime_elem = root.find(".//sepa:GrpHdr/sepa:CreDtTm", self.namespace)
-        if datetime_elem is not None:
-            try:
-                creation_dt = datetime.fromisoformat(datetime_elem.text.replace("Z", "+00:00"))
-                if creation_dt > datetime.now():
-                    issues.append(
-                        ValidationIssue(
-                            rule_id=rule.rule_id,
-                            severity=rule.severity,
-                            message="Creation datetime cannot be in the future",
-                            xpath=rule.xpath,
-                            element_value=datetime_elem.text,
-                            suggested_fix="Use current or past datetime",
-                        )
-                    )
-            except ValueError:
+        try:
+            creation_dt = datetime.fromisoformat(elem.text.replace("Z", "+00:00"))
+            if creation_dt > datetime.now():
                 issues.append(
                     ValidationIssue(
                         rule_id=rule.rule_id,
                         severity=rule.severity,
-                        message="Invalid datetime format",
+                        message="Creation datetime cannot be in the future",
                         xpath=rule.xpath,
-                        element_value=datetime_elem.text,
-                        suggested_fix="Use ISO 8601 datetime format",
+                        element_value=elem.text,
+                        suggested_fix="Use current or past datetime",
                     )
                 )
+        except ValueError:
+            issues.append(
+                ValidationIssue(
+                    rule_id=rule.rule_id,
+                    severity=rule.severity,
+                    message="Invalid datetime format",
+                    xpath=rule.xpath,
+                    element_value=elem.text,
+                    suggested_fix="Use ISO 8601 datetime format",
+                )
+            )
 
         return issues
 
     def validate_transaction_count(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: Optional[ET.Element], ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
         """Validate transaction count matches actual transactions"""
         issues = []
 
         # Get declared count
-        count_elem = root.find(".//sepa:GrpHdr/sepa:NbOfTxs", self.namespace)
-        if count_elem is not None:
+        if ctx.declared_transaction_count is not None:
             try:
-                declared_count = int(count_elem.text)
-
-                # Count actual transactions
-                actual_count = len(root.findall(".//sepa:DrctDbtTxInf", self.namespace))
+                declared_count = int(ctx.declared_transaction_count)
+                actual_count = ctx.transaction_count
 
                 if declared_count != actual_count:
                     issues.append(
@@ -464,7 +611,7 @@ class SEPARulebookValidator:
                             severity=rule.severity,
                             message=f"Transaction count mismatch: declared {declared_count}, actual {actual_count}",
                             xpath=rule.xpath,
-                            element_value=count_elem.text,
+                            element_value=ctx.declared_transaction_count,
                             suggested_fix=f"Update count to {actual_count}",
                         )
                     )
@@ -475,7 +622,7 @@ class SEPARulebookValidator:
                         severity=rule.severity,
                         message="Invalid transaction count format",
                         xpath=rule.xpath,
-                        element_value=count_elem.text,
+                        element_value=ctx.declared_transaction_count,
                         suggested_fix="Use integer format",
                     )
                 )
@@ -483,20 +630,16 @@ class SEPARulebookValidator:
         return issues
 
     def validate_control_sum(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: Optional[ET.Element], ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
         """Validate control sum matches sum of transaction amounts"""
         issues = []
 
-        # Get declared control sum
-        sum_elem = root.find(".//sepa:GrpHdr/sepa:CtrlSum", self.namespace)
-        if sum_elem is not None:
+        # Invalid transaction amounts are reported by the amount rule
+        if ctx.declared_control_sum is not None and not ctx.has_invalid_amounts:
             try:
-                declared_sum = Decimal(sum_elem.text)
-
-                # Calculate actual sum
-                amount_elems = root.findall(".//sepa:DrctDbtTxInf/sepa:InstdAmt", self.namespace)
-                actual_sum = sum(Decimal(elem.text) for elem in amount_elems)
+                declared_sum = Decimal(ctx.declared_control_sum)
+                actual_sum = ctx.control_sum
 
                 if abs(declared_sum - actual_sum) > Decimal("0.01"):  # Allow 1 cent difference
                     issues.append(
@@ -505,18 +648,18 @@ class SEPARulebookValidator:
                             severity=rule.severity,
                             message=f"Control sum mismatch: declared {declared_sum}, actual {actual_sum}",
                             xpath=rule.xpath,
-                            element_value=sum_elem.text,
+                            element_value=ctx.declared_control_sum,
                             suggested_fix=f"Update control sum to {actual_sum:.2f}",
                         )
                     )
-            except (ValueError, TypeError):
+            except (InvalidOperation, ValueError, TypeError):
                 issues.append(
                     ValidationIssue(
                         rule_id=rule.rule_id,
                         severity=rule.severity,
                         message="Invalid control sum format",
                         xpath=rule.xpath,
-                        element_value=sum_elem.text,
+                        element_value=ctx.declared_control_sum,
                         suggested_fix="Use decimal format with 2 decimal places",
                     )
                 )
@@ -524,336 +667,288 @@ class SEPARulebookValidator:
         return issues
 
     def validate_collection_date_timing(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: ET.Element, ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
-        """Validate collection date timing requirements"""
+        """Validate collection date timing requirements of a payment info block"""
         issues = []
 
-        # Get creation date
-        creation_elem = root.find(".//sepa:GrpHdr/sepa:CreDtTm", self.namespace)
+        collection_text = ctx.payment_info.get("collection_date")
 
-        # Check each payment info
-        for pmt_inf in root.findall(".//sepa:PmtInf", self.namespace):
-            collection_elem = pmt_inf.find("sepa:ReqdColltnDt", self.namespace)
-            local_instr_elem = pmt_inf.find(".//sepa:LclInstrm/sepa:Cd", self.namespace)
+        if collection_text is not None and ctx.creation_datetime is not None:
+            try:
+                creation_date = datetime.fromisoformat(ctx.creation_datetime.replace("Z", "+00:00")).date()
+                collection_date = datetime.fromisoformat(collection_text).date()
 
-            if collection_elem is not None and creation_elem is not None:
-                try:
-                    creation_date = datetime.fromisoformat(creation_elem.text.replace("Z", "+00:00")).date()
-                    collection_date = datetime.fromisoformat(collection_elem.text).date()
-
-                    # Determine minimum lead time based on local instrument
-                    local_instrument = local_instr_elem.text if local_instr_elem is not None else "CORE"
-
-                    if local_instrument == "CORE":
-                        min_lead_days = 5  # 5 business days for CORE
-                    elif local_instrument == "COR1":
-                        min_lead_days = 1  # 1 business day for COR1
-                    elif local_instrument == "B2B":
-                        min_lead_days = 1  # 1 business day for B2B
-                    else:
-                        min_lead_days = 5  # Default to CORE
-
-                    # Calculate business days (simplified - just skip weekends)
-                    days_between = (collection_date - creation_date).days
-
-                    if days_between < min_lead_days:
-                        issues.append(
-                            ValidationIssue(
-                                rule_id=rule.rule_id,
-                                severity=rule.severity,
-                                message=f"Collection date too early: {days_between} days lead time, minimum {min_lead_days} for {local_instrument}",
-                                xpath="sepa:ReqdColltnDt",
-                                element_value=collection_elem.text,
-                                suggested_fix=f"Use collection date at least {min_lead_days} business days after creation",
-                            )
-                        )
+                # Determine minimum lead time based on local instrument
+                local_instrument = ctx.payment_info.get("local_instrument") or "CORE"
+
+                if local_instrument == "CORE":
+                    min_lead_days = 5  # 5 business days for CORE
+                elif local_instrument == "COR1":
+                    min_lead_days = 1  # 1 business day for COR1
+                elif local_instrument == "B2B":
+                    min_lead_days = 1  # 1 business day for B2B
+                else:
+                    min_lead_days = 5  # Default to CORE
+
+                # Calculate business days (simplified - just skip weekends)
+                days_between = (collection_date - creation_date).days
 
-                except ValueError:
+                if days_between < min_lead_days:
                     issues.append(
                         ValidationIssue(
                             rule_id=rule.rule_id,
-                            severity=ValidationSeverity.ERROR,
-                            message="Invalid date format in collection date or creation date",
+                            severity=rule.severity,
+                            message=f"Collection date too early: {days_between} days lead time, minimum {min_lead_days} for {local_instrument}",
                             xpath="sepa:ReqdColltnDt",
-                            suggested_fix="Use ISO 8601 date format",
+                            element_value=collection_text,
+                            suggested_fix=f"Use collection date at least {min_lead_days} business days after creation",
                         )
                     )
 
+            except ValueError:
+                issues.append(
+                    ValidationIssue(
+                        rule_id=rule.rule_id,
+                        severity=ValidationSeverity.ERROR,
+                        message="Invalid date format in collection date or creation date",
+                        xpath="sepa:ReqdColltnDt",
+                        suggested_fix="Use ISO 8601 date format",
+                    )
+                )
+
         return issues
 
     def validate_sequence_type_consistency(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: ET.Element, ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
         """Validate sequence type consistency within payment info"""
-        issues = []
-
-        for pmt_inf in root.findall(".//sepa:PmtInf", self.namespace):
-            pmt_seq_elem = pmt_inf.find(".//sepa:PmtTpInf/sepa:SeqTp", self.namespace)
-
-            if pmt_seq_elem is not None:
-                # Check all transactions in this payment info
-                for txn in pmt_inf.findall(".//sepa:DrctDbtTxInf", self.namespace):
-                    # For now, we assume sequence type is consistent at payment info level
-                    # In full implementation, you might check individual transaction sequence types
-                    pass
-
-        return issues
+        # pain.008.001.02 only carries the sequence type at payment info level, so all
+        # transactions in a block share it. In full implementation, you might check
+        # individual transaction sequence types
+        return []
 
     def validate_creditor_identifier(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: ET.Element, ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
         """Validate creditor identifier format"""
         issues = []
 
-        cred_id_elem = root.find(".//sepa:CdtrSchmeId/sepa:Id/sepa:PrvtId/sepa:Othr/sepa:Id", self.namespace)
-        if cred_id_elem is not None:
-            cred_id = cred_id_elem.text
+        cred_id = elem.text
 
-            # Basic format validation for Dutch creditor IDs
-            if cred_id:
-                if not cred_id.startswith("NL") or len(cred_id) != 18:
-                    issues.append(
-                        ValidationIssue(
-                            rule_id=rule.rule_id,
-                            severity=rule.severity,
-                            message="Invalid Dutch creditor ID format (should be NL + 16 digits)",
-                            xpath=rule.xpath,
-                            element_value=cred_id,
-                            suggested_fix="Use format NL + 2-letter bank code + ZZZ + 10 digits + validation digit",
-                        )
+        # Basic format validation for Dutch creditor IDs; every payment info repeats it
+        if cred_id and ctx.is_new_value(rule, cred_id):
+            if not cred_id.startswith("NL") or len(cred_id) != 18:
+                issues.append(
+                    ValidationIssue(
+                        rule_id=rule.rule_id,
+                        severity=rule.severity,
+                        message="Invalid Dutch creditor ID format (should be NL + 16 digits)",
+                        xpath=rule.xpath,
+                        element_value=cred_id,
+                        suggested_fix="Use format NL + 2-letter bank code + ZZZ + 10 digits + validation digit",
                     )
+                )
 
         return issues
 
     def validate_mandate_age(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: ET.Element, ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
         """Validate mandate is not older than 36 months"""
         issues = []
 
-        for mandate_elem in root.findall(".//sepa:MndtRltdInf", self.namespace):
-            sign_date_elem = mandate_elem.find("sepa:DtOfSgntr", self.namespace)
+        try:
+            sign_date = datetime.fromisoformat(elem.text).date()
+            today_date = date.today()
 
-            if sign_date_elem is not None:
-                try:
-                    sign_date = datetime.fromisoformat(sign_date_elem.text).date()
-                    today_date = date.today()
+            # Calculate months difference
+            months_diff = (today_date.year - sign_date.year) * 12 + (today_date.month - sign_date.month)
 
-                    # Calculate months difference
-                    months_diff = (today_date.year - sign_date.year) * 12 + (
-                        today_date.month - sign_date.month
+            if months_diff > 36:
+                issues.append(
+                    ValidationIssue(
+                        rule_id=rule.rule_id,
+                        severity=rule.severity,
+                        message=f"Mandate is {months_diff} months old (maximum 36 months)",
+                        xpath="sepa:DtOfSgntr",
+                        element_value=elem.text,
+                        suggested_fix="Obtain new mandate from debtor",
                     )
+                )
 
-                    if months_diff > 36:
-                        issues.append(
-                            ValidationIssue(
-                                rule_id=rule.rule_id,
-                                severity=rule.severity,
-                                message=f"Mandate is {months_diff} months old (maximum 36 months)",
-                                xpath="sepa:DtOfSgntr",
-                                element_value=sign_date_elem.text,
-                                suggested_fix="Obtain new mandate from debtor",
-                            )
-                        )
-
-                except ValueError:
-                    issues.append(
-                        ValidationIssue(
-                            rule_id=rule.rule_id,
-                            severity=ValidationSeverity.ERROR,
-                            message="Invalid mandate signature date format",
-                            xpath="sepa:DtOfSgntr",
-                            element_value=sign_date_elem.text,
-                            suggested_fix="Use ISO 8601 date format (YYYY-MM-DD)",
-                        )
-                    )
+        except ValueError:
+            issues.append(
+                ValidationIssue(
+                    rule_id=rule.rule_id,
+                    severity=ValidationSeverity.ERROR,
+                    message="Invalid mandate signature date format",
+                    xpath="sepa:DtOfSgntr",
+                    element_value=elem.text,
+                    suggested_fix="Use ISO 8601 date format (YYYY-MM-DD)",
+                )
+            )
 
         return issues
 
+    # SEPA character set pattern
+    SEPA_CHARACTER_PATTERN = re.compile(r"^[a-zA-Z0-9\+\?\-\:\(\)\.\,\'\s/]*$")
+
     def validate_character_set(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: ET.Element, ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
-        """Validate SEPA character set usage"""
+        """Validate SEPA character set usage in common text fields"""
         issues = []
 
-        # SEPA character set pattern
-        sepa_pattern = re.compile(r"^[a-zA-Z0-9\+\?\-\:\(\)\.\,\'\s/]*$")
-
-        # Check common text fields
-        text_fields = [
-            ".//sepa:InitgPty/sepa:Nm",
-            ".//sepa:Cdtr/sepa:Nm",
-            ".//sepa:Dbtr/sepa:Nm",
-            ".//sepa:RmtInf/sepa:Ustrd",
-        ]
-
-        for xpath in text_fields:
-            for elem in root.findall(xpath, self.namespace):
-                if elem.text and not sepa_pattern.match(elem.text):
-                    issues.append(
-                        ValidationIssue(
-                            rule_id=rule.rule_id,
-                            severity=rule.severity,
-                            message=f"Text contains non-SEPA characters: {elem.text[:50]}...",
-                            xpath=xpath,
-                            element_value=elem.text,
-                            suggested_fix="Remove or replace non-SEPA characters",
-                        )
-                    )
+        if elem.text and not self.SEPA_CHARACTER_PATTERN.match(elem.text):
+            issues.append(
+                ValidationIssue(
+                    rule_id=rule.rule_id,
+                    severity=rule.severity,
+                    message=f"Text contains non-SEPA characters: {elem.text[:50]}...",
+                    xpath=ctx.xpath,
+                    element_value=elem.text,
+                    suggested_fix="Remove or replace non-SEPA characters",
+                )
+            )
 
         return issues
 
     # Additional validator methods for other rules...
     def validate_frst_mandate_usage(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: ET.Element, ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
         """Validate FRST sequence type usage"""
         # Implementation for FRST validation
         return []
 
     def validate_rcur_mandate_usage(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: ET.Element, ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
         """Validate RCUR sequence type usage"""
         # Implementation for RCUR validation
         return []
 
     def validate_ooff_mandate_usage(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: ET.Element, ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
         """Validate OOFF sequence type usage"""
         # Implementation for OOFF validation
         return []
 
     def validate_fnal_mandate_usage(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: ET.Element, ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
         """Validate FNAL sequence type usage"""
         # Implementation for FNAL validation
         return []
 
     def validate_transaction_limit(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: ET.Element, ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
         """Validate transaction count per payment info"""
         issues = []
 
-        for pmt_inf in root.findall(".//sepa:PmtInf", self.namespace):
-            txn_count = len(pmt_inf.findall(".//sepa:DrctDbtTxInf", self.namespace))
+        txn_count = ctx.payment_info.get("transactions", 0)
 
-            if txn_count > 10000:
-                issues.append(
-                    ValidationIssue(
-                        rule_id=rule.rule_id,
-                        severity=rule.severity,
-                        message=f"Too many transactions in payment info: {txn_count} (maximum 10,000)",
-                        suggested_fix="Split into multiple payment information blocks",
-                    )
+        if txn_count > 10000:
+            issues.append(
+                ValidationIssue(
+                    rule_id=rule.rule_id,
+                    severity=rule.severity,
+                    message=f"Too many transactions in payment info: {txn_count} (maximum 10,000)",
+                    suggested_fix="Split into multiple payment information blocks",
                 )
+            )
 
         return issues
 
     def validate_creditor_iban(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: ET.Element, ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
         """Validate creditor IBAN"""
         issues = []
 
         from verenigingen.utils.validation.iban_validator import validate_iban
 
-        iban_elem = root.find(".//sepa:CdtrAcct/sepa:Id/sepa:IBAN", self.namespace)
-        if iban_elem is not None:
-            iban_result = validate_iban(iban_elem.text)
+        # Every payment info repeats the creditor account
+        if not ctx.is_new_value(rule, elem.text):
+            return issues
 
-            if not iban_result["valid"]:
-                issues.append(
-                    ValidationIssue(
-                        rule_id=rule.rule_id,
-                        severity=rule.severity,
-                        message=f"Invalid creditor IBAN: {iban_result['message']}",
-                        xpath=rule.xpath,
-                        element_value=iban_elem.text,
-                        suggested_fix="Use a valid IBAN",
-                    )
+        iban_result = validate_iban(elem.text)
+
+        if not iban_result["valid"]:
+            issues.append(
+                ValidationIssue(
+                    rule_id=rule.rule_id,
+                    severity=rule.severity,
+                    message=f"Invalid creditor IBAN: {iban_result['message']}",
+                    xpath=rule.xpath,
+                    element_value=elem.text,
+                    suggested_fix="Use a valid IBAN",
                 )
+            )
 
         return issues
 
     def validate_transaction_amount(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: ET.Element, ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
         """Validate transaction amounts"""
         issues = []
 
-        for amount_elem in root.findall(".//sepa:DrctDbtTxInf/sepa:InstdAmt", self.namespace):
-            try:
-                amount = Decimal(amount_elem.text)
+        try:
+            amount = Decimal(elem.text)
 
-                if amount < Decimal("0.01"):
-                    issues.append(
-                        ValidationIssue(
-                            rule_id=rule.rule_id,
-                            severity=rule.severity,
-                            message=f"Transaction amount too small: {amount} (minimum 0.01)",
-                            xpath=rule.xpath,
-                            element_value=amount_elem.text,
-                            suggested_fix="Use minimum amount of 0.01 EUR",
-                        )
-                    )
-                elif amount > Decimal("999999999.99"):
-                    issues.append(
-                        ValidationIssue(
-                            rule_id=rule.rule_id,
-                            severity=rule.severity,
-                            message=f"Transaction amount too large: {amount} (maximum 999,999,999.99)",
-                            xpath=rule.xpath,
-                            element_value=amount_elem.text,
-                            suggested_fix="Split into multiple smaller transactions",
-                        )
+            if amount < Decimal("0.01"):
+                issues.append(
+                    ValidationIssue(
+                        rule_id=rule.rule_id,
+                        severity=rule.severity,
+                        message=f"Transaction amount too small: {amount} (minimum 0.01)",
+                        xpath=rule.xpath,
+                        element_value=elem.text,
+                        suggested_fix="Use minimum amount of 0.01 EUR",
                     )
-
-            except (ValueError, TypeError):
+                )
+            elif amount > Decimal("999999999.99"):
                 issues.append(
                     ValidationIssue(
                         rule_id=rule.rule_id,
-                        severity=ValidationSeverity.ERROR,
-                        message="Invalid amount format",
+                        severity=rule.severity,
+                        message=f"Transaction amount too large: {amount} (maximum 999,999,999.99)",
                         xpath=rule.xpath,
-                        element_value=amount_elem.text,
-                        suggested_fix="Use decimal format with up to 2 decimal places",
+                        element_value=elem.text,
+                        suggested_fix="Split into multiple smaller transactions",
                     )
                 )
 
+        except (InvalidOperation, ValueError, TypeError):
+            issues.append(
+                ValidationIssue(
+                    rule_id=rule.rule_id,
+                    severity=ValidationSeverity.ERROR,
+                    message="Invalid amount format",
+                    xpath=rule.xpath,
+                    element_value=elem.text,
+                    suggested_fix="Use decimal format with up to 2 decimal places",
+                )
+            )
+
         return issues
 
     def validate_end_to_end_id_uniqueness(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: Optional[ET.Element], ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
         """Validate end-to-end ID uniqueness"""
         issues = []
 
-        end_to_end_ids = []
-        for elem in root.findall(".//sepa:PmtId/sepa:EndToEndId", self.namespace):
-            if elem.text:
-                end_to_end_ids.append(elem.text)
-
-        # Check for duplicates
-        seen = set()
-        duplicates = set()
-
-        for e2e_id in end_to_end_ids:
-            if e2e_id in seen:
-                duplicates.add(e2e_id)
-            else:
-                seen.add(e2e_id)
-
-        if duplicates:
+        if ctx.duplicate_end_to_end_ids:
             issues.append(
                 ValidationIssue(
                     rule_id=rule.rule_id,
                     severity=rule.severity,
-                    message=f"Duplicate end-to-end IDs found: {', '.join(duplicates)}",
+                    message=f"Duplicate end-to-end IDs found: {', '.join(ctx.duplicate_end_to_end_ids)}",
                     suggested_fix="Use unique end-to-end IDs for each transaction",
                 )
             )
@@ -861,106 +956,103 @@ class SEPARulebookValidator:
         return issues
 
     def validate_debtor_iban(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: ET.Element, ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
         """Validate debtor IBANs"""
         issues = []
 
         from verenigingen.utils.validation.iban_validator import validate_iban
 
-        for iban_elem in root.findall(".//sepa:DbtrAcct/sepa:Id/sepa:IBAN", self.namespace):
-            iban_result = validate_iban(iban_elem.text)
+        iban_result = validate_iban(elem.text)
 
-            if not iban_result["valid"]:
-                issues.append(
-                    ValidationIssue(
-                        rule_id=rule.rule_id,
-                        severity=rule.severity,
-                        message=f"Invalid debtor IBAN: {iban_result['message']}",
-                        xpath=rule.xpath,
-                        element_value=iban_elem.text,
-                        suggested_fix="Use a valid IBAN",
-                    )
+        if not iban_result["valid"]:
+            issues.append(
+                ValidationIssue(
+                    rule_id=rule.rule_id,
+                    severity=rule.severity,
+                    message=f"Invalid debtor IBAN: {iban_result['message']}",
+                    xpath=rule.xpath,
+                    element_value=elem.text,
+                    suggested_fix="Use a valid IBAN",
                 )
+            )
 
         return issues
 
+    # Dutch bank codes for validation
+    DUTCH_BANK_CODES = {"ABNA", "INGB", "RABO", "TRIO", "FVLB", "BUNQ"}
+
     def validate_dutch_iban_format(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: ET.Element, ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
         """Validate Dutch IBAN format specifics"""
         issues = []
 
-        # Dutch bank codes for validation
-        dutch_bank_codes = ["ABNA", "INGB", "RABO", "TRIO", "FVLB", "BUNQ"]
-
-        for iban_elem in root.findall(".//sepa:IBAN", self.namespace):
-            if iban_elem.text and iban_elem.text.startswith("NL"):
-                iban = iban_elem.text.replace(" ", "")
-                if len(iban) >= 8:
-                    bank_code = iban[4:8]
-                    if bank_code not in dutch_bank_codes:
-                        issues.append(
-                            ValidationIssue(
-                                rule_id=rule.rule_id,
-                                severity=rule.severity,
-                                message=f"Unknown Dutch bank code: {bank_code}",
-                                element_value=iban_elem.text,
-                                suggested_fix="Verify bank code with Dutch banking authority",
-                            )
+        if elem.text and elem.text.startswith("NL"):
+            iban = elem.text.replace(" ", "")
+            if len(iban) >= 8:
+                bank_code = iban[4:8]
+                if bank_code not in self.DUTCH_BANK_CODES:
+                    issues.append(
+                        ValidationIssue(
+                            rule_id=rule.rule_id,
+                            severity=rule.severity,
+                            message=f"Unknown Dutch bank code: {bank_code}",
+                            element_value=elem.text,
+                            suggested_fix="Verify bank code with Dutch banking authority",
                         )
+                    )
 
         return issues
 
+    # Dutch public holidays (simplified list)
+    DUTCH_HOLIDAYS = {
+        date(2025, 1, 1),  # New Year
+        date(2025, 4, 18),  # Good Friday
+        date(2025, 4, 21),  # Easter Monday
+        date(2025, 4, 27),  # King's Day
+        date(2025, 5, 5),  # Liberation Day
+        date(2025, 5, 29),  # Ascension Day
+        date(2025, 6, 9),  # Whit Monday
+        date(2025, 12, 25),  # Christmas Day
+        date(2025, 12, 26),  # Boxing Day
+    }
+
     def validate_dutch_business_days(
-        self, rule: SEPARule, root: ET.Element, xml_content: str
+        self, rule: SEPARule, elem: ET.Element, ctx: SEPAValidationContext
     ) -> List[ValidationIssue]:
         """Validate Dutch business days for collection dates"""
         issues = []
 
-        # Dutch public holidays (simplified list)
-        dutch_holidays_2025 = [
-            date(2025, 1, 1),  # New Year
-            date(2025, 4, 18),  # Good Friday
-            date(2025, 4, 21),  # Easter Monday
-            date(2025, 4, 27),  # King's Day
-            date(2025, 5, 5),  # Liberation Day
-            date(2025, 5, 29),  # Ascension Day
-            date(2025, 6, 9),  # Whit Monday
-            date(2025, 12, 25),  # Christmas Day
-            date(2025, 12, 26),  # Boxing Day
-        ]
-
-        for date_elem in root.findall(".//sepa:ReqdColltnDt", self.namespace):
-            try:
-                collection_date = datetime.fromisoformat(date_elem.text).date()
+        try:
+            collection_date = datetime.fromisoformat(elem.text).date()
 
-                # Check if weekend
-                if collection_date.weekday() >= 5:
-                    issues.append(
-                        ValidationIssue(
-                            rule_id=rule.rule_id,
-                            severity=rule.severity,
-                            message=f"Collection date falls on weekend: {collection_date}",
-                            element_value=date_elem.text,
-                            suggested_fix="Use next business day",
-                        )
+            # Check if weekend
+            if collection_date.weekday() >= 5:
+                issues.append(
+                    ValidationIssue(
+                        rule_id=rule.rule_id,
+                        severity=rule.severity,
+                        message=f"Collection date falls on weekend: {collection_date}",
+                        element_value=elem.text,
+                        suggested_fix="Use next business day",
                     )
+                )
 
-                # Check if Dutch holiday
-                if collection_date in dutch_holidays_2025:
-                    issues.append(
-                        ValidationIssue(
-                            rule_id=rule.rule_id,
-                            severity=rule.severity,
-                            message=f"Collection date is Dutch public holiday: {collection_date}",
-                            element_value=date_elem.text,
-                            suggested_fix="Use next business day",
-                        )
+            # Check if Dutch holiday
+            if collection_date in self.DUTCH_HOLIDAYS:
+                issues.append(
+                    ValidationIssue(
+                        rule_id=rule.rule_id,
+                        severity=rule.severity,
+                        message=f"Collection date is Dutch public holiday: {collection_date}",
+                        element_value=elem.text,
+                        suggested_fix="Use next business day",
                     )
+                )
 
-            except ValueError:
-                pass  # Date format already checked by other validators
+        except ValueError:
+            pass  # Date format already checked by other validators
 
         return issues
 
@@ -1047,18 +1139,21 @@ class SEPARulebookValidator:
 
 @frappe.whitelist()
 @handle_api_error
-def validate_sepa_xml_rulebook(xml_content: str, country: str = "NL") -> Dict[str, Any]:
+def validate_sepa_xml_rulebook(
+    xml_content: str, country: str = "NL", max_errors: int = DEFAULT_MAX_ERRORS
+) -> Dict[str, Any]:
     """
     API endpoint to validate SEPA XML against rulebook
 
     Args:
         xml_content: SEPA XML content
         country: Country code for country-specific validation
+        max_errors: Stop after this many critical/error issues (0 for no limit)
 
     Returns:
         Comprehensive validation result
     """
-    validator = SEPARulebookValidator()
+    validator = SEPARulebookValidator(max_errors=int(max_errors) or None)
     return validator.validate_sepa_xml(xml_content, country)
 
 
@@ -8,13 +8,17 @@ SEPA mandate types (OOFF, FRST, RCUR, FNAL).
 Implements Week 3 Day 3-4 requirements from the SEPA billing improvements project.
 """
 
+import io
 import re
+import shutil
+import tempfile
 import xml.etree.ElementTree as ET
 from dataclasses import dataclass
 from datetime import date, datetime
 from decimal import Decimal
 from enum import Enum
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+from xml.sax.saxutils import escape, quoteattr
 
 import frappe
 from frappe import _
@@ -184,24 +188,18 @@ class EnhancedSEPAXMLGenerator:
                 message_id, creation_datetime, payment_infos, initiating_party_name
             )
 
-            # Create XML structure
-            root = self._create_document_root()
-            cstmr_drct_dbt_initn = ET.SubElement(root, "CstmrDrctDbtInitn")
-
-            # Generate group header
-            self._generate_group_header(
-                cstmr_drct_dbt_initn, message_id, creation_datetime, payment_infos, initiating_party_name
-            )
-
-            # Generate payment information blocks
+            # Stream the document into memory; input is already validated above
+            buffer = io.BytesIO()
+            writer = StreamingSEPAXMLWriter(buffer, generator=self, validate=False)
+            writer.start_document(message_id, creation_datetime, initiating_party_name)
             for payment_info in payment_infos:
-                self._generate_payment_info(cstmr_drct_dbt_initn, payment_info)
+                writer.start_payment_info(payment_info)
+                for transaction in payment_info.transactions:
+                    writer.add_transaction(transaction)
+                writer.end_payment_info()
+            writer.end_document()
 
-            # Validate final XML structure
-            self._validate_xml_structure(root)
-
-            # Convert to string with proper formatting
-            xml_string = self._format_xml_output(root)
+            xml_string = buffer.getvalue().decode("utf-8")
 
             # Log generation success
             frappe.logger().info(
@@ -224,7 +222,28 @@ class EnhancedSEPAXMLGenerator:
         initiating_party_name: str,
     ):
         """Validate top-level message parameters"""
+        self._validate_message_header(message_id, creation_datetime, initiating_party_name)
+
+        # Payment infos validation
+        if not payment_infos:
+            self.validation_errors.append("At least one payment info block is required")
+
+        if len(payment_infos) > 99:  # SEPA practical limit
+            self.validation_warnings.append(
+                f"Large number of payment info blocks ({len(payment_infos)}) may cause processing issues"
+            )
+
+        # Validate each payment info
+        for i, payment_info in enumerate(payment_infos):
+            self._validate_payment_info(payment_info, i)
 
+        # Check for validation errors
+        self._raise_validation_errors()
+
+    def _validate_message_header(
+        self, message_id: str, creation_datetime: datetime, initiating_party_name: str
+    ):
+        """Validate group header parameters"""
         # Message ID validation
         if not message_id or len(message_id) > self.MAX_MESSAGE_ID_LENGTH:
             self.validation_errors.append(f"Message ID must be 1-{self.MAX_MESSAGE_ID_LENGTH} characters")
@@ -236,15 +255,6 @@ class EnhancedSEPAXMLGenerator:
         if not isinstance(creation_datetime, datetime):
             self.validation_errors.append("Creation datetime must be a datetime object")
 
-        # Payment infos validation
-        if not payment_infos:
-            self.validation_errors.append("At least one payment info block is required")
-
-        if len(payment_infos) > 99:  # SEPA practical limit
-            self.validation_warnings.append(
-                f"Large number of payment info blocks ({len(payment_infos)}) may cause processing issues"
-            )
-
         # Initiating party name validation
         if not initiating_party_name or len(initiating_party_name) > self.MAX_CREDITOR_NAME_LENGTH:
             self.validation_errors.append(
@@ -254,17 +264,34 @@ class EnhancedSEPAXMLGenerator:
         if not self.SEPA_CHAR_PATTERN.match(initiating_party_name):
             self.validation_errors.append("Initiating party name contains invalid characters")
 
-        # Validate each payment info
-        for i, payment_info in enumerate(payment_infos):
-            self._validate_payment_info(payment_info, i)
-
-        # Check for validation errors
+    def _raise_validation_errors(self):
+        """Raise a ValidationError if validation errors were collected"""
         if self.validation_errors:
             error_msg = f"SEPA validation failed: {'; '.join(self.validation_errors)}"
             raise ValidationError(_(error_msg))
 
     def _validate_payment_info(self, payment_info: SEPAPaymentInfo, index: int):
         """Validate payment information block"""
+        prefix = self._validate_payment_info_header(payment_info, index)
+
+        # Transactions validation
+        if not payment_info.transactions:
+            self.validation_errors.append(f"{prefix}: At least one transaction is required")
+
+        if len(payment_info.transactions) > 10000:  # SEPA limit
+            self.validation_errors.append(
+                f"{prefix}: Too many transactions ({len(payment_info.transactions)}, max 10,000)"
+            )
+
+        # Validate transactions
+        for j, transaction in enumerate(payment_info.transactions):
+            self._validate_transaction(transaction, f"{prefix}, Transaction {j + 1}")
+
+        # Validate sequence type consistency
+        self._validate_sequence_type_consistency(payment_info, prefix)
+
+    def _validate_payment_info_header(self, payment_info: SEPAPaymentInfo, index: int) -> str:
+        """Validate the payment information fields other than its transactions"""
         prefix = f"Payment Info {index + 1}"
 
         # Payment Info ID validation
@@ -285,21 +312,7 @@ class EnhancedSEPAXMLGenerator:
         # Creditor validation
         self._validate_creditor(payment_info.creditor, prefix)
 
-        # Transactions validation
-        if not payment_info.transactions:
-            self.validation_errors.append(f"{prefix}: At least one transaction is required")
-
-        if len(payment_info.transactions) > 10000:  # SEPA limit
-            self.validation_errors.append(
-                f"{prefix}: Too many transactions ({len(payment_info.transactions)}, max 10,000)"
-            )
-
-        # Validate transactions
-        for j, transaction in enumerate(payment_info.transactions):
-            self._validate_transaction(transaction, f"{prefix}, Transaction {j + 1}")
-
-        # Validate sequence type consistency
-        self._validate_sequence_type_consistency(payment_info, prefix)
+        return prefix
 
     def _validate_creditor(self, creditor: SEPACreditor, prefix: str):
         """Validate creditor information"""
@@ -444,7 +457,8 @@ class EnhancedSEPAXMLGenerator:
         parent: ET.Element,
         message_id: str,
         creation_datetime: datetime,
-        payment_infos: List[SEPAPaymentInfo],
+        number_of_transactions: int,
+        control_sum: Decimal,
         initiating_party_name: str,
     ) -> ET.Element:
         """Generate group header section"""
@@ -456,15 +470,11 @@ class EnhancedSEPAXMLGenerator:
         # Creation Date Time
         ET.SubElement(grp_hdr, "CreDtTm").text = creation_datetime.strftime("%Y-%m-%dT%H:%M:%S")
 
-        # Calculate totals
-        total_transactions = sum(len(pi.transactions) for pi in payment_infos)
-        total_amount = sum(sum(tx.amount for tx in pi.transactions) for pi in payment_infos)
-
         # Number of Transactions
-        ET.SubElement(grp_hdr, "NbOfTxs").text = str(total_transactions)
+        ET.SubElement(grp_hdr, "NbOfTxs").text = str(number_of_transactions)
 
         # Control Sum
-        ET.SubElement(grp_hdr, "CtrlSum").text = f"{total_amount:.2f}"
+        ET.SubElement(grp_hdr, "CtrlSum").text = f"{control_sum:.2f}"
 
         # Initiating Party
         init_pty = ET.SubElement(grp_hdr, "InitgPty")
@@ -472,8 +482,14 @@ class EnhancedSEPAXMLGenerator:
 
         return grp_hdr
 
-    def _generate_payment_info(self, parent: ET.Element, payment_info: SEPAPaymentInfo):
-        """Generate payment information block"""
+    def _generate_payment_info_header(
+        self,
+        parent: ET.Element,
+        payment_info: SEPAPaymentInfo,
+        number_of_transactions: int,
+        control_sum: Decimal,
+    ) -> ET.Element:
+        """Generate payment information block up to (not including) its transactions"""
         pmt_inf = ET.SubElement(parent, "PmtInf")
 
         # Payment Info ID
@@ -486,10 +502,9 @@ class EnhancedSEPAXMLGenerator:
         ET.SubElement(pmt_inf, "BtchBookg").text = "true" if payment_info.batch_booking else "false"
 
         # Number of Transactions
-        ET.SubElement(pmt_inf, "NbOfTxs").text = str(len(payment_info.transactions))
+        ET.SubElement(pmt_inf, "NbOfTxs").text = str(number_of_transactions)
 
         # Control Sum
-        control_sum = sum(tx.amount for tx in payment_info.transactions)
         ET.SubElement(pmt_inf, "CtrlSum").text = f"{control_sum:.2f}"
 
         # Payment Type Information
@@ -512,9 +527,7 @@ class EnhancedSEPAXMLGenerator:
         # Creditor Scheme Identification
         self._generate_creditor_scheme_id(pmt_inf, payment_info.creditor)
 
-        # Direct Debit Transaction Information
-        for transaction in payment_info.transactions:
-            self._generate_transaction_info(pmt_inf, transaction)
+        return pmt_inf
 
     def _generate_payment_type_info(self, parent: ET.Element, payment_info: SEPAPaymentInfo):
         """Generate payment type information"""
@@ -679,36 +692,257 @@ class EnhancedSEPAXMLGenerator:
             if debtor.town:
                 ET.SubElement(pstl_adr, "TwnNm").text = debtor.town
 
-    def _validate_xml_structure(self, root: ET.Element):
-        """Validate final XML structure against SEPA requirements"""
-        # This is a placeholder for comprehensive XML schema validation
-        # In a production implementation, you would validate against the actual XSD schema
-        pass
+    def get_validation_results(self) -> Dict[str, List[str]]:
+        """Get validation errors and warnings"""
+        return {"errors": self.validation_errors, "warnings": self.validation_warnings}
 
-    def _format_xml_output(self, root: ET.Element) -> str:
-        """Format XML output with proper indentation"""
-        # Convert to string
-        xml_string = ET.tostring(root, encoding="utf-8", method="xml")
 
-        # Prettify with xml.dom.minidom
-        import xml.dom.minidom
+class StreamingSEPAXMLWriter:
+    """
+    Constant-memory pain.008.001.02 writer
+
+    Writes the group header, payment information blocks and transactions to a binary
+    stream as they are added, so only one transaction is held in memory at a time.
+    The NbOfTxs and CtrlSum values of the group header and each payment information
+    block are written as fixed-width placeholders and back-patched once their totals
+    are known. Non-seekable streams are spooled through a temporary file.
+
+    Usage:
+        writer = StreamingSEPAXMLWriter(stream)
+        writer.start_document(message_id, creation_datetime, initiating_party_name)
+        writer.start_payment_info(payment_info)  # transactions of payment_info are ignored
+        for transaction in transactions:
+            writer.add_transaction(transaction)
+        writer.end_payment_info()
+        statistics = writer.end_document()
+    """
 
-        dom = xml.dom.minidom.parseString(xml_string)
-        pretty_xml = dom.toprettyxml(indent="  ", encoding="utf-8")
+    INDENT = "  "
 
-        # Clean up extra whitespace
-        lines = pretty_xml.decode("utf-8").split("\n")
-        cleaned_lines = [line for line in lines if line.strip()]
+    # Reserved widths: Max15NumericText and DecimalNumber (18 digits, 2 fraction digits)
+    NB_OF_TXS_WIDTH = 15
+    CTRL_SUM_WIDTH = 19
 
-        return "\n".join(cleaned_lines)
+    # SEPA limit on transactions per payment information block
+    MAX_TRANSACTIONS_PER_PAYMENT_INFO = 10000
 
-    def get_validation_results(self) -> Dict[str, List[str]]:
-        """Get validation errors and warnings"""
-        return {"errors": self.validation_errors, "warnings": self.validation_warnings}
+    def __init__(
+        self,
+        stream: BinaryIO,
+        generator: Optional[EnhancedSEPAXMLGenerator] = None,
+        validate: bool = True,
+    ):
+        self.generator = generator or EnhancedSEPAXMLGenerator()
+        self.validate = validate
+
+        self._target = stream
+        self._stream = stream if self._is_seekable(stream) else tempfile.TemporaryFile()
+
+        self._group_placeholders = {}
+        self._group_transactions = 0
+        self._group_control_sum = Decimal("0")
+
+        self._payment_info = None
+        self._payment_info_count = 0
+        self._payment_info_placeholders = {}
+        self._payment_info_transactions = 0
+        self._payment_info_control_sum = Decimal("0")
+
+    @staticmethod
+    def _is_seekable(stream) -> bool:
+        try:
+            return stream.seekable()
+        except (AttributeError, ValueError):
+            return False
+
+    def start_document(self, message_id: str, creation_datetime: datetime, initiating_party_name: str):
+        """Write the document opening and group header"""
+        if self.validate:
+            self.generator._validate_message_header(message_id, creation_datetime, initiating_party_name)
+            self.generator._raise_validation_errors()
+
+        root = self.generator._create_document_root()
+        self._write_line(0, '<?xml version="1.0" encoding="utf-8"?>')
+        self._write_line(0, f"<{root.tag}{self._format_attributes(root)}>")
+        self._write_line(1, "<CstmrDrctDbtInitn>")
+
+        container = ET.Element("CstmrDrctDbtInitn")
+        grp_hdr = self.generator._generate_group_header(
+            container, message_id, creation_datetime, 0, Decimal("0"), initiating_party_name
+        )
+        self._group_placeholders = self._write_element(grp_hdr, 2, reserved=("NbOfTxs", "CtrlSum"))
+
+    def start_payment_info(self, payment_info: SEPAPaymentInfo):
+        """Write the header of a payment information block"""
+        if self._payment_info is not None:
+            self.end_payment_info()
+
+        if self.validate:
+            self.generator._validate_payment_info_header(payment_info, self._payment_info_count)
+            self.generator._raise_validation_errors()
+
+        self._payment_info = payment_info
+        self._payment_info_count += 1
+        self._payment_info_transactions = 0
+        self._payment_info_control_sum = Decimal("0")
+
+        container = ET.Element("CstmrDrctDbtInitn")
+        pmt_inf = self.generator._generate_payment_info_header(container, payment_info, 0, Decimal("0"))
+
+        self._write_line(2, "<PmtInf>")
+        self._payment_info_placeholders = self._write_children(pmt_inf, 3, reserved=("NbOfTxs", "CtrlSum"))
+
+    def add_transaction(self, transaction: SEPATransaction):
+        """Write one direct debit transaction to the current payment information block"""
+        if self._payment_info is None:
+            raise SEPAError(_("start_payment_info must be called before adding transactions"))
+
+        if self.validate:
+            self._validate_transaction(transaction)
+
+        container = ET.Element("PmtInf")
+        self.generator._generate_transaction_info(container, transaction)
+        self._write_element(container[0], 3)
+
+        self._payment_info_transactions += 1
+        self._payment_info_control_sum += transaction.amount
+
+    def end_payment_info(self):
+        """Close the current payment information block and back-patch its totals"""
+        if self._payment_info is None:
+            return
+
+        if self.validate and not self._payment_info_transactions:
+            self.generator.validation_errors.append(
+                f"Payment Info {self._payment_info_count}: At least one transaction is required"
+            )
+            self.generator._raise_validation_errors()
+
+        self._write_line(2, "</PmtInf>")
+        self._patch_totals(
+            self._payment_info_placeholders, self._payment_info_transactions, self._payment_info_control_sum
+        )
+
+        self._group_transactions += self._payment_info_transactions
+        self._group_control_sum += self._payment_info_control_sum
+        self._payment_info = None
+
+    def end_document(self) -> Dict[str, Any]:
+        """Close the document, back-patch the group header totals and flush the output"""
+        self.end_payment_info()
+
+        if self.validate and not self._payment_info_count:
+            self.generator.validation_errors.append("At least one payment info block is required")
+            self.generator._raise_validation_errors()
+
+        self._write_line(1, "</CstmrDrctDbtInitn>")
+        self._write_line(0, "</Document>", newline=False)
+        self._patch_totals(self._group_placeholders, self._group_transactions, self._group_control_sum)
+
+        if self._stream is not self._target:
+            self._stream.seek(0)
+            shutil.copyfileobj(self._stream, self._target)
+            self._stream.close()
+
+        return {
+            "payment_infos": self._payment_info_count,
+            "transactions": self._group_transactions,
+            "total_amount": float(self._group_control_sum),
+        }
+
+    def _validate_transaction(self, transaction: SEPATransaction):
+        """Validate a transaction against the current payment information block"""
+        prefix = f"Payment Info {self._payment_info_count}, Transaction {self._payment_info_transactions + 1}"
+
+        if self._payment_info_transactions >= self.MAX_TRANSACTIONS_PER_PAYMENT_INFO:
+            self.generator.validation_errors.append(
+                f"{prefix}: Too many transactions (max {self.MAX_TRANSACTIONS_PER_PAYMENT_INFO:,})"
+            )
+
+        self.generator._validate_transaction(transaction, prefix)
+
+        if transaction.sequence_type != self._payment_info.sequence_type:
+            self.generator.validation_errors.append(
+                f"{prefix}: Sequence type mismatch "
+                f"(expected {self._payment_info.sequence_type.value}, got {transaction.sequence_type.value})"
+            )
+
+        self.generator._raise_validation_errors()
+
+    def _write_line(self, level: int, content: str, newline: bool = True):
+        line = f"{self.INDENT * level}{content}"
+        if newline:
+            line += "\n"
+        self._stream.write(line.encode("utf-8"))
+
+    def _write_element(self, element: ET.Element, level: int, reserved=()) -> Dict[str, Tuple[int, int, int]]:
+        """
+        Write an element subtree, one element per line.
+
+        Direct children whose tag is in `reserved` are padded to a fixed width so they can
+        be back-patched later. Returns their (offset, width, level) by tag.
+        """
+        placeholders = {}
+        attributes = self._format_attributes(element)
+
+        if len(element):
+            self._write_line(level, f"<{element.tag}{attributes}>")
+            placeholders = self._write_children(element, level + 1, reserved)
+            self._write_line(level, f"</{element.tag}>")
+        elif element.text:
+            self._write_line(level, f"<{element.tag}{attributes}>{escape(element.text)}</{element.tag}>")
+        else:
+            self._write_line(level, f"<{element.tag}{attributes}/>")
+
+        return placeholders
+
+    def _write_children(
+        self, element: ET.Element, level: int, reserved=()
+    ) -> Dict[str, Tuple[int, int, int]]:
+        """Write the children of an element, reserving space for the `reserved` tags"""
+        placeholders = {}
+        for child in element:
+            if child.tag in reserved:
+                placeholders[child.tag] = self._write_placeholder(child.tag, level)
+            else:
+                self._write_element(child, level)
+        return placeholders
+
+    def _write_placeholder(self, tag: str, level: int) -> Tuple[int, int, int]:
+        """Write a reserved total line and return its offset, width and level"""
+        value_width = self.NB_OF_TXS_WIDTH if tag == "NbOfTxs" else self.CTRL_SUM_WIDTH
+        width = len(f"{self.INDENT * level}<{tag}></{tag}>") + value_width
+
+        offset = self._stream.tell()
+        self._stream.write(f"{self.INDENT * level}<{tag}>0</{tag}>".ljust(width).encode("utf-8") + b"\n")
+        return offset, width, level
+
+    def _patch_totals(
+        self, placeholders: Dict[str, Tuple[int, int, int]], number_of_transactions: int, control_sum: Decimal
+    ):
+        """Overwrite reserved total lines in place, keeping their width"""
+        values = {"NbOfTxs": str(number_of_transactions), "CtrlSum": f"{control_sum:.2f}"}
+        end = self._stream.tell()
+
+        for tag, (offset, width, level) in placeholders.items():
+            line = f"{self.INDENT * level}<{tag}>{values[tag]}</{tag}>"
+            if len(line) > width:
+                raise SEPAError(_("{0} value {1} exceeds the reserved width").format(tag, values[tag]))
+            self._stream.seek(offset)
+            self._stream.write(line.ljust(width).encode("utf-8"))
+
+        self._stream.seek(end)
+
+    @staticmethod
+    def _format_attributes(element: ET.Element) -> str:
+        return "".join(f" {name}={quoteattr(str(value))}" for name, value in element.attrib.items())
 
 
 # Factory functions for creating SEPA objects from Frappe data
 
+# Number of batch invoice rows read per query when streaming a batch
+BATCH_ROWS_PAGE_SIZE = 1000
+
 
 def create_sepa_creditor_from_settings() -> SEPACreditor:
     """Create SEPA creditor from Verenigingen Settings"""
@@ -738,7 +972,7 @@ def create_sepa_transaction_from_invoice(
     # Create mandate
     mandate = SEPAMandate(
         mandate_id=invoice_data.get("mandate_reference", ""),
-        date_of_signature=getdate(invoice_data.get("mandate_date", today())),
+        date_of_signature=getdate(invoice_data.get("mandate_date") or today()),
     )
 
     # Create transaction
@@ -769,74 +1003,175 @@ def generate_enhanced_sepa_xml(batch_name: str) -> Dict[str, Any]:
         Generation result with XML content
     """
     try:
-        # Get batch document
-        batch = frappe.get_doc("Direct Debit Batch", batch_name)
-
-        # Create generator
-        generator = EnhancedSEPAXMLGenerator()
-
-        # Create creditor from settings
-        creditor = create_sepa_creditor_from_settings()
-
-        # Determine sequence type and local instrument
-        sequence_type = SEPASequenceType(batch.batch_type or "CORE")
-        local_instrument = SEPALocalInstrument.CORE  # Default to CORE
-
-        # Create transactions
-        transactions = []
-        for invoice_data in batch.invoices:
-            transaction = create_sepa_transaction_from_invoice(
-                {
-                    "invoice": invoice_data.invoice,
-                    "amount": invoice_data.amount,
-                    "currency": invoice_data.currency or "EUR",
-                    "member_name": invoice_data.member_name,
-                    "iban": invoice_data.iban,
-                    "bic": invoice_data.bic,
-                    "mandate_reference": invoice_data.mandate_reference,
-                },
-                sequence_type,
-            )
-            transactions.append(transaction)
-
-        # Create payment info
-        payment_info = SEPAPaymentInfo(
-            payment_info_id=f"PMT-{batch.name}",
-            payment_method="DD",
-            batch_booking=True,
-            requested_collection_date=getdate(batch.batch_date),
-            creditor=creditor,
-            local_instrument=local_instrument,
-            sequence_type=sequence_type,
-            transactions=transactions,
-        )
-
-        # Generate XML
-        xml_content = generator.generate_sepa_xml(
-            message_id=f"MSG-{batch.name}",
-            creation_datetime=datetime.now(),
-            payment_infos=[payment_info],
-            initiating_party_name=creditor.name,
-        )
-
-        # Get validation results
-        validation_results = generator.get_validation_results()
+        buffer = io.BytesIO()
+        statistics = write_batch_sepa_xml(batch_name, buffer)
 
         return {
             "success": True,
-            "xml_content": xml_content,
-            "validation_results": validation_results,
-            "statistics": {
-                "payment_infos": 1,
-                "transactions": len(transactions),
-                "total_amount": float(sum(tx.amount for tx in transactions)),
-            },
+            "xml_content": buffer.getvalue().decode("utf-8"),
+            "validation_results": statistics.pop("validation_results"),
+            "statistics": statistics,
         }
 
     except Exception as e:
         return {"success": False, "error": str(e), "xml_content": None}
 
 
+def write_batch_sepa_xml(batch_name: str, stream: BinaryIO) -> Dict[str, Any]:
+    """
+    Stream the SEPA XML of a batch to a binary stream or file.
+
+    Transactions are grouped into one payment information block per sequence type and
+    requested collection date, so FRST and RCUR collections on different dates go out
+    in a single document. Batch invoice rows are read page by page per group and
+    written as they are read, so memory use does not grow with the batch size.
+
+    Returns:
+        Statistics with payment infos, transactions, total amount, payment info groups
+        and validation results
+    """
+    batch = frappe.db.get_value(
+        "Direct Debit Batch", batch_name, ["name", "batch_type", "batch_date"], as_dict=True
+    )
+    if not batch:
+        raise SEPAError(_("Direct Debit Batch {0} not found").format(batch_name))
+
+    # Create generator and creditor from settings
+    generator = EnhancedSEPAXMLGenerator()
+    creditor = create_sepa_creditor_from_settings()
+
+    # Rows without their own sequence type follow the batch type, defaulting to recurring
+    sequence_types = {sequence_type.value for sequence_type in SEPASequenceType}
+    default_sequence_type = (
+        batch.batch_type if batch.batch_type in sequence_types else SEPASequenceType.RCUR.value
+    )
+    local_instrument = SEPALocalInstrument.B2B if batch.batch_type == "B2B" else SEPALocalInstrument.CORE
+
+    writer = StreamingSEPAXMLWriter(stream, generator=generator)
+    writer.start_document(
+        message_id=f"MSG-{batch.name}",
+        creation_datetime=datetime.now(),
+        initiating_party_name=creditor.name,
+    )
+
+    groups = []
+    payment_info_index = 0
+    for group in _get_batch_payment_groups(batch, default_sequence_type):
+        sequence_type = SEPASequenceType(group.sequence_type)
+        group_transactions = 0
+
+        for invoice_data in _iter_batch_invoice_rows(
+            batch, group.sequence_type, group.collection_date, default_sequence_type
+        ):
+            # Start a new block for each group and whenever a block reaches the SEPA limit
+            if group_transactions % StreamingSEPAXMLWriter.MAX_TRANSACTIONS_PER_PAYMENT_INFO == 0:
+                payment_info_index += 1
+                writer.start_payment_info(
+                    SEPAPaymentInfo(
+                        payment_info_id=f"PMT-{batch.name}-{payment_info_index}",
+                        payment_method="DD",
+                        batch_booking=True,
+                        requested_collection_date=getdate(group.collection_date),
+                        creditor=creditor,
+                        local_instrument=local_instrument,
+                        sequence_type=sequence_type,
+                        transactions=[],
+                    )
+                )
+
+            writer.add_transaction(create_sepa_transaction_from_invoice(invoice_data, sequence_type))
+            group_transactions += 1
+
+        groups.append(
+            {
+                "sequence_type": group.sequence_type,
+                "collection_date": str(group.collection_date),
+                "transactions": group_transactions,
+            }
+        )
+
+    statistics = writer.end_document()
+    statistics["groups"] = groups
+    statistics["validation_results"] = generator.get_validation_results()
+
+    frappe.logger().info(
+        f"SEPA XML streamed for batch {batch.name}: {statistics['transactions']} transactions "
+        f"in {statistics['payment_infos']} payment info blocks, total {statistics['total_amount']:.2f}"
+    )
+    return statistics
+
+
+def _get_batch_payment_groups(batch, default_sequence_type: str) -> List[Dict]:
+    """Get the distinct (sequence type, collection date) groups of a batch's invoice rows"""
+    return frappe.db.sql(
+        """
+        SELECT DISTINCT
+            IFNULL(NULLIF(ddi.sequence_type, ''), %(default_sequence_type)s) AS sequence_type,
+            IFNULL(ddi.collection_date, %(batch_date)s) AS collection_date
+        FROM `tabDirect Debit Batch Invoice` ddi
+        WHERE ddi.parent = %(batch)s
+        AND ddi.parenttype = 'Direct Debit Batch'
+        ORDER BY collection_date, sequence_type
+    """,
+        {"batch": batch.name, "batch_date": batch.batch_date, "default_sequence_type": default_sequence_type},
+        as_dict=True,
+    )
+
+
+def _iter_batch_invoice_rows(
+    batch,
+    sequence_type: str,
+    collection_date,
+    default_sequence_type: str,
+    page_size: int = BATCH_ROWS_PAGE_SIZE,
+) -> Iterator[Dict]:
+    """Yield the invoice rows of one payment group in order, reading one page at a time"""
+    last_idx = 0
+    while True:
+        rows = frappe.db.sql(
+            """
+            SELECT
+                ddi.idx,
+                ddi.invoice,
+                ddi.amount,
+                IFNULL(ddi.currency, 'EUR') AS currency,
+                ddi.member_name,
+                ddi.iban,
+                ddi.mandate_reference,
+                sm.bic,
+                sm.sign_date AS mandate_date
+            FROM `tabDirect Debit Batch Invoice` ddi
+            LEFT JOIN `tabSEPA Mandate` sm ON sm.name = (
+                SELECT mandate.name FROM `tabSEPA Mandate` mandate
+                WHERE mandate.mandate_id = ddi.mandate_reference
+                LIMIT 1
+            )
+            WHERE ddi.parent = %(batch)s
+            AND ddi.parenttype = 'Direct Debit Batch'
+            AND IFNULL(NULLIF(ddi.sequence_type, ''), %(default_sequence_type)s) = %(sequence_type)s
+            AND IFNULL(ddi.collection_date, %(batch_date)s) = %(collection_date)s
+            AND ddi.idx > %(last_idx)s
+            ORDER BY ddi.idx
+            LIMIT %(page_size)s
+        """,
+            {
+                "batch": batch.name,
+                "batch_date": batch.batch_date,
+                "default_sequence_type": default_sequence_type,
+                "sequence_type": sequence_type,
+                "collection_date": collection_date,
+                "last_idx": last_idx,
+                "page_size": page_size,
+            },
+            as_dict=True,
+        )
+        if not rows:
+            return
+
+        yield from rows
+        last_idx = rows[-1].idx
+
+
 @frappe.whitelist()
 @handle_api_error
 def validate_sepa_xml_compliance(xml_content: str) -> Dict[str, Any]:
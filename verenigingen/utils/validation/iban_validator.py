@@ -167,6 +167,16 @@ def generate_test_iban(bank_code="TEST", account_number=None):
     return iban
 
 
+def normalize_iban(iban):
+    """
+    IBAN without spaces in upper case, as stored in the indexed iban_normalized fields
+    """
+    if not iban:
+        return ""
+
+    return iban.replace(" ", "").upper()
+
+
 @frappe.whitelist()
 def format_iban(iban):
     """
@@ -613,6 +613,11 @@ function mark_as_processed_dialog(frm) {
                     </div>
                 `
 			},
+			{
+				fieldname: 'consolidated',
+				label: __('Post one bank entry per chunk of invoices instead of one payment entry per invoice'),
+				fieldtype: 'Check'
+			},
 			{
 				fieldname: 'confirm',
 				label: __('I confirm that the bank has processed this batch'),
@@ -624,17 +629,17 @@ function mark_as_processed_dialog(frm) {
 		primary_action(values) {
 			if (!values.confirm) return;
 
-			frappe.show_progress(__('Processing Payments'), 0, 100);
-
 			frappe.call({
 				method: 'mark_invoices_as_paid',
 				doc: frm.doc,
+				args: {
+					consolidated: values.consolidated ? 1 : 0
+				},
 				callback: function(r) {
-					frappe.hide_progress();
 					if (!r.exc && r.message) {
 						frm.reload_doc();
 						frappe.msgprint(
-							__('Successfully processed {0} payments', [r.message])
+							__('Payment posting has been queued. Progress is shown on this batch while payments are posted.')
 						);
 						dialog.hide();
 					}
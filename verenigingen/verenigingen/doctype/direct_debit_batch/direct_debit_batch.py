@@ -5,7 +5,7 @@ from datetime import datetime
 import frappe
 from frappe import _
 from frappe.model.document import Document
-from frappe.utils import format_datetime, getdate, nowdate, nowtime, random_string, today
+from frappe.utils import flt, format_datetime, getdate, nowdate, nowtime, random_string, today
 
 
 class DirectDebitBatch(Document):
@@ -19,26 +19,120 @@ class DirectDebitBatch(Document):
         if not self.invoices:
             frappe.throw(_("No invoices added to batch"))
 
-        for invoice in self.invoices:
-            # Check if invoice exists
-            if not frappe.db.exists("Sales Invoice", invoice.invoice):
-                frappe.throw(_("Invoice {0} does not exist").format(invoice.invoice))
+        # Saving a batch with an unchanged invoice table needs no revalidation;
+        # submitting always revalidates against the current invoice state
+        doc_before_save = self.get_doc_before_save()
+        if (
+            doc_before_save
+            and doc_before_save.docstatus == self.docstatus
+            and self._get_invoice_signature(doc_before_save.invoices)
+            == self._get_invoice_signature(self.invoices)
+        ):
+            return
 
-            # Check if invoice is unpaid
-            inv = frappe.get_doc("Sales Invoice", invoice.invoice)
-            if inv.status not in ["Unpaid", "Overdue"]:
-                frappe.throw(_("Invoice {0} is not unpaid").format(inv.name))
+        invoice_info, membership_info, mandate_info = self._get_invoice_validation_data()
+        errors = []
 
-            # Check if membership exists
-            if not frappe.db.exists("Membership", invoice.membership):
-                frappe.throw(_("Membership {0} does not exist").format(invoice.membership))
+        for invoice in self.invoices:
+            inv = invoice_info.get(invoice.invoice)
+
+            # Check if invoice exists and is unpaid
+            if not inv:
+                errors.append(_("Invoice {0} does not exist").format(invoice.invoice))
+            elif inv.status not in ["Unpaid", "Overdue"] or flt(inv.outstanding_amount) <= 0:
+                errors.append(_("Invoice {0} is not unpaid").format(inv.name))
+
+            # Check if membership exists and belongs to the invoiced customer
+            membership = membership_info.get(invoice.membership)
+            if not membership:
+                errors.append(_("Membership {0} does not exist").format(invoice.membership))
+            elif inv and membership.customer and inv.customer and membership.customer != inv.customer:
+                errors.append(
+                    _("Invoice {0} is not addressed to the customer of membership {1}").format(
+                        inv.name, invoice.membership
+                    )
+                )
 
             # Check bank details
             if not invoice.iban:
-                frappe.throw(_("IBAN is required for invoice {0}").format(invoice.invoice))
+                errors.append(_("IBAN is required for invoice {0}").format(invoice.invoice))
 
             if not invoice.mandate_reference:
-                frappe.throw(_("Mandate reference is required for invoice {0}").format(invoice.invoice))
+                errors.append(_("Mandate reference is required for invoice {0}").format(invoice.invoice))
+                continue
+
+            # Mandate status is checked with the sequence types; only reject foreign mandates here
+            mandate = mandate_info.get(invoice.mandate_reference)
+            if mandate and mandate.member and invoice.member and mandate.member != invoice.member:
+                errors.append(
+                    _("Mandate {0} does not belong to member {1}").format(
+                        invoice.mandate_reference, invoice.member
+                    )
+                )
+
+        if errors:
+            frappe.throw(_("Invalid invoices in batch:\n{0}").format("\n".join(errors)))
+
+    def _get_invoice_signature(self, invoices):
+        """Fields of the invoice table that invoice validation depends on"""
+        return [
+            (row.invoice, row.membership, row.member, row.iban, row.mandate_reference)
+            for row in invoices or []
+        ]
+
+    def _get_invoice_validation_data(self):
+        """Fetch invoice, customer and mandate details for all rows at once"""
+        invoice_names = list({row.invoice for row in self.invoices if row.invoice})
+        membership_names = list({row.membership for row in self.invoices if row.membership})
+        mandate_references = list({row.mandate_reference for row in self.invoices if row.mandate_reference})
+
+        invoice_info = {}
+        if invoice_names:
+            invoice_info = {
+                row.name: row
+                for row in frappe.db.sql(
+                    """
+                    SELECT name, status, outstanding_amount, customer
+                    FROM `tabSales Invoice`
+                    WHERE name IN %(invoices)s
+                """,
+                    {"invoices": invoice_names},
+                    as_dict=True,
+                )
+            }
+
+        membership_info = {}
+        if membership_names:
+            membership_info = {
+                row.name: row
+                for row in frappe.db.sql(
+                    """
+                    SELECT ms.name, m.customer
+                    FROM `tabMembership` ms
+                    LEFT JOIN `tabMember` m ON m.name = ms.member
+                    WHERE ms.name IN %(memberships)s
+                """,
+                    {"memberships": membership_names},
+                    as_dict=True,
+                )
+            }
+
+        mandate_info = {}
+        if mandate_references:
+            mandate_info = {
+                row.mandate_id: row
+                for row in frappe.db.sql(
+                    """
+                    SELECT mandate_id, member, status
+                    FROM `tabSEPA Mandate`
+                    WHERE mandate_id IN %(mandates)s
+                """,
+                    {"mandates": mandate_references},
+                    as_dict=True,
+                )
+            }
+
+        return invoice_info, membership_info, mandate_info
 
     def validate_sequence_types(self):
         """Validate SEPA sequence types for automated batch processing"""
@@ -46,21 +140,40 @@ class DirectDebitBatch(Document):
             return
 
         # Import here to avoid circular imports
-        from verenigingen.verenigingen.doctype.sepa_mandate_usage.sepa_mandate_usage import (
-            get_mandate_sequence_type,
-        )
+        from verenigingen.utils.sepa_mandate_service import get_sepa_mandate_service
 
         critical_errors = []
         warnings = []
 
+        # Resolve all mandate references with one query
+        mandate_references = list(
+            {invoice.mandate_reference for invoice in self.invoices if invoice.mandate_reference}
+        )
+        mandate_names = {}
+        if mandate_references:
+            mandate_names = dict(
+                frappe.get_all(
+                    "SEPA Mandate",
+                    filters={"mandate_id": ["in", mandate_references], "status": "Active"},
+                    fields=["mandate_id", "name"],
+                    as_list=True,
+                )
+            )
+
+        # Determine the expected sequence types of the whole batch from one usage query
+        expected_sequence_types = get_sepa_mandate_service().get_sequence_info_batch(
+            [
+                (mandate_names[invoice.mandate_reference], invoice.invoice)
+                for invoice in self.invoices
+                if invoice.mandate_reference in mandate_names
+            ]
+        )
+
         for invoice in self.invoices:
             if not invoice.mandate_reference:
                 continue  # Will be caught by validate_invoices
 
-            # Get mandate for this member
-            mandate_name = frappe.db.get_value(
-                "SEPA Mandate", {"mandate_id": invoice.mandate_reference, "status": "Active"}, "name"
-            )
+            mandate_name = mandate_names.get(invoice.mandate_reference)
 
             if not mandate_name:
                 critical_errors.append(
@@ -74,8 +187,17 @@ class DirectDebitBatch(Document):
 
             # Get expected sequence type
             try:
-                expected_info = get_mandate_sequence_type(mandate_name, invoice.invoice)
+                expected_info = expected_sequence_types[f"{mandate_name}:{invoice.invoice}"]
                 expected_type = expected_info["sequence_type"]
+                if not expected_type:
+                    critical_errors.append(
+                        {
+                            "invoice": invoice.invoice,
+                            "issue": expected_info.get("reason", ""),
+                            "mandate_reference": invoice.mandate_reference,
+                        }
+                    )
+                    continue
 
                 # Compare with actual sequence type
                 if hasattr(invoice, "sequence_type") and invoice.sequence_type:
@@ -396,53 +518,23 @@ class DirectDebitBatch(Document):
 
         self.save()
 
-    def mark_invoices_as_paid(self):
-        """Mark all invoices in the batch as paid"""
-        success_count = 0
-
-        for i, invoice_item in enumerate(self.invoices):
-            try:
-                # Get the invoice
-                invoice = frappe.get_doc("Sales Invoice", invoice_item.invoice)
-
-                # Create payment entry
-                payment_entry = create_payment_entry_for_invoice(
-                    invoice=invoice,
-                    payment_type="Receive",
-                    mode_of_payment="SEPA Direct Debit",
-                    reference_no=self.name,
-                    reference_date=self.batch_date,
-                )
-
-                # Update batch invoice status
-                self.update_invoice_status(
-                    i, "Successful", "PDNG", f"Payment entry {payment_entry.name} created"
-                )
-
-                # Update membership
-                update_membership_payment_status(invoice_item.membership)
-
-                success_count += 1
-
-            except Exception as e:
-                self.update_invoice_status(i, "Failed", "RJCT", f"Error: {str(e)}")
-                frappe.log_error(
-                    f"Error processing payment for invoice {invoice_item.invoice}: {str(e)}",
-                    "SEPA Direct Debit Payment Error",
-                )
-
-        # Update batch status
-        if success_count == len(self.invoices):
-            self.status = "Processed"
-        elif success_count > 0:
-            self.status = "Partially Processed"
-        else:
-            self.status = "Failed"
+    @frappe.whitelist()
+    def mark_invoices_as_paid(self, consolidated=False):
+        """
+        Queue posting the payments of all invoices in the batch
+
+        Payments are posted by a resumable background job, see payment_posting. With
+        consolidated set, each chunk of invoices is posted as one bank entry instead of
+        one Payment Entry per invoice.
+        """
+        from verenigingen.verenigingen.doctype.direct_debit_batch.payment_posting import (
+            enqueue_batch_payment_posting,
+        )
 
-        self.add_to_batch_log(_(f"Processed {success_count} of {len(self.invoices)} invoices"))
-        self.save()
+        if self.docstatus != 1:
+            frappe.throw(_("Batch must be submitted before marking invoices as paid"))
 
-        return success_count
+        return enqueue_batch_payment_posting(self.name, consolidated=frappe.utils.cint(consolidated))
 
     def create_dutch_sepa_xml_structure(self, message_id, payment_info_id, company, settings):
         """Create SEPA XML structure specifically for Dutch direct debit"""
@@ -575,8 +667,15 @@ class DirectDebitBatch(Document):
 # Helper Functions
 
 
-def create_payment_entry_for_invoice(invoice, payment_type, mode_of_payment, reference_no, reference_date):
-    """Create a payment entry for an invoice"""
+def create_payment_entry_for_invoice(
+    invoice, payment_type, mode_of_payment, reference_no, reference_date, defer_hooks=False
+):
+    """
+    Create a payment entry for an invoice
+
+    With defer_hooks set, member payment history and donor processing are left to the
+    caller, which runs them once for a whole set of payments.
+    """
     try:
         from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
 
@@ -591,6 +690,10 @@ def create_payment_entry_for_invoice(invoice, payment_type, mode_of_payment, ref
         payment_entry.reference_no = reference_no
         payment_entry.reference_date = reference_date
 
+        if defer_hooks:
+            payment_entry.flags.defer_member_history_update = True
+            payment_entry.flags.ignore_donor_creation = True
+
         # Save and submit
         payment_entry.insert(ignore_permissions=True)
         payment_entry.submit()
@@ -689,17 +792,11 @@ def process_batch(batch_name):
 
 
 @frappe.whitelist()
-def mark_invoices_as_paid(batch_name):
-    """Mark all invoices in a batch as paid"""
+def mark_invoices_as_paid(batch_name, consolidated=False):
+    """Queue posting the payments of all invoices in a batch"""
     try:
-        batch = frappe.get_doc("SEPA Direct Debit Batch", batch_name)
-
-        if batch.docstatus != 1:
-            frappe.throw(_("Batch must be submitted before marking invoices as paid"))
-
-        success_count = batch.mark_invoices_as_paid()
-
-        return success_count
+        batch = frappe.get_doc("Direct Debit Batch", batch_name)
+        return batch.mark_invoices_as_paid(consolidated=consolidated)
     except Exception as e:
         frappe.log_error(
             f"Error marking invoices as paid for batch {batch_name}: {str(e)}",
@@ -0,0 +1,413 @@
+"""
+Background payment posting for Direct Debit Batches
+
+Payments for a collected batch are posted by a background job in chunks. Every chunk
+is committed together with the batch rows it posted, so the rows themselves are the
+progress record: an interrupted or re-run job continues with the rows that have no
+payment yet. Membership updates, member payment history and donor processing are
+deferred until all payments have been posted.
+
+Payments are posted either as one Payment Entry per invoice or, consolidated, as one
+bank Journal Entry per chunk with a receivable line referencing each invoice.
+"""
+
+import frappe
+from frappe import _
+from frappe.utils import flt, today
+
+# Batch rows posted and committed together
+POSTING_CHUNK_SIZE = 100
+
+# Invoices referenced by one consolidated bank entry
+CONSOLIDATED_CHUNK_SIZE = 500
+
+POSTING_JOB_TIMEOUT = 4 * 3600
+
+
+def get_posting_job_id(batch_name):
+    """Background job id, one posting job per batch"""
+    return f"dd_batch_payment_posting::{batch_name}"
+
+
+def enqueue_batch_payment_posting(batch_name, consolidated=False):
+    """Queue the payment posting job for a submitted batch"""
+    from frappe.utils.background_jobs import is_job_enqueued
+
+    job_id = get_posting_job_id(batch_name)
+    if is_job_enqueued(job_id):
+        frappe.throw(_("Payments for batch {0} are already being posted").format(batch_name))
+
+    frappe.db.set_value(
+        "Direct Debit Batch", batch_name, "payment_posting_status", "Queued", update_modified=False
+    )
+    frappe.enqueue(
+        "verenigingen.verenigingen.doctype.direct_debit_batch.payment_posting.post_batch_payments",
+        queue="long",
+        timeout=POSTING_JOB_TIMEOUT,
+        job_id=job_id,
+        deduplicate=True,
+        enqueue_after_commit=True,
+        batch_name=batch_name,
+        consolidated=consolidated,
+    )
+
+    return {"queued": True, "job_id": job_id, "consolidated": bool(consolidated)}
+
+
+def post_batch_payments(batch_name, consolidated=False):
+    """
+    Background job: post the payments of all rows that have not been posted yet
+
+    Returns a summary with the number of payments posted and failed in this run.
+    """
+    batch = frappe.get_doc("Direct Debit Batch", batch_name)
+    if batch.docstatus != 1:
+        frappe.throw(_("Batch must be submitted before marking invoices as paid"))
+
+    batch.db_set("payment_posting_status", "In Progress", update_modified=False)
+    frappe.db.commit()
+
+    chunk_size = CONSOLIDATED_CHUNK_SIZE if consolidated else POSTING_CHUNK_SIZE
+    summary = {"posted": 0, "failed": 0}
+    last_idx = 0
+
+    try:
+        while True:
+            rows = _get_unposted_rows(batch_name, last_idx, chunk_size)
+            if not rows:
+                break
+            last_idx = rows[-1].idx
+
+            if consolidated:
+                result = _post_consolidated_chunk(batch, rows)
+            else:
+                result = _post_individual_chunk(batch, rows)
+
+            for key in ("posted", "failed"):
+                summary[key] += result[key]
+
+            _update_posting_progress(batch)
+            frappe.db.commit()
+
+        _finalize_batch_payments(batch)
+        frappe.db.commit()
+
+    except Exception as e:
+        frappe.db.rollback()
+        batch.db_set("payment_posting_status", "Failed", update_modified=False)
+        frappe.db.commit()
+        frappe.log_error(
+            f"Error posting payments for batch {batch_name}: {str(e)}", "SEPA Direct Debit Payment Error"
+        )
+        _publish(batch_name, _("Payment posting failed: {0}").format(str(e)), indicator="red", reload=True)
+        raise
+
+    return {"posted": summary["posted"], "failed": summary["failed"]}
+
+
+def _get_unposted_rows(batch_name, after_idx, limit):
+    """Next rows without a posted payment, with the invoice details needed to post them"""
+    return frappe.db.sql(
+        """
+        SELECT
+            bi.name, bi.idx, bi.invoice, bi.membership,
+            si.customer, si.company, si.debit_to, si.outstanding_amount, si.docstatus
+        FROM `tabDirect Debit Batch Invoice` bi
+        LEFT JOIN `tabSales Invoice` si ON si.name = bi.invoice
+        WHERE bi.parent = %(batch)s
+        AND bi.parenttype = 'Direct Debit Batch'
+        AND IFNULL(bi.payment_entry, '') = ''
+        AND bi.idx > %(after_idx)s
+        ORDER BY bi.idx
+        LIMIT %(limit)s
+    """,
+        {"batch": batch_name, "after_idx": after_idx, "limit": limit},
+        as_dict=True,
+    )
+
+
+def _post_individual_chunk(batch, rows):
+    """Post one Payment Entry per invoice, isolating failures per row"""
+    from verenigingen.verenigingen.doctype.direct_debit_batch.direct_debit_batch import (
+        create_payment_entry_for_invoice,
+    )
+
+    result = {"posted": 0, "failed": 0}
+
+    for row in rows:
+        error = _get_row_error(row)
+        if error:
+            _mark_row_failed(row, error)
+            result["failed"] += 1
+            continue
+
+        frappe.db.savepoint("dd_payment_row")
+        try:
+            payment_entry = create_payment_entry_for_invoice(
+                invoice=frappe._dict(name=row.invoice, outstanding_amount=row.outstanding_amount),
+                payment_type="Receive",
+                mode_of_payment="SEPA Direct Debit",
+                reference_no=batch.name,
+                reference_date=batch.batch_date,
+                defer_hooks=True,
+            )
+        except Exception as e:
+            frappe.db.rollback(save_point="dd_payment_row")
+            _mark_row_failed(row, str(e))
+            result["failed"] += 1
+            continue
+
+        _mark_row_posted(row, "Payment Entry", payment_entry.name)
+        result["posted"] += 1
+
+    return result
+
+
+def _post_consolidated_chunk(batch, rows):
+    """Post one bank Journal Entry per company crediting the receivable of every invoice in the chunk"""
+    result = {"posted": 0, "failed": 0}
+    postable_by_company = {}
+
+    for row in rows:
+        error = _get_row_error(row)
+        if error:
+            _mark_row_failed(row, error)
+            result["failed"] += 1
+        else:
+            postable_by_company.setdefault(row.company, []).append(row)
+
+    for postable in postable_by_company.values():
+        frappe.db.savepoint("dd_payment_chunk")
+        try:
+            journal_entry = _create_consolidated_journal_entry(batch, postable)
+        except Exception as e:
+            frappe.db.rollback(save_point="dd_payment_chunk")
+            for row in postable:
+                _mark_row_failed(row, str(e))
+            result["failed"] += len(postable)
+            continue
+
+        for row in postable:
+            _mark_row_posted(row, "Journal Entry", journal_entry.name)
+        result["posted"] += len(postable)
+
+        _notify_consolidated_payments(journal_entry, postable)
+
+    return result
+
+
+def _create_consolidated_journal_entry(batch, rows):
+    """Create and submit a bank entry with one receivable line per invoice"""
+    company = rows[0].company
+    bank_account = _get_collection_bank_account(company)
+    total = sum(flt(row.outstanding_amount) for row in rows)
+
+    journal_entry = frappe.new_doc("Journal Entry")
+    journal_entry.voucher_type = "Bank Entry"
+    journal_entry.company = company
+    journal_entry.posting_date = today()
+    journal_entry.cheque_no = batch.name
+    journal_entry.cheque_date = batch.batch_date
+    journal_entry.user_remark = _("SEPA Direct Debit collection for batch {0}").format(batch.name)
+
+    journal_entry.append("accounts", {"account": bank_account, "debit_in_account_currency": total})
+    for row in rows:
+        journal_entry.append(
+            "accounts",
+            {
+                "account": row.debit_to,
+                "party_type": "Customer",
+                "party": row.customer,
+                "credit_in_account_currency": flt(row.outstanding_amount),
+                "reference_type": "Sales Invoice",
+                "reference_name": row.invoice,
+            },
+        )
+
+    journal_entry.flags.ignore_donor_creation = True
+    journal_entry.insert(ignore_permissions=True)
+    journal_entry.submit()
+
+    frappe.logger().info(f"Created journal entry {journal_entry.name} for {len(rows)} invoices")
+    return journal_entry
+
+
+def _notify_consolidated_payments(journal_entry, rows):
+    """
+    Run the Payment Entry submit notifications for every invoice settled by a bank entry
+
+    A Payment Entry per invoice would send the payment success notification and resolve
+    open SEPA Payment Retries for the invoice on submit; a consolidated Journal Entry
+    does not trigger these hooks, so they are run per invoice here.
+    """
+    from verenigingen.utils.payment_notifications import on_payment_submit
+
+    currency = frappe.get_cached_value("Company", journal_entry.company, "default_currency")
+    for row in rows:
+        on_payment_submit(
+            frappe._dict(
+                doctype="Journal Entry",
+                name=journal_entry.name,
+                party_type="Customer",
+                party=row.customer,
+                paid_amount=flt(row.outstanding_amount),
+                paid_to_account_currency=currency,
+                posting_date=journal_entry.posting_date,
+                mode_of_payment="SEPA Direct Debit",
+                references=[frappe._dict(reference_doctype="Sales Invoice", reference_name=row.invoice)],
+            ),
+            "on_submit",
+        )
+
+
+def _get_collection_bank_account(company):
+    """Bank account the SEPA Direct Debit collections are received on"""
+    from erpnext.accounts.doctype.sales_invoice.sales_invoice import get_bank_cash_account
+
+    account = (get_bank_cash_account("SEPA Direct Debit", company) or {}).get("account")
+    account = account or frappe.get_cached_value("Company", company, "default_bank_account")
+    if not account:
+        frappe.throw(_("No bank account configured for SEPA Direct Debit in company {0}").format(company))
+
+    return account
+
+
+def _get_row_error(row):
+    """Reason a batch row cannot be posted, if any"""
+    if row.docstatus is None:
+        return _("Invoice {0} does not exist").format(row.invoice)
+    if row.docstatus != 1 or flt(row.outstanding_amount) <= 0:
+        return _("Invoice {0} has no outstanding amount").format(row.invoice)
+    return None
+
+
+def _mark_row_posted(row, payment_doctype, payment_name):
+    frappe.db.set_value(
+        "Direct Debit Batch Invoice",
+        row.name,
+        {
+            "status": "Successful",
+            "result_code": "PDNG",
+            "result_message": f"{payment_doctype} {payment_name} created",
+            "payment_doctype": payment_doctype,
+            "payment_entry": payment_name,
+        },
+        update_modified=False,
+    )
+
+
+def _mark_row_failed(row, error):
+    frappe.db.set_value(
+        "Direct Debit Batch Invoice",
+        row.name,
+        {"status": "Failed", "result_code": "RJCT", "result_message": f"Error: {error}"},
+        update_modified=False,
+    )
+
+
+def _get_posting_counts(batch_name):
+    counts = frappe.db.sql(
+        """
+        SELECT
+            COUNT(*) AS total,
+            SUM(IF(IFNULL(payment_entry, '') != '', 1, 0)) AS posted
+        FROM `tabDirect Debit Batch Invoice`
+        WHERE parent = %s AND parenttype = 'Direct Debit Batch'
+    """,
+        batch_name,
+        as_dict=True,
+    )[0]
+    return int(counts.total or 0), int(counts.posted or 0)
+
+
+def _update_posting_progress(batch):
+    total, posted = _get_posting_counts(batch.name)
+    batch.db_set("payments_posted", posted, update_modified=False)
+    _publish(batch.name, _("Posted {0} of {1} payments").format(posted, total))
+
+
+def _finalize_batch_payments(batch):
+    """
+    Run the work deferred while posting and close the batch
+
+    The deferred work is built from the posted batch rows rather than from the payments
+    of this run, so payments of an interrupted earlier run or a failed finalize are
+    covered as well. All of it is idempotent.
+    """
+    from verenigingen.events.subscribers.payment_history_coalescer import queue_member_history_update
+    from verenigingen.utils.donor_auto_creation import process_payment_for_donor_creation
+    from verenigingen.verenigingen.doctype.direct_debit_batch.direct_debit_batch import (
+        update_membership_payment_status,
+    )
+
+    posted_rows = frappe.db.sql(
+        """
+        SELECT bi.invoice, bi.membership, si.customer, bi.payment_doctype, bi.payment_entry
+        FROM `tabDirect Debit Batch Invoice` bi
+        LEFT JOIN `tabSales Invoice` si ON si.name = bi.invoice
+        WHERE bi.parent = %s
+        AND bi.parenttype = 'Direct Debit Batch'
+        AND IFNULL(bi.payment_entry, '') != ''
+    """,
+        batch.name,
+        as_dict=True,
+    )
+
+    invoices_by_membership = {}
+    for row in posted_rows:
+        if row.membership:
+            invoices_by_membership.setdefault(row.membership, []).append(row.invoice)
+
+    for membership, invoices in invoices_by_membership.items():
+        try:
+            update_membership_payment_status(membership)
+        except Exception as e:
+            # The payments stay posted; record which invoices left their membership unpaid
+            frappe.log_error(
+                f"Error updating payment status of membership {membership} for invoice(s) "
+                f"{', '.join(invoices)} in batch {batch.name}: {str(e)}",
+                "SEPA Direct Debit Payment Error",
+            )
+
+    for customer in {row.customer for row in posted_rows if row.customer}:
+        queue_member_history_update(customer)
+
+    # Payments were created with donor creation deferred; it skips customers that already have a donor
+    payments = {(row.payment_doctype or "Payment Entry", row.payment_entry) for row in posted_rows}
+    for payment_doctype, payment_name in sorted(payments):
+        process_payment_for_donor_creation(frappe.get_doc(payment_doctype, payment_name))
+
+    total, posted = _get_posting_counts(batch.name)
+    if posted == total:
+        status = "Processed"
+    elif posted > 0:
+        status = "Partially Processed"
+    else:
+        status = "Failed"
+
+    batch.reload()
+    batch.add_to_batch_log(_("Processed {0} of {1} invoices").format(posted, total))
+    batch.db_set(
+        {
+            "status": status,
+            "payments_posted": posted,
+            "payment_posting_status": "Completed",
+            "batch_log": batch.batch_log,
+        }
+    )
+
+    _publish(
+        batch.name,
+        _("Posted {0} of {1} payments").format(posted, total),
+        indicator="green" if posted == total else "orange",
+        reload=True,
+    )
+
+
+def _publish(batch_name, message, indicator="blue", reload=False):
+    frappe.publish_realtime(
+        f"dd_batch_update_{batch_name}",
+        {"message": message, "indicator": indicator, "reload": reload},
+        doctype="Direct Debit Batch",
+        docname=batch_name,
+    )
@@ -22,6 +22,15 @@ class SEPAProcessor:
         self.mandate_service = get_sepa_mandate_service()
         self.error_handler = get_sepa_error_handler()
 
+        # Shared invoice context (settings and dues items), resolved on first use
+        self._invoice_context = None
+
+        # Collection candidates of the current run, keyed by schedule name
+        self._collection_candidates = {}
+
+        # Mandate usages of the batch being built, recorded in bulk once it is saved
+        self._pending_mandate_usage = []
+
         # Get company from centralized config
         company_config = self.config_manager.get_company_sepa_config()
         self.company = (
@@ -61,11 +70,22 @@ class SEPAProcessor:
         batch = self.create_batch_from_invoices(eligible_invoices, collection_date)
 
         # Batch process sequence types for all invoices at once
+        self._pending_mandate_usage = []
         self.add_invoices_to_batch_optimized(batch, eligible_invoices)
 
         if batch.invoices:
-            batch.calculate_totals()
-            batch.save()
+            # Save the batch and record its mandate usage together, or neither
+            savepoint = f"sepa_batch_{frappe.generate_hash(length=8)}"
+            frappe.db.savepoint(savepoint)
+            try:
+                batch.calculate_totals()
+                batch.save()
+                self.record_pending_mandate_usage(batch)
+            except Exception:
+                frappe.db.rollback(save_point=savepoint)
+                raise
+            finally:
+                self._pending_mandate_usage = []
 
             # Handle validation and notifications for automated processing
             self.handle_automated_batch_validation(batch)
@@ -81,53 +101,101 @@ class SEPAProcessor:
             batch.delete()
             return None
 
-    def get_eligible_dues_schedules(self, collection_date):
-        """Get membership dues schedules eligible for collection"""
-        # Calculate the date range for eligible schedules
-        # We want to collect dues that are due within the invoice_days_before period
+    def get_collection_candidates(self, collection_date):
+        """
+        Get SEPA dues schedules due for collection with their existing unpaid invoice for the
+        current coverage period and their active mandate, in a single query.
+
+        The generation date (next_invoice_date minus invoice_days_before) is evaluated in SQL.
+        Rows are cached on the processor so the per-schedule invoice and mandate lookups
+        of this run are answered without further queries.
+        """
         max_due_date = add_days(collection_date, 30)  # Default 30 days lookahead
 
-        filters = {
-            "status": "Active",
-            "auto_generate": 1,
-            "test_mode": 0,
-            "payment_method": "SEPA Direct Debit",
-            "next_invoice_date": ["<=", max_due_date],
-        }
-
-        schedules = frappe.get_all(
-            "Membership Dues Schedule",
-            filters=filters,
-            fields=[
-                "name",
-                "member",
-                "membership",
-                "membership_type",
-                "dues_rate",
-                "billing_frequency",
-                "next_invoice_date",
-                "invoice_days_before",
-                "contribution_mode",
-                "billing_day",
-            ],
+        candidates = frappe.db.sql(
+            """
+            SELECT
+                mds.name, mds.member, mds.membership, mds.membership_type, mds.dues_rate,
+                mds.billing_frequency, mds.next_invoice_date, mds.invoice_days_before,
+                mds.contribution_mode, mds.billing_day,
+                m.customer, m.full_name AS member_name,
+                si.name AS existing_invoice,
+                si.grand_total AS existing_invoice_amount,
+                si.status AS existing_invoice_status,
+                sm.name AS mandate, sm.mandate_id, sm.iban, sm.bic, sm.account_holder_name
+            FROM `tabMembership Dues Schedule` mds
+            INNER JOIN `tabMember` m ON m.name = mds.member
+            LEFT JOIN `tabSales Invoice` si ON si.name = (
+                SELECT inv.name
+                FROM `tabSales Invoice` inv
+                WHERE inv.customer = m.customer
+                AND inv.docstatus != 2
+                AND inv.status IN ('Unpaid', 'Overdue')
+                AND (inv.custom_membership_dues_schedule = mds.name OR inv.name = mds.last_generated_invoice)
+                AND inv.custom_coverage_start_date <= %(collection_date)s
+                AND inv.custom_coverage_end_date >= %(collection_date)s
+                ORDER BY inv.posting_date DESC
+                LIMIT 1
+            )
+            LEFT JOIN `tabSEPA Mandate` sm ON sm.name = (
+                SELECT mandate.name
+                FROM `tabSEPA Mandate` mandate
+                WHERE mandate.member = mds.member
+                AND mandate.status = 'Active'
+                ORDER BY mandate.creation DESC
+                LIMIT 1
+            )
+            WHERE mds.status = 'Active'
+            AND mds.auto_generate = 1
+            AND IFNULL(mds.test_mode, 0) = 0
+            AND mds.is_template = 0
+            AND m.payment_method = 'SEPA Direct Debit'
+            AND mds.next_invoice_date <= %(max_due_date)s
+            AND DATE_SUB(
+                mds.next_invoice_date,
+                INTERVAL IF(IFNULL(mds.invoice_days_before, 0) = 0, 30, mds.invoice_days_before) DAY
+            ) <= %(collection_date)s
+            ORDER BY mds.next_invoice_date, mds.name
+        """,
+            {"collection_date": getdate(collection_date), "max_due_date": max_due_date},
+            as_dict=True,
         )
 
-        # Filter based on invoice_days_before
-        eligible = []
-        for schedule in schedules:
-            days_before = schedule.invoice_days_before or 30
-            generate_date = add_days(schedule.next_invoice_date, -days_before)
+        for candidate in candidates:
+            candidate.needs_invoice = not candidate.existing_invoice
+
+        self._collection_candidates = {candidate.name: candidate for candidate in candidates}
+        return candidates
+
+    def get_eligible_dues_schedules(self, collection_date):
+        """Get membership dues schedules eligible for collection that still need an invoice"""
+        candidates = self.get_collection_candidates(collection_date)
 
-            if getdate(collection_date) >= getdate(generate_date):
-                # Always include eligible schedules - we'll handle existing invoices in the main loop
-                schedule_doc = frappe.get_doc("Membership Dues Schedule", schedule.name)
-                eligible.append(schedule_doc)
+        # Only schedules without an unpaid invoice for the current period are loaded as documents
+        eligible = [
+            frappe.get_doc("Membership Dues Schedule", candidate.name)
+            for candidate in candidates
+            if candidate.needs_invoice
+        ]
 
-        frappe.logger().info(f"Found {len(eligible)} eligible dues schedules for collection")
+        frappe.logger().info(
+            f"Found {len(eligible)} eligible dues schedules for collection "
+            f"({len(candidates) - len(eligible)} already invoiced)"
+        )
         return eligible
 
     def find_existing_invoice_for_schedule(self, schedule):
         """Find existing invoice for the current coverage period"""
+        candidate = self._collection_candidates.get(schedule.name)
+        if candidate:
+            if not candidate.existing_invoice:
+                return None
+            return frappe._dict(
+                name=candidate.existing_invoice,
+                grand_total=candidate.existing_invoice_amount,
+                status=candidate.existing_invoice_status,
+            )
+
         existing = frappe.get_all(
             "Sales Invoice",
             filters={
@@ -272,21 +340,23 @@ class SEPAProcessor:
 
         return base_desc
 
+    def get_invoice_context(self):
+        """Get the invoice context shared by all dues invoices created by this processor"""
+        if self._invoice_context is None:
+            from verenigingen.verenigingen.doctype.membership_dues_schedule.dues_invoice_factory import (
+                DuesInvoiceContext,
+            )
+
+            self._invoice_context = DuesInvoiceContext()
+        return self._invoice_context
+
     def get_or_create_dues_item(self, schedule):
         """Get or create item for membership dues billing"""
         item_code = f"DUES-{schedule.membership_type}-{schedule.billing_frequency}".replace(" ", "-").upper()
 
-        if not frappe.db.exists("Item", item_code):
-            item = frappe.new_doc("Item")
-            item.item_code = item_code
-            item.item_name = f"Membership Dues - {schedule.membership_type} ({schedule.billing_frequency})"
-            item.item_group = "Services"
-            item.is_stock_item = 0
-            item.is_sales_item = 1
-            item.is_service_item = 1
-            item.save()
-
-        return item_code
+        return self.get_invoice_context().get_item(
+            item_code, f"Membership Dues - {schedule.membership_type} ({schedule.billing_frequency})"
+        )
 
     def add_invoice_to_batch(self, batch, invoice, schedule):
         """Add invoice to SEPA batch with proper sequence type determination"""
@@ -344,7 +414,21 @@ class SEPAProcessor:
 
     def get_active_mandate(self, schedule):
         """Get active SEPA mandate for the schedule"""
-        if schedule.active_mandate:
+        candidate = self._collection_candidates.get(schedule.name)
+        if candidate:
+            if not candidate.mandate:
+                return None
+            return frappe._dict(
+                name=candidate.mandate,
+                mandate_id=candidate.mandate_id,
+                iban=candidate.iban,
+                bic=candidate.bic,
+                account_holder_name=candidate.account_holder_name,
+                member=candidate.member,
+                status="Active",
+            )
+
+        if schedule.get("active_mandate"):
             return frappe.get_doc("SEPA Mandate", schedule.active_mandate)
 
         # Try to find mandate by member
@@ -739,25 +823,38 @@ Organization
             },
         )
 
-        # Create mandate usage record for tracking
-        try:
-            from verenigingen.verenigingen.doctype.sepa_mandate_usage.sepa_mandate_usage import (
-                create_mandate_usage_record,
-            )
+        # Mandate usage is recorded in bulk once the batch is saved
+        self._pending_mandate_usage.append(
+            {
+                "mandate_name": invoice_data["mandate_name"],
+                "reference_doctype": "Sales Invoice",
+                "reference_name": invoice_data["name"],
+                "amount": invoice_data["amount"],
+                "sequence_type": sequence_type,
+            }
+        )
 
-            create_mandate_usage_record(
-                mandate_name=invoice_data["mandate_name"],
-                reference_doctype="Sales Invoice",
-                reference_name=invoice_data["name"],
-                amount=invoice_data["amount"],
-                sequence_type=sequence_type,
-            )
-        except Exception as e:
+    def record_pending_mandate_usage(self, batch):
+        """Record the mandate usage of all invoices added to a saved batch in one bulk operation"""
+        from verenigingen.verenigingen.doctype.sepa_mandate_usage.sepa_mandate_usage import (
+            record_mandate_usage_bulk,
+        )
+
+        result = record_mandate_usage_bulk(self._pending_mandate_usage, batch_reference=batch.name)
+        self._pending_mandate_usage = []
+
+        if result["errors"]:
             frappe.log_error(
-                f"Failed to create mandate usage record for {invoice_data['mandate_name']}: {str(e)}",
+                "\n".join(
+                    f"{error['mandate']} ({error['reference_name']}): {error['error']}"
+                    for error in result["errors"]
+                ),
                 "Enhanced SEPA Processor - Mandate Usage Creation Error",
             )
 
+        frappe.logger().info(f"Recorded {result['recorded']} mandate usages for batch {batch.name}")
+        return result
+
     def add_existing_invoice_to_batch(self, batch, invoice_data):
         """Add existing invoice to SEPA batch with proper sequence type determination"""
         # Determine correct sequence type using mandate history
@@ -1,6 +1,7 @@
 import random
 import string
 import unittest
+from unittest.mock import patch
 
 import frappe
 from frappe import _
@@ -215,6 +216,21 @@ class TestDirectDebitBatch(FrappeTestCase):
 
         return invoice_name
 
+    def create_minimal_payment_entry(self, invoice_name):
+        """Create a minimal payment entry record standing in for a posted payment"""
+        payment_entry = frappe.new_doc("Payment Entry")
+        payment_entry.name = f"PE-TEST-{frappe.utils.random_string(10)}"
+        payment_entry.payment_type = "Receive"
+        payment_entry.party_type = "Customer"
+        payment_entry.party = self.member.customer
+        payment_entry.company = "_Test Company"
+        payment_entry.posting_date = today()
+        payment_entry.reference_no = invoice_name
+
+        payment_entry.flags.ignore_permissions = True
+        payment_entry.db_insert()
+        return payment_entry
+
     def create_test_membership_and_invoice(self, amount=100.00):
         """Create a test membership and invoice for testing"""
         # Create membership type if needed
@@ -370,6 +386,61 @@ class TestDirectDebitBatch(FrappeTestCase):
                 batch.cancel()
             batch.delete()
 
+    def test_enhanced_sepa_xml_groups_payment_infos(self):
+        """Test that one SEPA file holds a payment info block per sequence type and date"""
+        import xml.etree.ElementTree as ET
+
+        from verenigingen.utils.sepa_xml_enhanced_generator import generate_enhanced_sepa_xml
+
+        batch = self.create_test_batch()
+        membership_name, invoice_name = self.create_test_membership_and_invoice(50.00)
+        batch.append(
+            "invoices",
+            {
+                "invoice": invoice_name,
+                "membership": membership_name,
+                "member": self.member.name,
+                "member_name": self.member.full_name,
+                "amount": 50.00,
+                "currency": "EUR",
+                "iban": self.member.iban,
+                "mandate_reference": self.mandate.mandate_id,
+                "status": "Pending",
+            },
+        )
+        batch.save()
+
+        try:
+            frappe.db.set_value("Direct Debit Batch Invoice", batch.invoices[0].name, "sequence_type", "FRST")
+            frappe.db.set_value(
+                "Direct Debit Batch Invoice",
+                batch.invoices[1].name,
+                {"sequence_type": "RCUR", "collection_date": add_days(today(), 3)},
+            )
+
+            result = generate_enhanced_sepa_xml(batch.name)
+            self.assertTrue(result["success"], result.get("error"))
+            self.assertEqual(result["statistics"]["payment_infos"], 2)
+            self.assertEqual(result["statistics"]["transactions"], 2)
+
+            ns = {"ns": "urn:iso:std:iso:20022:tech:xsd:pain.008.001.02"}
+            root = ET.fromstring(result["xml_content"])
+            blocks = {
+                pmt_inf.find("ns:PmtTpInf/ns:SeqTp", ns).text: pmt_inf
+                for pmt_inf in root.findall(".//ns:PmtInf", ns)
+            }
+
+            self.assertEqual(set(blocks), {"FRST", "RCUR"})
+            self.assertEqual(blocks["FRST"].find("ns:NbOfTxs", ns).text, "1")
+            self.assertEqual(flt(blocks["FRST"].find("ns:CtrlSum", ns).text), 100.00)
+            self.assertEqual(flt(blocks["RCUR"].find("ns:CtrlSum", ns).text), 50.00)
+            self.assertEqual(blocks["RCUR"].find("ns:ReqdColltnDt", ns).text, str(add_days(today(), 3)))
+            self.assertEqual(root.find(".//ns:GrpHdr/ns:NbOfTxs", ns).text, "2")
+        finally:
+            if batch.docstatus == 1:
+                batch.cancel()
+            batch.delete()
+
     def test_batch_calculation(self):
         """Test batch total amount and entry count calculation"""
         # Create a batch with multiple invoices
@@ -460,6 +531,85 @@ class TestDirectDebitBatch(FrappeTestCase):
         with self.assertRaises(frappe.exceptions.ValidationError):
             batch.insert()
 
+    def test_invoice_validation_reports_all_problems(self):
+        """Test that invalid rows are reported together and unchanged batches are not revalidated"""
+        batch = self.create_test_batch()
+
+        # Saving without touching the invoice table skips invoice validation
+        with patch.object(
+            type(batch), "_get_invoice_validation_data", side_effect=AssertionError("revalidated")
+        ):
+            batch.batch_description = f"Test Batch {self.unique_id} renamed"
+            batch.save()
+
+        # A paid invoice, another customer's membership and another member's mandate
+        paid_invoice = self.create_minimal_invoice(25.00)
+        self.invoices.append(paid_invoice)
+        frappe.db.set_value("Sales Invoice", paid_invoice, {"status": "Paid", "outstanding_amount": 0})
+
+        other_member = frappe.new_doc("Member")
+        other_member.first_name = f"Other{self.unique_id}"
+        other_member.last_name = "Member"
+        other_member.email = f"testsepa{self.unique_id}other@example.com"
+        other_member.iban = "NL69INGB0123456789"
+        other_member.bank_account_name = f"Other{self.unique_id} Member"
+        other_member.insert()
+        if not other_member.customer:
+            other_member.create_customer()
+            other_member.reload()
+        self.addCleanup(frappe.delete_doc, "Member", other_member.name, force=True)
+
+        other_membership = frappe.new_doc("Membership")
+        other_membership.member = other_member.name
+        other_membership.membership_type = self.create_membership_type().name
+        other_membership.start_date = today()
+        other_membership.email = other_member.email
+        other_membership.flags.ignore_permissions = True
+        other_membership.flags.ignore_mandatory = True
+        other_membership.insert()
+        self.memberships.append(other_membership.name)
+
+        other_mandate = frappe.new_doc("SEPA Mandate")
+        other_mandate.mandate_id = f"TEST-MANDATE-{self.unique_id}-OTHER"
+        other_mandate.member = other_member.name
+        other_mandate.account_holder_name = other_member.full_name
+        other_mandate.iban = other_member.iban
+        other_mandate.bic = "INGBNL2A"
+        other_mandate.sign_date = today()
+        other_mandate.status = "Active"
+        other_mandate.is_active = 1
+        other_mandate.flags.ignore_mandatory = True
+        other_mandate.flags.ignore_permissions = True
+        other_mandate.flags.disable_notifications = True
+        other_mandate.insert()
+        self.addCleanup(frappe.delete_doc, "SEPA Mandate", other_mandate.name, force=True)
+
+        batch.append(
+            "invoices",
+            {
+                "invoice": paid_invoice,
+                "membership": other_membership.name,
+                "member": self.member.name,
+                "amount": 25.00,
+                "currency": "EUR",
+                "iban": self.member.iban,
+                "mandate_reference": other_mandate.mandate_id,
+            },
+        )
+
+        with self.assertRaises(frappe.exceptions.ValidationError) as context:
+            batch.save()
+
+        message = str(context.exception)
+        self.assertIn(f"Invoice {paid_invoice} is not unpaid", message)
+        self.assertIn(
+            f"Invoice {paid_invoice} is not addressed to the customer of membership {other_membership.name}",
+            message,
+        )
+        self.assertIn(
+            f"Mandate {other_mandate.mandate_id} does not belong to member {self.member.name}", message
+        )
+
     def test_field_protection(self):
         """Test that fields are protected after batch generation"""
         # Create and submit a batch
@@ -586,6 +736,48 @@ class TestDirectDebitBatch(FrappeTestCase):
                 batch.cancel()
             frappe.delete_doc("Direct Debit Batch", batch.name, force=True)
 
+    def test_payment_posting_is_resumable(self):
+        """Test that payment posting records progress on the rows and skips posted rows on re-run"""
+        from verenigingen.verenigingen.doctype.direct_debit_batch import direct_debit_batch
+        from verenigingen.verenigingen.doctype.direct_debit_batch.payment_posting import post_batch_payments
+
+        batch = self.create_test_batch()
+        batch.submit()
+
+        # Payment Entry creation itself is covered elsewhere; a stand-in keeps the posting deterministic
+        def create_payment_entry(invoice, **kwargs):
+            return self.create_minimal_payment_entry(invoice.name)
+
+        try:
+            with patch.object(
+                direct_debit_batch, "create_payment_entry_for_invoice", side_effect=create_payment_entry
+            ) as mock_create, patch(
+                "verenigingen.utils.donor_auto_creation.process_payment_for_donor_creation"
+            ):
+                first_run = post_batch_payments(batch.name)
+                second_run = post_batch_payments(batch.name)
+
+            batch.reload()
+            row = batch.invoices[0]
+            self.assertEqual(first_run, {"posted": 1, "failed": 0})
+            self.assertEqual(second_run, {"posted": 0, "failed": 0})
+            self.assertEqual(mock_create.call_count, 1)
+
+            self.assertEqual(row.status, "Successful")
+            self.assertEqual(row.payment_doctype, "Payment Entry")
+            self.assertTrue(row.payment_entry)
+            self.assertEqual(batch.payments_posted, 1)
+            self.assertEqual(batch.status, "Processed")
+            self.assertEqual(batch.payment_posting_status, "Completed")
+
+        finally:
+            batch.reload()
+            for row in batch.invoices:
+                if row.payment_entry:
+                    frappe.delete_doc(row.payment_doctype, row.payment_entry, force=True)
+            batch.cancel()
+            frappe.delete_doc("Direct Debit Batch", batch.name, force=True)
+
     def test_batch_scheduler_integration(self):
         """Test integration with the new batch scheduler"""
         from verenigingen.api.dd_batch_optimizer import create_optimal_batches
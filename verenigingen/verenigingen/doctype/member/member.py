@@ -751,53 +751,18 @@ class Member(
             )
 
     def calculate_total_membership_days(self):
-        """Calculate total membership days from all active membership periods"""
+        """Calculate total membership days from all membership periods, merging overlaps"""
+        from verenigingen.verenigingen.doctype.member.membership_duration import (
+            calculate_total_membership_days,
+            get_member_memberships,
+        )
+
         try:
             if not self.name or not frappe.db.exists("Member", self.name):
                 # For new records, can't calculate duration yet
                 return 0
 
-            # Get all memberships for this member, ordered by start date
-            memberships = frappe.get_all(
-                "Membership",
-                filters={"member": self.name, "docstatus": 1},
-                fields=["name", "start_date", "renewal_date", "status", "cancellation_date"],
-                order_by="start_date asc",
-            )
-
-            if not memberships:
-                return 0
-
-            total_days = 0
-            today_date = getdate(today())
-
-            for membership in memberships:
-                start_date = getdate(membership.start_date)
-
-                # Determine end date for this membership period
-                if membership.status in ["Cancelled", "Expired"]:
-                    # Use cancellation date if available, otherwise renewal date
-                    end_date = (
-                        getdate(membership.cancellation_date)
-                        if membership.cancellation_date
-                        else getdate(membership.renewal_date)
-                    )
-                elif membership.status == "Active":
-                    # For active memberships, use today or renewal date (whichever is earlier)
-                    renewal_date = getdate(membership.renewal_date) if membership.renewal_date else today_date
-                    end_date = min(today_date, renewal_date)
-                else:
-                    # For other statuses, use renewal date if available
-                    end_date = getdate(membership.renewal_date) if membership.renewal_date else start_date
-
-                # Calculate days for this membership period
-                if end_date >= start_date:
-                    period_days = (
-                        date_diff(end_date, start_date) + 1
-                    )  # +1 to include both start and end dates
-                    total_days += period_days
-
-            return total_days
+            return calculate_total_membership_days(get_member_memberships(self.name))
 
         except Exception as e:
             frappe.log_error(f"Error calculating total membership days: {str(e)}", "Member Error")
@@ -1264,36 +1229,16 @@ class Member(
 
     def calculate_cumulative_membership_duration(self):
         """Calculate and set total membership duration in human-readable format"""
+        from verenigingen.verenigingen.doctype.member.membership_duration import format_membership_duration
+
         try:
             # Use the already calculated total_membership_days if available, otherwise calculate it
             total_days = getattr(self, "total_membership_days", 0) or self.calculate_total_membership_days()
 
-            if total_days <= 0:
-                self.cumulative_membership_duration = "Less than 1 day"
-                return 0
-
-            # Convert total days to human-readable format
-            years = total_days // 365
-            remaining_days = total_days % 365
-            months = remaining_days // 30
-            remaining_days = remaining_days % 30
-
-            # Build duration string
-            duration_parts = []
-            if years > 0:
-                duration_parts.append(f"{years} year{'s' if years != 1 else ''}")
-            if months > 0:
-                duration_parts.append(f"{months} month{'s' if months != 1 else ''}")
-            if remaining_days > 0 and years == 0:  # Only show days if less than a year
-                duration_parts.append(f"{remaining_days} day{'s' if remaining_days != 1 else ''}")
-
-            if duration_parts:
-                self.cumulative_membership_duration = ", ".join(duration_parts)
-            else:
-                self.cumulative_membership_duration = "Less than 1 day"
+            self.cumulative_membership_duration = format_membership_duration(total_days)
 
             # Also return the value in years for backward compatibility
-            return total_days / 365.25
+            return total_days / 365.25 if total_days > 0 else 0
 
         except Exception as e:
             frappe.log_error(
@@ -77,35 +77,32 @@ def check_sepa_mandate_status(member):
 
 @frappe.whitelist()
 def update_member_payment_history(doc, method=None):
-    """Update payment history for member when a payment entry is modified"""
+    """
+    Queue a payment history update for the members of the customer of a payment entry.
+
+    The rebuild is deferred until after the transaction commits and coalesced per
+    customer, so bursts of payments (bank imports, migrations) cause one rebuild per member.
+    """
+    from verenigingen.events.subscribers.payment_history_coalescer import queue_member_history_update
+
     if doc.party_type != "Customer":
         return
 
-    members = frappe.get_all("Member", filters={"customer": doc.party}, fields=["name"])
+    # Bulk payment posting queues its customers once all payments are posted
+    if doc.flags.defer_member_history_update:
+        return
 
-    for member_doc in members:
-        try:
-            member = frappe.get_doc("Member", member_doc.name)
-            member.load_payment_history()
-            member.save(ignore_permissions=True)
-        except Exception as e:
-            frappe.log_error(f"Failed to update payment history for Member {member_doc.name}: {str(e)}")
+    queue_member_history_update(doc.party)
 
 
 def update_member_payment_history_from_invoice(doc, method=None):
-    """Update payment history for member when an invoice is modified"""
+    """Queue a payment history update for the members of the customer of an invoice"""
+    from verenigingen.events.subscribers.payment_history_coalescer import queue_member_history_update
+
     if doc.doctype != "Sales Invoice" or doc.customer is None:
         return
 
-    members = frappe.get_all("Member", filters={"customer": doc.customer}, fields=["name"])
-
-    for member_doc in members:
-        try:
-            member = frappe.get_doc("Member", member_doc.name)
-            member.load_payment_history()
-            member.save(ignore_permissions=True)
-        except Exception as e:
-            frappe.log_error(f"Failed to update payment history for Member {member_doc.name}: {str(e)}")
+    queue_member_history_update(doc.customer)
 
 
 @frappe.whitelist()
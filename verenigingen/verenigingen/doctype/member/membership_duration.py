@@ -0,0 +1,195 @@
+"""
+Membership duration engine
+
+Computes total and cumulative membership duration from Membership periods. Periods
+are merged before counting so overlapping memberships (e.g. a renewal that starts
+before the previous membership ended) are not counted twice. The same functions back
+the per-member recompute and the bulk recompute of all members.
+"""
+
+from itertools import groupby
+
+import frappe
+from frappe.utils import date_diff, getdate, now, today
+
+# Number of members written per batched UPDATE statement
+DURATION_UPDATE_BATCH_SIZE = 500
+
+
+def get_membership_period(membership, today_date=None):
+    """
+    Get the (start, end) period a membership counts towards the membership duration.
+
+    Returns None when the membership has no countable period.
+    """
+    if not membership.get("start_date"):
+        return None
+
+    today_date = today_date or getdate(today())
+    start_date = getdate(membership.start_date)
+
+    if membership.status in ["Cancelled", "Expired"]:
+        # Use cancellation date if available, otherwise renewal date
+        end_date = (
+            getdate(membership.cancellation_date)
+            if membership.cancellation_date
+            else getdate(membership.renewal_date)
+        )
+    elif membership.status == "Active":
+        # For active memberships, use today or renewal date (whichever is earlier)
+        renewal_date = getdate(membership.renewal_date) if membership.renewal_date else today_date
+        end_date = min(today_date, renewal_date)
+    else:
+        # For other statuses, use renewal date if available
+        end_date = getdate(membership.renewal_date) if membership.renewal_date else start_date
+
+    if end_date < start_date:
+        return None
+
+    return (start_date, end_date)
+
+
+def merge_periods(periods):
+    """Merge overlapping and adjacent (start, end) periods"""
+    merged = []
+    for start_date, end_date in sorted(periods):
+        if merged and date_diff(start_date, merged[-1][1]) <= 1:
+            if end_date > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end_date)
+        else:
+            merged.append((start_date, end_date))
+    return merged
+
+
+def calculate_total_membership_days(memberships, today_date=None):
+    """Calculate total membership days, both start and end dates inclusive"""
+    today_date = today_date or getdate(today())
+    periods = [get_membership_period(membership, today_date) for membership in memberships]
+    return sum(
+        date_diff(end_date, start_date) + 1 for start_date, end_date in merge_periods(p for p in periods if p)
+    )
+
+
+def format_membership_duration(total_days):
+    """Convert a number of membership days to a human-readable duration"""
+    if not total_days or total_days <= 0:
+        return "Less than 1 day"
+
+    years = total_days // 365
+    remaining_days = total_days % 365
+    months = remaining_days // 30
+    remaining_days = remaining_days % 30
+
+    duration_parts = []
+    if years > 0:
+        duration_parts.append(f"{years} year{'s' if years != 1 else ''}")
+    if months > 0:
+        duration_parts.append(f"{months} month{'s' if months != 1 else ''}")
+    if remaining_days > 0 and years == 0:  # Only show days if less than a year
+        duration_parts.append(f"{remaining_days} day{'s' if remaining_days != 1 else ''}")
+
+    return ", ".join(duration_parts) if duration_parts else "Less than 1 day"
+
+
+def get_member_memberships(member_name):
+    """Get the submitted memberships of a member relevant for duration calculation"""
+    return frappe.get_all(
+        "Membership",
+        filters={"member": member_name, "docstatus": 1},
+        fields=["name", "start_date", "renewal_date", "status", "cancellation_date"],
+        order_by="start_date asc",
+    )
+
+
+def compute_all_membership_days(today_date=None):
+    """
+    Compute total membership days for every member with submitted memberships in one pass.
+
+    Returns:
+        Dict mapping member name to total membership days
+    """
+    today_date = today_date or getdate(today())
+    memberships = frappe.db.sql(
+        """
+        SELECT member, start_date, renewal_date, status, cancellation_date
+        FROM `tabMembership`
+        WHERE docstatus = 1 AND IFNULL(member, '') != ''
+        ORDER BY member, start_date
+    """,
+        as_dict=True,
+    )
+
+    return {
+        member: calculate_total_membership_days(rows, today_date)
+        for member, rows in groupby(memberships, key=lambda row: row.member)
+    }
+
+
+def update_all_membership_durations_bulk(batch_size=DURATION_UPDATE_BATCH_SIZE):
+    """
+    Recompute membership durations for all active members and write only changed values.
+
+    Durations are derived data, so they are written with batched UPDATE statements that
+    bypass document validation, hooks and the `modified` timestamp.
+
+    Returns:
+        Dict with processed and updated counts
+    """
+    members = frappe.db.sql(
+        """
+        SELECT name, total_membership_days, cumulative_membership_duration, last_duration_update
+        FROM `tabMember`
+        WHERE docstatus != 2
+        AND IFNULL(status, '') NOT IN ('Deceased', 'Banned')
+    """,
+        as_dict=True,
+    )
+
+    total_days_by_member = compute_all_membership_days()
+
+    changes = []
+    for member in members:
+        total_days = total_days_by_member.get(member.name, 0)
+        duration = format_membership_duration(total_days)
+
+        # Only update if the value has changed, never been set, or cumulative duration is missing
+        if (
+            total_days != (member.total_membership_days or 0)
+            or duration != member.cumulative_membership_duration
+            or not member.last_duration_update
+        ):
+            changes.append((member.name, total_days, duration))
+
+    update_time = now()
+    for i in range(0, len(changes), batch_size):
+        _write_duration_batch(changes[i : i + batch_size], update_time)
+        # Commit after each batch to avoid long transactions
+        frappe.db.commit()
+
+    return {"processed": len(members), "updated": len(changes)}
+
+
+def _write_duration_batch(changes, update_time):
+    """Write a batch of (member, total_days, duration) values in a single UPDATE"""
+    days_cases = " ".join(["WHEN %s THEN %s"] * len(changes))
+    duration_cases = " ".join(["WHEN %s THEN %s"] * len(changes))
+    placeholders = ", ".join(["%s"] * len(changes))
+
+    values = []
+    for name, total_days, _duration in changes:
+        values.extend([name, total_days])
+    for name, _total_days, duration in changes:
+        values.extend([name, duration])
+    values.append(update_time)
+    values.extend(name for name, _total_days, _duration in changes)
+
+    frappe.db.sql(
+        f"""
+        UPDATE `tabMember`
+        SET total_membership_days = CASE name {days_cases} END,
+            cumulative_membership_duration = CASE name {duration_cases} END,
+            last_duration_update = %s
+        WHERE name IN ({placeholders})
+    """,
+        tuple(values),
+    )
@@ -1,6 +1,6 @@
 import frappe
 from frappe import _
-from frappe.utils import date_diff, today
+from frappe.utils import cint, date_diff, flt, getdate, now_datetime, today
 
 
 class PaymentMixin:
@@ -21,307 +21,73 @@ class PaymentMixin:
         return True
 
     def on_load(self):
-        """Load payment history when the document is loaded"""
-        if self.customer:
+        """
+        Payment history is persisted on the member and kept current by invoice and payment
+        events, so loading a member only reads the stored rows. A live rebuild on load can be
+        requested explicitly by setting `frappe.flags.live_payment_history`.
+        """
+        if self.customer and frappe.flags.live_payment_history:
             self._load_payment_history_without_save()
 
-    def _load_payment_history_without_save(self):
-        """Internal method to load payment history without saving"""
-        if not self.customer:
-            return
-
-        # New approach: Only show 20 most recent entries
-        # Limit to 20 most recent entries
-        MAX_PAYMENT_HISTORY_ENTRIES = 20
+    @frappe.whitelist()
+    def get_payment_history(self, live=False):
+        """
+        Get the member's payment history rows.
 
-        self.payment_history = []
+        Args:
+            live: Rebuild the rows from invoices and payments instead of returning the
+                persisted history. The rebuilt rows are not saved.
+        """
+        if cint(live) and self.customer:
+            self._load_payment_history_without_save()
 
-        try:
-            # 1. Get all invoices for this customer (including drafts)
-            # Build field list dynamically to handle missing custom fields gracefully
-            base_fields = [
-                "name",
-                "posting_date",
-                "due_date",
-                "grand_total",
-                "outstanding_amount",
-                "status",
-                "docstatus",
-            ]
-
-            # Safely check for coverage custom fields existence
-            coverage_fields = []
-            try:
-                if frappe.db.has_column("Sales Invoice", "custom_coverage_start_date"):
-                    coverage_fields.append("custom_coverage_start_date")
-                if frappe.db.has_column("Sales Invoice", "custom_coverage_end_date"):
-                    coverage_fields.append("custom_coverage_end_date")
-            except Exception as e:
-                frappe.log_error(
-                    f"Error checking for coverage fields: {str(e)}", "Coverage Field Check Error"
-                )
+        return [row.as_dict() for row in self.payment_history or []]
 
-            query_fields = base_fields + coverage_fields
-
-            # Only get the most recent invoices
-            invoices = frappe.get_all(
-                "Sales Invoice",
-                filters={
-                    "customer": self.customer,
-                    "docstatus": ["in", [0, 1]],
-                },  # Include both draft and submitted
-                fields=query_fields,
-                order_by="posting_date desc",
-                limit=MAX_PAYMENT_HISTORY_ENTRIES,
-            )
+    def _load_payment_history_without_save(self, payment_history_rows=None):
+        """
+        Internal method to load payment history without saving.
 
-        except Exception as e:
-            # Critical error - log and continue with empty payment history
-            frappe.log_error(
-                f"Critical error loading invoices for customer {self.customer}: {str(e)}",
-                "Payment History Load Error",
-            )
+        Args:
+            payment_history_rows: Rows prebuilt by the bulk payment history builder. When
+                omitted, the rows for this member are built on the spot.
+        """
+        if not self.customer:
             return
 
-        reconciled_payments = []
+        from verenigingen.verenigingen.doctype.member.payment_history_builder import (
+            build_member_payment_history,
+        )
 
-        # 2. Process each invoice and its payment status
-        for invoice in invoices:
+        if payment_history_rows is None:
             try:
-                # Safely get invoice document with error handling
-                try:
-                    invoice_doc = frappe.get_doc("Sales Invoice", invoice.name)
-                except Exception as e:
-                    frappe.log_error(
-                        f"Error loading invoice document {invoice.name}: {str(e)}",
-                        "Invoice Document Load Error",
-                    )
-                    continue  # Skip this invoice and continue with others
-
-                reference_doctype = None
-                reference_name = None
-                transaction_type = "Regular Invoice"
-
-                # Check if invoice is linked to a membership
-                if hasattr(invoice_doc, "membership") and invoice_doc.membership:
-                    transaction_type = "Membership Invoice"
-                    reference_doctype = "Membership"
-                    reference_name = invoice_doc.membership
-
-                # Find linked payment entries
-                payment_entries = frappe.get_all(
-                    "Payment Entry Reference",
-                    filters={"reference_doctype": "Sales Invoice", "reference_name": invoice.name},
-                    fields=["parent", "allocated_amount"],
-                )
-
-                payment_status = "Unpaid"
-                payment_date = None
-                payment_entry = None
-                payment_method = None
-                paid_amount = 0
-                reconciled = 0
-
-                if payment_entries:
-                    for pe in payment_entries:
-                        reconciled_payments.append(pe.parent)
-                        # Validate allocated amount before adding
-                        allocated_amount = pe.allocated_amount or 0
-                        if allocated_amount < 0:
-                            frappe.log_error(
-                                f"Negative allocated amount in payment entry {pe.parent}: {allocated_amount}",
-                                "PaymentValidation",
-                            )
-                        paid_amount += float(allocated_amount)
-
-                    most_recent_payment = frappe.get_all(
-                        "Payment Entry",
-                        filters={"name": ["in", [pe.parent for pe in payment_entries]]},
-                        fields=["name", "posting_date", "mode_of_payment", "paid_amount"],
-                        order_by="posting_date desc",
-                    )
-
-                    if most_recent_payment:
-                        payment_entry = most_recent_payment[0].name
-                        payment_date = most_recent_payment[0].posting_date
-                        payment_method = most_recent_payment[0].mode_of_payment
-                        reconciled = 1
-
-                # Set payment status based on invoice and payment data
-                if invoice.docstatus == 0:
-                    payment_status = "Draft"
-                elif invoice.status == "Paid":
-                    payment_status = "Paid"
-                elif invoice.status == "Overdue":
-                    payment_status = "Overdue"
-                elif invoice.status == "Cancelled":
-                    payment_status = "Cancelled"
-                elif paid_amount > 0 and paid_amount < invoice.grand_total:
-                    payment_status = "Partially Paid"
-
-                # Check for SEPA mandate
-                has_mandate = 0
-                sepa_mandate = None
-                mandate_status = None
-                mandate_reference = None
-
-                if reference_doctype == "Membership" and reference_name:
-                    try:
-                        membership_doc = frappe.get_doc("Membership", reference_name)
-                        if hasattr(membership_doc, "sepa_mandate") and membership_doc.sepa_mandate:
-                            has_mandate = 1
-                            sepa_mandate = membership_doc.sepa_mandate
-                            mandate_doc = frappe.get_doc("SEPA Mandate", sepa_mandate)
-                            mandate_status = mandate_doc.status
-                            mandate_reference = mandate_doc.mandate_id
-                    except Exception as e:
-                        frappe.log_error(
-                            f"Error checking membership mandate for invoice {invoice.name}: {str(e)}"
-                        )
-
-                if not has_mandate:
-                    default_mandate = self.get_default_sepa_mandate()
-                    if default_mandate:
-                        has_mandate = 1
-                        sepa_mandate = default_mandate.name
-                        mandate_status = default_mandate.status
-                        mandate_reference = default_mandate.mandate_id
-
-                # ✅ ENHANCED: Get coverage from schedule (SSoT) with invoice fallback
-                coverage_start_date = None
-                coverage_end_date = None
-
-                try:
-                    # PRIMARY: Get coverage from schedule (authoritative source)
-                    schedule_coverage = self._get_coverage_from_schedule(invoice.name)
-
-                    # FALLBACK: Use invoice cache if schedule lookup fails
-                    invoice_coverage = self._get_coverage_from_invoice(invoice)
-
-                    # Use best available source
-                    coverage_start_date = schedule_coverage[0] or invoice_coverage[0]
-                    coverage_end_date = schedule_coverage[1] or invoice_coverage[1]
-
-                    # Validate coverage dates if both are present
-                    if coverage_start_date and coverage_end_date:
-                        # Ensure start date is not after end date
-                        if coverage_start_date > coverage_end_date:
-                            frappe.log_error(
-                                f"Invalid coverage period for invoice {invoice.name}: "
-                                f"start_date ({coverage_start_date}) > end_date ({coverage_end_date})",
-                                "Coverage Date Validation Error",
-                            )
-                            # Reset to None for invalid data
-                            coverage_start_date = None
-                            coverage_end_date = None
-
-                except Exception as e:
-                    # Log error but don't fail payment history loading
-                    frappe.log_error(
-                        f"Error extracting coverage fields for invoice {invoice.name}: {str(e)}",
-                        "Coverage Field Access Error",
-                    )
-                    coverage_start_date = None
-                    coverage_end_date = None
-
-                # Add invoice to payment history
-                self.append(
-                    "payment_history",
-                    {
-                        "invoice": invoice.name,
-                        "posting_date": invoice.posting_date,
-                        "due_date": invoice.due_date,
-                        "coverage_start_date": coverage_start_date,
-                        "coverage_end_date": coverage_end_date,
-                        "transaction_type": transaction_type,
-                        "reference_doctype": reference_doctype,
-                        "reference_name": reference_name,
-                        "amount": invoice.grand_total,
-                        "outstanding_amount": invoice.outstanding_amount,
-                        "status": invoice.status,
-                        "payment_status": payment_status,
-                        "payment_date": payment_date,
-                        "payment_entry": payment_entry,
-                        "payment_method": payment_method,
-                        "paid_amount": paid_amount,
-                        "reconciled": reconciled,
-                        "has_mandate": has_mandate,
-                        "sepa_mandate": sepa_mandate,
-                        "mandate_status": mandate_status,
-                        "mandate_reference": mandate_reference,
-                    },
-                )
-
+                payment_history_rows = build_member_payment_history(self)
             except Exception as e:
-                # Log individual invoice processing error but continue with other invoices
+                # Critical error - log and continue with empty payment history
                 frappe.log_error(
-                    f"Error processing invoice {invoice.name} for payment history: {str(e)}",
-                    "Individual Invoice Processing Error",
+                    f"Critical error loading invoices for customer {self.customer}: {str(e)}",
+                    "Payment History Load Error",
                 )
-                continue  # Skip this invoice and continue with others
-
-        # 3. Find payments that aren't reconciled with any invoice
-        unreconciled_payments = frappe.get_all(
-            "Payment Entry",
-            filters={
-                "party_type": "Customer",
-                "party": self.customer,
-                "docstatus": 1,
-                "name": ["not in", reconciled_payments or [""]],
-            },
-            fields=[
-                "name",
-                "posting_date",
-                "paid_amount",
-                "mode_of_payment",
-                "status",
-                "reference_no",
-                "reference_date",
-            ],
-            order_by="posting_date desc",
-        )
+                payment_history_rows = []
 
-        for payment in unreconciled_payments:
-            donation = None
-            if payment.reference_no:
-                donations = frappe.get_all(
-                    "Donation", filters={"payment_id": payment.reference_no}, fields=["name"]
-                )
-                if donations:
-                    donation = donations[0].name
+        self.payment_history = []
+        for row in payment_history_rows:
+            self.append("payment_history", row)
 
-            transaction_type = "Unreconciled Payment"
-            reference_doctype = None
-            reference_name = None
-            notes = "Payment without matching invoice"
-
-            if donation:
-                transaction_type = "Donation Payment"
-                reference_doctype = "Donation"
-                reference_name = donation
-                notes = "Payment linked to donation"
-
-            self.append(
-                "payment_history",
-                {
-                    "invoice": None,
-                    "posting_date": payment.posting_date,
-                    "due_date": None,
-                    "transaction_type": transaction_type,
-                    "reference_doctype": reference_doctype,
-                    "reference_name": reference_name,
-                    "amount": payment.paid_amount,
-                    "outstanding_amount": 0,
-                    "status": "N/A",
-                    "payment_status": "Paid",
-                    "payment_date": payment.posting_date,
-                    "payment_entry": payment.name,
-                    "payment_method": payment.mode_of_payment,
-                    "paid_amount": payment.paid_amount,
-                    "reconciled": 0,
-                    "notes": notes,
-                },
-            )
+        self._update_payment_history_summary()
+
+    def _update_payment_history_summary(self):
+        """Refresh the denormalized payment history summary fields from the history rows"""
+        outstanding_statuses = ("Unpaid", "Overdue", "Partially Paid")
+        rows = self.payment_history or []
+        outstanding_rows = [
+            row for row in rows if row.get("invoice") and row.get("payment_status") in outstanding_statuses
+        ]
+        payment_dates = [getdate(row.get("payment_date")) for row in rows if row.get("payment_date")]
+
+        self.outstanding_invoice_count = len(outstanding_rows)
+        self.total_outstanding_amount = sum(flt(row.get("outstanding_amount")) for row in outstanding_rows)
+        self.last_payment_date = max(payment_dates) if payment_dates else None
+        self.payment_history_updated_on = now_datetime()
 
     def _get_coverage_from_schedule(self, invoice_name):
         """Get coverage from schedule - direct link, no heuristics (authoritative source)"""
@@ -363,69 +129,11 @@ class PaymentMixin:
 
     def _calculate_coverage_from_invoice_date(self, invoice_date, schedule_info):
         """Calculate coverage period from invoice date and billing frequency"""
-        try:
-            from frappe.utils import add_days, add_months, add_years, getdate
-
-            invoice_date = getdate(invoice_date)
-            billing_frequency = schedule_info.get("billing_frequency", "Daily")
-
-            # Calculate coverage based on billing frequency
-            if billing_frequency == "Daily":
-                # Daily billing: coverage is the same day
-                return (invoice_date, invoice_date)
-            elif billing_frequency == "Weekly":
-                # Weekly billing: coverage is 7 days from invoice date
-                return (invoice_date, add_days(invoice_date, 6))
-            elif billing_frequency == "Monthly":
-                # Monthly billing: coverage is 1 month from invoice date
-                end_date = add_months(invoice_date, 1)
-                end_date = add_days(end_date, -1)  # Last day of coverage month
-                return (invoice_date, end_date)
-            elif billing_frequency == "Quarterly":
-                # Quarterly billing: coverage is 3 months from invoice date
-                end_date = add_months(invoice_date, 3)
-                end_date = add_days(end_date, -1)
-                return (invoice_date, end_date)
-            elif billing_frequency == "Semi-Annual":
-                # Semi-annual billing: coverage is 6 months from invoice date
-                end_date = add_months(invoice_date, 6)
-                end_date = add_days(end_date, -1)
-                return (invoice_date, end_date)
-            elif billing_frequency == "Annual":
-                # Annual billing: coverage is 1 year from invoice date
-                end_date = add_years(invoice_date, 1)
-                end_date = add_days(end_date, -1)
-                return (invoice_date, end_date)
-            elif billing_frequency == "Custom":
-                # Custom frequency: calculate based on custom settings
-                number = schedule_info.get("custom_frequency_number", 1)
-                unit = schedule_info.get("custom_frequency_unit", "Days")
-
-                if unit == "Days":
-                    end_date = add_days(invoice_date, number - 1)
-                elif unit == "Weeks":
-                    end_date = add_days(invoice_date, (number * 7) - 1)
-                elif unit == "Months":
-                    end_date = add_months(invoice_date, number)
-                    end_date = add_days(end_date, -1)
-                elif unit == "Years":
-                    end_date = add_years(invoice_date, number)
-                    end_date = add_days(end_date, -1)
-                else:
-                    # Default to same day
-                    end_date = invoice_date
-
-                return (invoice_date, end_date)
-            else:
-                # Unknown frequency, default to same day
-                return (invoice_date, invoice_date)
+        from verenigingen.verenigingen.doctype.member.payment_history_builder import (
+            calculate_coverage_from_invoice_date,
+        )
 
-        except Exception as e:
-            frappe.log_error(
-                f"Error calculating coverage from invoice date {invoice_date}: {str(e)}",
-                "Coverage Calculation Error",
-            )
-            return (None, None)
+        return calculate_coverage_from_invoice_date(invoice_date, schedule_info)
 
     def _get_coverage_from_invoice(self, invoice):
         """Fallback: get coverage from invoice cache"""
@@ -479,6 +187,12 @@ class PaymentMixin:
             if not self.is_new() and self.has_value_changed("iban"):
                 self.track_iban_change()
 
+        # Indexed copy used for matching bank transactions
+        if hasattr(self, "iban_normalized"):
+            from verenigingen.utils.validation.iban_validator import normalize_iban
+
+            self.iban_normalized = normalize_iban(self.iban)
+
         # Additional validation for SEPA Direct Debit
         if getattr(self, "payment_method", None) == "SEPA Direct Debit":
             if not self.iban:
@@ -768,10 +482,13 @@ class PaymentMixin:
             return True
 
     @frappe.whitelist()
-    def refresh_financial_history(self):
+    def refresh_financial_history(self, payment_history_rows=None):
         """
         Comprehensive financial history refresh.
         This is the method called by the "Refresh Financial History" button and scheduled tasks.
+
+        Args:
+            payment_history_rows: Optional rows prebuilt by the bulk payment history builder
         """
         try:
             # Set flags to reduce activity logging for bulk financial updates
@@ -779,7 +496,7 @@ class PaymentMixin:
             self.flags.ignore_links = True
 
             # 1. Load payment history (invoices, payments, etc.)
-            self._load_payment_history_without_save()
+            self._load_payment_history_without_save(payment_history_rows)
 
             # 2. Refresh dues schedule history if the method exists
             if hasattr(self, "refresh_dues_schedule_history"):
@@ -839,6 +556,8 @@ class PaymentMixin:
                 if len(self.payment_history) > 20:
                     self.payment_history = self.payment_history[:20]
 
+            self._update_payment_history_summary()
+
             # Save with minimal logging
             self.flags.ignore_version = True
             self.flags.ignore_links = True
@@ -868,6 +587,7 @@ class PaymentMixin:
 
             if removed:
                 self.payment_history = updated_history
+                self._update_payment_history_summary()
 
                 # Save with minimal logging
                 self.flags.ignore_version = True
@@ -906,6 +626,8 @@ class PaymentMixin:
                 # Invoice not in history, add it
                 self.add_invoice_to_payment_history(invoice_name)
             else:
+                self._update_payment_history_summary()
+
                 # Save the updates with minimal logging
                 self.flags.ignore_version = True
                 self.flags.ignore_links = True
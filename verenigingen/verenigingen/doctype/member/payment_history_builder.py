@@ -0,0 +1,501 @@
+"""
+Set-based payment history builder for members
+
+Builds Member Payment History rows for many members at once. Invoices, payment
+references, SEPA mandates and dues schedule coverage are fetched in a handful of
+grouped queries and assembled in memory, so a refresh costs a constant number of
+queries per batch instead of roughly ten queries per invoice.
+"""
+
+import frappe
+from frappe.utils import add_days, add_months, add_years, flt, getdate
+
+# Only the most recent invoices are shown in the member's payment history
+MAX_PAYMENT_HISTORY_ENTRIES = 20
+
+# Maximum number of values passed to a single IN clause
+QUERY_CHUNK_SIZE = 500
+
+
+def build_payment_history(members, max_entries=MAX_PAYMENT_HISTORY_ENTRIES):
+    """
+    Build payment history rows for a batch of members.
+
+    Args:
+        members: Iterable of Member documents or dicts with `name` and `customer`
+        max_entries: Maximum number of invoices per customer
+
+    Returns:
+        Dict mapping member name to a list of payment history row dicts, invoices first
+        (newest first) followed by payments that are not reconciled with those invoices
+    """
+    members = [member for member in members if member.get("customer")]
+    if not members:
+        return {}
+
+    member_names = sorted({member.get("name") for member in members})
+    customers = sorted({member.get("customer") for member in members})
+
+    invoices_by_customer = _get_recent_invoices(customers, max_entries)
+    invoices = [invoice for rows in invoices_by_customer.values() for invoice in rows]
+    invoice_names = [invoice.name for invoice in invoices]
+
+    payments_by_invoice = _get_invoice_payments(invoice_names)
+    membership_mandates = _get_membership_mandates(invoices)
+    default_mandates = _get_default_mandates(member_names)
+    linked_coverage, active_schedules = _get_schedule_coverage(member_names, invoice_names)
+
+    reconciled_by_customer = {}
+    for invoice in invoices:
+        payment_info = payments_by_invoice.get(invoice.name)
+        if payment_info:
+            reconciled_by_customer.setdefault(invoice.customer, set()).update(payment_info["entries"])
+
+    unreconciled_by_customer = _get_unreconciled_payments(customers, reconciled_by_customer)
+    donations_by_payment_id = _get_donations_by_payment_id(
+        [
+            payment.reference_no
+            for payments in unreconciled_by_customer.values()
+            for payment in payments
+            if payment.reference_no
+        ]
+    )
+
+    history = {}
+    for member in members:
+        member_name = member.get("name")
+        customer = member.get("customer")
+        rows = []
+
+        for invoice in invoices_by_customer.get(customer, []):
+            try:
+                rows.append(
+                    _build_invoice_row(
+                        invoice,
+                        payments_by_invoice.get(invoice.name),
+                        membership_mandates.get(invoice.name) or default_mandates.get(member_name),
+                        linked_coverage.get((member_name, invoice.name)),
+                        active_schedules.get(member_name),
+                    )
+                )
+            except Exception as e:
+                # Log individual invoice processing error but continue with other invoices
+                frappe.log_error(
+                    f"Error processing invoice {invoice.name} for payment history: {str(e)}",
+                    "Individual Invoice Processing Error",
+                )
+
+        for payment in unreconciled_by_customer.get(customer, []):
+            rows.append(_build_unreconciled_payment_row(payment, donations_by_payment_id))
+
+        history[member_name] = rows
+
+    return history
+
+
+def build_member_payment_history(member):
+    """Build payment history rows for a single member document"""
+    return build_payment_history([member]).get(member.name, [])
+
+
+def calculate_coverage_from_invoice_date(invoice_date, schedule_info):
+    """Calculate coverage period from invoice date and billing frequency"""
+    try:
+        invoice_date = getdate(invoice_date)
+        billing_frequency = schedule_info.get("billing_frequency", "Daily")
+
+        if billing_frequency == "Daily":
+            return (invoice_date, invoice_date)
+        elif billing_frequency == "Weekly":
+            return (invoice_date, add_days(invoice_date, 6))
+        elif billing_frequency == "Monthly":
+            return (invoice_date, add_days(add_months(invoice_date, 1), -1))
+        elif billing_frequency == "Quarterly":
+            return (invoice_date, add_days(add_months(invoice_date, 3), -1))
+        elif billing_frequency == "Semi-Annual":
+            return (invoice_date, add_days(add_months(invoice_date, 6), -1))
+        elif billing_frequency == "Annual":
+            return (invoice_date, add_days(add_years(invoice_date, 1), -1))
+        elif billing_frequency == "Custom":
+            number = schedule_info.get("custom_frequency_number", 1)
+            unit = schedule_info.get("custom_frequency_unit", "Days")
+
+            if unit == "Days":
+                end_date = add_days(invoice_date, number - 1)
+            elif unit == "Weeks":
+                end_date = add_days(invoice_date, (number * 7) - 1)
+            elif unit == "Months":
+                end_date = add_days(add_months(invoice_date, number), -1)
+            elif unit == "Years":
+                end_date = add_days(add_years(invoice_date, number), -1)
+            else:
+                end_date = invoice_date
+
+            return (invoice_date, end_date)
+        else:
+            # Unknown frequency, default to same day
+            return (invoice_date, invoice_date)
+
+    except Exception as e:
+        frappe.log_error(
+            f"Error calculating coverage from invoice date {invoice_date}: {str(e)}",
+            "Coverage Calculation Error",
+        )
+        return (None, None)
+
+
+def get_payment_status(invoice, paid_amount):
+    """Derive the payment history status of an invoice"""
+    if invoice.docstatus == 0:
+        return "Draft"
+    elif invoice.status == "Paid":
+        return "Paid"
+    elif invoice.status == "Overdue":
+        return "Overdue"
+    elif invoice.status == "Cancelled":
+        return "Cancelled"
+    elif paid_amount > 0 and paid_amount < invoice.grand_total:
+        return "Partially Paid"
+    return "Unpaid"
+
+
+def _chunks(values, size=QUERY_CHUNK_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i : i + size]
+
+
+def _get_recent_invoices(customers, max_entries):
+    """Get the most recent invoices (draft and submitted) per customer"""
+    fields = [
+        "name",
+        "customer",
+        "posting_date",
+        "due_date",
+        "grand_total",
+        "outstanding_amount",
+        "status",
+        "docstatus",
+    ]
+
+    # Optional custom fields are only selected when present on this site
+    for fieldname in ("custom_coverage_start_date", "custom_coverage_end_date", "membership"):
+        try:
+            if frappe.db.has_column("Sales Invoice", fieldname):
+                fields.append(fieldname)
+        except Exception as e:
+            frappe.log_error(f"Error checking for coverage fields: {str(e)}", "Coverage Field Check Error")
+
+    select_fields = ", ".join(f"`{fieldname}`" for fieldname in fields)
+    invoices_by_customer = {}
+
+    for chunk in _chunks(customers):
+        invoices = frappe.db.sql(
+            f"""
+            SELECT {select_fields}
+            FROM (
+                SELECT {select_fields},
+                    ROW_NUMBER() OVER (PARTITION BY customer ORDER BY posting_date DESC, creation DESC) AS rn
+                FROM `tabSales Invoice`
+                WHERE customer IN %(customers)s
+                AND docstatus IN (0, 1)
+            ) ranked
+            WHERE rn <= %(max_entries)s
+            ORDER BY customer, posting_date DESC
+        """,
+            {"customers": tuple(chunk), "max_entries": max_entries},
+            as_dict=True,
+        )
+
+        for invoice in invoices:
+            invoices_by_customer.setdefault(invoice.customer, []).append(invoice)
+
+    return invoices_by_customer
+
+
+def _get_invoice_payments(invoice_names):
+    """Get allocated amounts and the most recent payment entry per invoice"""
+    payments_by_invoice = {}
+
+    for chunk in _chunks(invoice_names):
+        references = frappe.db.sql(
+            """
+            SELECT per.reference_name AS invoice, per.parent, per.allocated_amount,
+                pe.posting_date, pe.mode_of_payment
+            FROM `tabPayment Entry Reference` per
+            INNER JOIN `tabPayment Entry` pe ON pe.name = per.parent
+            WHERE per.reference_doctype = 'Sales Invoice'
+            AND per.reference_name IN %(invoices)s
+            ORDER BY pe.posting_date DESC
+        """,
+            {"invoices": tuple(chunk)},
+            as_dict=True,
+        )
+
+        for ref in references:
+            info = payments_by_invoice.setdefault(
+                ref.invoice, {"paid_amount": 0, "entries": set(), "latest": None}
+            )
+            allocated_amount = ref.allocated_amount or 0
+            if allocated_amount < 0:
+                frappe.log_error(
+                    f"Negative allocated amount in payment entry {ref.parent}: {allocated_amount}",
+                    "PaymentValidation",
+                )
+            info["paid_amount"] += flt(allocated_amount)
+            info["entries"].add(ref.parent)
+            # Rows are ordered by posting date, so the first one is the most recent payment
+            if not info["latest"]:
+                info["latest"] = ref
+
+    return payments_by_invoice
+
+
+def _get_membership_mandates(invoices):
+    """Get the SEPA mandate of the membership linked to each invoice, when tracked"""
+    membership_invoices = {invoice.name: invoice.membership for invoice in invoices if invoice.get("membership")}
+    if not membership_invoices or not frappe.db.has_column("Membership", "sepa_mandate"):
+        return {}
+
+    memberships = {}
+    for chunk in _chunks(set(membership_invoices.values())):
+        for row in frappe.db.sql(
+            """
+            SELECT ms.name AS membership, sm.name, sm.status, sm.mandate_id
+            FROM `tabMembership` ms
+            INNER JOIN `tabSEPA Mandate` sm ON sm.name = ms.sepa_mandate
+            WHERE ms.name IN %(memberships)s
+        """,
+            {"memberships": tuple(chunk)},
+            as_dict=True,
+        ):
+            memberships[row.membership] = row
+
+    return {
+        invoice_name: memberships[membership]
+        for invoice_name, membership in membership_invoices.items()
+        if membership in memberships
+    }
+
+
+def _get_default_mandates(member_names):
+    """
+    Get the default SEPA mandate per member: the current linked mandate when it is
+    active, otherwise the first active mandate of the member.
+    """
+    current_mandates = {}
+    active_mandates = {}
+
+    for chunk in _chunks(member_names):
+        for row in frappe.db.sql(
+            """
+            SELECT link.parent AS member, sm.name, sm.status, sm.mandate_id
+            FROM `tabMember SEPA Mandate Link` link
+            INNER JOIN `tabSEPA Mandate` sm ON sm.name = link.sepa_mandate
+            WHERE link.parenttype = 'Member'
+            AND link.parent IN %(members)s
+            AND link.is_current = 1
+            AND sm.status = 'Active' AND sm.is_active = 1
+            ORDER BY link.idx
+        """,
+            {"members": tuple(chunk)},
+            as_dict=True,
+        ):
+            current_mandates.setdefault(row.member, row)
+
+        for row in frappe.db.sql(
+            """
+            SELECT member, name, status, mandate_id
+            FROM `tabSEPA Mandate`
+            WHERE member IN %(members)s
+            AND status = 'Active' AND is_active = 1
+            ORDER BY modified DESC
+        """,
+            {"members": tuple(chunk)},
+            as_dict=True,
+        ):
+            active_mandates.setdefault(row.member, row)
+
+    return {member: current_mandates.get(member) or active_mandates.get(member) for member in member_names}
+
+
+def _get_schedule_coverage(member_names, invoice_names):
+    """
+    Get coverage periods for invoices directly linked to a dues schedule, plus the latest
+    active schedule per member for calculating coverage of other invoices.
+    """
+    linked_coverage = {}
+    active_schedules = {}
+
+    invoice_set = set(invoice_names)
+    for chunk in _chunks(member_names):
+        if invoice_set:
+            for row in frappe.db.sql(
+                """
+                SELECT member, last_generated_invoice, last_invoice_coverage_start, last_invoice_coverage_end
+                FROM `tabMembership Dues Schedule`
+                WHERE member IN %(members)s
+                AND last_generated_invoice IS NOT NULL
+                AND last_invoice_coverage_start IS NOT NULL
+            """,
+                {"members": tuple(chunk)},
+                as_dict=True,
+            ):
+                if row.last_generated_invoice in invoice_set:
+                    linked_coverage.setdefault(
+                        (row.member, row.last_generated_invoice),
+                        (row.last_invoice_coverage_start, row.last_invoice_coverage_end),
+                    )
+
+        for row in frappe.db.sql(
+            """
+            SELECT member, name, billing_frequency, custom_frequency_number, custom_frequency_unit
+            FROM `tabMembership Dues Schedule`
+            WHERE member IN %(members)s
+            AND status = 'Active'
+            ORDER BY creation DESC
+        """,
+            {"members": tuple(chunk)},
+            as_dict=True,
+        ):
+            active_schedules.setdefault(row.member, row)
+
+    return linked_coverage, active_schedules
+
+
+def _get_unreconciled_payments(customers, reconciled_by_customer):
+    """Get submitted payments per customer that are not linked to any of the loaded invoices"""
+    payments_by_customer = {}
+
+    for chunk in _chunks(customers):
+        for payment in frappe.db.sql(
+            """
+            SELECT name, party, posting_date, paid_amount, mode_of_payment, status,
+                reference_no, reference_date
+            FROM `tabPayment Entry`
+            WHERE party_type = 'Customer'
+            AND party IN %(customers)s
+            AND docstatus = 1
+            ORDER BY posting_date DESC
+        """,
+            {"customers": tuple(chunk)},
+            as_dict=True,
+        ):
+            if payment.name in reconciled_by_customer.get(payment.party, ()):
+                continue
+            payments_by_customer.setdefault(payment.party, []).append(payment)
+
+    return payments_by_customer
+
+
+def _get_donations_by_payment_id(payment_ids):
+    """Map payment references to the donation they belong to"""
+    donations = {}
+    for chunk in _chunks(set(payment_ids)):
+        for row in frappe.get_all(
+            "Donation", filters={"payment_id": ["in", chunk]}, fields=["name", "payment_id"]
+        ):
+            donations.setdefault(row.payment_id, row.name)
+    return donations
+
+
+def _build_invoice_row(invoice, payment_info, mandate, linked_coverage, active_schedule):
+    """Assemble a payment history row for an invoice from prefetched data"""
+    reference_doctype = None
+    reference_name = None
+    transaction_type = "Regular Invoice"
+
+    if invoice.get("membership"):
+        transaction_type = "Membership Invoice"
+        reference_doctype = "Membership"
+        reference_name = invoice.membership
+
+    paid_amount = 0
+    payment_date = None
+    payment_entry = None
+    payment_method = None
+    reconciled = 0
+
+    if payment_info:
+        paid_amount = payment_info["paid_amount"]
+        latest = payment_info["latest"]
+        payment_entry = latest.parent
+        payment_date = latest.posting_date
+        payment_method = latest.mode_of_payment
+        reconciled = 1
+
+    # Coverage from the schedule (authoritative source) with the invoice cache as fallback
+    schedule_coverage = linked_coverage or (None, None)
+    if not schedule_coverage[0] and active_schedule:
+        schedule_coverage = calculate_coverage_from_invoice_date(invoice.posting_date, active_schedule)
+
+    coverage_start_date = schedule_coverage[0] or invoice.get("custom_coverage_start_date")
+    coverage_end_date = schedule_coverage[1] or invoice.get("custom_coverage_end_date")
+
+    if coverage_start_date and coverage_end_date and getdate(coverage_start_date) > getdate(coverage_end_date):
+        frappe.log_error(
+            f"Invalid coverage period for invoice {invoice.name}: "
+            f"start_date ({coverage_start_date}) > end_date ({coverage_end_date})",
+            "Coverage Date Validation Error",
+        )
+        coverage_start_date = None
+        coverage_end_date = None
+
+    return {
+        "invoice": invoice.name,
+        "posting_date": invoice.posting_date,
+        "due_date": invoice.due_date,
+        "coverage_start_date": coverage_start_date,
+        "coverage_end_date": coverage_end_date,
+        "transaction_type": transaction_type,
+        "reference_doctype": reference_doctype,
+        "reference_name": reference_name,
+        "amount": invoice.grand_total,
+        "outstanding_amount": invoice.outstanding_amount,
+        "status": invoice.status,
+        "payment_status": get_payment_status(invoice, paid_amount),
+        "payment_date": payment_date,
+        "payment_entry": payment_entry,
+        "payment_method": payment_method,
+        "paid_amount": paid_amount,
+        "reconciled": reconciled,
+        "has_mandate": 1 if mandate else 0,
+        "sepa_mandate": mandate.name if mandate else None,
+        "mandate_status": mandate.status if mandate else None,
+        "mandate_reference": mandate.mandate_id if mandate else None,
+    }
+
+
+def _build_unreconciled_payment_row(payment, donations_by_payment_id):
+    """Assemble a payment history row for a payment without a matching invoice"""
+    donation = donations_by_payment_id.get(payment.reference_no) if payment.reference_no else None
+
+    transaction_type = "Unreconciled Payment"
+    reference_doctype = None
+    reference_name = None
+    notes = "Payment without matching invoice"
+
+    if donation:
+        transaction_type = "Donation Payment"
+        reference_doctype = "Donation"
+        reference_name = donation
+        notes = "Payment linked to donation"
+
+    return {
+        "invoice": None,
+        "posting_date": payment.posting_date,
+        "due_date": None,
+        "transaction_type": transaction_type,
+        "reference_doctype": reference_doctype,
+        "reference_name": reference_name,
+        "amount": payment.paid_amount,
+        "outstanding_amount": 0,
+        "status": "N/A",
+        "payment_status": "Paid",
+        "payment_date": payment.posting_date,
+        "payment_entry": payment.name,
+        "payment_method": payment.mode_of_payment,
+        "paid_amount": payment.paid_amount,
+        "reconciled": 0,
+        "notes": notes,
+    }
@@ -1,20 +1,39 @@
+import json
 import traceback
 
 import frappe
-from frappe.utils import now
+from frappe import _
+from frappe.utils import add_to_date, cint, now, now_datetime
 from frappe.utils.background_jobs import enqueue
 
+# Number of members whose payment history is built together in one set of queries
+HISTORY_BUILD_CHUNK_SIZE = 200
 
-def refresh_all_member_financial_histories():
+# Number of members per checkpointed refresh shard
+REFRESH_SHARD_SIZE = 500
+
+# Queues the refresh shards are spread over, so several workers can pick them up
+REFRESH_QUEUES = ("long", "default")
+
+# Seconds after which an unfinished shard is considered interrupted (job timeout plus margin)
+REFRESH_SHARD_STALE_AFTER = 2 * 3600
+
+# Times a shard may be queued before its run is abandoned and a new run starts from the watermark
+REFRESH_SHARD_MAX_ATTEMPTS = 3
+
+
+def refresh_all_member_financial_histories(full_rebuild=False):
     """
-    Scheduled task to refresh payment, dues schedule, and invoice histories for all members.
+    Scheduled task to refresh payment, dues schedule, and invoice histories for members.
     Runs twice daily (morning and evening) to keep member financial data up-to-date.
 
-    This replicates the functionality of the "Refresh Financial History" button
-    for all members with customer records.
+    By default the refresh is incremental: only members whose customer had a Sales Invoice,
+    Payment Entry or Membership Dues Schedule change since the last stored watermark are
+    rebuilt. Pass full_rebuild=True to refresh every member with a customer record, which
+    replicates the "Refresh Financial History" button for all members.
     """
 
-    from frappe.utils import get_datetime, now_datetime
+    from frappe.utils import get_datetime
 
     # Check if we should run twice daily
     current_time = now_datetime()
@@ -51,6 +70,10 @@ def refresh_all_member_financial_histories():
             should_run = True
             run_reason = f"Error parsing last run time: {str(e)}"
 
+    if full_rebuild and not should_run:
+        should_run = True
+        run_reason = "Explicit full rebuild"
+
     if not should_run:
         frappe.logger().info(
             f"Skipping member history refresh - last run was recent (current hour: {current_hour})"
@@ -60,40 +83,64 @@ def refresh_all_member_financial_histories():
     frappe.logger().info(f"Starting scheduled member financial history refresh - {run_reason}")
 
     try:
-        # Get all members with customer records (only these need financial history updates)
-        members = frappe.get_all(
-            "Member",
-            filters={"customer": ["!=", ""], "docstatus": ["!=", 2]},  # Exclude cancelled members
-            fields=["name", "full_name", "customer"],
-        )
+        # Resume an interrupted sharded run before starting a new one
+        incomplete_run = get_incomplete_member_history_refresh_run()
+        if incomplete_run and not _abandon_exhausted_member_history_refresh_run(incomplete_run):
+            result = resume_member_history_refresh(incomplete_run)
+            _update_member_history_run_markers(current_time)
+            result["run_reason"] = f"{run_reason} - resumed interrupted run {incomplete_run}"
+            return result
+
+        # Capture the new watermark before reading changes, so documents modified while this
+        # run is in progress are picked up again by the next run instead of being skipped
+        new_watermark = current_time
+        watermark = None
+        if not full_rebuild:
+            watermark = frappe.db.get_single_value("Verenigingen Settings", "member_history_watermark")
+
+        if watermark:
+            members = get_members_with_financial_changes(watermark)
+            mode = "incremental"
+        else:
+            # Get all members with customer records (only these need financial history updates)
+            members = frappe.get_all(
+                "Member",
+                filters={"customer": ["!=", ""], "docstatus": ["!=", 2]},  # Exclude cancelled members
+                fields=["name", "full_name", "customer"],
+            )
+            mode = "full"
 
         if not members:
-            frappe.logger().info("No members with customer records found")
-            return {"success": True, "message": "No members to process", "processed": 0}
+            frappe.logger().info(f"No members need a financial history refresh ({mode} mode)")
+            _update_member_history_run_markers(current_time, new_watermark)
+            return {
+                "success": True,
+                "message": "No members to process",
+                "processed": 0,
+                "mode": mode,
+                "run_reason": run_reason,
+            }
 
-        frappe.logger().info(f"Found {len(members)} members to process")
+        frappe.logger().info(f"Found {len(members)} members to process ({mode} mode)")
 
-        # For large datasets, use background jobs to avoid timeout
+        # For large datasets, use sharded background jobs to avoid timeout. The watermark is
+        # stored with the shards and only advanced once every shard has completed.
         if len(members) > 100:
-            result = enqueue_member_history_refresh(members)
+            result = enqueue_member_history_refresh(members, watermark=new_watermark)
+            if result and result.get("success"):
+                _update_member_history_run_markers(current_time)
         else:
             # Process smaller datasets synchronously
             result = process_member_history_batch(members)
 
-        # Update the last run time if successful
-        if result and result.get("success"):
-            try:
-                frappe.db.set_single_value(
-                    "Verenigingen Settings", "last_member_history_refresh", current_time
-                )
-                frappe.db.commit()
-                frappe.logger().info("Updated last member history refresh time")
-            except Exception as e:
-                frappe.logger().warning(f"Could not update last run time: {str(e)}")
+            # Update the last run time and watermark if successful
+            if result and result.get("success"):
+                _update_member_history_run_markers(current_time, new_watermark)
 
         # Add run reason to result
         if result and isinstance(result, dict):
             result["run_reason"] = run_reason
+            result["mode"] = mode
 
         return result
 
@@ -104,21 +151,121 @@ def refresh_all_member_financial_histories():
         return {"success": False, "message": error_msg}
 
 
+def get_members_with_financial_changes(since):
+    """
+    Get members whose financial history may be stale because related documents changed.
+
+    Looks at the `modified` timestamps of Sales Invoice, Payment Entry and Membership Dues
+    Schedule after the given watermark and resolves them to members with a customer record.
+
+    Args:
+        since: Datetime watermark; only documents modified after it are considered
+
+    Returns:
+        List of member dicts with name, full_name and customer
+    """
+    changed_customers = set()
+
+    invoice_customers = frappe.db.sql(
+        """
+        SELECT DISTINCT customer
+        FROM `tabSales Invoice`
+        WHERE modified > %s AND IFNULL(customer, '') != ''
+    """,
+        (since,),
+    )
+    changed_customers.update(row[0] for row in invoice_customers)
+
+    payment_customers = frappe.db.sql(
+        """
+        SELECT DISTINCT party
+        FROM `tabPayment Entry`
+        WHERE modified > %s AND party_type = 'Customer' AND IFNULL(party, '') != ''
+    """,
+        (since,),
+    )
+    changed_customers.update(row[0] for row in payment_customers)
+
+    schedule_members = frappe.db.sql(
+        """
+        SELECT DISTINCT member
+        FROM `tabMembership Dues Schedule`
+        WHERE modified > %s AND IFNULL(member, '') != ''
+    """,
+        (since,),
+    )
+    changed_members = {row[0] for row in schedule_members}
+
+    if not changed_customers and not changed_members:
+        return []
+
+    members = {}
+    base_filters = {"customer": ["!=", ""], "docstatus": ["!=", 2]}
+    lookups = [("customer", sorted(changed_customers)), ("name", sorted(changed_members))]
+
+    for fieldname, values in lookups:
+        # Chunk the IN lists so bursts of changes don't produce oversized queries
+        for i in range(0, len(values), 1000):
+            filters = dict(base_filters)
+            filters[fieldname] = ["in", values[i : i + 1000]]
+            for member in frappe.get_all("Member", filters=filters, fields=["name", "full_name", "customer"]):
+                members[member.name] = member
+
+    return list(members.values())
+
+
+def _update_member_history_run_markers(run_time=None, watermark=None):
+    """Persist the last run time and/or the change watermark of the member history refresh"""
+    try:
+        if run_time:
+            frappe.db.set_single_value("Verenigingen Settings", "last_member_history_refresh", run_time)
+        if watermark:
+            frappe.db.set_single_value("Verenigingen Settings", "member_history_watermark", watermark)
+        frappe.db.commit()
+        frappe.logger().info("Updated last member history refresh markers")
+    except Exception as e:
+        frappe.logger().warning(f"Could not update last run time: {str(e)}")
+
+
+@frappe.whitelist()
+def run_full_member_history_refresh():
+    """
+    Explicitly rebuild the financial history of every member with a customer record,
+    ignoring the incremental watermark.
+    """
+    if not frappe.has_permission("Member", "write"):
+        frappe.throw(_("Insufficient permissions"))
+
+    return refresh_all_member_financial_histories(full_rebuild=True)
+
+
 def process_member_history_batch(members):
     """
     Process a batch of members for financial history refresh.
     """
+    from verenigingen.verenigingen.doctype.member.payment_history_builder import build_payment_history
+
     success_count = 0
     error_count = 0
     errors = []
+    payment_histories = {}
+
+    for idx, member_data in enumerate(members):
+        # Build payment history rows for the next chunk of members in grouped queries
+        if idx % HISTORY_BUILD_CHUNK_SIZE == 0:
+            chunk = members[idx : idx + HISTORY_BUILD_CHUNK_SIZE]
+            try:
+                payment_histories = build_payment_history(chunk)
+            except Exception as e:
+                frappe.logger().error(f"Error building bulk payment history: {str(e)}")
+                payment_histories = {}
 
-    for member_data in members:
         try:
             # Get the member document
             member = frappe.get_doc("Member", member_data.name)
 
-            # Use the mixin method for consistency
-            result = member.refresh_financial_history()
+            # Use the mixin method for consistency, with the prebuilt rows when available
+            result = member.refresh_financial_history(payment_histories.get(member_data.name))
 
             if result.get("success"):
                 success_count += 1
@@ -161,9 +308,18 @@ def process_member_history_batch(members):
 
 
 @frappe.whitelist()
-def enqueue_member_history_refresh(members=None):
+def enqueue_member_history_refresh(members=None, shard_size=None, watermark=None):
     """
-    Enqueue member financial history refresh as a background job for large datasets.
+    Enqueue member financial history refresh as sharded background jobs for large datasets.
+
+    The member set is split into fixed-size shards, each tracked by a Member History Refresh
+    Shard record and spread over several queues. Completed shards act as checkpoints, so an
+    interrupted run can be resumed with resume_member_history_refresh without redoing them.
+
+    Args:
+        members: List of member dicts; defaults to all members with a customer record
+        shard_size: Number of members per shard
+        watermark: Change watermark to store once every shard has completed
     """
     if members is None:
         # Get all members if not provided
@@ -172,15 +328,249 @@ def enqueue_member_history_refresh(members=None):
             filters={"customer": ["!=", ""], "docstatus": ["!=", 2]},
             fields=["name", "full_name", "customer"],
         )
+    elif isinstance(members, str):
+        members = json.loads(members)
+
+    shard_size = cint(shard_size) or REFRESH_SHARD_SIZE
+    member_names = sorted({member.get("name") if isinstance(member, dict) else member for member in members})
+    if not member_names:
+        return {"success": True, "message": "No members to process", "shards": 0}
+
+    run_id = f"MHR-{now_datetime().strftime('%Y%m%d%H%M%S')}-{frappe.generate_hash(length=6)}"
+
+    shards = []
+    for shard_index, start in enumerate(range(0, len(member_names), shard_size)):
+        shard_members = member_names[start : start + shard_size]
+        shard = frappe.get_doc(
+            {
+                "doctype": "Member History Refresh Shard",
+                "run_id": run_id,
+                "shard_index": shard_index,
+                "status": "Pending",
+                "queue": REFRESH_QUEUES[shard_index % len(REFRESH_QUEUES)],
+                "total_members": len(shard_members),
+                "members": json.dumps(shard_members),
+                "watermark": watermark,
+            }
+        )
+        shard.insert(ignore_permissions=True)
+        shards.append(shard)
+
+    # Shard records must be visible to the workers before the jobs start
+    frappe.db.commit()
+
+    for shard in shards:
+        _enqueue_refresh_shard(shard.name, shard.queue)
+
+    frappe.logger().info(
+        f"Queued member history refresh run {run_id}: {len(member_names)} members in {len(shards)} shards"
+    )
+
+    return {
+        "success": True,
+        "message": f"Queued financial history refresh for {len(member_names)} members in {len(shards)} shards",
+        "run_id": run_id,
+        "shards": len(shards),
+        "queued": len(member_names),
+    }
+
+
+def _enqueue_refresh_shard(shard_name, queue):
+    """Enqueue a single refresh shard, mark it as queued and count the attempt"""
+    attempts = cint(frappe.db.get_value("Member History Refresh Shard", shard_name, "attempts"))
+    frappe.db.set_value(
+        "Member History Refresh Shard", shard_name, {"status": "Queued", "attempts": attempts + 1}
+    )
+    frappe.db.commit()
+
+    enqueue(
+        process_member_history_shard,
+        queue=queue,
+        timeout=3600,
+        job_name=f"refresh_member_financial_histories_{shard_name}",
+        shard_name=shard_name,
+    )
+
+
+def process_member_history_shard(shard_name):
+    """
+    Background job: refresh the financial history of the members in one shard and record
+    the outcome as a checkpoint.
+    """
+    shard = frappe.get_doc("Member History Refresh Shard", shard_name)
+    if shard.status == "Completed":
+        return {"success": True, "message": f"Shard {shard_name} already completed", "skipped": True}
+
+    shard.db_set({"status": "Running", "started_at": now_datetime(), "error_message": None})
+    frappe.db.commit()
+
+    try:
+        member_names = json.loads(shard.members or "[]")
+        members = frappe.get_all(
+            "Member",
+            filters={"name": ["in", member_names], "customer": ["!=", ""]},
+            fields=["name", "full_name", "customer"],
+            order_by="name",
+        )
+
+        result = process_member_history_batch(members)
+
+        shard.db_set(
+            {
+                "status": "Completed",
+                "processed": result.get("processed", 0),
+                "errors": result.get("errors", 0),
+                "completed_at": now_datetime(),
+            }
+        )
+        frappe.db.commit()
+
+        _finalize_member_history_refresh_run(shard.run_id)
+        return result
+
+    except Exception as e:
+        frappe.db.rollback()
+        shard.db_set({"status": "Failed", "error_message": str(e)[:1000]})
+        frappe.db.commit()
+        frappe.logger().error(f"Member history refresh shard {shard_name} failed: {str(e)}")
+        raise
+
+
+def _finalize_member_history_refresh_run(run_id):
+    """Advance the change watermark once every shard of a run has completed"""
+    shards = frappe.get_all(
+        "Member History Refresh Shard", filters={"run_id": run_id}, fields=["status", "watermark"]
+    )
+    if not shards or any(shard.status != "Completed" for shard in shards):
+        return False
+
+    watermark = shards[0].watermark
+    if watermark:
+        _update_member_history_run_markers(watermark=watermark)
+
+    frappe.logger().info(f"Member history refresh run {run_id} completed")
+    return True
+
+
+def get_incomplete_member_history_refresh_run():
+    """
+    Get the run id of the most recent sharded refresh that did not finish: it has failed
+    shards, or shards that stayed pending/queued/running longer than a job may take.
+    """
+    stale_before = add_to_date(now_datetime(), seconds=-REFRESH_SHARD_STALE_AFTER)
+
+    rows = frappe.db.sql(
+        """
+        SELECT run_id
+        FROM `tabMember History Refresh Shard`
+        WHERE status = 'Failed'
+        OR (status IN ('Pending', 'Queued', 'Running') AND modified < %s)
+        ORDER BY creation DESC
+        LIMIT 1
+    """,
+        (stale_before,),
+    )
+    return rows[0][0] if rows else None
+
+
+def _abandon_exhausted_member_history_refresh_run(run_id):
+    """
+    Abandon a run when one of its unfinished shards has used up its attempts, so a shard that
+    keeps failing does not block new runs. The watermark of an abandoned run is never stored,
+    so the next incremental run picks up its changes again from the previous watermark.
+    """
+    shards = frappe.get_all(
+        "Member History Refresh Shard",
+        filters={"run_id": run_id, "status": ["not in", ["Completed", "Abandoned"]]},
+        fields=["name", "attempts"],
+    )
+    if not any(cint(shard.attempts) >= REFRESH_SHARD_MAX_ATTEMPTS for shard in shards):
+        return False
+
+    for shard in shards:
+        frappe.db.set_value("Member History Refresh Shard", shard.name, "status", "Abandoned")
+    frappe.db.commit()
+
+    frappe.logger().warning(
+        f"Abandoned member history refresh run {run_id}: shards failed {REFRESH_SHARD_MAX_ATTEMPTS} times"
+    )
+    return True
+
+
+@frappe.whitelist()
+def resume_member_history_refresh(run_id=None):
+    """
+    Resume an interrupted sharded refresh, re-enqueueing only shards that did not complete.
+
+    Args:
+        run_id: Run to resume; defaults to the most recent incomplete run
+    """
+    run_id = run_id or get_incomplete_member_history_refresh_run()
+    if not run_id:
+        return {"success": True, "message": "No interrupted member history refresh to resume", "shards": 0}
+
+    shards = frappe.get_all(
+        "Member History Refresh Shard",
+        filters={"run_id": run_id, "status": ["not in", ["Completed", "Abandoned"]]},
+        fields=["name", "queue"],
+        order_by="shard_index asc",
+    )
+
+    for shard in shards:
+        _enqueue_refresh_shard(shard.name, shard.queue or REFRESH_QUEUES[0])
+
+    frappe.logger().info(f"Resumed member history refresh run {run_id}: {len(shards)} shards re-queued")
+
+    return {
+        "success": True,
+        "message": f"Resumed run {run_id} with {len(shards)} remaining shards",
+        "run_id": run_id,
+        "shards": len(shards),
+    }
+
+
+def get_member_history_refresh_progress(run_id=None):
+    """Get shard progress of a sharded refresh run (defaults to the latest run)"""
+    if not run_id:
+        latest = frappe.get_all(
+            "Member History Refresh Shard", fields=["run_id"], order_by="creation desc", limit=1
+        )
+        if not latest:
+            return None
+        run_id = latest[0].run_id
 
-    return enqueue(
-        process_member_history_batch,
-        queue="long",
-        timeout=3600,  # 1 hour timeout for large datasets
-        job_name="refresh_member_financial_histories",
-        members=members,
+    rows = frappe.db.sql(
+        """
+        SELECT status, COUNT(*) AS shards, SUM(total_members) AS members,
+            SUM(processed) AS processed, SUM(errors) AS errors,
+            MIN(started_at) AS started_at, MAX(completed_at) AS completed_at
+        FROM `tabMember History Refresh Shard`
+        WHERE run_id = %s
+        GROUP BY status
+    """,
+        (run_id,),
+        as_dict=True,
     )
 
+    shards_by_status = {row.status: cint(row.shards) for row in rows}
+    total_shards = sum(shards_by_status.values())
+    completed_shards = shards_by_status.get("Completed", 0)
+
+    return {
+        "run_id": run_id,
+        "total_shards": total_shards,
+        "shards_by_status": shards_by_status,
+        "total_members": sum(cint(row.members) for row in rows),
+        "processed_members": sum(cint(row.processed) for row in rows),
+        "errors": sum(cint(row.errors) for row in rows),
+        "started_at": min((row.started_at for row in rows if row.started_at), default=None),
+        "completed_at": max((row.completed_at for row in rows if row.completed_at), default=None)
+        if completed_shards == total_shards
+        else None,
+        "progress_percentage": round(completed_shards / total_shards * 100, 2) if total_shards else 0,
+        "is_complete": total_shards > 0 and completed_shards == total_shards,
+    }
+
 
 @frappe.whitelist()
 def refresh_specific_member_histories(member_names):
@@ -254,6 +644,7 @@ def get_member_history_refresh_status():
             "members_with_payment_history": members_with_history,
             "recent_updates_24h": recent_updates,
             "last_refresh_time": now(),
+            "current_run": get_member_history_refresh_progress(),
             "coverage_percentage": round((members_with_history / total_members * 100), 2)
             if total_members > 0
             else 0,
@@ -321,91 +712,33 @@ def update_all_membership_durations():
     """
     Scheduled task to update membership duration calculations for all members.
     Runs daily to keep duration data current for filtering and reporting.
+
+    Durations are computed for all members from the Membership table in one pass and only
+    changed values are written, in batches. Use update_single_member_duration to
+    recompute a single member through the document.
     """
+    from verenigingen.verenigingen.doctype.member.membership_duration import (
+        update_all_membership_durations_bulk,
+    )
 
     frappe.logger().info("Starting scheduled membership duration updates")
 
     try:
-        # Get all active members (exclude cancelled)
-        members = frappe.get_all(
-            "Member",
-            filters={
-                "docstatus": ["!=", 2],  # Exclude cancelled members
-                "status": ["not in", ["Deceased", "Banned"]],  # Exclude inactive statuses
-            },
-            fields=["name", "full_name", "total_membership_days", "last_duration_update"],
-        )
-
-        if not members:
-            frappe.logger().info("No members found for duration update")
-            return {"success": True, "message": "No members to process", "processed": 0}
-
-        frappe.logger().info(f"Found {len(members)} members to process")
-
-        # Process in batches to avoid memory issues
-        batch_size = 100
-        total_processed = 0
-        total_updated = 0
-        errors = []
-
-        for i in range(0, len(members), batch_size):
-            batch = members[i : i + batch_size]
-
-            for member_data in batch:
-                try:
-                    # Get the member document
-                    member = frappe.get_doc("Member", member_data.name)
-
-                    # Calculate new duration
-                    new_total_days = member.calculate_total_membership_days()
-                    old_total_days = getattr(member, "total_membership_days", 0) or 0
+        result = update_all_membership_durations_bulk()
 
-                    # Only update if the value has changed, never been set, or cumulative duration is missing
-                    needs_update = (
-                        new_total_days != old_total_days
-                        or not member_data.last_duration_update
-                        or not getattr(member, "cumulative_membership_duration", None)
-                    )
-
-                    if needs_update:
-                        member.total_membership_days = new_total_days
-                        member.last_duration_update = now()
-                        member.calculate_cumulative_membership_duration()
-
-                        # Save without triggering full validation to avoid recursive calls
-                        member.save(ignore_permissions=True)
-                        total_updated += 1
-
-                        if total_updated % 50 == 0:
-                            frappe.logger().info(f"Updated {total_updated} member durations")
-
-                    total_processed += 1
-
-                except Exception as e:
-                    error_msg = f"Error updating duration for member {member_data.name}: {str(e)}"
-                    errors.append(error_msg)
-                    frappe.logger().error(error_msg)
-                    continue
-
-            # Commit after each batch to avoid long transactions
-            frappe.db.commit()
-
-        # Log final results
-        result_message = f"Membership duration update completed: {total_updated} updated out of {total_processed} processed"
+        result_message = (
+            f"Membership duration update completed: {result['updated']} updated "
+            f"out of {result['processed']} processed"
+        )
         frappe.logger().info(result_message)
 
-        if errors:
-            frappe.logger().warning(
-                f"Errors occurred during duration updates: {errors[:5]}"
-            )  # Log first 5 errors
-
         return {
             "success": True,
             "message": result_message,
-            "processed": total_processed,
-            "updated": total_updated,
-            "errors": len(errors),
-            "error_details": errors if len(errors) <= 10 else errors[:10],
+            "processed": result["processed"],
+            "updated": result["updated"],
+            "errors": 0,
+            "error_details": [],
         }
 
     except Exception as e:
@@ -0,0 +1,325 @@
+"""
+Set-based invoice eligibility for membership dues schedules
+
+Evaluates the checks of `MembershipDuesSchedule.can_generate_invoice` (member status,
+active membership, dues rate, membership type consistency, generation date and
+duplicate invoices) for all candidate schedules with a few grouped queries, instead of
+loading every schedule document and querying per schedule. Only the schedules that pass
+need to be loaded as documents by the invoice generation job.
+"""
+
+from collections import defaultdict
+
+import frappe
+from frappe.utils import add_days, add_months, add_years, flt, getdate, today
+
+# Member statuses that must never be billed
+NON_BILLABLE_MEMBER_STATUSES = ("Terminated", "Expelled", "Deceased", "Suspended", "Quit")
+
+# Number of members / customers per IN clause
+ELIGIBILITY_CHUNK_SIZE = 1000
+
+# Default number of days before the next invoice date an invoice may be generated
+DEFAULT_INVOICE_DAYS_BEFORE = 30
+
+
+def get_billing_period(
+    billing_frequency, invoice_date, custom_frequency_number=None, custom_frequency_unit=None
+):
+    """Calculate the billing period start and end dates for a given invoice date"""
+    invoice_date = getdate(invoice_date)
+
+    if billing_frequency == "Daily":
+        # For daily billing, the period is just the single day
+        return invoice_date, invoice_date
+    elif billing_frequency == "Weekly":
+        # Weekly period: Monday to Sunday
+        days_since_monday = invoice_date.weekday()
+        period_start = add_days(invoice_date, -days_since_monday)
+        period_end = add_days(period_start, 6)
+        return period_start, period_end
+    elif billing_frequency == "Monthly":
+        # Monthly period: 1st to last day of month
+        period_start = invoice_date.replace(day=1)
+        # Get last day of month
+        if invoice_date.month == 12:
+            next_month = invoice_date.replace(year=invoice_date.year + 1, month=1, day=1)
+        else:
+            next_month = invoice_date.replace(month=invoice_date.month + 1, day=1)
+        period_end = add_days(next_month, -1)
+        return period_start, period_end
+    elif billing_frequency == "Quarterly":
+        # Quarterly periods: Q1 (Jan-Mar), Q2 (Apr-Jun), Q3 (Jul-Sep), Q4 (Oct-Dec)
+        quarter = (invoice_date.month - 1) // 3 + 1
+        period_start = invoice_date.replace(month=(quarter - 1) * 3 + 1, day=1)
+        period_end_month = quarter * 3
+        if period_end_month == 12:
+            period_end = invoice_date.replace(month=12, day=31)
+        else:
+            next_quarter = invoice_date.replace(month=period_end_month + 1, day=1)
+            period_end = add_days(next_quarter, -1)
+        return period_start, period_end
+    elif billing_frequency == "Semi-Annual":
+        # Semi-annual: H1 (Jan-Jun), H2 (Jul-Dec)
+        if invoice_date.month <= 6:
+            period_start = invoice_date.replace(month=1, day=1)
+            period_end = invoice_date.replace(month=6, day=30)
+        else:
+            period_start = invoice_date.replace(month=7, day=1)
+            period_end = invoice_date.replace(month=12, day=31)
+        return period_start, period_end
+    elif billing_frequency == "Annual":
+        # Annual period: Jan 1 to Dec 31
+        period_start = invoice_date.replace(month=1, day=1)
+        period_end = invoice_date.replace(month=12, day=31)
+        return period_start, period_end
+    elif billing_frequency == "Custom":
+        # For custom frequency, use the custom settings (both required for custom billing)
+        frequency_number = custom_frequency_number
+        if not frequency_number or frequency_number < 1:
+            frequency_number = 1  # Safe default
+
+        frequency_unit = custom_frequency_unit or "Months"  # Safe default
+
+        if frequency_unit == "Days":
+            # Custom daily periods
+            return invoice_date, invoice_date
+        elif frequency_unit == "Weeks":
+            # Custom weekly periods
+            days_since_monday = invoice_date.weekday()
+            period_start = add_days(invoice_date, -days_since_monday)
+            period_end = add_days(period_start, (frequency_number * 7) - 1)
+            return period_start, period_end
+        elif frequency_unit == "Months":
+            # Custom monthly periods
+            period_start = invoice_date.replace(day=1)
+            period_end = add_months(period_start, frequency_number)
+            period_end = add_days(period_end, -1)
+            return period_start, period_end
+        elif frequency_unit == "Years":
+            # Custom yearly periods
+            period_start = invoice_date.replace(month=1, day=1)
+            period_end = add_years(period_start, frequency_number)
+            period_end = add_days(period_end, -1)
+            return period_start, period_end
+
+    # Default fallback: treat as daily
+    return invoice_date, invoice_date
+
+
+def get_invoice_eligibility(test_mode=False, today_date=None):
+    """
+    Determine which active dues schedules should be invoiced today.
+
+    Args:
+        test_mode: Evaluate test mode schedules instead of regular schedules
+        today_date: Date to evaluate against, defaults to today
+
+    Returns:
+        Dict with `eligible` (list of schedule names to invoice, in processing order)
+        and `skipped` (list of dicts with schedule, member and reason)
+    """
+    today_date = getdate(today_date or today())
+
+    schedules = _get_candidate_schedules(test_mode, today_date)
+    result = {"eligible": [], "skipped": []}
+    if not schedules:
+        return result
+
+    if test_mode:
+        # Test mode schedules bypass all other checks, same as can_generate_invoice
+        result["eligible"] = [schedule.name for schedule in schedules]
+        return result
+
+    member_names = list({schedule.member for schedule in schedules if schedule.member})
+    customers = list({schedule.customer for schedule in schedules if schedule.customer})
+
+    memberships = _get_active_membership_types(member_names)
+    max_reasonable_rate = _get_max_reasonable_dues_rate()
+
+    periods = {
+        schedule.name: get_billing_period(
+            schedule.billing_frequency,
+            today_date,
+            schedule.custom_frequency_number,
+            schedule.custom_frequency_unit,
+        )
+        for schedule in schedules
+    }
+    invoices = _get_customer_invoices(customers, periods.values())
+
+    # Customers invoiced earlier in this run, so a second schedule is a same-day duplicate
+    customers_in_run = set()
+
+    for schedule in schedules:
+        reason = _get_skip_reason(
+            schedule,
+            today_date,
+            periods[schedule.name],
+            memberships,
+            invoices,
+            customers_in_run,
+            max_reasonable_rate,
+        )
+
+        if reason:
+            result["skipped"].append({"schedule": schedule.name, "member": schedule.member, "reason": reason})
+        else:
+            result["eligible"].append(schedule.name)
+            if schedule.customer:
+                customers_in_run.add(schedule.customer)
+
+    return result
+
+
+def _get_skip_reason(
+    schedule, today_date, period, memberships, invoices, customers_in_run, max_reasonable_rate
+):
+    """Return why a schedule cannot be invoiced, or None when it is eligible"""
+    if schedule.member:
+        if not schedule.member_exists:
+            return "Member is not eligible for billing"
+        if schedule.member_status in NON_BILLABLE_MEMBER_STATUSES:
+            return "Member is not eligible for billing"
+        if schedule.member not in memberships:
+            return "Member is not eligible for billing"
+
+    if not schedule.dues_rate or flt(schedule.dues_rate) <= 0:
+        return f"Invalid dues rate: {schedule.dues_rate} (must be positive)"
+
+    if flt(schedule.dues_rate) > max_reasonable_rate:
+        return f"Dues rate {schedule.dues_rate} exceeds max {max_reasonable_rate}"
+
+    if schedule.member and schedule.membership_type:
+        current_type = memberships[schedule.member]
+        if current_type != schedule.membership_type:
+            return f"Type mismatch: schedule={schedule.membership_type}, current={current_type}"
+
+    days_before = (
+        schedule.invoice_days_before
+        if schedule.invoice_days_before is not None
+        else DEFAULT_INVOICE_DAYS_BEFORE
+    )
+    generate_on_date = getdate(add_days(schedule.next_invoice_date, -days_before))
+    if today_date < generate_on_date:
+        return f"Too early - will generate on {generate_on_date}"
+
+    if schedule.member and schedule.customer:
+        customer_invoices = invoices.get(schedule.customer, [])
+
+        existing_today = [inv.name for inv in customer_invoices if getdate(inv.posting_date) == today_date]
+        if existing_today:
+            return (
+                f"Same-day duplicate prevented: Invoice(s) {', '.join(existing_today)} "
+                f"already exist for {today_date}"
+            )
+
+        if schedule.customer in customers_in_run:
+            return f"Same-day duplicate prevented: another schedule for {schedule.customer} is invoiced in this run"
+
+        period_start, period_end = period
+        existing_in_period = [
+            inv.name for inv in customer_invoices if period_start <= getdate(inv.posting_date) <= period_end
+        ]
+        if existing_in_period:
+            return (
+                f"Billing period duplicate prevented: Invoice(s) {', '.join(existing_in_period)} "
+                f"already exist for period {period_start} to {period_end}"
+            )
+
+    if schedule.last_invoice_date and schedule.last_invoice_date == schedule.next_invoice_date:
+        return "Invoice already generated for this period"
+
+    return None
+
+
+def _get_candidate_schedules(test_mode, today_date):
+    """Get active auto-generating schedules with their member's status and customer"""
+    return frappe.db.sql(
+        """
+        SELECT
+            mds.name, mds.member, mds.membership_type, mds.dues_rate,
+            mds.billing_frequency, mds.custom_frequency_number, mds.custom_frequency_unit,
+            mds.invoice_days_before, mds.next_invoice_date, mds.last_invoice_date,
+            m.name IS NOT NULL AS member_exists, m.status AS member_status, m.customer
+        FROM `tabMembership Dues Schedule` mds
+        LEFT JOIN `tabMember` m ON m.name = mds.member
+        WHERE mds.status = 'Active'
+        AND mds.auto_generate = 1
+        AND mds.is_template = 0
+        AND IFNULL(mds.test_mode, 0) = %(test_mode)s
+        AND mds.next_invoice_date <= %(horizon)s
+        ORDER BY mds.next_invoice_date, mds.name
+    """,
+        {"test_mode": 1 if test_mode else 0, "horizon": add_days(today_date, 30)},
+        as_dict=True,
+    )
+
+
+def _get_active_membership_types(member_names):
+    """
+    Get the membership type of each member's active membership.
+
+    When a member has several active memberships, the most recently modified one is used,
+    matching the single-schedule type consistency check.
+    """
+    membership_types = {}
+    for i in range(0, len(member_names), ELIGIBILITY_CHUNK_SIZE):
+        rows = frappe.db.sql(
+            """
+            SELECT member, membership_type
+            FROM `tabMembership`
+            WHERE member IN %(members)s
+            AND status = 'Active'
+            AND docstatus = 1
+            ORDER BY modified ASC
+        """,
+            {"members": tuple(member_names[i : i + ELIGIBILITY_CHUNK_SIZE])},
+            as_dict=True,
+        )
+        # Later (more recently modified) rows overwrite earlier ones
+        for row in rows:
+            membership_types[row.member] = row.membership_type
+
+    return membership_types
+
+
+def _get_customer_invoices(customers, periods):
+    """Get non-cancelled invoices of the given customers within the span of all periods"""
+    invoices = defaultdict(list)
+    periods = list(periods)
+    if not customers or not periods:
+        return invoices
+
+    from_date = min(period_start for period_start, _period_end in periods)
+    to_date = max(period_end for _period_start, period_end in periods)
+
+    for i in range(0, len(customers), ELIGIBILITY_CHUNK_SIZE):
+        rows = frappe.db.sql(
+            """
+            SELECT name, customer, posting_date
+            FROM `tabSales Invoice`
+            WHERE customer IN %(customers)s
+            AND posting_date BETWEEN %(from_date)s AND %(to_date)s
+            AND docstatus != 2
+            ORDER BY posting_date, name
+        """,
+            {
+                "customers": tuple(customers[i : i + ELIGIBILITY_CHUNK_SIZE]),
+                "from_date": from_date,
+                "to_date": to_date,
+            },
+            as_dict=True,
+        )
+        for row in rows:
+            invoices[row.customer].append(row)
+
+    return invoices
+
+
+def _get_max_reasonable_dues_rate():
+    """Get the configured maximum dues rate with a safe fallback"""
+    try:
+        return flt(frappe.db.get_single_value("Verenigingen Settings", "max_reasonable_dues_rate")) or 10000
+    except Exception:
+        return 10000
@@ -0,0 +1,223 @@
+"""
+Bulk membership dues invoice factory
+
+Creating dues invoices one schedule at a time repeats the same lookups for every
+invoice: the dues item, the member's customer and active SEPA mandate, and the
+auto-submit setting. The factory resolves this shared context once per run,
+prefetches member data per chunk and then creates and submits the invoices chunk by
+chunk with a commit per chunk. Company, accounts and taxes are left to ERPNext, as
+for invoices created one at a time.
+"""
+
+import time
+
+import frappe
+from frappe.utils import add_days, flt, today
+
+# Number of invoices created between commits
+INVOICE_CHUNK_SIZE = 100
+
+
+def get_dues_item_code(billing_frequency, custom_frequency_number=None, custom_frequency_unit=None):
+    """Item code of the membership dues item for a billing frequency"""
+    if billing_frequency == "Custom":
+        frequency_number = custom_frequency_number
+        if not frequency_number or frequency_number < 1:
+            frequency_number = 1  # Safe default
+        frequency_unit = custom_frequency_unit or "Months"  # Safe default
+        return f"Membership Dues - Custom (Every {frequency_number} {frequency_unit})"
+
+    return f"Membership Dues - {billing_frequency}"
+
+
+class DuesInvoiceContext:
+    """Settings and items shared by all dues invoices created in one run"""
+
+    def __init__(self):
+        settings = frappe.get_single("Verenigingen Settings")
+
+        auto_submit = settings.get("auto_submit_membership_invoices")
+        # Default to auto-submit if setting doesn't exist (better UX)
+        self.auto_submit = auto_submit is None or bool(auto_submit)
+
+        self._items = {}
+
+    def get_item(self, item_code, item_name=None):
+        """Get a dues item code, creating the item the first time it is needed"""
+        if item_code not in self._items:
+            if not frappe.db.exists("Item", item_code):
+                item = frappe.new_doc("Item")
+                item.item_code = item_code
+                item.item_name = item_name or item_code
+                item.item_group = "Services"
+                item.is_stock_item = 0
+                item.is_sales_item = 1
+                item.is_service_item = 1
+                item.insert()
+            self._items[item_code] = item_code
+
+        return self._items[item_code]
+
+
+class DuesInvoiceFactory:
+    """Creates dues invoices for many schedules with shared context and chunked commits"""
+
+    def __init__(self, chunk_size=INVOICE_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.context = DuesInvoiceContext()
+
+    def create_invoices(self, schedule_names):
+        """
+        Create and submit dues invoices for the given (already eligible) schedules.
+
+        Returns:
+            Dict with generated count, invoices, errors and per-chunk throughput
+        """
+        results = {"generated": 0, "errors": [], "invoices": [], "chunks": []}
+
+        for chunk_index, i in enumerate(range(0, len(schedule_names), self.chunk_size)):
+            chunk = schedule_names[i : i + self.chunk_size]
+            started = time.monotonic()
+
+            chunk_results = self._create_chunk(chunk)
+            frappe.db.commit()
+
+            elapsed = time.monotonic() - started
+            chunk_stats = {
+                "chunk": chunk_index + 1,
+                "schedules": len(chunk),
+                "generated": len(chunk_results["invoices"]),
+                "errors": len(chunk_results["errors"]),
+                "seconds": round(elapsed, 2),
+                "invoices_per_second": round(len(chunk_results["invoices"]) / elapsed, 2) if elapsed else 0,
+            }
+            results["chunks"].append(chunk_stats)
+            results["generated"] += chunk_stats["generated"]
+            results["invoices"].extend(chunk_results["invoices"])
+            results["errors"].extend(chunk_results["errors"])
+
+            frappe.logger().info(
+                f"Dues invoice chunk {chunk_stats['chunk']}: {chunk_stats['generated']}/{len(chunk)} invoices "
+                f"in {chunk_stats['seconds']}s ({chunk_stats['invoices_per_second']}/s)"
+            )
+
+        return results
+
+    def _create_chunk(self, schedule_names):
+        """Create invoices for one chunk of schedules, isolating failures per schedule"""
+        schedules = [frappe.get_doc("Membership Dues Schedule", name) for name in schedule_names]
+        member_names = list({schedule.member for schedule in schedules if schedule.member})
+        customers = self._get_member_customers(member_names)
+        mandates = self._get_active_membership_mandates(member_names)
+
+        results = {"errors": [], "invoices": []}
+        for schedule in schedules:
+            savepoint = f"dues_invoice_{frappe.generate_hash(length=8)}"
+            frappe.db.savepoint(savepoint)
+            try:
+                invoice = self._create_invoice(schedule, customers, mandates)
+                results["invoices"].append(
+                    {"schedule": schedule.name, "member": schedule.member_name, "invoice": invoice.name}
+                )
+            except Exception as e:
+                frappe.db.rollback(save_point=savepoint)
+                error_msg = f"Error processing schedule {schedule.name}: {str(e)}"
+                frappe.log_error(error_msg, "Membership Dues Generation")
+                results["errors"].append(error_msg)
+
+        return results
+
+    def _create_invoice(self, schedule, customers, mandates):
+        """Create the invoice for one schedule and advance the schedule"""
+        customer = customers.get(schedule.member)
+        if not customer:
+            frappe.throw(f"Member {schedule.member} does not have a customer record")
+
+        posting_date = today()
+        coverage_start, coverage_end = schedule.calculate_billing_period(posting_date)
+        description = schedule.get_invoice_description()
+
+        invoice = frappe.new_doc("Sales Invoice")
+        invoice.customer = customer
+        invoice.posting_date = posting_date
+
+        invoice.custom_coverage_start_date = coverage_start
+        invoice.custom_coverage_end_date = coverage_end
+
+        if schedule.payment_terms_template:
+            # Let ERPNext calculate due date from payment terms
+            invoice.payment_terms_template = schedule.payment_terms_template
+        else:
+            # Default to 30 days from posting date for membership invoices
+            invoice.due_date = add_days(posting_date, 30)
+
+        # Members with an active mandate pay by SEPA Direct Debit
+        if mandates.get(schedule.member):
+            invoice.sepa_mandate_id = mandates[schedule.member]
+
+        invoice.append(
+            "items",
+            {
+                "item_code": self.context.get_item(
+                    get_dues_item_code(
+                        schedule.billing_frequency,
+                        schedule.get("custom_frequency_number"),
+                        schedule.get("custom_frequency_unit"),
+                    )
+                ),
+                "qty": 1,
+                "rate": flt(schedule.dues_rate),
+                "description": description,
+            },
+        )
+
+        invoice.remarks = f"Generated from Membership Dues Schedule: {schedule.name}\n{description}"
+        invoice.insert()
+
+        if self.context.auto_submit:
+            try:
+                invoice.submit()
+            except Exception as e:
+                # Keep the draft invoice, same as single invoice generation
+                frappe.log_error(f"Failed to auto-submit invoice {invoice.name}: {str(e)}", "Invoice Auto-Submit")
+
+        schedule.next_billing_period_start_date = coverage_start
+        schedule.next_billing_period_end_date = coverage_end
+        schedule.last_generated_invoice = invoice.name
+        schedule.last_invoice_coverage_start = coverage_start
+        schedule.last_invoice_coverage_end = coverage_end
+        # update_schedule_dates saves the schedule once with all changes
+        schedule.update_schedule_dates(actual_invoice_date=invoice.posting_date)
+
+        return invoice
+
+    def _get_member_customers(self, member_names):
+        """Map member name to customer for a chunk of members"""
+        if not member_names:
+            return {}
+
+        return dict(
+            frappe.get_all(
+                "Member", filters={"name": ["in", member_names]}, fields=["name", "customer"], as_list=True
+            )
+        )
+
+    def _get_active_membership_mandates(self, member_names):
+        """Map member name to its active membership SEPA mandate for a chunk of members"""
+        if not member_names:
+            return {}
+
+        mandates = {}
+        for row in frappe.get_all(
+            "SEPA Mandate",
+            filters={
+                "member": ["in", member_names],
+                "status": "Active",
+                "is_active": 1,
+                "used_for_memberships": 1,
+            },
+            fields=["name", "member"],
+            order_by="creation asc",
+        ):
+            mandates.setdefault(row.member, row.name)
+        return mandates
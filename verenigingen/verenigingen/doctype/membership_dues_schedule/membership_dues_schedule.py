@@ -7,6 +7,15 @@ import frappe
 from frappe.model.document import Document
 from frappe.utils import add_days, add_months, add_years, flt, getdate, today
 
+from verenigingen.verenigingen.doctype.membership_dues_schedule.dues_invoice_eligibility import (
+    get_billing_period,
+    get_invoice_eligibility,
+)
+from verenigingen.verenigingen.doctype.membership_dues_schedule.dues_invoice_factory import (
+    DuesInvoiceFactory,
+    get_dues_item_code,
+)
+
 
 class MembershipDuesSchedule(Document):
     def get_template_values(self):
@@ -675,86 +684,12 @@ class MembershipDuesSchedule(Document):
 
     def calculate_billing_period(self, invoice_date):
         """Calculate the billing period start and end dates for a given invoice date"""
-        invoice_date = getdate(invoice_date)
-
-        if self.billing_frequency == "Daily":
-            # For daily billing, the period is just the single day
-            return invoice_date, invoice_date
-        elif self.billing_frequency == "Weekly":
-            # Weekly period: Monday to Sunday
-            days_since_monday = invoice_date.weekday()
-            period_start = add_days(invoice_date, -days_since_monday)
-            period_end = add_days(period_start, 6)
-            return period_start, period_end
-        elif self.billing_frequency == "Monthly":
-            # Monthly period: 1st to last day of month
-            period_start = invoice_date.replace(day=1)
-            # Get last day of month
-            if invoice_date.month == 12:
-                next_month = invoice_date.replace(year=invoice_date.year + 1, month=1, day=1)
-            else:
-                next_month = invoice_date.replace(month=invoice_date.month + 1, day=1)
-            period_end = add_days(next_month, -1)
-            return period_start, period_end
-        elif self.billing_frequency == "Quarterly":
-            # Quarterly periods: Q1 (Jan-Mar), Q2 (Apr-Jun), Q3 (Jul-Sep), Q4 (Oct-Dec)
-            quarter = (invoice_date.month - 1) // 3 + 1
-            period_start = invoice_date.replace(month=(quarter - 1) * 3 + 1, day=1)
-            period_end_month = quarter * 3
-            if period_end_month == 12:
-                period_end = invoice_date.replace(month=12, day=31)
-            else:
-                next_quarter = invoice_date.replace(month=period_end_month + 1, day=1)
-                period_end = add_days(next_quarter, -1)
-            return period_start, period_end
-        elif self.billing_frequency == "Semi-Annual":
-            # Semi-annual: H1 (Jan-Jun), H2 (Jul-Dec)
-            if invoice_date.month <= 6:
-                period_start = invoice_date.replace(month=1, day=1)
-                period_end = invoice_date.replace(month=6, day=30)
-            else:
-                period_start = invoice_date.replace(month=7, day=1)
-                period_end = invoice_date.replace(month=12, day=31)
-            return period_start, period_end
-        elif self.billing_frequency == "Annual":
-            # Annual period: Jan 1 to Dec 31
-            period_start = invoice_date.replace(month=1, day=1)
-            period_end = invoice_date.replace(month=12, day=31)
-            return period_start, period_end
-        elif self.billing_frequency == "Custom":
-            # For custom frequency, use the custom settings (both required for custom billing)
-            frequency_number = getattr(self, "custom_frequency_number", None)
-            if not frequency_number or frequency_number < 1:
-                frequency_number = 1  # Safe default
-
-            frequency_unit = getattr(self, "custom_frequency_unit", None)
-            if not frequency_unit:
-                frequency_unit = "Months"  # Safe default
-
-            if frequency_unit == "Days":
-                # Custom daily periods
-                return invoice_date, invoice_date
-            elif frequency_unit == "Weeks":
-                # Custom weekly periods
-                days_since_monday = invoice_date.weekday()
-                period_start = add_days(invoice_date, -days_since_monday)
-                period_end = add_days(period_start, (frequency_number * 7) - 1)
-                return period_start, period_end
-            elif frequency_unit == "Months":
-                # Custom monthly periods
-                period_start = invoice_date.replace(day=1)
-                period_end = add_months(period_start, frequency_number)
-                period_end = add_days(period_end, -1)
-                return period_start, period_end
-            elif frequency_unit == "Years":
-                # Custom yearly periods
-                period_start = invoice_date.replace(month=1, day=1)
-                period_end = add_years(period_start, frequency_number)
-                period_end = add_days(period_end, -1)
-                return period_start, period_end
-
-        # Default fallback: treat as daily
-        return invoice_date, invoice_date
+        return get_billing_period(
+            self.billing_frequency,
+            invoice_date,
+            getattr(self, "custom_frequency_number", None),
+            getattr(self, "custom_frequency_unit", None),
+        )
 
     def validate_member_eligibility_for_invoice(self):
         """
@@ -893,9 +828,17 @@ class MembershipDuesSchedule(Document):
             # Don't block generation on validation errors - continue gracefully
             return {"valid": True, "reason": "Type validation error - allowing generation"}
 
-    def generate_invoice(self, force=False):
-        """Generate invoice for the current period with enhanced coverage tracking"""
-        can_generate, reason = self.can_generate_invoice()
+    def generate_invoice(self, force=False, eligibility_checked=False):
+        """
+        Generate invoice for the current period with enhanced coverage tracking.
+
+        `eligibility_checked` skips `can_generate_invoice` when the caller already
+        evaluated eligibility in bulk with `get_invoice_eligibility`.
+        """
+        if eligibility_checked:
+            can_generate, reason = True, "Eligibility checked in bulk"
+        else:
+            can_generate, reason = self.can_generate_invoice()
 
         if not can_generate and not force:
             frappe.log_error(f"Cannot generate invoice: {reason}", f"Membership Dues Schedule {self.name}")
@@ -1039,19 +982,11 @@ class MembershipDuesSchedule(Document):
 
     def get_membership_dues_item(self):
         """Get or create the membership dues item"""
-        if self.billing_frequency == "Custom":
-            # Get custom frequency settings with validation
-            frequency_number = getattr(self, "custom_frequency_number", None)
-            if not frequency_number or frequency_number < 1:
-                frequency_number = 1  # Safe default
-
-            frequency_unit = getattr(self, "custom_frequency_unit", None)
-            if not frequency_unit:
-                frequency_unit = "Months"  # Safe default
-            frequency_desc = f"Every {frequency_number} {frequency_unit}"
-            item_name = f"Membership Dues - Custom ({frequency_desc})"
-        else:
-            item_name = f"Membership Dues - {self.billing_frequency}"
+        item_name = get_dues_item_code(
+            self.billing_frequency,
+            getattr(self, "custom_frequency_number", None),
+            getattr(self, "custom_frequency_unit", None),
+        )
 
         if not frappe.db.exists("Item", item_name):
             item = frappe.new_doc("Item")
@@ -1570,48 +1505,43 @@ class MembershipDuesSchedule(Document):
 def generate_dues_invoices(test_mode=False):
     """Scheduled job to generate membership dues invoices"""
 
-    # Get all active schedules that need processing (exclude templates)
-    schedules = frappe.get_all(
-        "Membership Dues Schedule",
-        filters={
-            "status": "Active",
-            "auto_generate": 1,
-            "is_template": 0,
-            "next_invoice_date": ["<=", add_days(today(), 30)],
-        },
-        pluck="name",
-    )
+    # Evaluate eligibility for all active schedules at once; only eligible schedules are loaded
+    eligibility = get_invoice_eligibility(test_mode=test_mode)
 
-    results = {"processed": 0, "generated": 0, "errors": [], "invoices": []}
+    results = {
+        "processed": len(eligibility["eligible"]) + len(eligibility["skipped"]),
+        "generated": 0,
+        "errors": [],
+        "invoices": [],
+        "skipped": eligibility["skipped"],
+    }
 
-    for schedule_name in schedules:
+    if not test_mode:
+        # Create real invoices in chunks with lookups shared across the whole run
+        factory_results = DuesInvoiceFactory().create_invoices(eligibility["eligible"])
+        results["generated"] = factory_results["generated"]
+        results["invoices"] = factory_results["invoices"]
+        results["errors"] = factory_results["errors"]
+        results["chunks"] = factory_results["chunks"]
+        eligible_test_schedules = []
+    else:
+        eligible_test_schedules = eligibility["eligible"]
+
+    for schedule_name in eligible_test_schedules:
         try:
             schedule = frappe.get_doc("Membership Dues Schedule", schedule_name)
 
-            # Skip if test_mode flag doesn't match
-            if test_mode and not schedule.test_mode:
-                continue
-            elif not test_mode and schedule.test_mode:
-                continue
-
-            can_generate, reason = schedule.can_generate_invoice()
-
-            if can_generate:
-                invoice = schedule.generate_invoice()
-                if invoice:
-                    results["generated"] += 1
-                    results["invoices"].append(
-                        {"schedule": schedule_name, "member": schedule.member_name, "invoice": invoice}
-                    )
-                else:
-                    # Log when invoice generation fails despite can_generate being True
-                    error_msg = (
-                        f"Schedule {schedule_name} passed can_generate check but failed to generate invoice"
-                    )
-                    frappe.log_error(error_msg, "Invoice Generation Failed")
-                    results["errors"].append(error_msg)
-
-            results["processed"] += 1
+            invoice = schedule.generate_invoice(eligibility_checked=True)
+            if invoice:
+                results["generated"] += 1
+                results["invoices"].append(
+                    {"schedule": schedule_name, "member": schedule.member_name, "invoice": invoice}
+                )
+            else:
+                # Log when invoice generation fails despite passing the eligibility check
+                error_msg = f"Schedule {schedule_name} passed eligibility check but failed to generate invoice"
+                frappe.log_error(error_msg, "Invoice Generation Failed")
+                results["errors"].append(error_msg)
 
         except Exception as e:
             error_msg = f"Error processing schedule {schedule_name}: {str(e)}"
@@ -1620,7 +1550,8 @@ def generate_dues_invoices(test_mode=False):
 
     # Log results
     frappe.logger().info(
-        f"Membership dues generation completed: {results['generated']} invoices from {results['processed']} schedules"
+        f"Membership dues generation completed: {results['generated']} invoices from {results['processed']} schedules "
+        f"({len(results['skipped'])} skipped)"
     )
 
     return results
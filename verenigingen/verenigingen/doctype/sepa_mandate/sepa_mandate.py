@@ -171,6 +171,8 @@ class SEPAMandate(Document):
                 frappe.throw(_("Expiry date cannot be before sign date"))
 
     def validate_iban(self):
+        from verenigingen.utils.validation.iban_validator import normalize_iban
+
         # Comprehensive IBAN validation with mod-97
         if self.iban:
             from verenigingen.utils.validation.iban_validator import (
@@ -194,6 +196,9 @@ class SEPAMandate(Document):
                     self.bic = derived_bic
                     frappe.msgprint(_("BIC automatically derived from IBAN: {0}").format(derived_bic))
 
+        # Indexed copy used for matching bank transactions
+        self.iban_normalized = normalize_iban(self.iban)
+
     def after_insert(self):
         """Send notification when mandate is created and update member's child table"""
         # Update member's SEPA mandates child table
@@ -231,6 +236,24 @@ class SEPAMandate(Document):
         if self.member:
             self.update_member_sepa_mandates_table()
 
+        self.invalidate_mandate_cache()
+
+    def on_trash(self):
+        """Drop the member's cached mandate lookup when the mandate is deleted"""
+        self.invalidate_mandate_cache()
+
+    def invalidate_mandate_cache(self):
+        """Invalidate the shared active mandate cache for this mandate's member(s)"""
+        from verenigingen.utils.sepa_mandate_service import invalidate_mandate_cache
+
+        members = [self.member]
+        doc_before_save = self.get_doc_before_save()
+        if doc_before_save and doc_before_save.member != self.member:
+            # Mandate moved to another member, the previous member's lookup is stale too
+            members.append(doc_before_save.member)
+
+        invalidate_mandate_cache(members)
+
     def update_member_sepa_mandates_table(self):
         """Update the member's SEPA mandates child table to reflect this mandate"""
         if not self.member:
@@ -1,7 +1,7 @@
 import unittest
 
 import frappe
-from frappe.utils import add_days, today
+from frappe.utils import add_days, get_datetime, today
 
 
 class TestSEPAMandate(unittest.TestCase):
@@ -70,6 +70,15 @@ class TestSEPAMandate(unittest.TestCase):
         # IBAN gets formatted with spaces, so check for the formatted version
         self.assertEqual(self.mandate.iban, "NL91 ABNA 0417 1643 00")
 
+    def test_iban_normalized_is_stored(self):
+        """Test the normalized IBAN used for reconciliation is stored on save"""
+        self.mandate.iban = "nl91 abna 0417 1643 00"
+        self.mandate.insert()
+
+        self.assertEqual(
+            frappe.db.get_value("SEPA Mandate", self.mandate.name, "iban_normalized"), "NL91ABNA0417164300"
+        )
+
     def test_preserve_draft_status(self):
         """Test Draft status is preserved until explicitly changed"""
         self.mandate.status = "Draft"
@@ -251,6 +260,48 @@ class TestSEPAMandate(unittest.TestCase):
         self.assertEqual(getattr(usage_record, "sequence_type", "FRST"), "FRST")
         self.assertEqual(usage_record.status, "Pending")
 
+    def test_bulk_mandate_usage_recording(self):
+        """Test that usage for many invoices is recorded without saving the mandate per invoice"""
+        self.mandate.status = "Active"
+        self.mandate.maximum_amount = 50
+        self.mandate.insert()
+
+        from verenigingen.verenigingen.doctype.sepa_mandate_usage.sepa_mandate_usage import (
+            create_mandate_usage_record,
+            record_mandate_usage_bulk,
+        )
+
+        create_mandate_usage_record(
+            mandate_name=self.mandate.name,
+            reference_doctype="Sales Invoice",
+            reference_name="INV-BULK-000",
+            amount=25.00,
+            sequence_type="FRST",
+        )
+        modified_before = frappe.db.get_value("SEPA Mandate", self.mandate.name, "modified")
+
+        result = record_mandate_usage_bulk(
+            [
+                {"mandate_name": self.mandate.name, "reference_name": "INV-BULK-001", "amount": 25.00},
+                {"mandate_name": self.mandate.name, "reference_name": "INV-BULK-002", "amount": 30.00},
+                {"mandate_name": self.mandate.name, "reference_name": "INV-BULK-003", "amount": 75.00},
+            ]
+        )
+
+        self.assertEqual(result["recorded"], 2)
+        self.assertEqual(len(result["errors"]), 1, "Amount above the mandate maximum should be rejected")
+        self.assertEqual(result["errors"][0]["reference_name"], "INV-BULK-003")
+
+        self.mandate.reload()
+        self.assertEqual([usage.idx for usage in self.mandate.usage_history], [1, 2, 3])
+        self.assertEqual(
+            [usage.reference_name for usage in self.mandate.usage_history],
+            ["INV-BULK-000", "INV-BULK-001", "INV-BULK-002"],
+        )
+        self.assertEqual(self.mandate.usage_history[1].sequence_type, "FRST")
+        self.assertEqual(self.mandate.usage_history[1].status, "Pending")
+        self.assertGreater(get_datetime(self.mandate.modified), get_datetime(modified_before))
+
     def test_sequence_type_determination(self):
         """Test FRST/RCUR sequence type determination"""
         # Insert mandate with Active status
@@ -3,7 +3,9 @@
 
 import frappe
 from frappe.model.document import Document
-from frappe.utils import getdate, today
+from frappe.utils import add_months, flt, getdate, now, today
+
+from verenigingen.utils.sepa_mandate_service import invalidate_mandate_cache_for_mandates
 
 
 class SEPAMandateUsage(Document):
@@ -29,6 +31,10 @@ class SEPAMandateUsage(Document):
         """Auto-determine sequence type based on mandate history"""
         if not self.sequence_type and self.get("parent"):
             self.sequence_type = self.determine_sequence_type()
+            if not self.sequence_type:
+                frappe.throw(
+                    f"Mandate {self.parent} was closed by a final collection and cannot be used again"
+                )
 
     def determine_sequence_type(self):
         """
@@ -38,30 +44,10 @@ class SEPAMandateUsage(Document):
         if not self.get("parent"):
             return "FRST"  # Default for standalone usage
 
-        mandate_name = self.parent
-
-        # Check if this mandate has been used before successfully
-        previous_usage = frappe.get_all(
-            "SEPA Mandate Usage",
-            filters={"parent": mandate_name, "status": "Collected", "name": ["!=", self.name or ""]},
-            fields=["usage_date", "sequence_type"],
-            order_by="usage_date desc",
-            limit=1,
+        summaries = get_mandate_usage_summaries(
+            [self.parent], exclude_references=[self.reference_name] if self.reference_name else None
         )
-
-        if not previous_usage:
-            # First usage of this mandate
-            return "FRST"
-
-        # Check if mandate was reset (new mandate after cancellation)
-        mandate = frappe.get_doc("SEPA Mandate", mandate_name)
-        last_usage_date = previous_usage[0].usage_date
-
-        if mandate.sign_date and getdate(mandate.sign_date) > getdate(last_usage_date):
-            # Mandate was renewed after last usage
-            return "FRST"
-
-        return "RCUR"
+        return get_sequence_type_from_usage(summaries.get(self.parent))["sequence_type"]
 
     def validate_amount(self):
         """Validate amount against mandate limits"""
@@ -142,44 +128,349 @@ def create_mandate_usage_record(mandate_name, reference_doctype, reference_name,
     return usage_row.name
 
 
-@frappe.whitelist()
-def get_mandate_sequence_type(mandate_name, reference_name=None):
+# Months without a collection after which a mandate lapses under the SEPA rulebook
+MANDATE_LAPSE_MONTHS = 36
+
+# A collection is final when the mandate expires within this many months of it
+FINAL_COLLECTION_WINDOW_MONTHS = 1
+
+# Usage rows inserted per INSERT statement when recording usage in bulk
+USAGE_INSERT_CHUNK_SIZE = 1000
+
+USAGE_INSERT_FIELDS = [
+    "name",
+    "creation",
+    "modified",
+    "owner",
+    "modified_by",
+    "docstatus",
+    "parent",
+    "parenttype",
+    "parentfield",
+    "idx",
+    "usage_date",
+    "reference_doctype",
+    "reference_name",
+    "sequence_type",
+    "batch_reference",
+    "amount",
+    "status",
+]
+
+
+def record_mandate_usage_bulk(usages, batch_reference=None, usage_date=None):
     """
-    API to determine what sequence type should be used for a mandate
+    Record SEPA mandate usage for many transactions at once
+
+    The usages get the same checks as SEPAMandateUsage.validate (active, unexpired
+    mandate within its maximum amount), but the rows are written with multi-row
+    INSERTs and the mandates are updated with grouped statements instead of loading
+    and saving every SEPA Mandate. Nothing is committed, so the usages roll back
+    together with the caller's transaction or savepoint.
 
     Args:
-        mandate_name: Name of the SEPA Mandate
-        reference_name: Optional reference to exclude from history check
+        usages: List of dicts with mandate_name, reference_doctype, reference_name,
+            amount and optionally sequence_type (derived from usage history if missing)
+        batch_reference: Direct Debit Batch the usages are collected in
+        usage_date: Usage date, defaults to today
 
     Returns:
-        Dict with sequence_type and reasoning
+        Dict with the recorded count and a list of usages that were rejected
     """
-    try:
-        mandate = frappe.get_doc("SEPA Mandate", mandate_name)
+    if not usages:
+        return {"recorded": 0, "errors": []}
+
+    usage_date = getdate(usage_date or today())
+    mandate_names = list({usage["mandate_name"] for usage in usages})
+
+    mandates = {
+        mandate.name: mandate
+        for mandate in frappe.get_all(
+            "SEPA Mandate",
+            filters={"name": ["in", mandate_names]},
+            fields=["name", "mandate_id", "status", "expiry_date", "maximum_amount"],
+        )
+    }
+
+    # Continue numbering after the existing usage rows of each mandate
+    last_idx = dict(
+        frappe.db.sql(
+            """
+            SELECT parent, MAX(idx)
+            FROM `tabSEPA Mandate Usage`
+            WHERE parenttype = 'SEPA Mandate'
+            AND parentfield = 'usage_history'
+            AND parent IN %(mandates)s
+            GROUP BY parent
+        """,
+            {"mandates": mandate_names},
+        )
+    )
+
+    missing_sequence_types = [
+        (usage["mandate_name"], usage["reference_name"]) for usage in usages if not usage.get("sequence_type")
+    ]
+    derived_sequence_types = {}
+    if missing_sequence_types:
+        derived_sequence_types = get_mandate_sequence_types(missing_sequence_types)
+
+    timestamp = now()
+    user = frappe.session.user or "Administrator"
+    rows = []
+    errors = []
+    used_mandates = set()
+
+    for usage in usages:
+        mandate = mandates.get(usage["mandate_name"])
+        error = _get_usage_error(mandate, usage, usage_date)
+        if error:
+            errors.append(
+                {"mandate": usage["mandate_name"], "reference_name": usage["reference_name"], "error": error}
+            )
+            continue
+
+        derived = derived_sequence_types.get((usage["mandate_name"], usage["reference_name"])) or {}
+        sequence_type = usage.get("sequence_type") or derived.get("sequence_type")
+        if not sequence_type:
+            errors.append(
+                {
+                    "mandate": usage["mandate_name"],
+                    "reference_name": usage["reference_name"],
+                    "error": derived.get("reason"),
+                }
+            )
+            continue
+
+        last_idx[mandate.name] = (last_idx.get(mandate.name) or 0) + 1
+        used_mandates.add(mandate.name)
+
+        rows.append(
+            (
+                frappe.generate_hash(length=10),
+                timestamp,
+                timestamp,
+                user,
+                user,
+                0,
+                mandate.name,
+                "SEPA Mandate",
+                "usage_history",
+                last_idx[mandate.name],
+                usage_date,
+                usage.get("reference_doctype") or "Sales Invoice",
+                usage["reference_name"],
+                sequence_type,
+                batch_reference,
+                flt(usage.get("amount")),
+                "Pending",
+            )
+        )
+
+    if rows:
+        frappe.db.bulk_insert(
+            "SEPA Mandate Usage", USAGE_INSERT_FIELDS, rows, chunk_size=USAGE_INSERT_CHUNK_SIZE
+        )
+        _update_used_mandates(list(used_mandates), timestamp)
 
-        # Check previous successful usage
-        filters = {"parent": mandate_name, "status": "Collected"}
+    return {"recorded": len(rows), "errors": errors}
 
-        if reference_name:
-            filters["reference_name"] = ["!=", reference_name]
 
-        previous_usage = frappe.get_all(
-            "SEPA Mandate Usage",
-            filters=filters,
-            fields=["usage_date", "sequence_type"],
-            order_by="usage_date desc",
-            limit=1,
+def _get_usage_error(mandate, usage, usage_date):
+    """Reason a usage cannot be recorded on a mandate, None if it can"""
+    if not mandate:
+        return f"SEPA Mandate {usage['mandate_name']} not found"
+    if mandate.status != "Active":
+        return f"Cannot use inactive mandate: {mandate.mandate_id}"
+    if mandate.expiry_date and getdate(mandate.expiry_date) < usage_date:
+        return f"Mandate {mandate.mandate_id} has expired"
+    if mandate.maximum_amount and flt(usage.get("amount")) > mandate.maximum_amount:
+        return f"Amount €{usage.get('amount')} exceeds mandate maximum of €{mandate.maximum_amount}"
+    return None
+
+
+def _update_used_mandates(mandate_names, timestamp):
+    """
+    Touch the used mandates in one statement, as saving them with a new usage row would.
+    Only `modified` changes: the member's mandate table mirrors status and dates, which a
+    usage leaves alone, so the cache invalidation is the only post-save hook that applies.
+    """
+    frappe.db.sql(
+        """
+        UPDATE `tabSEPA Mandate`
+        SET modified = %(modified)s
+        WHERE name IN %(mandates)s
+    """,
+        {"mandates": mandate_names, "modified": timestamp},
+    )
+    invalidate_mandate_cache_for_mandates(mandate_names)
+
+
+def get_mandate_usage_summaries(mandate_names, exclude_references=None):
+    """
+    Summarise the usage history of several mandates in one aggregate query
+
+    Args:
+        mandate_names: Names of the SEPA Mandates
+        exclude_references: Reference names whose usage rows are ignored, e.g. the
+            invoices that are being collected
+
+    Returns:
+        Dict of mandate name to its sign date, mandate type, status, expiry and cancellation
+        date, collected count, first and last collection date, whether a final (FNAL)
+        collection was made, and the failed collection count and last failure date
+    """
+    if not mandate_names:
+        return {}
+
+    reference_condition = ""
+    if exclude_references:
+        reference_condition = (
+            "AND (mu.reference_name IS NULL OR mu.reference_name NOT IN %(exclude_references)s)"
         )
 
-        if not previous_usage:
-            return {"sequence_type": "FRST", "reason": "First usage of this mandate"}
+    summaries = frappe.db.sql(
+        f"""
+        SELECT
+            sm.name AS mandate,
+            sm.mandate_id,
+            sm.sign_date,
+            sm.mandate_type,
+            sm.status,
+            sm.expiry_date,
+            sm.cancelled_date,
+            COUNT(CASE WHEN mu.status = 'Collected' THEN 1 END) AS collected_count,
+            MIN(CASE WHEN mu.status = 'Collected' THEN mu.usage_date END) AS first_collected_date,
+            MAX(CASE WHEN mu.status = 'Collected' THEN mu.usage_date END) AS last_collected_date,
+            MAX(CASE WHEN mu.status = 'Collected' AND mu.sequence_type = 'FNAL' THEN 1 ELSE 0 END)
+                AS has_final_collection,
+            COUNT(CASE WHEN mu.status IN ('Failed', 'Returned') THEN 1 END) AS failed_count,
+            MAX(CASE WHEN mu.status IN ('Failed', 'Returned') THEN mu.usage_date END) AS last_failed_date
+        FROM `tabSEPA Mandate` sm
+        LEFT JOIN `tabSEPA Mandate Usage` mu
+            ON mu.parent = sm.name
+            AND mu.parenttype = 'SEPA Mandate'
+            {reference_condition}
+        WHERE sm.name IN %(mandates)s
+        GROUP BY sm.name, sm.mandate_id, sm.sign_date, sm.mandate_type, sm.status, sm.expiry_date,
+            sm.cancelled_date
+    """,
+        {"mandates": list(set(mandate_names)), "exclude_references": list(set(exclude_references or []))},
+        as_dict=True,
+    )
+
+    return {summary.mandate: summary for summary in summaries}
+
+
+def is_final_collection(mandate, collection_date=None):
+    """
+    Whether a collection is the last one on a mandate, derived from the mandate state
+
+    The collection is final when the mandate is cancelled or has a cancellation date, or
+    when it expires before the next monthly collection would be due.
+
+    Args:
+        mandate: Dict with the mandate's status, expiry_date and cancelled_date, such as a
+            usage summary from get_mandate_usage_summaries
+        collection_date: Date of the collection, defaults to today
+    """
+    if not mandate:
+        return False
+
+    if mandate.get("status") == "Cancelled" or mandate.get("cancelled_date"):
+        return True
+
+    expiry_date = mandate.get("expiry_date")
+    next_collection = add_months(getdate(collection_date or today()), FINAL_COLLECTION_WINDOW_MONTHS)
+    return bool(expiry_date and getdate(expiry_date) < next_collection)
 
-        # Check if mandate was renewed
-        last_usage_date = previous_usage[0].usage_date
-        if mandate.sign_date and getdate(mandate.sign_date) > getdate(last_usage_date):
-            return {"sequence_type": "FRST", "reason": "Mandate was renewed after last usage"}
 
-        return {"sequence_type": "RCUR", "reason": "Recurring usage - mandate has been used before"}
+def get_sequence_type_from_usage(summary, is_final=None):
+    """
+    Derive the sequence type of the next collection from a mandate usage summary
+
+    Args:
+        summary: Usage summary from get_mandate_usage_summaries, None if the mandate was not found
+        is_final: Whether this is the last collection on the mandate; derived from the
+            mandate state with is_final_collection when not given
+
+    Returns:
+        Dict with sequence_type and reasoning; sequence_type is None when a final
+        collection closed the mandate and it must not be used again
+    """
+    if not summary:
+        return {"sequence_type": "FRST", "reason": "Mandate not found, defaulting to FRST"}
+
+    if not summary.collected_count:
+        if summary.failed_count:
+            return {"sequence_type": "FRST", "reason": "Previous first collection failed, collecting as FRST"}
+        return {"sequence_type": "FRST", "reason": "First usage of this mandate"}
+
+    if summary.has_final_collection:
+        return {
+            "sequence_type": None,
+            "reason": "Mandate was closed by a final collection, a new mandate is required",
+        }
+
+    last_collected_date = getdate(summary.last_collected_date)
+    if summary.sign_date and getdate(summary.sign_date) > last_collected_date:
+        return {"sequence_type": "FRST", "reason": "Mandate was renewed after last usage"}
+
+    today_date = getdate(today())
+    months_since_last_use = (today_date.year - last_collected_date.year) * 12 + (
+        today_date.month - last_collected_date.month
+    )
+    if months_since_last_use > MANDATE_LAPSE_MONTHS:
+        return {
+            "sequence_type": "FRST",
+            "reason": f"Mandate was not used for {months_since_last_use} months, starting a new sequence",
+        }
+
+    if is_final is None:
+        is_final = is_final_collection(summary)
+    if is_final:
+        return {"sequence_type": "FNAL", "reason": "Final collection on a recurring mandate"}
+
+    return {"sequence_type": "RCUR", "reason": "Recurring usage - mandate has been used before"}
+
+
+def get_mandate_sequence_types(mandate_invoice_pairs):
+    """
+    Determine sequence types for many mandate/invoice pairs with one usage query
+
+    Usage rows of the invoices being collected are left out of the history, so
+    re-validating a batch gives the same result as building it.
+
+    Args:
+        mandate_invoice_pairs: List of (mandate name, invoice name) tuples
+
+    Returns:
+        Dict of (mandate name, invoice name) to a dict with sequence_type and reasoning
+    """
+    summaries = get_mandate_usage_summaries(
+        [mandate_name for mandate_name, _invoice in mandate_invoice_pairs],
+        exclude_references=[invoice_name for _mandate, invoice_name in mandate_invoice_pairs if invoice_name],
+    )
+
+    return {
+        (mandate_name, invoice_name): get_sequence_type_from_usage(summaries.get(mandate_name))
+        for mandate_name, invoice_name in mandate_invoice_pairs
+    }
+
+
+@frappe.whitelist()
+def get_mandate_sequence_type(mandate_name, reference_name=None):
+    """
+    API to determine what sequence type should be used for a mandate
+
+    Args:
+        mandate_name: Name of the SEPA Mandate
+        reference_name: Optional reference to exclude from history check
+
+    Returns:
+        Dict with sequence_type and reasoning
+    """
+    try:
+        return get_mandate_sequence_types([(mandate_name, reference_name)])[(mandate_name, reference_name)]
 
     except Exception as e:
         frappe.log_error(f"Error determining sequence type for mandate {mandate_name}: {str(e)}")